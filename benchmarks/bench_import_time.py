@@ -0,0 +1,138 @@
+"""Import-time profile of every function module (cold-start cost).
+
+Each function package is imported in a fresh interpreter under
+`python -X importtime`, after azure.functions (which the worker has loaded
+before any function). Reported per function: the median cumulative import time
+over --runs runs, the heavy dependencies it pulled in, and with --top the
+packages that cost the most.
+
+benchmarks/data/import_budget.json sets an import-time budget per HTTP function,
+plus heavy modules it must not import. --check exits non-zero when a function
+goes over budget; tests/test_import_budget.py runs the same check.
+
+Usage:
+    python benchmarks/bench_import_time.py [--functions ping,get_segment] [--runs 5] [--top 5]
+        [--json out.json] [--check]
+"""
+import argparse, json, statistics, subprocess, sys
+from pathlib import Path
+
+APP_ROOT = Path(__file__).resolve().parent.parent / "functions" / "adt_ingest"
+BUDGET_PATH = Path(__file__).resolve().parent / "data" / "import_budget.json"
+HEAVY = ("pandas", "numpy", "requests", "feedparser", "azure.core", "azure.identity",
+         "azure.storage.blob", "azure.storage.queue", "azure.digitaltwins.core")
+MARK = "-- function import --"
+
+CHILD = """
+import sys, json
+sys.path.insert(0, {root!r})
+import azure.functions
+sys.stderr.write({mark!r} + "\\n")
+sys.stderr.flush()
+import {name}
+print(json.dumps(sorted(m for m in {heavy!r} if m in sys.modules)))
+"""
+
+
+def functions(http_only: bool = False) -> list:
+    """Function names (directories with a function.json), optionally only HTTP-triggered ones."""
+    names = []
+    for path in sorted(APP_ROOT.glob("*/function.json")):
+        bindings = json.loads(path.read_text()).get("bindings", [])
+        if not http_only or any(b.get("type") == "httpTrigger" for b in bindings):
+            names.append(path.parent.name)
+    return names
+
+
+def parse_importtime(stderr: str, name: str):
+    """(cumulative ms of `name`, {package: self ms}) for the imports after the marker."""
+    lines = stderr.split(MARK, 1)[-1].splitlines()
+    total, packages = None, {}
+    for line in lines:
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cum_us, module = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # column header
+        module = module.strip()
+        parts = module.split(".")
+        package = ".".join(parts[:2]) if parts[0] == "azure" else parts[0]
+        packages[package] = packages.get(package, 0.0) + int(self_us) / 1000
+        if module == name:
+            total = int(cum_us) / 1000
+    return total, packages
+
+
+def measure(name: str, runs: int = 3) -> dict:
+    """Median import time of one function over `runs` fresh interpreters (after one warm-up)."""
+    code = CHILD.format(root=str(APP_ROOT), mark=MARK, name=name, heavy=HEAVY)
+    totals, packages, modules = [], {}, []
+    for i in range(runs + 1):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=str(APP_ROOT),
+                              capture_output=True, text=True)
+        if proc.returncode != 0:
+            raise RuntimeError(f"importing {name} failed:\n{proc.stderr[-2000:]}")
+        if i == 0:
+            continue  # warm the OS file cache and __pycache__
+        total, by_package = parse_importtime(proc.stderr, name)
+        totals.append(total)
+        for package, ms in by_package.items():
+            packages.setdefault(package, []).append(ms)
+        modules = json.loads(proc.stdout.strip().splitlines()[-1])
+    top = sorted(((p, round(statistics.median(v), 1)) for p, v in packages.items()), key=lambda x: -x[1])
+    return {"function": name, "import_ms": round(statistics.median(totals), 1), "heavy_modules": modules,
+            "top_packages": top}
+
+
+def load_budget(path: Path = BUDGET_PATH) -> dict:
+    return json.loads(Path(path).read_text())
+
+
+def violations(results: list, budget: dict) -> list:
+    found = []
+    for r in results:
+        limits = budget["functions"].get(r["function"])
+        if limits is None:
+            continue
+        if r["import_ms"] > limits["max_ms"]:
+            found.append(f"{r['function']}: import {r['import_ms']}ms > budget {limits['max_ms']}ms")
+        allowed = set(limits.get("allow", []))
+        for module in r["heavy_modules"]:
+            if module in budget["forbid"] and module not in allowed:
+                found.append(f"{r['function']}: imports {module} at module load")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--functions", help="comma-separated (default: every function)")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=0)
+    parser.add_argument("--json")
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--budget", default=str(BUDGET_PATH))
+    args = parser.parse_args()
+
+    names = args.functions.split(",") if args.functions else functions()
+    http = set(functions(http_only=True))
+    budget = load_budget(args.budget)
+    results = [measure(name, args.runs) for name in names]
+    print(f"{'function':24} {'trigger':>7} {'import ms':>10} {'budget':>7}  heavy modules")
+    for r in results:
+        limit = budget["functions"].get(r["function"], {}).get("max_ms", "")
+        print(f"{r['function']:24} {'http' if r['function'] in http else 'other':>7} {r['import_ms']:10.1f} "
+              f"{limit:>7}  {', '.join(r['heavy_modules']) or '-'}")
+        for package, ms in r["top_packages"][:args.top]:
+            print(f"{'':34}{ms:8.1f}  {package}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    if args.check:
+        found = violations(results, budget)
+        for line in found:
+            print(f"OVER BUDGET {line}")
+        if found:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""Benchmark RITIS description parsing per feed entry.
+
+Parses the sample corpus (benchmarks/data/ritis_incidents_sample.xml, an
+anonymised RITIS-format RSS feed) with feedparser once, then times the legacy
+multi-regex parsing against the single-pass parse_description used by
+fetch_ritis_incidents.parse_entry, reporting the cost per entry.
+
+Usage:
+    python benchmarks/bench_incident_parse.py [--corpus PATH] [--repeat 50]
+"""
+import argparse, importlib.util, sys, time
+from pathlib import Path
+
+APP_ROOT = Path(__file__).resolve().parent.parent / "functions" / "adt_ingest"
+sys.path.insert(0, str(APP_ROOT))
+
+import feedparser
+
+
+def load_ritis():
+    spec = importlib.util.spec_from_file_location("fetch_ritis_incidents", APP_ROOT / "fetch_ritis_incidents" / "__init__.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def legacy_parse(mod, entry):
+    desc = entry.get("description", "") or ""
+    title = entry.get("title", "") or ""
+    incident = {
+        "externalSegmentId": mod.parse_segment_id(desc) or mod.parse_segment_id(title),
+        "coordinates": mod.parse_coordinates(desc),
+        **(mod.parse_lane_status(desc) or {}),
+    }
+    last_update = mod.parse_last_update(desc)
+    if last_update:
+        incident["incidentLastUpdate"] = last_update
+    lowered = desc.lower()
+    cleared = "scene is clear" in lowered or "all vehicles have departed" in lowered or "cleared" in lowered
+    incident["status"] = "cleared" if cleared else "active"
+    return incident
+
+
+def timed(fn, entries, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for entry in entries:
+            fn(entry)
+    return (time.perf_counter() - start) / (repeat * len(entries))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=str(Path(__file__).resolve().parent / "data" / "ritis_incidents_sample.xml"))
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    mod = load_ritis()
+    entries = feedparser.parse(Path(args.corpus).read_bytes()).entries
+    print(f"corpus: {len(entries)} entries, repeat x{args.repeat}")
+
+    legacy = timed(lambda e: legacy_parse(mod, e), entries, args.repeat)
+    single = timed(lambda e: mod.parse_description(e.get("description", "") or "", e.get("title", "") or ""),
+                   entries, args.repeat)
+    print(f"legacy multi-regex : {legacy * 1e6:8.1f} us/entry")
+    print(f"single pass        : {single * 1e6:8.1f} us/entry  ({legacy / single:.2f}x)")
+
+    multi = sum(1 for e in entries if "laneStatus" in mod.parse_description(e.get("description", "") or ""))
+    print(f"entries with several lane-status blocks: {multi}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""End-to-end benchmark of the ingest and read functions against local backends.
+
+Each function runs in its own child process with ADT_BACKEND=local and
+BLOB_BACKEND=local (see functions/adt_ingest/local_backends.py), so the real
+main() code paths execute against an in-process Digital Twins stand-in (with
+optional injected latency and 429s) and a filesystem blob store. Synthetic
+FDOT JSON and RITIS RSS feeds are served from a local HTTP server.
+
+Reported per function: records/sec, p50/p99 per-patch latency as seen by
+the ADT stand-in (first attempt to success, so 429 retries count), and peak
+RSS of the child process. With --baseline, exits non-zero when records/sec
+drops or peak RSS grows by more than --tolerance against a previous --json
+result, so regressions show up before deploy.
+
+Usage:
+    python benchmarks/bench_ingest_e2e.py [--segments 10000] [--incidents 500] [--latency-ms 2]
+        [--throttle-rate 0.01] [--functions fetch_dot_traffic,list_segments] [--json out.json]
+        [--baseline previous.json --tolerance 0.2]
+"""
+import argparse, importlib.util, json, os, random, resource, subprocess, sys, tempfile, threading, time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+APP_ROOT = Path(__file__).resolve().parent.parent / "functions" / "adt_ingest"
+sys.path.insert(0, str(APP_ROOT))
+
+FUNCTIONS = ("fetch_dot_traffic", "fetch_ritis_incidents", "upsert_from_storage", "list_segments")
+MODEL = "dtmi:fgcu:traffic:RoadSegment;1"
+
+
+# ---------------------------------------------------------------- synthetic data
+
+def twin_id(i: int) -> str:
+    return f"SEG-{i:06d}"
+
+
+def seed_twins(segments: int):
+    rnd = random.Random(1)
+    return [{"$dtId": twin_id(i), "$metadata": {"$model": MODEL}, "segmentId": twin_id(i),
+             "name": f"Segment {i}", "lanes": rnd.choice((2, 3, 4)), "speedLimit": rnd.choice((35, 45, 55, 70))}
+            for i in range(segments)]
+
+
+def chain_relationships(segments: int):
+    return [{"$sourceId": twin_id(i), "$relationshipId": f"{twin_id(i)}-connectedTo", "$targetId": twin_id(i + 1),
+             "$relationshipName": "connectedTo"} for i in range(segments - 1)]
+
+
+def segment_map_csv(segments: int) -> bytes:
+    return ("external_segment_id,adt_segment_id\n" +
+            "".join(f"EXT{i},{twin_id(i)}\n" for i in range(segments))).encode()
+
+
+def fdot_json(segments: int) -> bytes:
+    rnd = random.Random(2)
+    now = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return json.dumps({"records": [
+        {"segment_id": f"EXT{i}", "speed": round(rnd.uniform(5, 70), 1), "volume": rnd.randint(50, 2000),
+         "timestamp": now} for i in range(segments)]}).encode()
+
+
+def ritis_rss(incidents: int, segments: int) -> bytes:
+    rnd = random.Random(3)
+    items = []
+    for i in range(incidents):
+        seg = rnd.randrange(segments)
+        affected = rnd.randint(1, 3)
+        desc = (f"Segment EXT{seg} Lane Status: {affected} out of 4 lanes affected Right lane blocked (NB) "
+                f"Last Update Time: 2025-10-28 12:{i % 60:02d}:00-04:00")
+        items.append(f"<item><title>Crash on I-75 #{i}</title><guid>inc-{i}</guid>"
+                     f"<pubDate>Tue, 28 Oct 2025 12:00:00 GMT</pubDate><description>{desc}</description></item>")
+    return ("<?xml version=\"1.0\"?><rss version=\"2.0\"><channel><title>RITIS</title>" +
+            "".join(items) + "</channel></rss>").encode()
+
+
+def traffic_csv(segments: int) -> bytes:
+    rnd = random.Random(4)
+    start = datetime(2025, 10, 28, 12, tzinfo=timezone.utc)
+    lines = ["segmentId,asOf,avgSpeed,volume"]
+    for i in range(segments):
+        when = (start + timedelta(minutes=i % 60)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        lines.append(f"{twin_id(i)},{when},{rnd.uniform(5, 70):.1f},{rnd.randint(50, 2000)}")
+    return ("\n".join(lines) + "\n").encode()
+
+
+def pavement_csv(segments: int) -> bytes:
+    rnd = random.Random(5)
+    lines = ["segmentId,asOf,PCI,IRI"]
+    lines += [f"{twin_id(i)},2025-07-01T00:00:00Z,{rnd.randint(30, 100)},{rnd.uniform(0.5, 5):.2f}"
+              for i in range(0, segments, 2)]
+    return ("\n".join(lines) + "\n").encode()
+
+
+def serve(routes: dict):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = routes.get(self.path.split("?")[0])
+            self.send_response(200 if body is not None else 404)
+            self.send_header("Content-Length", str(len(body or b"")))
+            self.end_headers()
+            self.wfile.write(body or b"")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# ---------------------------------------------------------------- child process
+
+def load_function(name: str):
+    spec = importlib.util.spec_from_file_location(name, str(APP_ROOT / name / "__init__.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def http_request(params=None):
+    import azure.functions as func
+    return func.HttpRequest(method="GET", url="/api/bench", headers={}, params=params or {}, body=b"")
+
+
+def run_child(name: str, args) -> dict:
+    from shared import get_clients
+    from shared import latency_summary
+    adt, blob = get_clients()
+    adt.seed(seed_twins(args.segments) if name != "upsert_from_storage" else [],
+             chain_relationships(args.segments) if name == "fetch_ritis_incidents" else [])
+    raw = blob.get_container_client("raw")
+    raw.upload_blob("segment_map.csv", segment_map_csv(args.segments), overwrite=True)
+    routes = {}
+    if name == "fetch_dot_traffic":
+        routes["/fdot.json"] = fdot_json(args.segments)
+    elif name == "fetch_ritis_incidents":
+        routes["/ritis.xml"] = ritis_rss(args.incidents, args.segments)
+    elif name == "upsert_from_storage":
+        raw.upload_blob("seed/seed_segments.json", json.dumps(seed_twins(args.segments)), overwrite=True)
+        raw.upload_blob("traffic.csv", traffic_csv(args.segments), overwrite=True)
+        raw.upload_blob("pavement.csv", pavement_csv(args.segments), overwrite=True)
+    server, base = serve(routes)
+    os.environ["FDOT_TRAFFIC_API_URL"] = f"{base}/fdot.json"
+    os.environ["RITIS_RSS_URL"] = f"{base}/ritis.xml"
+    module = load_function(name)
+    adt.reset_stats()
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if name == "fetch_dot_traffic":
+        module.main(None)
+        records = args.segments
+    elif name == "fetch_ritis_incidents":
+        module.main(None)
+        records = args.incidents
+    elif name == "upsert_from_storage":
+        resp = module.main(http_request())
+        assert resp.status_code == 200, resp.get_body()
+        records = 2 * args.segments + len(range(0, args.segments, 2))
+    else:
+        resp = module.main(http_request())
+        assert resp.status_code == 200, resp.get_body()
+        records = len(json.loads(resp.get_body()))
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    result = {"function": name, "records": records, "seconds": round(elapsed, 3),
+              "records_per_sec": round(records / elapsed, 1) if elapsed > 0 else 0.0,
+              "adt_writes": adt.stats["writes"], "throttled": adt.stats["throttled"],
+              "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+              "setup_rss_mb": round(rss_before / 1024, 1)}
+    result.update(latency_summary(adt.patch_latencies))
+
+    if name == "list_segments":
+        # Warm requests are served from the materialised read model
+        start = time.perf_counter()
+        for _ in range(args.warm_requests):
+            module.main(http_request())
+        warm = (time.perf_counter() - start) / max(1, args.warm_requests)
+        result["warm_records_per_sec"] = round(records / warm, 1) if warm > 0 else 0.0
+    return result
+
+
+# ---------------------------------------------------------------- driver
+
+def run_all(args) -> list:
+    results = []
+    for name in args.functions.split(","):
+        with tempfile.TemporaryDirectory() as tmp:
+            env = dict(os.environ, ADT_BACKEND="local", BLOB_BACKEND="local",
+                       LOCAL_BLOB_ROOT=str(Path(tmp) / "blobs"),
+                       LOCAL_ADT_LATENCY_MS=str(args.latency_ms), LOCAL_ADT_JITTER_MS=str(args.jitter_ms),
+                       LOCAL_ADT_THROTTLE_RATE=str(args.throttle_rate),
+                       ADT_PATCH_CONCURRENCY=str(args.concurrency), SEGMENT_CACHE_TTL_SECONDS="300",
+                       FEATURE_STORE_LOCAL_PATH=str(Path(tmp) / "features.npy"))
+            for var in ("RITIS_EMAIL", "RITIS_PASSWORD", "RITIS_LOGIN_URL", "HISTORY_LOCAL_DIR"):
+                env.pop(var, None)
+            cmd = [sys.executable, __file__, "--child", name, "--segments", str(args.segments),
+                   "--incidents", str(args.incidents), "--warm-requests", str(args.warm_requests)]
+            proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(proc.stderr[-2000:], file=sys.stderr)
+                raise SystemExit(f"{name} failed")
+            results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def regressions(results: list, baseline: list, tolerance: float) -> list:
+    before = {r["function"]: r for r in baseline}
+    found = []
+    for r in results:
+        b = before.get(r["function"])
+        if not b:
+            continue
+        if r["records_per_sec"] < b["records_per_sec"] * (1 - tolerance):
+            found.append(f"{r['function']}: records/sec {b['records_per_sec']} -> {r['records_per_sec']}")
+        if r["peak_rss_mb"] > b["peak_rss_mb"] * (1 + tolerance):
+            found.append(f"{r['function']}: peak RSS {b['peak_rss_mb']}MB -> {r['peak_rss_mb']}MB")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--segments", type=int, default=10000)
+    parser.add_argument("--incidents", type=int, default=500)
+    parser.add_argument("--latency-ms", type=float, default=2.0)
+    parser.add_argument("--jitter-ms", type=float, default=1.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warm-requests", type=int, default=20)
+    parser.add_argument("--functions", default=",".join(FUNCTIONS))
+    parser.add_argument("--json")
+    parser.add_argument("--baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--child")
+    args = parser.parse_args()
+
+    if args.child:
+        import logging
+        logging.basicConfig(level=logging.WARNING)
+        print(json.dumps(run_child(args.child, args)))
+        return
+
+    results = run_all(args)
+    print(f"segments={args.segments} incidents={args.incidents} latency={args.latency_ms}ms "
+          f"throttle={args.throttle_rate} concurrency={args.concurrency}")
+    print(f"{'function':24} {'records':>8} {'seconds':>8} {'rec/s':>10} {'p50 ms':>8} {'p99 ms':>8} "
+          f"{'429s':>6} {'peak RSS':>9}")
+    for r in results:
+        print(f"{r['function']:24} {r['records']:8d} {r['seconds']:8.2f} {r['records_per_sec']:10.1f} "
+              f"{r['p50_ms']:8.1f} {r['p99_ms']:8.1f} {r['throttled']:6d} {r['peak_rss_mb']:7.1f}MB")
+        if "warm_records_per_sec" in r:
+            print(f"{'  (warm, cached)':24} {'':8} {'':8} {r['warm_records_per_sec']:10.1f}")
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+    if args.baseline:
+        found = regressions(results, json.loads(Path(args.baseline).read_text()), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found:
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Benchmark get_segment_history over a year of synthetic rollups.
+
+Builds a year of five-minute traffic observations for a synthetic network
+(default 500 segments) and writes them as rollups.py would have after a year of
+ticks: monthly 1h and 1d blocks, daily 5m blocks for the last --fine-days days,
+then a couple of live hours pushed through commit_rollups tick by tick (which
+times the per-tick buffer update and the hourly seal). Queries for random
+segments are then timed per range/resolution against the local blob store. The
+same week is also archived as raw history and scanned with HistoryStore.scan for
+comparison.
+
+Usage:
+    python benchmarks/bench_segment_history.py [--segments 500] [--fine-days 7] [--queries 30] [--root DIR]
+"""
+import argparse, shutil, sys, tempfile, time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "functions" / "adt_ingest"))
+
+import numpy as np
+from history_store import HistoryStore, BlobBackend
+from local_backends import LocalBlobServiceClient
+from rollups import RollupStore, BufferReader, commit_rollups, observe, reduce, TIERS
+from shared import latency_summary
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+END = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+def synthetic_day(day_ts: int, segments: int, rng):
+    """Five-minute speeds/volumes for every segment: free flow with two rush-hour dips."""
+    ts = day_ts + np.arange(288, dtype=np.int64) * 300
+    hour = (ts % 86400) / 3600.0
+    dip = 25 * np.exp(-((hour - 8) ** 2) / 2) + 30 * np.exp(-((hour - 17.5) ** 2) / 3)
+    base = rng.uniform(45, 70, segments)[:, None]
+    speeds = np.clip(base - dip[None, :] * rng.uniform(0.3, 1.0, segments)[:, None]
+                     + rng.normal(0, 4, (segments, 288)), 1, None).astype(np.float32)
+    volumes = rng.poisson(40 + dip, (segments, 288)).astype(np.float32)
+    keys = np.repeat(np.arange(segments), 288)
+    return keys, np.tile(ts, segments), speeds.ravel(), volumes.ravel()
+
+
+def build(store, names, segments: int, fine_days: int, seed: int = 42):
+    rng = np.random.default_rng(seed)
+    fine_from = int((END - timedelta(days=fine_days)).timestamp())
+    month_rows = {"1h": [], "1d": []}
+    day = START
+    while day < END:
+        day_ts = int(day.timestamp())
+        keys, ts, speeds, volumes = synthetic_day(day_ts, segments, rng)
+        rows = observe(ts, speeds, volumes)
+        if day_ts >= fine_from:
+            k, r = reduce(keys, rows, TIERS["5m"])
+            store.write("5m", f"{day:%Y/%m/%d}", names[k], r)
+        for tier in month_rows:
+            month_rows[tier].append(reduce(keys, rows, TIERS[tier]))
+        day += timedelta(days=1)
+        if day.month != (day - timedelta(days=1)).month:
+            window = f"{day - timedelta(days=1):%Y/%m}"
+            for tier, parts in month_rows.items():
+                k, r = reduce(np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts]),
+                              TIERS[tier])
+                store.write(tier, window, names[k], r)
+                parts.clear()
+
+
+def build_raw(history, segments: int, days: int, seed: int = 7):
+    rng = np.random.default_rng(seed)
+    day = END - timedelta(days=days)
+    while day < END:
+        keys, ts, speeds, volumes = synthetic_day(int(day.timestamp()), segments, rng)
+        for i in range(288):
+            sel = slice(i, None, 288)
+            when = day + timedelta(minutes=5 * i)
+            history.append("traffic", [{"twinId": f"SEG-{k:05d}", "avgSpeed": float(s), "volume": float(v)}
+                                       for k, s, v in zip(keys[sel], speeds[sel], volumes[sel])], when)
+        day += timedelta(days=1)
+
+
+def timed(fn, repeats):
+    samples, result = [], None
+    for i in range(repeats):
+        t = time.perf_counter()
+        result = fn(i)
+        samples.append(time.perf_counter() - t)
+    return latency_summary(samples), result
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--segments", type=int, default=500)
+    ap.add_argument("--fine-days", type=int, default=7)
+    ap.add_argument("--live-hours", type=int, default=2)
+    ap.add_argument("--queries", type=int, default=30)
+    ap.add_argument("--shards", type=int, default=16)
+    ap.add_argument("--root", help="local blob root to keep (default: a temporary directory)")
+    args = ap.parse_args()
+
+    root = args.root or tempfile.mkdtemp(prefix="bench_history_")
+    blob = LocalBlobServiceClient(root)
+    try:
+        blob.create_container("raw")
+    except Exception:
+        pass
+    store = RollupStore(blob, shards=args.shards)
+    names = np.array([f"SEG-{i:05d}" for i in range(args.segments)])
+    try:
+        t = time.perf_counter()
+        build(store, names, args.segments, args.fine_days)
+        print(f"built a year of rollups for {args.segments} segments in {time.perf_counter() - t:.1f}s")
+
+        rng = np.random.default_rng(1)
+        live = int(END.timestamp())
+        ticks = args.live_hours * 12 + 1
+        tick_stats, _ = timed(lambda i: commit_rollups(
+            blob, list(names), rng.uniform(20, 70, args.segments), rng.poisson(40, args.segments).astype(float),
+            live + i * 300, store=store), ticks)
+        print(f"live ticks ({ticks}, {args.live_hours} hourly seals): p50={tick_stats['p50_ms']}ms "
+              f"p99={tick_stats['p99_ms']}ms")
+
+        buffer = BufferReader(blob)  # as get_segment_history reads the open hour
+        now = live + ticks * 300
+        year_ago = int(START.timestamp())
+        cases = [
+            ("1 year @ 1d", year_ago, now, 86400),
+            ("1 year @ 1w", year_ago, now, 604800),
+            ("1 year @ 1h", year_ago, now, 3600),
+            ("30 days @ 1h", now - 30 * 86400, now, 3600),
+            ("7 days @ 1h", now - 7 * 86400, now, 3600),
+            ("1 day @ 5m", now - 86400, now, 300),
+            ("1 day @ 15m", now - 86400, now, 900),
+        ]
+        segs = names[rng.integers(0, args.segments, args.queries)]
+        print(f"{'query':14s} {'tier':>4s} {'points':>7s} {'p50 ms':>8s} {'p99 ms':>8s}")
+        for label, lo, hi, seconds in cases:
+            stats, result = timed(lambda i: store.history(str(segs[i]), lo, hi, seconds, buffer), args.queries)
+            print(f"{label:14s} {result['tier']:>4s} {len(result['points']):7d} "
+                  f"{stats['p50_ms']:8.1f} {stats['p99_ms']:8.1f}")
+
+        days = min(args.fine_days, 7)
+        history = HistoryStore(BlobBackend(blob, "raw"), compact=True)
+        t = time.perf_counter()
+        build_raw(history, args.segments, days)
+        print(f"archived {days} days of raw history in {time.perf_counter() - t:.1f}s")
+        lo, hi = int((END - timedelta(days=days)).timestamp()), int(END.timestamp())
+        raw_stats, _ = timed(lambda i: sum(1 for _ in history.scan(
+            "traffic", lo, hi, segments=[str(segs[i])], columns=["ts", "avgSpeed"])), min(args.queries, 5))
+        roll_stats, _ = timed(lambda i: store.history(str(segs[i]), lo, hi, 3600, buffer), min(args.queries, 5))
+        print(f"{days} days, one segment: raw scan p50={raw_stats['p50_ms']}ms, "
+              f"rollup @ 1h p50={roll_stats['p50_ms']}ms "
+              f"({raw_stats['p50_ms'] / max(roll_stats['p50_ms'], 0.1):.0f}x)")
+    finally:
+        if not args.root:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
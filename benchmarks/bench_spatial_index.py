@@ -0,0 +1,97 @@
+"""Benchmark coordinate -> segment resolution for RITIS incidents.
+
+Builds a synthetic statewide network (default 50k segment polylines of 2-6
+vertices over a Florida-sized bounding box), indexes it with geo.SegmentIndex
+and resolves a tick of incidents (default 1k points, most placed next to a
+segment) against it. A brute-force NumPy scan over every edge is timed on a
+sample of the same points for comparison and to check the answers agree.
+
+Usage:
+    python benchmarks/bench_spatial_index.py [--segments 50000] [--incidents 1000] [--radius 150]
+"""
+import argparse, math, random, sys, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "functions" / "adt_ingest"))
+
+import numpy as np
+from geo import METERS_PER_DEG, SegmentIndex
+
+BBOX = (24.5, 31.0, -87.6, -80.0)  # lat_min, lat_max, lon_min, lon_max
+
+
+def synthetic_network(segments: int, seed: int = 42):
+    rnd = random.Random(seed)
+    polylines = []
+    for i in range(segments):
+        lat, lon = rnd.uniform(BBOX[0], BBOX[1]), rnd.uniform(BBOX[2], BBOX[3])
+        heading = rnd.uniform(0, 2 * math.pi)
+        pts = [(lat, lon)]
+        for _ in range(rnd.randint(1, 5)):
+            heading += rnd.uniform(-0.4, 0.4)
+            step = rnd.uniform(100, 400) / METERS_PER_DEG
+            lat, lon = lat + step * math.sin(heading), lon + step * math.cos(heading)
+            pts.append((lat, lon))
+        polylines.append((f"Segment_{i:05d}", pts))
+    return polylines
+
+
+def synthetic_incidents(polylines, count: int, seed: int = 7):
+    rnd = random.Random(seed)
+    points = []
+    for _ in range(count):
+        if rnd.random() < 0.9:
+            _, pts = rnd.choice(polylines)
+            lat, lon = rnd.choice(pts)
+            points.append((lat + rnd.uniform(-0.0005, 0.0005), lon + rnd.uniform(-0.0005, 0.0005)))
+        else:
+            points.append((rnd.uniform(BBOX[0], BBOX[1]), rnd.uniform(BBOX[2], BBOX[3])))
+    return points
+
+
+def brute_force(index, lat, lon, radius):
+    kx = METERS_PER_DEG * math.cos(math.radians(lat))
+    a, b = index._a, index._b
+    ax, ay = (a[:, 1] - lon) * kx, (a[:, 0] - lat) * METERS_PER_DEG
+    bx, by = (b[:, 1] - lon) * kx, (b[:, 0] - lat) * METERS_PER_DEG
+    dx, dy = bx - ax, by - ay
+    length2 = dx * dx + dy * dy
+    t = np.clip(-(ax * dx + ay * dy) / np.where(length2 > 0, length2, 1.0), 0.0, 1.0)
+    dist = np.hypot(ax + t * dx, ay + t * dy)
+    best = int(np.argmin(dist))
+    return index.twin_ids[index._owner[best]] if dist[best] <= radius else None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--segments", type=int, default=50000)
+    parser.add_argument("--incidents", type=int, default=1000)
+    parser.add_argument("--radius", type=float, default=150.0)
+    parser.add_argument("--cell-deg", type=float, default=0.01)
+    parser.add_argument("--brute-sample", type=int, default=100)
+    args = parser.parse_args()
+
+    polylines = synthetic_network(args.segments)
+    points = synthetic_incidents(polylines, args.incidents)
+
+    start = time.perf_counter()
+    index = SegmentIndex(polylines, cell_deg=args.cell_deg)
+    build_s = time.perf_counter() - start
+    print(f"index: {len(index)} segments, {len(index._owner)} edges, {len(index._keys)} cells, built in {build_s * 1000:.0f}ms")
+
+    start = time.perf_counter()
+    hits = [index.nearest(lat, lon, args.radius) for lat, lon in points]
+    tick_s = time.perf_counter() - start
+    matched = sum(1 for h in hits if h)
+    print(f"grid lookup : {tick_s * 1000:8.1f} ms/tick  {tick_s / len(points) * 1e6:8.1f} us/incident  matched={matched}/{len(points)}")
+
+    sample = points[:args.brute_sample]
+    start = time.perf_counter()
+    brute = [brute_force(index, lat, lon, args.radius) for lat, lon in sample]
+    brute_s = (time.perf_counter() - start) / len(sample)
+    agree = sum(1 for h, b in zip(hits, brute) if (h[0] if h else None) == b)
+    print(f"brute force : {brute_s * 1e6:8.1f} us/incident  ({brute_s / (tick_s / len(points)):.0f}x slower, agree {agree}/{len(sample)})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+import os, math
+import numpy as np
+from features import time_slot, erf_approx, BASELINE_MIN_N
+
+# Speed-collapse detection against the feature store's time-of-day baselines.
+#
+# Each live speed is compared with its segment's weekday/weekend x hour slot
+# baseline (an online mean/variance kept in features.FeatureStore, so memory is
+# constant per segment). Only drops count: the score is erf(-z / sqrt(2)) for
+# z < 0, i.e. 0 at the baseline and approaching 1 as the speed falls into the
+# tail. Scoring is a single vectorised gather over the batch.
+#
+# Environment variables:
+# SPEED_ANOMALY - score speeds and patch speedAnomalyScore/speedAnomaly (default: false;
+#                 needs FEATURE_STORE, and the properties only exist on RoadSegment;2 twins)
+# ANOMALY_Z_THRESHOLD - standard deviations below baseline that flag a segment (default: 3)
+# ANOMALY_MIN_DROP - minimum fractional drop below the baseline mean to flag (default: 0.3)
+# ANOMALY_BATCH_ROWS - speeds scored per vectorised pass (default: 10000)
+
+MIN_STD_FRACTION = 0.05  # std floor relative to the baseline mean, so near-constant slots don't over-fire
+MIN_STD_MPH = 1.0
+
+def score_speeds(store, twin_ids, speeds, ts: int, z_threshold: float = None, min_drop: float = None):
+    """(scores, flags) per input speed; score is NaN where there is no usable baseline yet."""
+    z_threshold = z_threshold if z_threshold is not None else float(os.environ.get("ANOMALY_Z_THRESHOLD", 3))
+    min_drop = min_drop if min_drop is not None else float(os.environ.get("ANOMALY_MIN_DROP", 0.3))
+    speeds = np.asarray(speeds, dtype=np.float64)
+    rows = store.rows(twin_ids)
+    scores = np.full(len(speeds), np.nan)
+    flags = np.zeros(len(speeds), dtype=bool)
+    slot = int(time_slot(ts))
+    known = rows >= 0
+    known[known] = store.table["baseCount"][rows[known], slot] >= BASELINE_MIN_N
+    ok = known & np.isfinite(speeds)
+    if not ok.any():
+        return scores, flags
+    r, s = rows[ok], speeds[ok]
+    mean = store.table["baseMean"][r, slot].astype(np.float64)
+    std = np.sqrt(np.maximum(store.table["baseVar"][r, slot], 0.0))
+    std = np.maximum(std, np.maximum(MIN_STD_FRACTION * np.abs(mean), MIN_STD_MPH))
+    z = (s - mean) / std
+    scores[ok] = np.where(z < 0, erf_approx(np.maximum(-z, 0.0) / math.sqrt(2.0)), 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        drop = np.where(mean > 0, 1.0 - s / mean, 0.0)
+    flags[ok] = (z <= -z_threshold) & (drop >= min_drop)
+    return scores, flags
+
+def anomaly_patches(twin_ids, scores, flags) -> list:
+    """(twin_id, ops) for every scored twin; scores are rounded so the delta cache can skip noise."""
+    patches = []
+    for twin_id, score, flag in zip(twin_ids, scores, flags):
+        if not np.isfinite(score):
+            continue
+        patches.append((twin_id, [
+            {"op": "add", "path": "/speedAnomalyScore", "value": round(float(score), 2)},
+            {"op": "add", "path": "/speedAnomaly", "value": bool(flag)},
+        ]))
+    return patches
@@ -0,0 +1,15 @@
+import logging
+import azure.functions as func
+from shared import get_clients, traced
+from sharding import apply_shard_message
+
+# Queue-triggered worker for the sharded ingest fan-out (see sharding.py).
+# Raising hands the message back to the queue; the host retries it up to
+# maxDequeueCount (host.json) before moving it to ingest-shards-poison.
+
+@traced("apply_shard")
+def main(msg: func.QueueMessage) -> None:
+    adt, blob = get_clients()
+    result = apply_shard_message(adt, blob, msg.get_body())
+    logging.info(f"Shard message {result['key']} (delivery {msg.dequeue_count}): {result['status']} "
+                 f"updated={result.get('updated', 0)} failed={result.get('failed', 0)}")
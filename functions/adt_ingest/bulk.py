@@ -0,0 +1,113 @@
+import logging
+from datetime import datetime, timezone
+import pandas as pd
+
+# Column-at-a-time validation and patch building for tabular twin metrics.
+#
+# Each spec maps a column to its kind:
+#   number   - coerced with pd.to_numeric; unparseable cells make the row bad
+#   string   - passed through as str
+#   datetime - ISO strings pass through, epoch seconds become ISO 8601 UTC
+# Columns missing from the frame are simply not patched.
+
+TRAFFIC_SPEC = {"avgSpeed": "number", "volume": "number", "asOf": "datetime"}
+PAVEMENT_SPEC = {"PCI": "number", "IRI": "number", "asOf": "datetime"}
+PREDICTION_SPEC = {
+    "predictedAvgSpeed": "number",
+    "predictedCongestionIndex": "number",
+    "predictionTimestamp": "datetime",
+    "predictionHorizon": "string",
+}
+
+ID_COLUMNS = ("segmentId", "twinId", "adtSegmentId")
+# Field names used by older payloads such as ml/sample_predictions.json
+PREDICTION_ALIASES = {"congestionIndex": "predictedCongestionIndex", "timestamp": "predictionTimestamp"}
+MAX_REPORTED_BAD_ROWS = 20
+
+def csv_dtypes(spec: dict, aliases: dict = None) -> dict:
+    """read_csv dtypes for a spec: ids and metrics read as text, so every chunk agrees and coerce_frame
+    does the typing (ids keep leading zeros)."""
+    return {col: str for col in (*ID_COLUMNS, *spec, *(aliases or ()))}
+
+def _epoch_to_iso(v):
+    return datetime.fromtimestamp(float(v), timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def _resolve_ids(df) -> pd.Series:
+    ids = pd.Series([None] * len(df), index=df.index, dtype=object)
+    for col in ID_COLUMNS:
+        if col in df:
+            ids = ids.where(ids.notna(), df[col])
+    return ids.astype(object).where(ids.notna(), None).map(lambda v: None if v is None else str(v).strip())
+
+def coerce_frame(df: pd.DataFrame, spec: dict, aliases: dict = None):
+    """Validate and coerce whole columns at once.
+
+    Returns (clean, bad): clean has a twinId column plus the spec columns with
+    NaN replaced by None; bad lists {"row", "reason"} for rows that were dropped.
+    """
+    if aliases and any(src in df for src in aliases):
+        df = df.copy()
+        for src, dst in aliases.items():
+            if src in df:
+                df[dst] = df[dst].where(df[dst].notna(), df[src]) if dst in df else df[src]
+    out = pd.DataFrame({"twinId": _resolve_ids(df)}, index=df.index)
+    bad_mask = out["twinId"].isna() | (out["twinId"] == "")
+    reasons = pd.Series("", index=df.index)
+    reasons[bad_mask] = "missing segment id"
+    for col, kind in spec.items():
+        if col not in df:
+            continue
+        raw = df[col]
+        if kind == "number":
+            values = pd.to_numeric(raw, errors="coerce").astype("float64")
+            invalid = values.isna() & raw.notna()
+            reasons[invalid & ~bad_mask] = f"non-numeric {col}"
+            bad_mask |= invalid
+        else:
+            values = raw.astype(object).where(raw.notna(), None).map(lambda v: None if v is None else str(v))
+            if kind == "datetime":
+                epoch = pd.to_numeric(raw, errors="coerce")
+                is_epoch = epoch.notna()
+                if is_epoch.any():
+                    values[is_epoch] = epoch[is_epoch].map(_epoch_to_iso)
+        out[col] = values.astype(object).where(values.notna(), None)
+    bad = [{"row": int(i), "reason": reasons[i]} for i in df.index[bad_mask.to_numpy()]]
+    return out[~bad_mask.to_numpy()], bad
+
+def build_patches(clean: pd.DataFrame, spec: dict, order_by: str = None) -> dict:
+    """One merged op list per twin; later rows (by order_by, else file order) win."""
+    if order_by and order_by in clean:
+        clean = clean.sort_values(order_by, kind="stable", na_position="first")
+    clean = clean.drop_duplicates(subset="twinId", keep="last")
+    cols = [(f"/{c}", clean[c].tolist()) for c in spec if c in clean]
+    patches = {}
+    for i, twin_id in enumerate(clean["twinId"].tolist()):
+        ops = [{"op": "add", "path": path, "value": vals[i]} for path, vals in cols if vals[i] is not None]
+        if ops:
+            patches[twin_id] = ops
+    return patches
+
+def merge_patches(*patch_sets) -> dict:
+    """Merge per-twin patches from several sources; /asOf keeps the latest value."""
+    merged = {}
+    for patches in patch_sets:
+        for twin_id, ops in patches.items():
+            by_path = merged.setdefault(twin_id, {})
+            for op in ops:
+                prev = by_path.get(op["path"])
+                if op["path"] == "/asOf" and prev is not None and str(prev["value"]) > str(op["value"]):
+                    continue
+                by_path[op["path"]] = op
+    return {twin_id: list(by_path.values()) for twin_id, by_path in merged.items()}
+
+def report_bad_rows(label: str, bad: list):
+    if not bad:
+        return
+    sample = ", ".join(f"{b['row']}: {b['reason']}" for b in bad[:MAX_REPORTED_BAD_ROWS])
+    more = f" (+{len(bad) - MAX_REPORTED_BAD_ROWS} more)" if len(bad) > MAX_REPORTED_BAD_ROWS else ""
+    logging.warning(f"{label}: skipped {len(bad)} invalid rows [{sample}]{more}")
+
+def frame_patches(label: str, df: pd.DataFrame, spec: dict, aliases: dict = None, order_by: str = None) -> dict:
+    clean, bad = coerce_frame(df, spec, aliases)
+    report_bad_rows(label, bad)
+    return build_patches(clean, spec, order_by=order_by)
@@ -0,0 +1,16 @@
+import os, logging
+import azure.functions as func
+from shared import get_blob_service, traced, span
+from history_store import get_history_store
+
+# Daily compaction of the history archive, kept off the ingest timers' path.
+#
+# Expected env vars:
+# HISTORY_COMPACT_DAYS - closed days to (re)check per run, so a missed run is caught up (default: 2)
+
+@traced("compact_history")
+def main(myTimer: func.TimerRequest) -> None:
+    store = get_history_store(get_blob_service())
+    with span("compact"):
+        merged = store.compact_recent(int(os.environ.get("HISTORY_COMPACT_DAYS", 2)))
+    logging.info(f"History compaction merged {merged} hourly files")
@@ -0,0 +1,174 @@
+import os, json, gzip, time, logging, threading
+from collections import OrderedDict
+from shared import dependency
+
+# Last-written-state cache used to drop ADT patch ops whose values have not moved.
+#
+# Environment variables:
+# DELTA_CACHE_MAX_TWINS - LRU capacity in twins (default: 100000)
+# DELTA_REFRESH_SECONDS - resend every property after this long (default: 3600)
+# DELTA_DEADBANDS - per-property numeric deadbands, e.g. "avgSpeed=1,volume=5"
+#                   (default: avgSpeed=1)
+# DELTA_SNAPSHOT_BLOB - optional blob path for persisting the cache across cold
+#                       starts, stored in TRAFFIC_HISTORY_CONTAINER (default: unset)
+
+DEFAULT_MAX_TWINS = 100000
+DEFAULT_REFRESH_SECONDS = 3600
+DEFAULT_DEADBANDS = "avgSpeed=1"
+# Timestamps change every tick; they ride along with real changes but never
+# justify a write on their own.
+VOLATILE_PATHS = {"/asOf", "/lastSeen"}
+
+_MISSING = object()
+
+def parse_deadbands(spec: str) -> dict:
+    bands = {}
+    for part in (spec or "").split(","):
+        if "=" not in part:
+            continue
+        name, value = part.split("=", 1)
+        try:
+            bands["/" + name.strip().lstrip("/")] = float(value)
+        except ValueError:
+            logging.warning(f"Ignoring invalid deadband '{part}'")
+    return bands
+
+class DeltaCache:
+    """Per-worker LRU of the property values last written to each twin."""
+
+    def __init__(self, max_twins: int = None, refresh_seconds: float = None, deadbands: dict = None):
+        self.max_twins = max_twins or int(os.environ.get("DELTA_CACHE_MAX_TWINS", DEFAULT_MAX_TWINS))
+        self.refresh_seconds = refresh_seconds if refresh_seconds is not None else float(
+            os.environ.get("DELTA_REFRESH_SECONDS", DEFAULT_REFRESH_SECONDS))
+        self.deadbands = deadbands if deadbands is not None else parse_deadbands(
+            os.environ.get("DELTA_DEADBANDS", DEFAULT_DEADBANDS))
+        self._entries = OrderedDict()  # twin_id -> {"values": {path: value}, "refreshed": ts}
+        self._full_pending = set()
+        self._lock = threading.Lock()
+        self.stats = {"checked": 0, "suppressed_patches": 0, "suppressed_ops": 0, "full_writes": 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _changed(self, op, values) -> bool:
+        prev = values.get(op["path"], _MISSING)
+        if prev is _MISSING:
+            return True
+        new = op.get("value")
+        band = self.deadbands.get(op["path"])
+        if band is not None and isinstance(new, (int, float)) and isinstance(prev, (int, float)):
+            return abs(new - prev) >= band
+        return new != prev
+
+    def filter(self, twin_id: str, ops: list, now: float = None) -> list:
+        """Return the subset of ops worth sending; [] when nothing meaningful changed."""
+        now = now if now is not None else time.time()
+        with self._lock:
+            self.stats["checked"] += 1
+            entry = self._entries.get(twin_id)
+            if entry is None or now - entry["refreshed"] >= self.refresh_seconds:
+                self._full_pending.add(twin_id)
+                self.stats["full_writes"] += 1
+                return ops
+            self._entries.move_to_end(twin_id)
+            values = entry["values"]
+            changed = [op for op in ops if op["path"] not in VOLATILE_PATHS and self._changed(op, values)]
+            if not changed:
+                self.stats["suppressed_patches"] += 1
+                self.stats["suppressed_ops"] += len(ops)
+                return []
+            kept = [op for op in ops if op["path"] in VOLATILE_PATHS or op in changed]
+            self.stats["suppressed_ops"] += len(ops) - len(kept)
+            return kept
+
+    def commit(self, twin_id: str, ops: list, now: float = None):
+        """Record ops that ADT accepted. Safe to call from dispatcher worker threads."""
+        now = now if now is not None else time.time()
+        with self._lock:
+            entry = self._entries.get(twin_id)
+            if entry is None:
+                entry = {"values": {}, "refreshed": now}
+                self._entries[twin_id] = entry
+            elif twin_id in self._full_pending:
+                entry["refreshed"] = now
+            self._full_pending.discard(twin_id)
+            for op in ops:
+                if op.get("op") == "remove":
+                    entry["values"].pop(op["path"], None)
+                else:
+                    entry["values"][op["path"]] = op.get("value")
+            self._entries.move_to_end(twin_id)
+            while len(self._entries) > self.max_twins:
+                self._entries.popitem(last=False)
+
+    def to_bytes(self) -> bytes:
+        with self._lock:
+            data = {k: [v["refreshed"], v["values"]] for k, v in self._entries.items()}
+        return gzip.compress(json.dumps(data, separators=(",", ":")).encode())
+
+    def load_bytes(self, raw: bytes):
+        data = json.loads(gzip.decompress(raw))
+        with self._lock:
+            for twin_id, (refreshed, values) in data.items():
+                self._entries[twin_id] = {"values": values, "refreshed": refreshed}
+            while len(self._entries) > self.max_twins:
+                self._entries.popitem(last=False)
+
+    def _snapshot_client(self, blob_service):
+        name = os.environ.get("DELTA_SNAPSHOT_BLOB")
+        if not name or blob_service is None:
+            return None
+        container = os.environ.get("TRAFFIC_HISTORY_CONTAINER", "raw")
+        return blob_service.get_blob_client(container=container, blob=name)
+
+    def load_snapshot(self, blob_service):
+        bc = self._snapshot_client(blob_service)
+        if bc is None:
+            return
+        try:
+            with dependency("blob.delta"):
+                data = bc.download_blob().readall()
+            self.load_bytes(data)
+            logging.info(f"Delta cache restored {len(self)} twins from snapshot")
+        except Exception as e:
+            logging.info(f"Delta snapshot not loaded: {e}")
+
+    def save_snapshot(self, blob_service):
+        bc = self._snapshot_client(blob_service)
+        if bc is None:
+            return
+        try:
+            body = self.to_bytes()
+            with dependency("blob.delta"):
+                bc.upload_blob(body, overwrite=True)
+        except Exception as e:
+            logging.warning(f"Failed writing delta snapshot: {e}")
+
+class PassThroughDelta:
+    """Filters nothing and remembers nothing; for callers whose writes are applied elsewhere (see sharding.py)."""
+
+    def filter(self, twin_id: str, ops: list, now: float = None) -> list:
+        return ops
+
+    def commit(self, twin_id: str, ops: list, now: float = None):
+        pass
+
+    def save_snapshot(self, blob_service):
+        pass
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_delta_cache(blob_service=None) -> DeltaCache:
+    """Process-wide cache, seeded from the blob snapshot on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DeltaCache()
+            _cache.load_snapshot(blob_service)
+        return _cache
+
+def reset_delta_cache():
+    global _cache
+    with _cache_lock:
+        _cache = None
@@ -0,0 +1,328 @@
+import os, io, math, time, logging, threading
+import numpy as np
+from shared import dependency
+
+# Online per-segment feature store.
+#
+# One row per segment in a NumPy structured array (see FEATURE_DTYPE), so a
+# tick updates every touched row with a few vectorised operations and readers
+# get O(segments) state instead of rescanning the history archive. The table is
+# persisted as a single .npy file/blob, which np.load(..., mmap_mode="r") can
+# memory-map directly (FeatureStore.open).
+#
+# Per segment:
+#   ewmaSpeed / ewmaVolume - time-decayed averages (time constant FEATURE_EWMA_MINUTES)
+#   volumeRing             - volume per 5-minute bucket over the last hour (rollingVolume)
+#   baseMean / baseVar     - speed baseline per weekday/weekend x hour-of-day slot
+#   speedPct               - percentile of the latest speed against that slot's baseline
+#   incidentScore          - new incidents, decayed with FEATURE_INCIDENT_HALF_LIFE_HOURS
+#
+# Environment variables:
+# FEATURE_STORE - maintain the store from the ingest timers (default: true)
+# FEATURE_STORE_BLOB - blob in TRAFFIC_HISTORY_CONTAINER (default: state/features.npy)
+# FEATURE_STORE_LOCAL_PATH - use this local file instead of blob storage
+# FEATURE_EWMA_MINUTES - EWMA time constant (default: 30)
+# FEATURE_INCIDENT_HALF_LIFE_HOURS - incident score half-life (default: 24)
+
+BUCKET_SECONDS = 300
+VOLUME_BUCKETS = 12
+SLOT_MINUTES = 60
+SLOTS = 2 * 24 * 60 // SLOT_MINUTES
+BASELINE_MAX_N = 8     # baseline adapts like an EWMA once a slot has this many samples
+BASELINE_MIN_N = 3     # samples a slot needs before speedPct is reported
+SAVE_RETRIES = 3
+TWIN_ID_BYTES = 256    # UTF-8 length limit; longer ids are rejected rather than truncated
+
+FEATURE_DTYPE = np.dtype([
+    ("twinId", f"S{TWIN_ID_BYTES}"),
+    ("lastTs", "i8"),
+    ("lastSpeed", "f4"),
+    ("ewmaSpeed", "f4"),
+    ("ewmaVolume", "f4"),
+    ("volumeRing", "f4", (VOLUME_BUCKETS,)),
+    ("volumeBucket", "i4", (VOLUME_BUCKETS,)),
+    ("baseMean", "f4", (SLOTS,)),
+    ("baseVar", "f4", (SLOTS,)),
+    ("baseCount", "u2", (SLOTS,)),
+    ("speedPct", "f4"),
+    ("incidentScore", "f4"),
+    ("incidentTs", "i8"),
+    ("incidentTotal", "u4"),
+])
+
+def erf_approx(x):
+    """Vectorised erf for x >= 0 (Abramowitz & Stegun 7.1.26, |error| < 1.5e-7)."""
+    t = 1.0 / (1.0 + 0.3275911 * x)
+    poly = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    return 1.0 - poly * np.exp(-x * x)
+
+def _normal_cdf(z):
+    return 0.5 * (1.0 + np.sign(z) * erf_approx(np.abs(z) / math.sqrt(2.0)))
+
+def _widen(table: np.ndarray):
+    """Copy a table whose only difference is a narrower twinId field (else return it as is)."""
+    names = FEATURE_DTYPE.names
+    if table.dtype == FEATURE_DTYPE or table.dtype.names != names or table.dtype["twinId"].kind != "S" \
+            or table.dtype["twinId"].itemsize > TWIN_ID_BYTES \
+            or any(table.dtype[n] != FEATURE_DTYPE[n] for n in names if n != "twinId"):
+        return table
+    out = np.zeros(len(table), dtype=FEATURE_DTYPE)
+    for n in names:
+        out[n] = table[n]
+    return out
+
+def _storable(twin_ids) -> list:
+    """Twin ids that fit the twinId field; the rest are logged and dropped."""
+    ok = [t for t in twin_ids if len(t.encode()) <= TWIN_ID_BYTES]
+    if len(ok) < len(twin_ids):
+        dropped = len(twin_ids) - len(ok)
+        logging.warning(f"Feature store skipped {dropped} twin ids longer than {TWIN_ID_BYTES} bytes")
+    return ok
+
+def time_slot(ts) -> np.ndarray:
+    """Weekday/weekend x hour-of-day slot (UTC) for epoch seconds."""
+    ts = np.asarray(ts, dtype=np.int64)
+    day = ts // 86400
+    weekend = ((day + 3) % 7) >= 5  # 1970-01-01 was a Thursday
+    return weekend * (SLOTS // 2) + (ts % 86400) // (SLOT_MINUTES * 60)
+
+class FeatureStore:
+    def __init__(self, table: np.ndarray = None, etag=None):
+        table = table if table is not None else np.zeros(0, dtype=FEATURE_DTYPE)
+        table = _widen(table)
+        if table.dtype != FEATURE_DTYPE:
+            logging.warning("Feature store layout changed; starting a fresh table")
+            table = np.zeros(0, dtype=FEATURE_DTYPE)
+        self.table = table
+        self.size = len(table)
+        self.etag = etag
+        self.index = {t.decode(): i for i, t in enumerate(table["twinId"][:self.size])}
+
+    def __len__(self):
+        return self.size
+
+    @classmethod
+    def open(cls, path: str, mmap: bool = True):
+        """Memory-map a saved store read-only (mmap=False loads it writable)."""
+        return cls(np.load(path, mmap_mode="r" if mmap else None))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, etag=None):
+        return cls(np.load(io.BytesIO(data)), etag=etag)
+
+    def to_bytes(self) -> bytes:
+        buf = io.BytesIO()
+        np.save(buf, self.table[:self.size])
+        return buf.getvalue()
+
+    def save(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, self.table[:self.size])
+        os.replace(tmp, path)
+
+    def rows(self, twin_ids, create: bool = False) -> np.ndarray:
+        """Row index per twin id (-1 when unknown and create is False)."""
+        out = np.empty(len(twin_ids), dtype=np.int64)
+        for i, twin_id in enumerate(twin_ids):
+            row = self.index.get(twin_id)
+            if row is None:
+                row = self._append(twin_id) if create else -1
+            out[i] = row
+        return out
+
+    def _writable(self):
+        # A read-only mapping (FeatureStore.open) is copied on first write
+        if not self.table.flags.writeable:
+            self.table = np.array(self.table[:self.size])
+
+    def _append(self, twin_id) -> int:
+        if self.size == len(self.table):
+            grown = np.zeros(max(16, 2 * self.size), dtype=FEATURE_DTYPE)
+            grown[:self.size] = self.table[:self.size]
+            self.table = grown
+        encoded = twin_id.encode()
+        if len(encoded) > TWIN_ID_BYTES:
+            raise ValueError(f"Twin id longer than {TWIN_ID_BYTES} bytes: {twin_id[:64]}...")
+        row = self.size
+        self.table["twinId"][row] = encoded
+        self.table["speedPct"][row] = np.nan
+        self.index[twin_id] = row
+        self.size += 1
+        return row
+
+    def update_traffic(self, twin_ids, speeds, volumes, ts: int):
+        """Fold one tick of observations (NaN = missing) into the rolling features."""
+        if not len(twin_ids):
+            return
+        self._writable()
+        # Last observation per twin wins within a tick
+        keep = set(_storable(list(dict.fromkeys(twin_ids))))
+        last = {t: i for i, t in enumerate(twin_ids) if t in keep}
+        if not last:
+            return
+        pick = np.fromiter(last.values(), dtype=np.int64, count=len(last))
+        rows = self.rows(list(last), create=True)
+        speed = np.asarray(speeds, dtype=np.float64)[pick]
+        volume = np.asarray(volumes, dtype=np.float64)[pick]
+        tab = self.table
+        tau = float(os.environ.get("FEATURE_EWMA_MINUTES", 30)) * 60
+        first = tab["lastTs"][rows] == 0
+        dt = np.maximum(ts - tab["lastTs"][rows], 0)
+        alpha = np.where(first, 1.0, 1.0 - np.exp(-dt / tau))
+
+        has_speed = np.isfinite(speed)
+        r, s = rows[has_speed], speed[has_speed]
+        a = alpha[has_speed]
+        tab["ewmaSpeed"][r] = np.where(a >= 1.0, s, tab["ewmaSpeed"][r] + a * (s - tab["ewmaSpeed"][r]))
+        tab["lastSpeed"][r] = s
+        # Percentile against the slot baseline as it stood before this sample
+        slot = int(time_slot(ts))
+        mean, var, count = tab["baseMean"][r, slot], tab["baseVar"][r, slot], tab["baseCount"][r, slot]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            z = (s - mean) / np.sqrt(var)
+        pct = np.where(count >= BASELINE_MIN_N, _normal_cdf(np.nan_to_num(z, nan=0.0, posinf=8, neginf=-8)), np.nan)
+        tab["speedPct"][r] = pct
+        n = np.minimum(count.astype(np.int64) + 1, BASELINE_MAX_N)
+        delta = s - mean
+        tab["baseMean"][r, slot] = mean + delta / n
+        tab["baseVar"][r, slot] = np.where(n > 1, (1 - 1 / n) * (var + delta * delta / n), 0.0)
+        tab["baseCount"][r, slot] = np.minimum(count.astype(np.int64) + 1, np.iinfo(np.uint16).max)
+
+        has_volume = np.isfinite(volume)
+        r, v = rows[has_volume], volume[has_volume]
+        a = alpha[has_volume]
+        tab["ewmaVolume"][r] = np.where(a >= 1.0, v, tab["ewmaVolume"][r] + a * (v - tab["ewmaVolume"][r]))
+        bucket = ts // BUCKET_SECONDS
+        pos = bucket % VOLUME_BUCKETS
+        stale = tab["volumeBucket"][r, pos] != bucket
+        tab["volumeRing"][r[stale], pos] = 0.0
+        tab["volumeBucket"][r, pos] = bucket
+        tab["volumeRing"][r, pos] += v
+
+        tab["lastTs"][rows] = ts
+
+    def record_incidents(self, twin_ids, ts: int):
+        """Count one new incident per twin id occurrence, decaying older ones."""
+        if not len(twin_ids):
+            return
+        twin_ids = _storable(list(twin_ids))
+        if not twin_ids:
+            return
+        self._writable()
+        rows = self.rows(twin_ids, create=True)
+        rows, counts = np.unique(rows, return_counts=True)
+        tab = self.table
+        half_life = float(os.environ.get("FEATURE_INCIDENT_HALF_LIFE_HOURS", 24)) * 3600
+        age = np.maximum(ts - tab["incidentTs"][rows], 0)
+        decay = np.where(tab["incidentTs"][rows] == 0, 0.0, np.exp2(-age / half_life))
+        tab["incidentScore"][rows] = tab["incidentScore"][rows] * decay + counts
+        tab["incidentTs"][rows] = ts
+        tab["incidentTotal"][rows] += counts.astype(np.uint32)
+
+    def snapshot(self, now: int = None) -> dict:
+        """Column arrays for every segment, with time-dependent features evaluated at now."""
+        now = now if now is not None else int(time.time())
+        tab = self.table[:self.size]
+        bucket = now // BUCKET_SECONDS
+        live = tab["volumeBucket"] > bucket - VOLUME_BUCKETS
+        half_life = float(os.environ.get("FEATURE_INCIDENT_HALF_LIFE_HOURS", 24)) * 3600
+        age = np.maximum(now - tab["incidentTs"], 0)
+        return {
+            "twinId": [t.decode() for t in tab["twinId"]],
+            "lastTs": tab["lastTs"].copy(),
+            "lastSpeed": tab["lastSpeed"].copy(),
+            "ewmaSpeed": tab["ewmaSpeed"].copy(),
+            "ewmaVolume": tab["ewmaVolume"].copy(),
+            "rollingVolume": np.where(live, tab["volumeRing"], 0.0).sum(axis=1),
+            "speedPercentile": tab["speedPct"].copy(),
+            "incidentScore": np.where(tab["incidentTs"] == 0, 0.0, tab["incidentScore"] * np.exp2(-age / half_life)),
+            "incidentTotal": tab["incidentTotal"].copy(),
+        }
+
+    def frame(self, now: int = None):
+        import pandas as pd
+        return pd.DataFrame(self.snapshot(now))
+
+_store = None
+_store_lock = threading.Lock()
+
+def _blob(blob_service):
+    container = os.environ.get("TRAFFIC_HISTORY_CONTAINER", "raw")
+    name = os.environ.get("FEATURE_STORE_BLOB", "state/features.npy")
+    return blob_service.get_blob_client(container=container, blob=name)
+
+def load_feature_store(blob_service, force: bool = False) -> FeatureStore:
+    """Per-worker store, revalidated against the blob ETag (or read from FEATURE_STORE_LOCAL_PATH)."""
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceNotModifiedError, ResourceNotFoundError
+    global _store
+    local = os.environ.get("FEATURE_STORE_LOCAL_PATH")
+    with _store_lock:
+        if local:
+            if _store is None or force:
+                _store = FeatureStore.open(local, mmap=False) if os.path.exists(local) else FeatureStore()
+            return _store
+        cached = None if force else _store
+        try:
+            bc = _blob(blob_service)
+            with dependency("blob.features"):
+                if cached is not None and cached.etag:
+                    downloader = bc.download_blob(etag=cached.etag, match_condition=MatchConditions.IfModified)
+                else:
+                    downloader = bc.download_blob()
+                data = downloader.readall()
+            _store = FeatureStore.from_bytes(data, etag=downloader.properties.etag)
+        except ResourceNotModifiedError:
+            pass
+        except ResourceNotFoundError:
+            _store = FeatureStore()
+        except Exception as e:
+            logging.warning(f"Feature store not loaded: {e}")
+            if _store is None:
+                _store = FeatureStore()
+        return _store
+
+def commit_feature_store(blob_service, apply) -> FeatureStore:
+    """Run apply(store) and persist the result.
+
+    Blob writes are ETag-conditional; if another worker saved in between, the
+    store is reloaded and apply is re-run on the fresh copy.
+    """
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+    global _store
+    local = os.environ.get("FEATURE_STORE_LOCAL_PATH")
+    store = load_feature_store(blob_service)
+    for attempt in range(SAVE_RETRIES):
+        apply(store)
+        if local:
+            store.save(local)
+            return store
+        try:
+            bc = _blob(blob_service)
+            with dependency("blob.features"):
+                if store.etag:
+                    result = bc.upload_blob(store.to_bytes(), overwrite=True, etag=store.etag,
+                                            match_condition=MatchConditions.IfNotModified)
+                else:
+                    result = bc.upload_blob(store.to_bytes(), overwrite=False)
+            store.etag = result.get("etag")
+            return store
+        except (ResourceModifiedError, ResourceExistsError):
+            logging.info("Feature store changed concurrently; reloading and reapplying")
+            store = load_feature_store(blob_service, force=True)
+        except Exception as e:
+            logging.warning(f"Failed to save feature store: {e}")
+            with _store_lock:
+                _store = None  # in-memory copy no longer matches the blob
+            return store
+    logging.warning(f"Gave up saving feature store after {SAVE_RETRIES} concurrent updates")
+    with _store_lock:
+        _store = None
+    return store
+
+def reset_feature_store():
+    global _store
+    with _store_lock:
+        _store = None
@@ -0,0 +1,288 @@
+import os, re, json, time, codecs, random, logging, threading
+import requests
+from urllib.parse import urlsplit
+from shared import observe, count, dependency
+
+# HTTP helpers for the upstream feeds (RITIS RSS, FDOT JSON).
+#
+# Sessions are kept per worker so TCP/TLS connections and login cookies are
+# reused across timer ticks. ETag / Last-Modified validators let an unchanged
+# feed come back as a 304, and both validators and cookies are persisted to a
+# small state blob so they survive cold starts.
+#
+# Environment variables:
+# FEED_MAX_RETRIES - retries after 429/5xx or connection errors (default: 4)
+# FEED_BACKOFF_BASE_SECONDS - first backoff step (default: 1)
+# FEED_BACKOFF_MAX_SECONDS - backoff cap (default: 30)
+# FEED_STATE_BLOB - blob in TRAFFIC_HISTORY_CONTAINER for validators and cookies
+#                   (default: state/feed_state.json)
+# FEED_STREAM_CHUNK_BYTES - read size when streaming JSON bodies (default: 65536)
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+WRAPPER_KEYS = ("records", "data", "items")
+
+_sessions = {}
+_validators = {}  # url -> {"etag": ..., "last_modified": ...} that were fully processed
+_pending = {}     # url -> validators from the latest 200, committed after processing
+_state_loaded = False
+_lock = threading.Lock()
+
+def get_session(name: str) -> requests.Session:
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = requests.Session()
+            session.headers["Accept-Encoding"] = "gzip, deflate"
+            _sessions[name] = session
+        return session
+
+def drop_session(name: str):
+    with _lock:
+        session = _sessions.pop(name, None)
+    if session is not None:
+        session.close()
+
+def backoff_delay(attempt: int, retry_after=None) -> float:
+    """Exponential backoff with full jitter, honouring a Retry-After hint when given."""
+    cap = float(os.environ.get("FEED_BACKOFF_MAX_SECONDS", 30))
+    if retry_after:
+        try:
+            return min(cap, float(retry_after))
+        except ValueError:
+            pass
+    base = float(os.environ.get("FEED_BACKOFF_BASE_SECONDS", 1))
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+def request_with_backoff(session, method: str, url: str, max_retries: int = None, **kwargs):
+    max_retries = max_retries if max_retries is not None else int(os.environ.get("FEED_MAX_RETRIES", 4))
+    kwargs.setdefault("timeout", 30)
+    metric = f"http.{urlsplit(url).hostname or 'unknown'}"
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            resp = session.request(method, url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            observe(metric, time.perf_counter() - start)
+            if attempt >= max_retries:
+                count("http.errors")
+                raise
+            delay = backoff_delay(attempt)
+            logging.warning(f"{method} {url} failed ({e}); retrying in {delay:.1f}s")
+        else:
+            # Time to response headers; streamed bodies are timed by the caller's stage span
+            observe(metric, time.perf_counter() - start)
+            if resp.status_code not in RETRYABLE_STATUS or attempt >= max_retries:
+                return resp
+            count("http.throttled", status=resp.status_code)
+            delay = backoff_delay(attempt, resp.headers.get("Retry-After"))
+            logging.warning(f"{method} {url} returned {resp.status_code}; retrying in {delay:.1f}s")
+            # A streamed body is never read, so hand its connection back to the pool now
+            resp.close()
+        count("http.retries")
+        time.sleep(delay)
+        attempt += 1
+
+def conditional_get(session, url: str, headers: dict = None, **kwargs):
+    """GET with If-None-Match / If-Modified-Since. Returns None when the feed is unchanged.
+
+    Validators from a 200 are only remembered once commit_validators(url) is
+    called, so a run that fails after fetching will refetch next time.
+    """
+    headers = dict(headers or {})
+    with _lock:
+        known = _validators.get(url, {})
+    if known.get("etag"):
+        headers["If-None-Match"] = known["etag"]
+    if known.get("last_modified"):
+        headers["If-Modified-Since"] = known["last_modified"]
+    resp = request_with_backoff(session, "GET", url, headers=headers, **kwargs)
+    if resp.status_code == 304:
+        resp.close()
+        return None
+    if resp.status_code < 400:
+        with _lock:
+            _pending[url] = {
+                "etag": resp.headers.get("ETag"),
+                "last_modified": resp.headers.get("Last-Modified"),
+            }
+    return resp
+
+def commit_validators(url: str):
+    with _lock:
+        pending = _pending.pop(url, None)
+        if pending and (pending["etag"] or pending["last_modified"]):
+            _validators[url] = pending
+
+def _state_blob(blob_service):
+    container = os.environ.get("TRAFFIC_HISTORY_CONTAINER", "raw")
+    name = os.environ.get("FEED_STATE_BLOB", "state/feed_state.json")
+    return blob_service.get_blob_client(container=container, blob=name)
+
+def load_feed_state(blob_service):
+    """Restore validators and cookies once per worker (no-op when already warm)."""
+    global _state_loaded
+    with _lock:
+        if _state_loaded or blob_service is None:
+            return
+        _state_loaded = True
+    try:
+        with dependency("blob.feed_state"):
+            state = json.loads(_state_blob(blob_service).download_blob().readall())
+    except Exception as e:
+        logging.info(f"No feed state loaded: {e}")
+        return
+    with _lock:
+        for url, v in state.get("validators", {}).items():
+            _validators.setdefault(url, v)
+    for name, cookies in state.get("cookies", {}).items():
+        session = get_session(name)
+        for c in cookies:
+            session.cookies.set(c["name"], c["value"], domain=c.get("domain"), path=c.get("path"),
+                                expires=c.get("expires"), secure=c.get("secure", False))
+
+def save_feed_state(blob_service):
+    if blob_service is None:
+        return
+    with _lock:
+        state = {
+            "validators": dict(_validators),
+            "cookies": {
+                name: [{"name": c.name, "value": c.value, "domain": c.domain, "path": c.path,
+                        "expires": c.expires, "secure": c.secure} for c in session.cookies]
+                for name, session in _sessions.items()
+            },
+        }
+    try:
+        with dependency("blob.feed_state"):
+            _state_blob(blob_service).upload_blob(json.dumps(state), overwrite=True)
+    except Exception as e:
+        logging.warning(f"Failed to save feed state: {e}")
+
+def reset_feed_state():
+    global _state_loaded
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+        _validators.clear()
+        _pending.clear()
+        _state_loaded = False
+
+_WS = re.compile(r"[ \t\n\r]*")
+_decoder = json.JSONDecoder()
+
+class _JsonStream:
+    """Pull-style reader over byte chunks that decodes one JSON value at a time.
+
+    Only the value being decoded is buffered, so arrays of any length are read
+    with flat memory.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buf, self.pos, self.eof = "", 0, False
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self.eof = True
+            text = self._utf8.decode(b"", final=True)
+        else:
+            text = self._utf8.decode(chunk)
+        self.buf = self.buf[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self) -> str:
+        """Next non-whitespace character ("" at end of input)."""
+        while True:
+            self.pos = _WS.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, ch: str):
+        if self.peek() != ch:
+            raise ValueError(f"expected {ch!r} at offset {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode(self.buf, self.pos)
+                # A scalar ending exactly at the buffer edge may continue in the next chunk
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return obj
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+
+    def items(self):
+        self.expect("[")
+        while True:
+            c = self.peek()
+            if c == "]":
+                self.pos += 1
+                return
+            if c == ",":
+                self.pos += 1
+                continue
+            if not c:
+                raise ValueError("truncated JSON array")
+            yield self.value()
+
+def iter_json_records(chunks, keys=WRAPPER_KEYS):
+    """Yield records from a JSON body without loading it whole.
+
+    Accepts a bare array, or an object wrapping the array under one of keys
+    (the first one present in the document is streamed). Objects without a
+    wrapper key fall back to flattening all their list values, which are
+    buffered until the end of the object.
+    """
+    stream = _JsonStream(chunks)
+    c = stream.peek()
+    if c == "[":
+        yield from stream.items()
+        return
+    if c != "{":
+        # Raised rather than yielding nothing, so the caller doesn't commit this version's validators
+        raise ValueError("Unexpected JSON shape from feed")
+    stream.pos += 1
+    found, fallback = False, []
+    while True:
+        c = stream.peek()
+        if c == "}" or not c:
+            break
+        if c == ",":
+            stream.pos += 1
+            continue
+        key = stream.value()
+        stream.expect(":")
+        if stream.peek() != "[":
+            stream.value()
+        elif key in keys and not found:
+            found = True
+            yield from stream.items()
+        elif found:
+            for _ in stream.items():
+                pass
+        else:
+            fallback.extend(stream.items())
+    if not found:
+        yield from fallback
+
+def stream_json_records(resp, keys=WRAPPER_KEYS):
+    """Records parsed from a streamed response, closing it once read, abandoned or failed."""
+    chunk_bytes = int(os.environ.get("FEED_STREAM_CHUNK_BYTES", 65536))
+    try:
+        yield from iter_json_records(resp.iter_content(chunk_size=chunk_bytes), keys)
+    finally:
+        resp.close()
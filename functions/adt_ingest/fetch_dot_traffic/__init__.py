@@ -1,5 +1,13 @@
-import os, logging, datetime, json, requests
-from shared import get_clients, load_segment_map
+import os, logging, datetime, json, time
+from shared import get_clients, get_queue_client, load_segment_map, get_segment_model, traced, span, dependency, timed_iter, count
+from patching import PatchDispatcher, chain
+from delta import get_delta_cache, PassThroughDelta
+from history_store import get_history_store
+from feeds import get_session, conditional_get, commit_validators, load_feed_state, save_feed_state, stream_json_records
+from features import load_feature_store, commit_feature_store
+from rollups import commit_rollups
+from anomaly import score_speeds, anomaly_patches
+from sharding import ShardedDispatcher, SHARD_QUEUE, ingest_shards, report_previous_run
 
 # Expected env vars:
 # FDOT_TRAFFIC_API_URL - base endpoint for FDOT traffic data (JSON)
@@ -7,11 +15,28 @@ from shared import get_clients, load_segment_map
 # SEGMENT_MAP_CONTAINER - blob container holding segment_map.csv (default: raw)
 # SEGMENT_MAP_BLOB - blob path (default: segment_map.csv)
 # TRAFFIC_HISTORY_CONTAINER - container to append raw snapshots (default: raw)
+# FDOT_STREAM - parse the response incrementally instead of resp.json() (default: true)
+# FDOT_HISTORY_BATCH_ROWS - history rows buffered per archive file (default: 50000)
+# FEATURE_STORE - fold each tick into the rolling feature store (default: true, see features.py)
+# ROLLUPS - fold each tick into the 5m/1h/1d history rollups (default: true, see rollups.py)
+# SPEED_ANOMALY - flag speed collapses against the store's baselines; RoadSegment;2 twins only
+#                 (default: false, see anomaly.py)
+# INGEST_SHARDS - enqueue the ADT writes in this many shards for apply_shard instead of writing them here
+#                 (default: 0, see sharding.py)
 
-RATE_LIMIT_SLEEP_SECONDS = 2
+def failed_feed(error: Exception):
+    """A record stream that raises `error` when read, so iter_normalized marks the run as failed."""
+    raise error
+    yield
 
+def fetch_fdot_json():
+    """Return an iterable of FDOT records, or None when the feed is unchanged.
 
-def fetch_fdot_json() -> list:
+    In streaming mode the records are parsed lazily from the response body, so
+    errors part-way through surface while iterating (see iter_normalized). A
+    failed fetch or an unreadable body is returned as a failed_feed, which
+    yields nothing but keeps the response's validators from being committed.
+    """
     base = os.environ.get("FDOT_TRAFFIC_API_URL")
     if not base:
         logging.error("FDOT_TRAFFIC_API_URL not set")
@@ -20,14 +45,17 @@ def fetch_fdot_json() -> list:
     api_key = os.environ.get("FDOT_API_KEY")
     if api_key:
         headers['Authorization'] = f"Bearer {api_key}"
+    streaming = os.environ.get("FDOT_STREAM", "true").lower() == "true"
     try:
-        resp = requests.get(base, headers=headers, timeout=15)
-        if resp.status_code == 429:  # rate limit
-            logging.warning("Rate limited; backing off")
-            import time
-            time.sleep(RATE_LIMIT_SLEEP_SECONDS)
-            resp = requests.get(base, headers=headers, timeout=15)
+        # 429/5xx are retried with jittered exponential backoff inside conditional_get
+        resp = conditional_get(get_session("fdot"), base, headers=headers, timeout=15, stream=streaming)
+        if resp is None:
+            return None
+        if resp.status_code >= 400:
+            resp.close()
         resp.raise_for_status()
+        if streaming:
+            return stream_json_records(resp)
         data = resp.json()
         # Assume data is either a list of records or wrapped in a key
         if isinstance(data, dict):
@@ -45,10 +73,19 @@ def fetch_fdot_json() -> list:
             return data
         else:
             logging.warning("Unexpected JSON shape from FDOT API")
-            return []
+            return failed_feed(ValueError(f"unexpected JSON shape: {type(data).__name__}"))
     except Exception as e:
         logging.error(f"FDOT fetch failed: {e}")
-        return []
+        return failed_feed(e)
+
+def iter_normalized(raw_records, counts: dict):
+    try:
+        for rec in raw_records:
+            counts['raw'] += 1
+            yield normalize_record(rec)
+    except Exception as e:
+        counts['error'] = e
+        logging.error(f"FDOT stream failed after {counts['raw']} records: {e}")
 
 def normalize_record(rec: dict) -> dict:
     # Adjust field names based on actual FDOT API once known.
@@ -73,42 +110,164 @@ def build_patch(norm: dict) -> list:
     ops.append({"op":"add","path":"/asOf","value":str(norm['timestamp'])})
     return ops
 
-def write_history(blob_client, records: list):
-    container = os.environ.get("TRAFFIC_HISTORY_CONTAINER", "raw")
-    ts = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
-    name = f"history/traffic_{ts}.json"  # append-only snapshot
+def submit_patches(records, mapping, delta, dispatcher, counts: dict):
+    """Queue a patch per mapped twin and pass every record on (for the history writer)."""
+    for norm in records:
+        ext_id = norm['external_id']
+        twin_ids = mapping.twins(ext_id) if ext_id else None
+        patch = build_patch(norm) if twin_ids else None
+        if not patch:
+            counts['skipped'] += 1
+            yield norm
+            continue
+        norm['twinIds'] = twin_ids
+        for twin_id in twin_ids:
+            twin_patch = delta.filter(twin_id, patch)
+            if not twin_patch:
+                counts['unchanged'] += 1
+                continue
+            dispatcher.submit(twin_id, twin_patch)
+        yield norm
+
+def _as_float(value):
     try:
-        blob_client.get_blob_client(container=container, blob=name).upload_blob(json.dumps(records), overwrite=False)
-    except Exception as e:
-        logging.warning(f"Failed writing history snapshot: {e}")
+        return float(value)
+    except (TypeError, ValueError):
+        return float("nan")
+
+def collect_features(records, tick: dict):
+    """Gather {twin: (speed, volume)} for the feature store and rollups, passing records on.
+
+    Keyed by twin (last report wins), so it is bounded by the segment map, not by the feed.
+    """
+    for norm in records:
+        twin_ids = norm.get('twinIds')
+        if twin_ids:
+            reading = (_as_float(norm['avgSpeed']), _as_float(norm['volume']))
+            for twin_id in twin_ids:
+                tick[twin_id] = reading
+        yield norm
+
+def tick_columns(tick: dict):
+    """(twin_ids, speeds, volumes) columns of a collect_features tick."""
+    readings = list(tick.values())
+    return list(tick), [r[0] for r in readings], [r[1] for r in readings]
+
+def detect_anomalies(records, store, ts: int, delta, dispatcher, counts: dict):
+    """Score mapped speeds in vectorised batches and queue speedAnomaly patches, passing records on."""
+    batch_rows = int(os.environ.get("ANOMALY_BATCH_ROWS", 10000))
+    twins, speeds = [], []
+    def score():
+        scores, flags = score_speeds(store, twins, speeds, ts)
+        counts['anomalies'] += int(flags.sum())
+        for twin_id, patch in anomaly_patches(twins, scores, flags):
+            dispatcher.submit(twin_id, delta.filter(twin_id, patch))
+    for norm in records:
+        twin_ids = norm.get('twinIds')
+        if twin_ids:
+            speed = _as_float(norm['avgSpeed'])
+            for twin_id in twin_ids:
+                twins.append(twin_id)
+                speeds.append(speed)
+            if len(twins) >= batch_rows:
+                score()
+                twins, speeds = [], []
+        yield norm
+    if twins:
+        score()
 
+def write_history(blob_client, records):
+    # One row per mapped twin; unmapped records are kept with a null twinId.
+    # Rows are archived in batches so a large feed is never held in memory whole.
+    batch_rows = int(os.environ.get("FDOT_HISTORY_BATCH_ROWS", 50000))
+    store = get_history_store(blob_client)
+    rows = []
+    def flush():
+        try:
+            with dependency("blob.history"):
+                store.append("traffic", rows)
+        except Exception as e:
+            logging.warning(f"Failed writing history snapshot: {e}")
+    for r in records:
+        rows.extend({
+            'twinId': twin_id,
+            'externalId': r['external_id'],
+            'avgSpeed': r['avgSpeed'],
+            'volume': r['volume'],
+            'asOf': r['timestamp'],
+        } for twin_id in (r.get('twinIds') or (None,)))
+        if len(rows) >= batch_rows:
+            flush()
+            rows = []
+    if rows:
+        flush()
+
+@traced("fetch_dot_traffic")
 def main(myTimer) -> None:
     logging.info("Traffic timer trigger fired")
     adt, blob = get_clients()
-    mapping = load_segment_map(blob)
-    raw_records = fetch_fdot_json()
-    normalized = [normalize_record(r) for r in raw_records]
+    with span("load_state"):
+        mapping = load_segment_map(blob)
+        load_feed_state(blob)
+    with span("fetch"):
+        raw_records = fetch_fdot_json()
+    if raw_records is None:
+        logging.info("FDOT feed not modified since last run; skipping")
+        count("feed.not_modified")
+        save_feed_state(blob)
+        return
 
-    updated, skipped = 0, 0
-    for norm in normalized:
-        ext_id = norm['external_id']
-        if not ext_id:
-            skipped += 1
-            continue
-        twin_id = mapping.get(ext_id)
-        if not twin_id:
-            skipped += 1
-            continue
-        patch = build_patch(norm)
-        if not patch:
-            skipped += 1
-            continue
-        try:
-            adt.update_digital_twin(twin_id, patch)
-            updated += 1
-        except Exception as e:
-            logging.error(f"Failed patch twin {twin_id}: {e}")
-            skipped += 1
+    now_ts = int(time.time())
+    shards = ingest_shards()
+    if shards:
+        # Delta filtering happens in the shard workers, which see the writes
+        report_previous_run(blob, "traffic")
+        delta = PassThroughDelta()
+        dispatcher = ShardedDispatcher(get_queue_client(SHARD_QUEUE), blob, "traffic", shards, ts=now_ts)
+    else:
+        with span("load_state"):
+            delta = get_delta_cache(blob)
+        dispatcher = PatchDispatcher(adt, label="traffic", on_written=chain(delta.commit, get_segment_model().apply_patch))
+    counts = {'raw': 0, 'skipped': 0, 'unchanged': 0, 'anomalies': 0, 'error': None}
+    tick = {}
+    use_features = os.environ.get("FEATURE_STORE", "true").lower() == "true"
+    # fetch -> normalize -> queue patches -> score anomalies -> collect features -> archive,
+    # one record at a time; "parse" is the time spent pulling records off the (streamed) feed.
+    # What is kept until the end of the run (pending patches, the tick) is one entry per twin,
+    # so it grows with the segment map rather than with the size of the feed.
+    records = submit_patches(iter_normalized(timed_iter("parse", raw_records), counts), mapping, delta, dispatcher, counts)
+    anomalies = None
+    if use_features and os.environ.get("SPEED_ANOMALY", "false").lower() == "true":
+        # Scored against the baselines as they stood before this tick
+        with span("load_state"):
+            store = load_feature_store(blob)
+        # speedAnomaly* only exist on RoadSegment;2, so they are written as their own patches:
+        # a rejected anomaly write must not take the tick's avgSpeed/volume down with it
+        if shards:
+            anomalies = ShardedDispatcher(get_queue_client(SHARD_QUEUE), blob, "anomaly", shards, ts=now_ts)
+        else:
+            anomalies = PatchDispatcher(adt, label="anomaly", on_written=chain(delta.commit, get_segment_model().apply_patch))
+        records = detect_anomalies(records, store, now_ts, delta, anomalies, counts)
+    with span("pipeline"):
+        write_history(blob, collect_features(records, tick))
+
+    with span("adt_flush"):
+        summary = dispatcher.flush()
+        if anomalies is not None:
+            anomalies.flush()
+    updated = summary['updated']
+    skipped = counts['skipped'] + summary['failed'] + summary['not_found']
 
-    write_history(blob, normalized)
-    logging.info(f"Traffic update complete. Updated={updated} Skipped={skipped} TotalRaw={len(raw_records)}")
+    with span("save_state"):
+        delta.save_snapshot(blob)
+        twin_ids, speeds, volumes = tick_columns(tick)
+        if use_features:
+            commit_feature_store(blob, lambda store: store.update_traffic(twin_ids, speeds, volumes, now_ts))
+        if os.environ.get("ROLLUPS", "true").lower() == "true":
+            commit_rollups(blob, twin_ids, speeds, volumes, now_ts)
+        if counts['error'] is None:
+            commit_validators(os.environ.get("FDOT_TRAFFIC_API_URL"))
+        save_feed_state(blob)
+    for key in ('raw', 'skipped', 'unchanged', 'anomalies'):
+        count(f"records.{key}", counts[key])
+    logging.info(f"Traffic update complete. Updated={updated} Queued={summary.get('queued', 0)} Unchanged={counts['unchanged']} Skipped={skipped} TotalRaw={counts['raw']} Anomalies={counts['anomalies']}")
@@ -1,15 +1,23 @@
 import logging
 import os
 import re
+import html
 import json
+import hashlib
 from datetime import datetime, timezone
 import azure.functions as func
 import feedparser
 import requests
-from azure.digitaltwins.core import DigitalTwinsClient
-from azure.identity import DefaultAzureCredential
-from azure.core.exceptions import ResourceNotFoundError
-from shared import load_segment_map, get_clients
+from shared import load_segment_map, get_clients, get_queue_client, ensure_container, get_segment_model, traced, span, dependency, count
+from patching import PatchDispatcher, chain
+from delta import get_delta_cache, PassThroughDelta
+from history_store import get_history_store
+from snapshots import publish_snapshot
+from geo import load_segment_geometry
+from graph import get_segment_graph, propagation_patches, load_propagation_state, save_propagation_state
+from feeds import get_session, conditional_get, request_with_backoff, commit_validators, load_feed_state, save_feed_state
+from features import commit_feature_store
+from sharding import ShardedDispatcher, SHARD_QUEUE, ingest_shards, report_previous_run, unwritten_twins
 
 # Regex patterns to extract fields from HTML description blocks
 SEGMENT_ID_PATTERNS = [
@@ -21,6 +29,24 @@ COORD_RE = re.compile(r"(?P<lat>-?\d+\.\d+),(?P<lon>-?\d+\.\d+)")
 LANE_STATUS_RE = re.compile(r"Lane Status:\s*(?P<affected>\d+)\s+out of\s+(?P<total>\d+)\s+lanes affected\s*(?P<impact>.*?)\s*\((?P<direction>[NSEW][B]?|[A-Za-z]+)\)", re.IGNORECASE)
 LAST_UPDATE_RE = re.compile(r"Last Update Time:\s*(?P<dt>[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}[-+][0-9]{2}:[0-9]{2})")
 
+# Single-pass extractor used by parse_entry: one alternation covering every field
+# above, run once over the tag-stripped description. The leading lookahead rejects
+# positions no branch can start at before any branch is tried. The "cleared" phrases
+# are searched for separately: they can sit inside a lane-status block, whose
+# impact text a single alternation would consume.
+DESCRIPTION_RE = re.compile(
+    r"(?=[-0-9SLl])(?:"
+    r"Segment (?P<seg0>[A-Za-z0-9_-]+)"
+    r"|SEG(?P<seg1>[0-9]+)"
+    r"|SegmentID[:\s]+(?P<seg2>[A-Za-z0-9_-]+)"
+    r"|(?P<lat>-?\d+\.\d+),(?P<lon>-?\d+\.\d+)"
+    r"|(?i:Lane Status:\s*(?P<affected>\d+)\s+out of\s+(?P<total>\d+)\s+lanes affected\s*(?P<impact>.*?)\s*\((?P<direction>[NSEW][B]?|[A-Za-z]+)\))"
+    r"|Last Update Time:\s*(?P<dt>[0-9]{4}-[0-9]{2}-[0-9]{2} [0-9]{2}:[0-9]{2}:[0-9]{2}[-+][0-9]{2}:[0-9]{2})"
+    r")"
+)
+CLEARED_RE = re.compile(r"scene is clear|all vehicles have departed|cleared", re.IGNORECASE)
+TAG_RE = re.compile(r"<[^>]*>")
+
 def parse_segment_id(text: str):
     for pat in SEGMENT_ID_PATTERNS:
         m = pat.search(text)
@@ -45,6 +71,52 @@ def parse_lane_status(text: str):
         "incidentDirection": m.group("direction").strip()
     }
 
+def strip_html(text: str) -> str:
+    if "<" in text:
+        text = TAG_RE.sub(" ", text)
+    if "&" in text:
+        text = html.unescape(text)
+    return text
+
+def parse_description(desc: str, title: str = "") -> dict:
+    """Extract every incident field from a description in one regex pass.
+
+    Segment IDs keep the SEGMENT_ID_PATTERNS priority (the title is only
+    scanned when the description has none). With several lane-status blocks
+    the worst one (highest affected/total) fills the scalar lane fields and
+    all of them are kept under "laneStatus"; the latest update time wins.
+    """
+    segments, coords, lanes, updates = {}, [], [], []
+    text = strip_html(desc)
+    for m in DESCRIPTION_RE.finditer(text):
+        kind = m.lastgroup
+        if kind == "lon":
+            coords.append({"lat": float(m.group("lat")), "lon": float(m.group("lon"))})
+        elif kind == "direction":
+            lanes.append(m.group("affected", "total", "impact", "direction"))
+        elif kind == "dt":
+            updates.append(m.group("dt"))
+        else:
+            segments.setdefault(kind, m.group(kind))
+    segment_id = segments.get("seg0") or segments.get("seg1") or segments.get("seg2")
+    if segment_id is None and title:
+        segment_id = parse_segment_id(title)
+    out = {"externalSegmentId": segment_id, "coordinates": coords, "status": "cleared" if CLEARED_RE.search(text) else "active"}
+    if lanes:
+        lanes = [{
+            "incidentAffectedLanes": int(affected),
+            "incidentTotalLanes": int(total),
+            "incidentLaneImpact": impact.strip(),
+            "incidentDirection": direction.strip()
+        } for affected, total, impact, direction in lanes]
+        worst = max(lanes, key=lambda l: l["incidentAffectedLanes"] / l["incidentTotalLanes"] if l["incidentTotalLanes"] else 0)
+        out.update(worst)
+        if len(lanes) > 1:
+            out["laneStatus"] = lanes
+    if updates:
+        out["incidentLastUpdate"] = max(updates).replace(" ", "T")
+    return out
+
 def parse_last_update(text: str):
     m = LAST_UPDATE_RE.search(text)
     if not m:
@@ -58,53 +130,278 @@ def parse_last_update(text: str):
     except Exception:
         return None
 
+EMPTY_FEED = "<?xml version='1.0'?><rss><channel></channel></rss>"
+
+def _login(session, login_url, email, password) -> bool:
+    # Initial GET (capture cookies / tokens if any)
+    request_with_backoff(session, "GET", login_url)
+    # Attempt common form field names
+    payload_variants = [
+        {"username": email, "password": password},
+        {"email": email, "password": password},
+        {"user": email, "pass": password}
+    ]
+    for payload in payload_variants:
+        try:
+            r = request_with_backoff(session, "POST", login_url, data=payload)
+            if r.status_code < 400 and ("logout" in r.text.lower() or "dashboard" in r.text.lower()):
+                return True
+        except Exception:
+            continue
+    logging.warning("Login heuristics did not confirm session; proceeding to fetch feed anyway.")
+    return False
+
 def fetch_authenticated_feed(url: str):
+    """Return the feed text, or None when it is unchanged since the last processed run.
+
+    The login session (and its cookies) is reused across invocations and only
+    re-established after a 401.
+    """
     email = os.environ.get("RITIS_EMAIL")
     password = os.environ.get("RITIS_PASSWORD")
     login_url = os.environ.get("RITIS_LOGIN_URL")
+    session = get_session("ritis")
 
     if not email or not password or not login_url:
         # Fallback: unauthenticated direct fetch
-        resp = requests.get(url, timeout=30)
+        resp = conditional_get(session, url)
+        if resp is None:
+            return None
         resp.raise_for_status()
         return resp.text
 
-    session = requests.Session()
     try:
-        # Initial GET (capture cookies / tokens if any)
-        session.get(login_url, timeout=30)
-        # Attempt common form field names
-        payload_variants = [
-            {"username": email, "password": password},
-            {"email": email, "password": password},
-            {"user": email, "pass": password}
-        ]
-        logged_in = False
-        for payload in payload_variants:
-            try:
-                r = session.post(login_url, data=payload, timeout=30)
-                if r.status_code < 400 and ("logout" in r.text.lower() or "dashboard" in r.text.lower()):
-                    logged_in = True
-                    break
-            except Exception:
-                continue
-        if not logged_in:
-            logging.warning("Login heuristics did not confirm session; proceeding to fetch feed anyway.")
-        feed_resp = session.get(url, timeout=30)
+        if not len(session.cookies):
+            _login(session, login_url, email, password)
+        feed_resp = conditional_get(session, url)
+        if feed_resp is not None and feed_resp.status_code == 401:
+            logging.info("RITIS session expired; logging in again")
+            session.cookies.clear()
+            _login(session, login_url, email, password)
+            feed_resp = conditional_get(session, url)
+        if feed_resp is None:
+            return None
         if feed_resp.status_code == 401:
             logging.error("Authenticated feed returned 401 Unauthorized; returning empty feed.")
-            return "<?xml version='1.0'?><rss><channel></channel></rss>"
+            session.cookies.clear()
+            return EMPTY_FEED
         feed_resp.raise_for_status()
         return feed_resp.text
     except Exception as ex:
         logging.error(f"Authenticated fetch failed: {ex}; falling back to direct.")
-        resp = requests.get(url, timeout=30)
+        resp = request_with_backoff(requests, "GET", url)
         if resp.status_code == 401:
             logging.error("Direct feed fetch also 401 Unauthorized; returning empty feed.")
-            return "<?xml version='1.0'?><rss><channel></channel></rss>"
+            return EMPTY_FEED
         resp.raise_for_status()
         return resp.text
 
+def build_incident_patch(incident: dict, now_iso: str) -> list:
+    patch_ops = [
+        {"op": "add", "path": "/status", "value": incident["status"]},
+        {"op": "add", "path": "/lastSeen", "value": now_iso}
+    ]
+    # Attempt to include incident properties if model version supports them
+    for prop in [
+        "incidentAffectedLanes","incidentTotalLanes","incidentLaneImpact","incidentDirection","incidentLastUpdate"
+    ]:
+        if prop in incident:
+            patch_ops.append({"op": "add", "path": f"/{prop}", "value": incident[prop]})
+    # Derive congestionIndex from lane closure ratio if available
+    affected = incident.get("incidentAffectedLanes")
+    total = incident.get("incidentTotalLanes")
+    if isinstance(affected, int) and isinstance(total, int) and total > 0:
+        ratio = min(1.0, max(0.0, affected / total))
+        patch_ops.append({"op": "add", "path": "/congestionIndex", "value": ratio})
+        # Optionally mirror as predictedCongestionIndex until predictive model exists
+        patch_ops.append({"op": "add", "path": "/predictedCongestionIndex", "value": ratio})
+    return patch_ops
+
+# Incremental mode
+# RITIS_INCREMENTAL - skip entries whose fingerprint is unchanged; when false they are re-parsed and
+#                     re-patched, but still not counted or archived as changed (default: true)
+# RITIS_STATE_BLOB - seen-set blob in TRAFFIC_HISTORY_CONTAINER (default: state/ritis_incidents.json)
+# RITIS_EXPIRE_AFTER_MISSES - runs an incident may be absent before it is expired (default: 1)
+
+def fingerprint(entry) -> tuple:
+    """(key, fingerprint) for a feed entry without parsing its description.
+
+    The description embeds the "Last Update Time", so hashing it covers
+    incidentLastUpdate as well as any other content change.
+    """
+    desc = entry.get("description", "") or ""
+    title = entry.get("title", "") or ""
+    key = entry.get("id") or entry.get("guid") or entry.get("link") or hashlib.sha1(title.encode()).hexdigest()
+    digest = hashlib.sha1("\x1f".join([title, desc, entry.get("published", "") or ""]).encode()).hexdigest()
+    return key, digest
+
+def parse_entry(entry, now_iso: str) -> dict:
+    desc = entry.get("description", "") or ""
+    title = entry.get("title", "") or ""
+    fields = parse_description(desc, title)
+    incident = {
+        "title": title,
+        "summary": desc[:500],
+        "published": entry.get("published", None),
+        "ingested": now_iso,
+        **fields
+    }
+    return incident
+
+def incident_seeds(state: dict) -> dict:
+    """{twin_id: lane-closure ratio} for every active incident in the seen-set."""
+    seeds = {}
+    for v in state.values():
+        incident = v["incident"]
+        affected, total = incident.get("incidentAffectedLanes"), incident.get("incidentTotalLanes")
+        if incident["status"] != "active" or not isinstance(affected, int) or not isinstance(total, int) or total <= 0:
+            continue
+        ratio = min(1.0, max(0.0, affected / total))
+        for twin_id in (incident.get("twinId") or "").split(";"):
+            if twin_id:
+                seeds[twin_id] = max(seeds.get(twin_id, 0.0), ratio)
+    return seeds
+
+def clear_patch(now_iso: str) -> list:
+    return [
+        {"op": "add", "path": "/status", "value": "cleared"},
+        {"op": "add", "path": "/lastSeen", "value": now_iso},
+        {"op": "add", "path": "/congestionIndex", "value": 0.0},
+    ]
+
+def _state_blob(blob_service):
+    container = os.environ.get("TRAFFIC_HISTORY_CONTAINER", "raw")
+    name = os.environ.get("RITIS_STATE_BLOB", "state/ritis_incidents.json")
+    return blob_service.get_blob_client(container=container, blob=name)
+
+def load_incident_state(blob_service) -> dict:
+    try:
+        return json.loads(_state_blob(blob_service).download_blob().readall()).get("incidents", {})
+    except Exception as ex:
+        logging.info(f"No incident state loaded: {ex}")
+        return {}
+
+def save_incident_state(blob_service, state: dict):
+    try:
+        body = json.dumps({"version": 1, "incidents": state}, separators=(",", ":"))
+        _state_blob(blob_service).upload_blob(body, overwrite=True)
+    except Exception as ex:
+        logging.warning(f"Failed to save incident state: {ex}")
+
+def resolve_twins(incident: dict, segment_map, geometry=None) -> tuple:
+    """Twins for an incident: mapped segment id, else nearest segment to its coordinates."""
+    segment_external_id = incident["externalSegmentId"]
+    twin_ids = segment_map.twins(segment_external_id) if segment_external_id else ()
+    if not twin_ids and geometry is not None and incident["coordinates"]:
+        twin_ids = geometry.resolve(incident["coordinates"])
+        if twin_ids:
+            incident["matchedBy"] = "coordinates"
+    if not twin_ids and segment_external_id:
+        twin_ids = (map_external_to_twin(segment_external_id),)
+    return twin_ids
+
+def reconcile(entries, previous: dict, segment_map, now_iso: str, expire_after: int = 1, geometry=None,
+              reparse: bool = False):
+    """Diff feed entries against the previous seen-set.
+
+    Returns (state, changed, patches): the new seen-set, incidents that were
+    new/updated/cleared/expired (each tagged with "transition"), and
+    (twin_id, ops) pairs to apply. Unchanged entries are neither parsed nor patched.
+    geometry (a geo.SegmentIndex) links incidents without a mapped segment id
+    to the nearest segment by coordinates. With reparse, unchanged entries are
+    parsed and patched too, but still not reported as changed.
+    """
+    state, changed, patches = {}, [], []
+    for entry in entries:
+        key, fp = fingerprint(entry)
+        prev = previous.get(key)
+        unchanged = prev is not None and prev["fp"] == fp
+        if unchanged and not reparse:
+            state[key] = dict(prev, misses=0)
+            continue
+        incident = parse_entry(entry, now_iso)
+        was_cleared = prev is not None and prev["incident"]["status"] == "cleared"
+        if unchanged:
+            incident["transition"] = prev["incident"].get("transition")
+        elif incident["status"] == "cleared" and not was_cleared:
+            incident["transition"] = "cleared"
+        else:
+            incident["transition"] = "new" if prev is None else "updated"
+        twin_ids = resolve_twins(incident, segment_map, geometry)
+        if twin_ids:
+            incident["twinId"] = ";".join(twin_ids)
+            patch_ops = build_incident_patch(incident, now_iso)
+            patches.extend((twin_id, patch_ops) for twin_id in twin_ids)
+        state[key] = {"fp": fp, "misses": 0, "incident": incident}
+        if not unchanged:
+            changed.append(incident)
+
+    if not entries and previous:
+        # An empty feed is far more likely a failed fetch than every incident ending at once
+        logging.warning("Feed returned no entries; keeping previous incident state")
+        return dict(previous), changed, patches
+
+    active_twins = {
+        t for v in state.values() if v["incident"]["status"] == "active"
+        for t in (v["incident"].get("twinId") or "").split(";") if t
+    }
+    for key, prev in previous.items():
+        if key in state:
+            continue
+        misses = prev.get("misses", 0) + 1
+        if misses < expire_after:
+            state[key] = dict(prev, misses=misses)
+            continue
+        incident = dict(prev["incident"], status="cleared", transition="expired", ingested=now_iso)
+        changed.append(incident)
+        if prev["incident"]["status"] != "cleared":
+            for twin_id in (incident.get("twinId") or "").split(";"):
+                if twin_id and twin_id not in active_twins:
+                    patches.append((twin_id, clear_patch(now_iso)))
+    return state, changed, patches
+
+def hold_back_unwritten(state: dict, previous: dict, failed: set) -> dict:
+    """Restore the previous seen-set entry of every incident with a twin in `failed`.
+
+    The next run then sees those entries as changed (or as missing again) and
+    re-sends their patches instead of treating them as applied.
+    """
+    held = 0
+    for key in set(state) | set(previous):
+        current, prev = state.get(key), previous.get(key)
+        incident = (current or prev)["incident"]
+        if not failed.intersection((incident.get("twinId") or "").split(";")):
+            continue
+        if current is None:
+            state[key] = prev  # expired, but its clear was not written
+        elif prev is None:
+            del state[key]
+        elif prev["fp"] != current["fp"]:
+            state[key] = dict(prev, misses=0)
+        else:
+            continue
+        held += 1
+    if held:
+        logging.warning(f"{held} incidents had writes fail for {len(failed)} twins; they will be retried next run")
+    return state
+
+def resend_unwritten(previous: dict, unwritten) -> dict:
+    """Mark seen-set entries with a twin in `unwritten` as changed, so this run re-sends their patches.
+
+    With INGEST_SHARDS the timer only sees its patches enqueued; apply_shard
+    reports the twins whose writes then failed (sharding.unwritten_twins).
+    """
+    unwritten = set(unwritten)
+    resent = 0
+    for key, prev in previous.items():
+        if unwritten.intersection((prev["incident"].get("twinId") or "").split(";")):
+            previous[key] = dict(prev, fp=None)
+            resent += 1
+    if resent:
+        logging.warning(f"Re-sending {resent} incidents whose shard writes failed for {len(unwritten)} twins")
+    return previous
+
+@traced("fetch_ritis_incidents")
 def main(myTimer: func.TimerRequest) -> None:
     logging.info("RITIS incidents timer triggered")
     rss_url = os.environ.get("RITIS_RSS_URL")
@@ -113,96 +410,136 @@ def main(myTimer: func.TimerRequest) -> None:
         return
 
     try:
-        raw_feed = fetch_authenticated_feed(rss_url)
+        client, blob_service = get_clients()
+    except KeyError as e:
+        logging.error(f"Missing required env var: {e}")
+        return
+
+    with span("load_state"):
+        load_feed_state(blob_service)
+    try:
+        with span("fetch"):
+            raw_feed = fetch_authenticated_feed(rss_url)
     except Exception as ex:
         logging.error(f"Failed to retrieve feed: {ex}")
+        count("feed.errors")
+        return
+    if raw_feed is None:
+        logging.info("RITIS feed not modified since last run; skipping")
+        count("feed.not_modified")
+        save_feed_state(blob_service)
         return
 
-    feed = feedparser.parse(raw_feed)
+    with span("parse"):
+        feed = feedparser.parse(raw_feed)
     if feed.bozo:
         logging.error(f"Failed to parse feed: {feed.bozo_exception}")
+        count("feed.errors")
         return
 
-    try:
-        client, blob_service = get_clients()
-    except KeyError as e:
-        logging.error(f"Missing required env var: {e}")
-        return
+    with span("load_state"):
+        segment_map = load_segment_map(blob_service)
+        geometry = load_segment_geometry(blob_service)
+        shards = ingest_shards()
+        delta = PassThroughDelta() if shards else get_delta_cache(blob_service)
+    # Twins whose patches were accepted (or, sharded, enqueued: apply_shard reports the writes
+    # that then fail, see resend_unwritten); fingerprints are only kept for those.
+    # A twin that does not exist is final: retrying would 404 again on every run.
+    submitted, written, missing = set(), set(), set()
+    def note_written(twin_id, ops):
+        written.add(twin_id)
+    def note_missing(twin_id, ops):
+        missing.add(twin_id)
+    if shards:
+        # Incident writes fan out to apply_shard too (see INGEST_SHARDS); a later run never
+        # repeats a clear, so these messages are applied even when they arrive late
+        report_previous_run(blob_service, "incidents")
+        dispatcher = ShardedDispatcher(get_queue_client(SHARD_QUEUE), blob_service, "incidents", shards,
+                                       supersedes=False, on_written=note_written)
+    else:
+        dispatcher = PatchDispatcher(
+            client, label="incidents",
+            on_written=chain(delta.commit, get_segment_model().apply_patch, note_written),
+            on_not_found=note_missing)
+    now_iso = datetime.now(timezone.utc).isoformat()
 
-    segment_map = load_segment_map(blob_service)
+    # Without RITIS_INCREMENTAL every entry is re-parsed and re-patched, but new/updated are
+    # still judged against the saved seen-set, so counts and the archive only see real changes
+    incremental = os.environ.get("RITIS_INCREMENTAL", "true").lower() == "true"
+    with span("load_state"):
+        previous = load_incident_state(blob_service)
+        if shards and previous:
+            previous = resend_unwritten(previous, unwritten_twins(blob_service, "incidents"))
+    expire_after = int(os.environ.get("RITIS_EXPIRE_AFTER_MISSES", 1))
+    with span("reconcile"):
+        state, changed, patches = reconcile(feed.entries, previous, segment_map, now_iso, expire_after, geometry,
+                                            reparse=not incremental)
+    for twin_id, patch_ops in patches:
+        patch_ops = delta.filter(twin_id, patch_ops)
+        if patch_ops:
+            submitted.add(twin_id)
+        dispatcher.submit(twin_id, patch_ops)
 
-    incidents = []
-    now_iso = datetime.now(timezone.utc).isoformat()
+    # Spread each incident's congestion to upstream segments over connectedTo
+    propagate = os.environ.get("CONGESTION_PROPAGATION", "true").lower() == "true"
+    if propagate:
+        with span("propagate"):
+            seeds = incident_seeds(state)
+            propagated = get_segment_graph(client).propagate(seeds)
+            spread_patches, spread = propagation_patches(propagated, seeds, load_propagation_state(blob_service))
+            for twin_id, patch_ops in spread_patches:
+                dispatcher.submit(twin_id, delta.filter(twin_id, patch_ops))
+        logging.info(f"Congestion propagated to {len(spread)} upstream segments from {len(seeds)} incidents")
 
-    for entry in feed.entries:
-        desc = entry.get("description", "") or ""
-        title = entry.get("title", "") or ""
-        segment_external_id = parse_segment_id(desc) or parse_segment_id(title)
-        coords = parse_coordinates(desc)
-        lane_data = parse_lane_status(desc) or {}
-        incident_last_update = parse_last_update(desc)
-
-        status = "active"
-        lowered = desc.lower()
-        if "scene is clear" in lowered or "all vehicles have departed" in lowered or "cleared" in lowered:
-            status = "cleared"
-
-        incident = {
-            "title": title,
-            "summary": desc[:500],
-            "externalSegmentId": segment_external_id,
-            "coordinates": coords,
-            "status": status,
-            "published": entry.get("published", None),
-            "ingested": now_iso,
-            **lane_data
-        }
-        if incident_last_update:
-            incident["incidentLastUpdate"] = incident_last_update
-        incidents.append(incident)
-
-        if segment_external_id:
-            twin_id = segment_map.get(segment_external_id) or map_external_to_twin(segment_external_id)
-            if twin_id:
-                patch_ops = [
-                    {"op": "add", "path": "/status", "value": status},
-                    {"op": "add", "path": "/lastSeen", "value": now_iso}
-                ]
-                # Attempt to include incident properties if model version supports them
-                for prop in [
-                    "incidentAffectedLanes","incidentTotalLanes","incidentLaneImpact","incidentDirection","incidentLastUpdate"
-                ]:
-                    if prop in incident:
-                        patch_ops.append({"op": "add", "path": f"/{prop}", "value": incident[prop]})
-                # Derive congestionIndex from lane closure ratio if available
-                affected = incident.get("incidentAffectedLanes")
-                total = incident.get("incidentTotalLanes")
-                if isinstance(affected, int) and isinstance(total, int) and total > 0:
-                    ratio = min(1.0, max(0.0, affected / total))
-                    patch_ops.append({"op": "add", "path": "/congestionIndex", "value": ratio})
-                    # Optionally mirror as predictedCongestionIndex until predictive model exists
-                    patch_ops.append({"op": "add", "path": "/predictedCongestionIndex", "value": ratio})
-                try:
-                    client.update_digital_twin(twin_id, patch_ops)
-                except ResourceNotFoundError:
-                    logging.warning(f"Twin {twin_id} not found for incident {segment_external_id}")
-                except Exception as ex:
-                    logging.error(f"Patch failed {twin_id}: {ex}")
-
-    # Archive snapshot
+    with span("adt_flush"):
+        summary = dispatcher.flush()
+    failed = submitted - written - missing
+    if missing:
+        count("incidents.skipped", len(missing))
+    if failed:
+        count("incidents.write_failed", len(failed))
+        state = hold_back_unwritten(state, previous, failed)
+    with span("save_state"):
+        if propagate:
+            save_propagation_state(blob_service, spread)
+        delta.save_snapshot(blob_service)
+        save_incident_state(blob_service, state)
+        # New incidents bump the per-segment incident counts in the feature store (once, when written)
+        new_twins = [t for incident in changed if incident["transition"] == "new"
+                     for t in (incident.get("twinId") or "").split(";") if t and t not in failed]
+        if new_twins and os.environ.get("FEATURE_STORE", "true").lower() == "true":
+            now_ts = int(datetime.now(timezone.utc).timestamp())
+            commit_feature_store(blob_service, lambda store: store.record_incidents(new_twins, now_ts))
+        commit_validators(rss_url)
+        save_feed_state(blob_service)
+
+    counts = {}
+    for incident in changed:
+        counts[incident["transition"]] = counts.get(incident["transition"], 0) + 1
+    for transition, n in counts.items():
+        count(f"incidents.{transition}", n)
+    unchanged = len(feed.entries) - (len(changed) - counts.get("expired", 0))
+    logging.info(f"RITIS transitions: {counts} unchanged={unchanged} written={len(written)} "
+                 f"failed={len(failed)} skipped={len(missing)} (not_found={summary['not_found']})")
+
+    # Archive transitions into the partitioned history store
     try:
-        history_container = os.environ.get("TRAFFIC_HISTORY_CONTAINER", "history")
-        ts = datetime.utcnow().strftime('%Y%m%d%H%M%S')
-        # Ensure container exists
-        try:
-            blob_service.create_container(history_container)
-        except Exception:
-            pass
-        blob_client = blob_service.get_blob_client(container=history_container, blob=f"incidents_{ts}.json")
-        blob_client.upload_blob(json.dumps(incidents, indent=2), overwrite=True)
+        with dependency("blob.history"):
+            get_history_store(blob_service).append("incidents", changed)
     except Exception as ex:
         logging.error(f"Failed to archive incidents: {ex}")
 
+    # Latest snapshot (every incident currently in the feed) served by get_latest_incidents
+    try:
+        current = [v["incident"] for v in state.values() if v.get("misses", 0) == 0]
+        history_container = os.environ.get("TRAFFIC_HISTORY_CONTAINER", "raw")
+        ensure_container(blob_service, history_container)
+        with dependency("blob.snapshot"):
+            publish_snapshot(blob_service, history_container, "incidents",
+                             json.dumps(current, separators=(",", ":")).encode())
+    except Exception as ex:
+        logging.error(f"Failed to write latest incidents snapshot: {ex}")
+
 def map_external_to_twin(external_id: str) -> str:
     # TODO: Replace with CSV-based mapping using segment_map.csv
     return external_id
@@ -0,0 +1,188 @@
+import os, io, csv, json, math, time, logging, threading
+import numpy as np
+from shared import ensure_container
+
+# Segment geometry registry and grid index for coordinate -> twin lookups.
+#
+# Geometry lives next to segment_map.csv as either GeoJSON (LineString,
+# MultiLineString or Point features with an adt_segment_id / twinId /
+# segmentId property) or CSV rows "adt_segment_id,lat,lon" whose consecutive
+# rows are the polyline vertices. Every polyline edge is bucketed into the
+# lat/lon grid cells its bounding box touches (CSR layout: sorted cell keys +
+# offsets into an edge array), so a lookup only measures the handful of edges
+# in the cells around the point.
+#
+# Environment variables:
+# SEGMENT_MAP_CONTAINER - container holding the geometry blob (default: raw)
+# SEGMENT_GEOMETRY_BLOB - blob name (default: segment_geometry.geojson)
+# INCIDENT_MATCH_RADIUS_M - max distance from an incident to a segment (default: 150)
+# SEGMENT_GRID_CELL_DEG - grid cell size in degrees (default: 0.01, ~1.1 km)
+
+METERS_PER_DEG = 111320.0
+ID_PROPERTIES = ("adt_segment_id", "twinId", "segmentId")
+_KEY_SHIFT = 1 << 32
+
+class SegmentIndex:
+    """Nearest-segment-within-radius lookups over segment polylines."""
+
+    def __init__(self, polylines=(), cell_deg: float = None, etag=None):
+        self.cell = cell_deg or float(os.environ.get("SEGMENT_GRID_CELL_DEG", 0.01))
+        self.etag = etag
+        self.twin_ids = []
+        a, b, owner = [], [], []
+        for twin_id, points in polylines:
+            if not points:
+                continue
+            idx = len(self.twin_ids)
+            self.twin_ids.append(twin_id)
+            if len(points) == 1:
+                points = [points[0], points[0]]
+            for p, q in zip(points, points[1:]):
+                a.append(p)
+                b.append(q)
+                owner.append(idx)
+        self._a = np.asarray(a, dtype=np.float64).reshape(-1, 2)  # (lat, lon)
+        self._b = np.asarray(b, dtype=np.float64).reshape(-1, 2)
+        self._owner = np.asarray(owner, dtype=np.int64)
+        self._build_grid()
+
+    def _cell_of(self, values):
+        return np.floor(values / self.cell).astype(np.int64)
+
+    def _build_grid(self):
+        if not len(self._owner):
+            self._keys = np.empty(0, dtype=np.int64)
+            self._starts = np.zeros(1, dtype=np.int64)
+            self._edges = np.empty(0, dtype=np.int64)
+            return
+        lo = self._cell_of(np.minimum(self._a, self._b))
+        hi = self._cell_of(np.maximum(self._a, self._b))
+        rows, cols = hi[:, 0] - lo[:, 0] + 1, hi[:, 1] - lo[:, 1] + 1
+        counts = rows * cols
+        edge = np.repeat(np.arange(len(counts)), counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        ci = lo[edge, 0] + within // cols[edge]
+        cj = lo[edge, 1] + within % cols[edge]
+        keys = ci * _KEY_SHIFT + cj
+        order = np.argsort(keys, kind="stable")
+        keys, edge = keys[order], edge[order]
+        self._keys, first = np.unique(keys, return_index=True)
+        self._starts = np.append(first, len(keys))
+        self._edges = edge
+
+    def __len__(self):
+        return len(self.twin_ids)
+
+    def _candidates(self, lat, lon, radius_m):
+        dlat = radius_m / METERS_PER_DEG
+        dlon = radius_m / (METERS_PER_DEG * max(math.cos(math.radians(lat)), 1e-6))
+        i0, i1 = math.floor((lat - dlat) / self.cell), math.floor((lat + dlat) / self.cell)
+        j0, j1 = math.floor((lon - dlon) / self.cell), math.floor((lon + dlon) / self.cell)
+        wanted = np.array([i * _KEY_SHIFT + j for i in range(i0, i1 + 1) for j in range(j0, j1 + 1)], dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self._keys, wanted), len(self._keys) - 1)
+        hits = pos[self._keys[pos] == wanted]
+        if not len(hits):
+            return None
+        return np.concatenate([self._edges[self._starts[p]:self._starts[p + 1]] for p in hits])
+
+    def nearest(self, lat: float, lon: float, radius_m: float = None):
+        """(twin_id, distance_m) of the closest segment within radius_m, else None."""
+        if not len(self._keys):
+            return None
+        radius_m = radius_m if radius_m is not None else float(os.environ.get("INCIDENT_MATCH_RADIUS_M", 150))
+        edges = self._candidates(lat, lon, radius_m)
+        if edges is None:
+            return None
+        # Equirectangular projection around the query point, in meters
+        kx = METERS_PER_DEG * math.cos(math.radians(lat))
+        a, b = self._a[edges], self._b[edges]
+        ax, ay = (a[:, 1] - lon) * kx, (a[:, 0] - lat) * METERS_PER_DEG
+        bx, by = (b[:, 1] - lon) * kx, (b[:, 0] - lat) * METERS_PER_DEG
+        dx, dy = bx - ax, by - ay
+        length2 = dx * dx + dy * dy
+        t = np.clip(-(ax * dx + ay * dy) / np.where(length2 > 0, length2, 1.0), 0.0, 1.0)
+        dist = np.hypot(ax + t * dx, ay + t * dy)
+        best = int(np.argmin(dist))
+        if dist[best] > radius_m:
+            return None
+        return self.twin_ids[self._owner[edges[best]]], float(dist[best])
+
+    def resolve(self, coordinates, radius_m: float = None) -> tuple:
+        """Distinct twins nearest to each {"lat", "lon"} point, in point order."""
+        twins = []
+        for point in coordinates or ():
+            hit = self.nearest(point["lat"], point["lon"], radius_m)
+            if hit and hit[0] not in twins:
+                twins.append(hit[0])
+        return tuple(twins)
+
+def _feature_lines(geometry):
+    kind, coords = geometry.get("type"), geometry.get("coordinates")
+    if kind == "Point":
+        return [[coords]]
+    if kind == "LineString":
+        return [coords]
+    if kind == "MultiLineString":
+        return coords
+    return []
+
+def parse_segment_geometry(data: bytes, name: str = ""):
+    """(twin_id, [(lat, lon), ...]) polylines from GeoJSON or CSV bytes."""
+    text = data.decode("utf-8-sig")
+    if name.endswith(".csv") or not text.lstrip().startswith("{"):
+        lines = {}
+        for row in csv.reader(io.StringIO(text)):
+            if not row or row[0].startswith('#') or len(row) < 3 or row[0].strip() == "adt_segment_id":
+                continue
+            try:
+                lines.setdefault(row[0].strip(), []).append((float(row[1]), float(row[2])))
+            except ValueError:
+                continue
+        return list(lines.items())
+    polylines = []
+    for feature in json.loads(text).get("features", []):
+        props = feature.get("properties") or {}
+        twin_id = next((props[k] for k in ID_PROPERTIES if props.get(k)), None) or feature.get("id")
+        if not twin_id:
+            continue
+        for line in _feature_lines(feature.get("geometry") or {}):
+            # GeoJSON positions are [lon, lat]
+            polylines.append((str(twin_id), [(float(p[1]), float(p[0])) for p in line]))
+    return polylines
+
+_segment_index = None
+_segment_index_lock = threading.Lock()
+
+def load_segment_geometry(blob_service) -> SegmentIndex:
+    """Per-process SegmentIndex, revalidated against the geometry blob's ETag."""
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceNotModifiedError, ResourceNotFoundError
+    global _segment_index
+    container = os.environ.get("SEGMENT_MAP_CONTAINER", "raw")
+    name = os.environ.get("SEGMENT_GEOMETRY_BLOB", "segment_geometry.geojson")
+    ensure_container(blob_service, container)
+    with _segment_index_lock:
+        cached = _segment_index
+        try:
+            bc = blob_service.get_blob_client(container=container, blob=name)
+            if cached is not None and cached.etag:
+                downloader = bc.download_blob(etag=cached.etag, match_condition=MatchConditions.IfModified)
+            else:
+                downloader = bc.download_blob()
+            data = downloader.readall()
+            start = time.perf_counter()
+            _segment_index = SegmentIndex(parse_segment_geometry(data, name), etag=downloader.properties.etag)
+            logging.info(f"Segment geometry loaded: {len(_segment_index)} segments "
+                         f"in {round((time.perf_counter() - start) * 1000, 2)}ms")
+        except ResourceNotModifiedError:
+            pass
+        except ResourceNotFoundError:
+            logging.info(f"No segment geometry at {container}/{name}; coordinate matching disabled")
+        except Exception as e:
+            logging.warning(f"Segment geometry not loaded: {e}")
+        return _segment_index if _segment_index is not None else SegmentIndex()
+
+def reset_segment_geometry():
+    global _segment_index
+    with _segment_index_lock:
+        _segment_index = None
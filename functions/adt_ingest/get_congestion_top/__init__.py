@@ -1,25 +1,23 @@
-import azure.functions as func, os, json
-from azure.identity import DefaultAzureCredential
-from azure.digitaltwins.core import DigitalTwinsClient
+import azure.functions as func, json, logging
+from shared import get_adt_client, get_segment_model, cached_response_headers, traced
 
+@traced("get_congestion_top")
 def main(req: func.HttpRequest) -> func.HttpResponse:
     threshold = float(req.params.get("threshold", "0.7"))
-    cred = DefaultAzureCredential()
-    adt = DigitalTwinsClient(os.environ["ADT_ENDPOINT"], cred)
-    query = """
-    SELECT segment from DIGITALTWINS segment
-    WHERE IS_OF_MODEL(segment, 'dtmi:fgcu:traffic:RoadSegment;1')
-      AND segment.predictedCongestionIndex > @threshold
-    """
-    results = adt.query_twins(query, parameterized=True, parameters={"threshold": threshold})
+    model = get_segment_model()
+    model.ensure_fresh(get_adt_client())
+    headers = cached_response_headers(model)
+    # The body depends on the threshold as well as the table version
+    headers["ETag"] = headers["ETag"][:-1] + f'-{threshold}"'
+    if req.headers.get("If-None-Match") == headers["ETag"]:
+        return func.HttpResponse(status_code=304, headers=headers)
     out = []
-    for r in results:
-        seg = r.get('segment') or r
+    for seg in model.top_congested(10, threshold):
         out.append({
-            "segmentId": seg["$dtId"],
+            "segmentId": seg["segmentId"],
             "predictedAvgSpeed": seg.get("predictedAvgSpeed"),
             "predictedCongestionIndex": seg.get("predictedCongestionIndex"),
             "predictionHorizon": seg.get("predictionHorizon")
         })
-    out = sorted(out, key=lambda x: (x["predictedCongestionIndex"] or 0), reverse=True)[:10]
-    return func.HttpResponse(json.dumps(out), status_code=200, mimetype="application/json")
+    logging.info(f"get_congestion_top cache: {model.report()}")
+    return func.HttpResponse(json.dumps(out), status_code=200, mimetype="application/json", headers=headers)
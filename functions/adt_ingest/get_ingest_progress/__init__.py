@@ -0,0 +1,14 @@
+import azure.functions as func, json
+from shared import get_blob_service, traced
+from sharding import shard_progress
+
+# Query parameters:
+# source - "traffic" (default) or "incidents"
+
+@traced("get_ingest_progress")
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    source = req.params.get("source", "traffic")
+    if source not in ("traffic", "incidents"):
+        return func.HttpResponse("Bad request: source must be traffic or incidents", status_code=400)
+    progress = shard_progress(get_blob_service(), source)
+    return func.HttpResponse(json.dumps(progress), status_code=200, mimetype="application/json")
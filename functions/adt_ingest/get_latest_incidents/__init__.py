@@ -1,18 +1,25 @@
 import azure.functions as func
 import os, json
-from shared import get_clients
+from shared import get_blob_service, traced, dependency
+from snapshots import read_latest
 
+@traced("get_latest_incidents")
 def main(req: func.HttpRequest) -> func.HttpResponse:
-    _, blob = get_clients()
+    blob = get_blob_service()
     container = os.environ.get("TRAFFIC_HISTORY_CONTAINER", "raw")
-    prefix = req.params.get('prefix') or 'incidents_'
+    prefix = req.params.get('prefix')
     try:
-        cc = blob.get_container_client(container)
-        blobs = sorted([b.name for b in cc.list_blobs(name_starts_with=prefix)])
-        if not blobs:
+        if prefix:
+            # Legacy lookup over flat incidents_<ts>.json snapshots
+            with dependency("blob.snapshot"):
+                cc = blob.get_container_client(container)
+                blobs = sorted([b.name for b in cc.list_blobs(name_starts_with=prefix)])
+                data = cc.download_blob(blobs[-1]).readall() if blobs else None
+        else:
+            with dependency("blob.snapshot"):
+                data = read_latest(blob, container, "incidents")
+        if data is None:
             return func.HttpResponse(json.dumps({"message":"no blobs"}), status_code=200, mimetype='application/json')
-        latest = blobs[-1]
-        data = cc.download_blob(latest).readall()
         return func.HttpResponse(data, status_code=200, mimetype='application/json')
     except Exception as e:
         return func.HttpResponse(json.dumps({"error":str(e)}), status_code=500, mimetype='application/json')
@@ -0,0 +1,50 @@
+import azure.functions as func, json, time
+from datetime import datetime, timezone
+from shared import get_blob_service, traced, span
+from rollups import RollupStore, BufferReader, parse_resolution, MAX_POINTS
+
+# Query parameters:
+# id - twin id (required)
+# from / to - ISO 8601 timestamps or epoch seconds (default: the last 24 hours)
+# resolution - bucket width such as 5m, 15m, 1h, 1d, 1w (default: by range,
+#              5m up to 2 days, 1h up to 62 days, 1d beyond)
+
+def _parse_time(value) -> int:
+    if value.isdigit():
+        return int(value)
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return int(parsed.timestamp())
+
+def _default_resolution(seconds: int) -> int:
+    if seconds <= 2 * 86400:
+        return 300
+    return 3600 if seconds <= 62 * 86400 else 86400
+
+def _iso(ts: int) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+@traced("get_segment_history")
+def main(req: func.HttpRequest) -> func.HttpResponse:
+    seg_id = req.params.get("id")
+    if not seg_id:
+        return func.HttpResponse("Missing id", status_code=400)
+    try:
+        end = _parse_time(req.params["to"]) if req.params.get("to") else int(time.time())
+        start = _parse_time(req.params["from"]) if req.params.get("from") else end - 86400
+        resolution = req.params.get("resolution")
+        seconds = parse_resolution(resolution) if resolution else _default_resolution(end - start)
+    except ValueError as e:
+        return func.HttpResponse(f"Bad request: {e}", status_code=400)
+    if end <= start:
+        return func.HttpResponse("Bad request: from must be before to", status_code=400)
+    if (end - start) // seconds > MAX_POINTS:
+        return func.HttpResponse(f"Bad request: more than {MAX_POINTS} points; use a coarser resolution",
+                                 status_code=400)
+    blob = get_blob_service()
+    with span("query"):
+        # The open hour is range-read for this segment only, and only if the range reaches it
+        result = RollupStore(blob).history(seg_id, start, end, seconds, BufferReader(blob))
+    body = {"id": seg_id, "from": _iso(start), "to": _iso(end), "resolution": seconds, **result}
+    return func.HttpResponse(json.dumps(body), status_code=200, mimetype="application/json")
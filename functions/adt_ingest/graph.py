@@ -0,0 +1,147 @@
+import os, json, time, logging, threading
+import numpy as np
+
+# Segment adjacency and congestion propagation.
+#
+# The connectedTo relationships (A connectedTo B: traffic flows from A into B)
+# are loaded once per worker into CSR arrays: indptr[i]:indptr[i + 1] slices
+# indices to the downstream neighbours of segment i. Propagation pushes each
+# incident's congestion upstream one hop at a time, every hop a single
+# vectorised pass over all edges (gather downstream values, decay, max-reduce
+# per source row), so a whole-network run costs milliseconds and no per-hop
+# ADT queries.
+#
+# Environment variables:
+# CONGESTION_PROPAGATION - propagate incident congestion upstream (default: true)
+# CONGESTION_DECAY - multiplier applied per upstream hop (default: 0.5)
+# CONGESTION_MAX_HOPS - hops to propagate (default: 3)
+# CONGESTION_MIN_IMPACT - propagated values below this are dropped (default: 0.05)
+# GRAPH_REFRESH_SECONDS - how often the relationship list is re-read from ADT (default: 900)
+# CONGESTION_STATE_BLOB - blob in TRAFFIC_HISTORY_CONTAINER remembering which twins
+#                         carry propagated congestion (default: state/congestion_propagation.json)
+
+RELATIONSHIP_NAME = "connectedTo"
+
+class SegmentGraph:
+    def __init__(self, edges=()):
+        edges = sorted(set((str(s), str(t)) for s, t in edges if s and t and s != t))
+        self.edges_key = hash(tuple(edges))
+        self.twin_ids = sorted({t for e in edges for t in e})
+        self.index = {t: i for i, t in enumerate(self.twin_ids)}
+        n = len(self.twin_ids)
+        src = np.fromiter((self.index[s] for s, _ in edges), dtype=np.int64, count=len(edges))
+        dst = np.fromiter((self.index[t] for _, t in edges), dtype=np.int64, count=len(edges))
+        order = np.lexsort((dst, src))
+        self.indices = dst[order]
+        self.indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(src, minlength=n), out=self.indptr[1:])
+
+    def __len__(self):
+        return len(self.twin_ids)
+
+    def downstream(self, twin_id) -> list:
+        i = self.index.get(twin_id)
+        if i is None:
+            return []
+        return [self.twin_ids[j] for j in self.indices[self.indptr[i]:self.indptr[i + 1]]]
+
+    def propagate(self, seeds: dict, decay: float = None, max_hops: int = None, min_impact: float = None) -> dict:
+        """{twin_id: impact} after pushing seed impacts upstream with per-hop decay.
+
+        A segment's impact is the max over its own seed and decay**k times the
+        seed k hops downstream of it (k <= max_hops). Seeds for twins outside
+        the graph are returned unchanged.
+        """
+        decay = decay if decay is not None else float(os.environ.get("CONGESTION_DECAY", 0.5))
+        max_hops = max_hops if max_hops is not None else int(os.environ.get("CONGESTION_MAX_HOPS", 3))
+        min_impact = min_impact if min_impact is not None else float(os.environ.get("CONGESTION_MIN_IMPACT", 0.05))
+        values = np.zeros(len(self.twin_ids))
+        outside = {}
+        for twin_id, impact in seeds.items():
+            i = self.index.get(twin_id)
+            if i is None:
+                outside[twin_id] = impact
+            else:
+                values[i] = max(values[i], impact)
+        has_out = self.indptr[1:] > self.indptr[:-1]
+        starts = self.indptr[:-1][has_out]
+        for _ in range(max_hops if len(self.indices) else 0):
+            upstream = np.maximum.reduceat(values[self.indices] * decay, starts)
+            nxt = values.copy()
+            nxt[has_out] = np.maximum(values[has_out], upstream)
+            if np.array_equal(nxt, values):
+                break
+            values = nxt
+        hit = np.flatnonzero((values > 0) & (values >= min_impact))
+        out = {self.twin_ids[i]: float(values[i]) for i in hit}
+        out.update((t, v) for t, v in outside.items() if v > 0 and v >= min_impact)
+        return out
+
+def propagation_patches(propagated: dict, seeds: dict, previous: dict):
+    """Returns (patches, current): (twin_id, ops) pairs setting congestionIndex on
+    upstream twins and resetting twins that carried propagated congestion last
+    run but no longer do, plus the {twin_id: value} map to remember for next run."""
+    patches, current = [], {}
+    for twin_id, impact in propagated.items():
+        if impact <= seeds.get(twin_id, 0.0):
+            continue  # the twin's own incident patch already carries this value
+        current[twin_id] = round(impact, 4)
+        patches.append((twin_id, [{"op": "add", "path": "/congestionIndex", "value": current[twin_id]}]))
+    for twin_id in previous:
+        if twin_id not in current:
+            # Back to the twin's own incident congestion, or clear
+            value = round(seeds.get(twin_id, 0.0), 4)
+            patches.append((twin_id, [{"op": "add", "path": "/congestionIndex", "value": value}]))
+    return patches, current
+
+def load_edges(adt) -> list:
+    query = (f"SELECT r.$sourceId, r.$targetId FROM RELATIONSHIPS r "
+             f"WHERE r.$relationshipName = '{RELATIONSHIP_NAME}'")
+    return [(r.get("$sourceId"), r.get("$targetId")) for r in adt.query_twins(query)]
+
+_graph = None
+_graph_loaded_at = 0.0
+_graph_lock = threading.Lock()
+
+def get_segment_graph(adt, now: float = None) -> SegmentGraph:
+    """Per-worker SegmentGraph; the edge list is re-read every GRAPH_REFRESH_SECONDS
+    and the CSR arrays are only rebuilt when it actually changed."""
+    global _graph, _graph_loaded_at
+    now = now if now is not None else time.time()
+    ttl = float(os.environ.get("GRAPH_REFRESH_SECONDS", 900))
+    with _graph_lock:
+        if _graph is not None and now - _graph_loaded_at < ttl:
+            return _graph
+        try:
+            edges = load_edges(adt)
+            candidate = SegmentGraph(edges)
+            if _graph is None or candidate.edges_key != _graph.edges_key:
+                _graph = candidate
+                logging.info(f"Segment graph loaded: {len(_graph)} segments, {len(_graph.indices)} {RELATIONSHIP_NAME} edges")
+            _graph_loaded_at = now
+        except Exception as e:
+            logging.warning(f"Segment graph not loaded: {e}")
+        return _graph if _graph is not None else SegmentGraph()
+
+def reset_segment_graph():
+    global _graph, _graph_loaded_at
+    with _graph_lock:
+        _graph, _graph_loaded_at = None, 0.0
+
+def _state_blob(blob_service):
+    container = os.environ.get("TRAFFIC_HISTORY_CONTAINER", "raw")
+    name = os.environ.get("CONGESTION_STATE_BLOB", "state/congestion_propagation.json")
+    return blob_service.get_blob_client(container=container, blob=name)
+
+def load_propagation_state(blob_service) -> dict:
+    try:
+        return json.loads(_state_blob(blob_service).download_blob().readall()).get("propagated", {})
+    except Exception as ex:
+        logging.info(f"No propagation state loaded: {ex}")
+        return {}
+
+def save_propagation_state(blob_service, propagated: dict):
+    try:
+        _state_blob(blob_service).upload_blob(json.dumps({"propagated": propagated}, separators=(",", ":")), overwrite=True)
+    except Exception as ex:
+        logging.warning(f"Failed to save propagation state: {ex}")
@@ -0,0 +1,396 @@
+import os, io, json, gzip, time, uuid, shutil, logging, tempfile, threading
+from datetime import datetime, timedelta, timezone
+
+# Partitioned history archive.
+#
+# Records are appended as gzip'd NDJSON files with a fixed per-dataset schema:
+# the first line is a header {"schema": [...]} and every following line is a JSON
+# array in schema order, so keys are not repeated per row. Files are laid out as
+#
+#   history/<dataset>/date=YYYY-MM-DD/hour=HH/<HHMMSS>-<id>.ndjson.gz
+#   history/<dataset>/date=YYYY-MM-DD/daily.ndjson.gz       (after compaction)
+#
+# and carry min_ts/max_ts/rows metadata so readers can skip files without
+# downloading them.
+#
+# Compaction runs in the compact_history timer (or inline on append with
+# HISTORY_COMPACT). It streams the day one hour at a time into a spooled
+# temp file, and only one worker compacts a given day: it first creates
+# history/_compaction/<dataset>/<date>.lock with an If-None-Match condition
+# (taking over an expired one by ETag). The daily file's header lists the
+# hourly files merged into it, written in the same upload as the rows; hourly
+# files still listed there (left by a compaction that stopped before deleting
+# them) are deleted by the next one instead of being merged twice.
+#
+# Environment variables:
+# TRAFFIC_HISTORY_CONTAINER - container for the archive (default: raw)
+# HISTORY_LOCAL_DIR - write to this local directory instead of blob storage
+# HISTORY_COMPACT - also compact the previous day from the append path (default: false)
+# HISTORY_COMPACT_LOCK_SECONDS - how long a compaction claim holds before another worker may take it (default: 900)
+
+PREFIX = "history"
+DAILY_NAME = "daily.ndjson.gz"
+LOCK_PREFIX = f"{PREFIX}/_compaction"
+SPOOL_BYTES = 16 * 1024 * 1024
+
+# (dataset, day) pairs already compacted by this worker
+_compacted = set()
+_compacted_lock = threading.Lock()
+
+SCHEMAS = {
+    "traffic": ["ts", "twinId", "externalId", "avgSpeed", "volume", "asOf"],
+    "incidents": [
+        "ts", "externalSegmentId", "twinId", "status", "title", "summary", "published",
+        "incidentAffectedLanes", "incidentTotalLanes", "incidentLaneImpact",
+        "incidentDirection", "incidentLastUpdate", "coordinates", "transition",
+    ],
+}
+
+def _to_epoch(value) -> int:
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return int(value)
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return int(value.timestamp())
+    text = str(value).replace("Z", "+00:00")
+    return _to_epoch(datetime.fromisoformat(text))
+
+class BlobBackend:
+    def __init__(self, blob_service, container: str):
+        self.container = blob_service.get_container_client(container)
+
+    def put(self, name: str, data, metadata: dict):
+        """data is bytes or a readable file object."""
+        self.container.upload_blob(name, data, overwrite=True, metadata=metadata)
+
+    def get(self, name: str) -> bytes:
+        return self.container.download_blob(name).readall()
+
+    def list(self, prefix: str):
+        for b in self.container.list_blobs(name_starts_with=prefix, include=["metadata"]):
+            yield b.name, (b.metadata or {})
+
+    def delete(self, name: str):
+        self.container.delete_blob(name)
+
+    def claim(self, name: str, ttl: int) -> bool:
+        """Create a lock blob only if absent, or take over an expired one by ETag."""
+        from azure.core import MatchConditions
+        from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+        bc = self.container.get_blob_client(name)
+        body = json.dumps({"expires": time.time() + ttl})
+        try:
+            bc.upload_blob(body, overwrite=False)
+            return True
+        except ResourceExistsError:
+            pass
+        try:
+            downloader = bc.download_blob()
+            if json.loads(downloader.readall()).get("expires", 0) > time.time():
+                return False
+            bc.upload_blob(body, overwrite=True, etag=downloader.properties.etag,
+                           match_condition=MatchConditions.IfNotModified)
+            return True
+        except (ResourceModifiedError, ResourceNotFoundError):
+            return False
+
+    def release(self, name: str):
+        try:
+            self.container.delete_blob(name)
+        except Exception as e:
+            logging.warning(f"Failed to release {name}: {e}")
+
+class LocalBackend:
+    """Filesystem stand-in for BlobBackend; metadata lives in a .meta sidecar."""
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, name):
+        return os.path.join(self.root, *name.split("/"))
+
+    def put(self, name, data, metadata):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            if hasattr(data, "read"):
+                shutil.copyfileobj(data, f)
+            else:
+                f.write(data)
+        with open(path + ".meta", "w") as f:
+            json.dump(metadata, f)
+
+    def get(self, name):
+        with open(self._path(name), "rb") as f:
+            return f.read()
+
+    def list(self, prefix):
+        base = self._path(prefix.rsplit("/", 1)[0]) if "/" in prefix else self.root
+        if not os.path.isdir(base):
+            return
+        for dirpath, _, files in os.walk(base):
+            for fn in sorted(files):
+                if fn.endswith(".meta"):
+                    continue
+                full = os.path.join(dirpath, fn)
+                name = os.path.relpath(full, self.root).replace(os.sep, "/")
+                if not name.startswith(prefix):
+                    continue
+                try:
+                    with open(full + ".meta") as f:
+                        meta = json.load(f)
+                except OSError:
+                    meta = {}
+                yield name, meta
+
+    def delete(self, name):
+        path = self._path(name)
+        os.remove(path)
+        if os.path.exists(path + ".meta"):
+            os.remove(path + ".meta")
+
+    def claim(self, name, ttl):
+        path = self._path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        for _ in range(2):
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                try:
+                    with open(path) as f:
+                        if json.load(f).get("expires", 0) > time.time():
+                            return False
+                    os.remove(path)
+                except (OSError, ValueError):
+                    pass
+                continue
+            with os.fdopen(fd, "w") as f:
+                json.dump({"expires": time.time() + ttl}, f)
+            return True
+        return False
+
+    def release(self, name):
+        try:
+            os.remove(self._path(name))
+        except OSError:
+            pass
+
+def encode_rows(schema: list, rows: list) -> bytes:
+    buf = io.BytesIO()
+    with gzip.GzipFile(fileobj=buf, mode="wb") as gz:
+        gz.write(json.dumps({"schema": schema}, separators=(",", ":")).encode() + b"\n")
+        for row in rows:
+            gz.write(json.dumps(row, separators=(",", ":"), default=str).encode() + b"\n")
+    return buf.getvalue()
+
+def read_header(data: bytes) -> dict:
+    """The header line of an encoded history file ({} when empty)."""
+    with gzip.GzipFile(fileobj=io.BytesIO(data)) as gz:
+        line = gz.readline()
+    return json.loads(line) if line.strip() else {}
+
+def decode_rows(data: bytes):
+    """Yield (schema, row) pairs from an encoded history file, decompressing as it goes."""
+    with gzip.GzipFile(fileobj=io.BytesIO(data)) as gz:
+        header = gz.readline()
+        if not header.strip():
+            return
+        schema = json.loads(header)["schema"]
+        for line in gz:
+            if line.strip():
+                yield schema, json.loads(line)
+
+class HistoryStore:
+    def __init__(self, backend, compact: bool = None):
+        self.backend = backend
+        self.compact_enabled = compact if compact is not None else (
+            os.environ.get("HISTORY_COMPACT", "false").lower() == "true")
+
+    @staticmethod
+    def _day_prefix(dataset: str, day) -> str:
+        return f"{PREFIX}/{dataset}/date={day:%Y-%m-%d}/"
+
+    def append(self, dataset: str, records: list, when: datetime = None) -> str:
+        """Write one tick of records; returns the blob name (None when empty)."""
+        if not records:
+            return None
+        schema = SCHEMAS[dataset]
+        when = when or datetime.now(timezone.utc)
+        tick = _to_epoch(when)
+        rows = []
+        for rec in records:
+            row = [rec.get(col) for col in schema]
+            if row[0] is None:
+                row[0] = tick
+            rows.append(row)
+        ts_values = [r[0] for r in rows]
+        name = (f"{self._day_prefix(dataset, when)}hour={when:%H}/"
+                f"{when:%H%M%S}-{uuid.uuid4().hex[:8]}.ndjson.gz")
+        meta = {"min_ts": str(min(ts_values)), "max_ts": str(max(ts_values)), "rows": str(len(rows))}
+        self.backend.put(name, encode_rows(schema, rows), meta)
+        if self.compact_enabled:
+            self._compact_previous_day(dataset, when)
+        return name
+
+    def _compact_previous_day(self, dataset, when):
+        day = (when - timedelta(days=1)).date()
+        key = (dataset, day)
+        with _compacted_lock:
+            if key in _compacted:
+                return
+        try:
+            merged = self.compact(dataset, day)
+        except Exception as e:
+            logging.warning(f"History compaction failed for {dataset} {day}: {e}")
+            return
+        if merged is not None:
+            # Not while another worker holds the claim: its compaction may still fail
+            with _compacted_lock:
+                _compacted.add(key)
+
+    def compact(self, dataset: str, day) -> int:
+        """Merge a day's hourly files (and any earlier daily file) into one daily file.
+
+        Returns the number of hourly files merged (0 when there was nothing to
+        do), or None when another worker holds the day's compaction claim.
+        """
+        prefix = self._day_prefix(dataset, day)
+        entries = list(self.backend.list(prefix))
+        daily = prefix + DAILY_NAME
+        parts = sorted(name for name, _ in entries if name != daily)
+        if not parts:
+            return 0
+        lock = f"{LOCK_PREFIX}/{dataset}/{day:%Y-%m-%d}.lock"
+        if not self.backend.claim(lock, int(os.environ.get("HISTORY_COMPACT_LOCK_SECONDS", 900))):
+            logging.info(f"{dataset} {day} is being compacted by another worker; skipping")
+            return None
+        try:
+            existing = daily if len(entries) > len(parts) else None
+            merged = read_header(self.backend.get(existing)).get("parts", []) if existing else []
+            covered = set(merged)
+            fresh = [name for name in parts if name not in covered]
+            if fresh:
+                with tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES) as out:
+                    meta = self._write_daily(out, dataset, day, fresh, existing, merged + fresh)
+                    out.seek(0)
+                    self.backend.put(daily, out, meta)
+                logging.info(f"Compacted {len(fresh)} {dataset} files for {day} into {meta['rows']} rows")
+            if len(fresh) < len(parts):
+                logging.info(f"Removing {len(parts) - len(fresh)} {dataset} files for {day} already in the daily file")
+            for name in parts:
+                self.backend.delete(name)
+        finally:
+            self.backend.release(lock)
+        return len(fresh)
+
+    def _write_daily(self, out, dataset: str, day, parts: list, daily: str = None, merged: list = ()) -> dict:
+        """Stream the day into out one hour at a time (earlier daily rows merged in); returns its metadata.
+
+        merged (every hourly file now in the daily file) goes into the header.
+        """
+        schema = SCHEMAS[dataset]
+        by_hour = {}
+        for name in parts:
+            marker = name.find("/hour=")
+            by_hour.setdefault(int(name[marker + 6:marker + 8]) if marker >= 0 else 23, []).append(name)
+        previous = (_reorder(s, schema, row) for s, row in decode_rows(self.backend.get(daily))) if daily else iter(())
+        pending = next(previous, None)
+        day_start = int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp())
+        lo, hi, n = None, None, 0
+        with gzip.GzipFile(fileobj=out, mode="wb") as gz:
+            gz.write(json.dumps({"schema": schema, "parts": list(merged)}, separators=(",", ":")).encode() + b"\n")
+            for hour in list(range(24)) + [None]:
+                rows = []
+                hour_end = day_start + (hour + 1) * 3600 if hour is not None else None
+                # Earlier daily rows are already in ts order: take the ones up to this hour's end
+                while pending is not None and (hour_end is None or (pending[0] or 0) < hour_end):
+                    rows.append(pending)
+                    pending = next(previous, None)
+                for name in by_hour.get(hour, ()):
+                    rows.extend(_reorder(s, schema, row) for s, row in decode_rows(self.backend.get(name)))
+                rows.sort(key=lambda r: r[0] or 0)
+                for row in rows:
+                    gz.write(json.dumps(row, separators=(",", ":"), default=str).encode() + b"\n")
+                    if row[0] is not None:
+                        lo = row[0] if lo is None else min(lo, row[0])
+                        hi = row[0] if hi is None else max(hi, row[0])
+                n += len(rows)
+        return {"min_ts": str(lo or 0), "max_ts": str(hi or 0), "rows": str(n)}
+
+    def compact_recent(self, days: int = 2, now: datetime = None) -> int:
+        """Compact the last `days` closed days of every dataset (the compact_history timer)."""
+        today = (now or datetime.now(timezone.utc)).date()
+        merged = 0
+        for dataset in SCHEMAS:
+            for back in range(1, days + 1):
+                day = today - timedelta(days=back)
+                try:
+                    merged += self.compact(dataset, day) or 0
+                except Exception as e:
+                    logging.warning(f"History compaction failed for {dataset} {day}: {e}")
+        return merged
+
+    def scan(self, dataset: str, start, end, segments=None, columns=None, segment_column: str = None):
+        """Yield dicts for records with start <= ts < end.
+
+        Day/hour partitions and per-file min_ts/max_ts metadata prune files before
+        download; the segment filter and column projection are applied per row.
+        """
+        lo, hi = _to_epoch(start), _to_epoch(end)
+        segment_column = segment_column or ("twinId" if dataset == "traffic" else "externalSegmentId")
+        wanted = set(segments) if segments else None
+        day = datetime.fromtimestamp(lo, timezone.utc).date()
+        last_day = datetime.fromtimestamp(hi, timezone.utc).date()
+        while day <= last_day:
+            for name, meta in self.backend.list(self._day_prefix(dataset, day)):
+                if not _overlaps(name, meta, day, lo, hi):
+                    continue
+                idx = None
+                for schema, row in decode_rows(self.backend.get(name)):
+                    if idx is None:
+                        idx = {c: i for i, c in enumerate(schema)}
+                        seg_i = idx.get(segment_column)
+                        out_cols = [c for c in (columns or schema) if c in idx]
+                    ts = row[0]
+                    if ts is None or ts < lo or ts >= hi:
+                        continue
+                    if wanted is not None and (seg_i is None or row[seg_i] not in wanted):
+                        continue
+                    yield {c: row[idx[c]] for c in out_cols}
+            day += timedelta(days=1)
+
+    def scan_frame(self, dataset: str, start, end, segments=None, columns=None):
+        import pandas as pd
+        rows = list(self.scan(dataset, start, end, segments=segments, columns=columns))
+        return pd.DataFrame(rows, columns=columns or SCHEMAS[dataset])
+
+def _reorder(src_schema, dst_schema, row):
+    if src_schema == dst_schema:
+        return row
+    idx = {c: i for i, c in enumerate(src_schema)}
+    return [row[idx[c]] if c in idx else None for c in dst_schema]
+
+def _overlaps(name, meta, day, lo, hi) -> bool:
+    try:
+        if int(meta["max_ts"]) < lo or int(meta["min_ts"]) >= hi:
+            return False
+        return True
+    except (KeyError, ValueError):
+        pass
+    # No metadata: fall back to the hour partition in the name
+    marker = "/hour="
+    if marker in name:
+        hour = int(name.split(marker, 1)[1][:2])
+        start = int(datetime(day.year, day.month, day.day, hour, tzinfo=timezone.utc).timestamp())
+        return start < hi and start + 3600 > lo
+    return True
+
+def get_history_store(blob_service=None) -> HistoryStore:
+    local_dir = os.environ.get("HISTORY_LOCAL_DIR")
+    if local_dir:
+        return HistoryStore(LocalBackend(local_dir))
+    container = os.environ.get("TRAFFIC_HISTORY_CONTAINER", "raw")
+    return HistoryStore(BlobBackend(blob_service, container))
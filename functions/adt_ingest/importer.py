@@ -0,0 +1,288 @@
+import os, csv, json, time, uuid, logging
+from patching import PatchDispatcher
+from feeds import get_session, request_with_backoff
+
+# Bulk loading of models, twins and relationships for seeding and model migration.
+#
+# "job" mode writes one NDJSON file in the ADT Import Jobs format (Header,
+# Models, Twins, Relationships sections), uploads it to blob storage and drives
+# PUT/GET /jobs/imports/{id}; the ADT instance's managed identity needs read
+# access to ADT_IMPORT_CONTAINER and write access for the output log. Import
+# jobs only create entities, so use "upsert" mode to refresh existing twins.
+# "upsert" mode writes through PatchDispatcher (bounded concurrency, 429
+# retries) in checkpointed batches. Either way a checkpoint blob lets a run cut
+# short by a timeout resume: job mode re-attaches to the running job, upsert
+# mode skips the twins and relationships whose batches were already written, by
+# id, so sources need not iterate in a stable order (ADT query results don't).
+# Callers pass a version of the source (blob ETags, a file hash, the query); a
+# checkpoint written for another version is discarded, so an edited source is
+# loaded from the start.
+#
+# Environment variables:
+# ADT_IMPORT_MODE - "job" or "upsert" (default: upsert)
+# ADT_IMPORT_CONTAINER - container for import NDJSON, job logs and checkpoints (default: imports)
+# ADT_IMPORT_POLL_SECONDS - job status poll interval (default: 10)
+# ADT_IMPORT_BATCH - upserts written between checkpoints in upsert mode (default: 1000)
+
+IMPORT_API_VERSION = "2023-10-31"
+ADT_SCOPE = "https://digitaltwins.azure.net/.default"
+JOB_TERMINAL = ("succeeded", "failed", "cancelled")
+
+def relationship_record(source_id: str, target_id: str, name: str, relationship_id: str = None,
+                        properties: dict = None) -> dict:
+    return {
+        "$dtId": source_id,
+        "$relationshipId": relationship_id or f"{source_id}-{name}-{target_id}",
+        "$targetId": target_id,
+        "$relationshipName": name,
+        **(properties or {}),
+    }
+
+def relationship_body(record: dict) -> dict:
+    """An import-file relationship record as an upsert_relationship body ($sourceId instead of $dtId)."""
+    body = {k: v for k, v in record.items() if k != "$dtId"}
+    body["$sourceId"] = record["$dtId"]
+    return body
+
+def ndjson_lines(models=(), twins=(), relationships=(), author: str = "fgcu-traffic"):
+    """Yield the NDJSON import file line by line (bytes), streaming each section."""
+    def line(obj):
+        return json.dumps(obj, separators=(",", ":")).encode() + b"\n"
+    yield line({"Section": "Header"})
+    yield line({"fileVersion": "1.0.0", "author": author, "organization": author})
+    yield line({"Section": "Models"})
+    for model in models:
+        yield line(model)
+    yield line({"Section": "Twins"})
+    for twin in twins:
+        yield line(twin)
+    yield line({"Section": "Relationships"})
+    for rel in relationships:
+        yield line(rel)
+
+def _scalar(value: str):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return value
+
+def twins_from_csv(lines, model_id: str):
+    """Twins from CSV rows keyed by $dtId (or twinId/segmentId); other non-empty columns become properties."""
+    for row in csv.DictReader(lines):
+        twin_id = row.pop("$dtId", None) or row.get("twinId") or row.get("segmentId")
+        row.pop("twinId", None)
+        if not twin_id:
+            continue
+        model = row.pop("$model", None) or model_id
+        props = {k: _scalar(v) for k, v in row.items() if k and v not in (None, "")}
+        yield {"$dtId": twin_id, "$metadata": {"$model": model}, **props}
+
+def relationships_from_csv(lines, default_name: str = "connectedTo"):
+    """Relationships from CSV rows with source,target[,name][,relationshipId] columns."""
+    for row in csv.DictReader(lines):
+        source, target = row.get("source") or row.get("$dtId"), row.get("target") or row.get("$targetId")
+        if not source or not target:
+            continue
+        name = row.get("name") or row.get("$relationshipName") or default_name
+        yield relationship_record(source, target, name, row.get("relationshipId") or row.get("$relationshipId"))
+
+def migration_query(model: str) -> str:
+    return f"SELECT * FROM digitaltwins WHERE IS_OF_MODEL('{model}')"
+
+def migrate_model(adt, old_model: str, new_model: str, suffix: str):
+    """(twins, relationships) that copy every old_model twin to new_model as <id><suffix>.
+
+    Twins are streamed from the query pager. Relationships are read once the
+    twins have been consumed: outgoing ones are copied from the new twin (with
+    targets that were migrated re-pointed too), and incoming ones from
+    unmigrated twins get a parallel relationship to the new twin.
+    """
+    migrated = set()
+
+    def twins():
+        for twin in adt.query_twins(migration_query(old_model)):
+            orig_id = twin.get("$dtId")
+            migrated.add(orig_id)
+            contents = {k: v for k, v in twin.items() if not k.startswith("$")}
+            yield {"$dtId": f"{orig_id}{suffix}", "$metadata": {"$model": new_model}, **contents}
+
+    def relationships():
+        for rel in adt.query_twins("SELECT * FROM RELATIONSHIPS"):
+            source, target = rel.get("$sourceId"), rel.get("$targetId")
+            if source not in migrated and target not in migrated:
+                continue
+            props = {k: v for k, v in rel.items() if not k.startswith("$")}
+            rel_id = rel.get("$relationshipId")
+            if source in migrated:
+                source = f"{source}{suffix}"
+            else:
+                rel_id = f"{rel_id}{suffix}"
+            if target in migrated:
+                target = f"{target}{suffix}"
+            yield relationship_record(source, target, rel.get("$relationshipName"), rel_id, props)
+
+    return twins(), relationships()
+
+class ImportCheckpoint:
+    """Resume state for a named bulk import, stored as checkpoints/import_<name>.json.
+
+    State saved for a different source version is ignored on load.
+    """
+
+    def __init__(self, blob_service, name: str, container: str = None, version: str = None):
+        container = container or os.environ.get("ADT_IMPORT_CONTAINER", "imports")
+        self.bc = blob_service.get_blob_client(container=container, blob=f"checkpoints/import_{name}.json")
+        self.version = version
+
+    def load(self) -> dict:
+        try:
+            state = json.loads(self.bc.download_blob().readall())
+        except Exception:
+            return {}
+        if state.get("source") != self.version:
+            logging.info(f"Import source changed ({state.get('source')} -> {self.version}); discarding checkpoint")
+            return {}
+        return state
+
+    def commit(self, state: dict):
+        self.bc.upload_blob(json.dumps(dict(state, source=self.version)), overwrite=True)
+
+    def clear(self):
+        try:
+            self.bc.delete_blob()
+        except Exception:
+            pass
+
+class ImportJobClient:
+    """Minimal client for the ADT Import Jobs REST API (not exposed by azure-digitaltwins-core)."""
+
+    def __init__(self, endpoint: str, credential, session=None):
+        self.endpoint = endpoint if endpoint.startswith("http") else f"https://{endpoint}"
+        self.endpoint = self.endpoint.rstrip("/")
+        self.credential = credential
+        self.session = session or get_session("adt-import")
+
+    def _call(self, method: str, job_id: str, body: dict = None) -> dict:
+        url = f"{self.endpoint}/jobs/imports/{job_id}?api-version={IMPORT_API_VERSION}"
+        headers = {"Authorization": f"Bearer {self.credential.get_token(ADT_SCOPE).token}"}
+        resp = request_with_backoff(self.session, method, url, headers=headers, json=body)
+        if resp.status_code == 404:
+            return None
+        resp.raise_for_status()
+        return resp.json()
+
+    def start(self, job_id: str, input_uri: str, output_uri: str) -> dict:
+        return self._call("PUT", job_id, {"inputBlobUri": input_uri, "outputBlobUri": output_uri})
+
+    def get(self, job_id: str) -> dict:
+        return self._call("GET", job_id)
+
+    def wait(self, job_id: str, timeout: float = None, poll_seconds: float = None, sleep=time.sleep) -> dict:
+        """Poll until the job is terminal or timeout seconds pass; returns the last status."""
+        poll_seconds = poll_seconds if poll_seconds is not None else float(os.environ.get("ADT_IMPORT_POLL_SECONDS", 10))
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id) or {"id": job_id, "status": "notfound"}
+            if job.get("status") in JOB_TERMINAL + ("notfound",):
+                return job
+            if deadline is not None and time.monotonic() + poll_seconds > deadline:
+                return job
+            sleep(poll_seconds)
+
+def run_import_job(jobs: ImportJobClient, blob_service, name: str, source, checkpoint: ImportCheckpoint,
+                   timeout: float = None) -> dict:
+    """Upload source() as NDJSON and run it as an import job, or re-attach to the checkpointed one."""
+    container = os.environ.get("ADT_IMPORT_CONTAINER", "imports")
+    state = checkpoint.load()
+    if state.get("mode") == "job" and state.get("jobId"):
+        job_id = state["jobId"]
+        logging.info(f"Resuming import job {job_id}")
+        if jobs.get(job_id) is None:
+            jobs.start(job_id, state["input"], state["output"])
+    else:
+        job_id = f"{name}-{uuid.uuid4().hex[:12]}"
+        input_bc = blob_service.get_blob_client(container=container, blob=f"{name}/{job_id}.ndjson")
+        models, twins, relationships = source()
+        input_bc.upload_blob(ndjson_lines(models, twins, relationships), overwrite=True)
+        output_uri = blob_service.get_blob_client(container=container, blob=f"{name}/{job_id}.log.ndjson").url
+        state = {"mode": "job", "jobId": job_id, "input": input_bc.url, "output": output_uri}
+        checkpoint.commit(state)
+        jobs.start(job_id, state["input"], state["output"])
+        logging.info(f"Started import job {job_id}")
+    job = jobs.wait(job_id, timeout=timeout)
+    status = job.get("status")
+    if status in JOB_TERMINAL or status == "notfound":
+        checkpoint.clear()
+    if status == "failed":
+        logging.error(f"Import job {job_id} failed: {job.get('error')}; see {state['output']}")
+    return {"mode": "job", "jobId": job_id, "status": status, "log": state["output"]}
+
+def run_upserts(adt, source, checkpoint: ImportCheckpoint, batch: int = None, label: str = "bulk_import") -> dict:
+    """Write source() through PatchDispatcher in batches, checkpointing after each one."""
+    batch = batch or int(os.environ.get("ADT_IMPORT_BATCH", 1000))
+    state = checkpoint.load()
+    if state.get("mode") != "upsert" or "done" not in state:
+        state = {"mode": "upsert", "done": {"twins": [], "relationships": []}}
+    done = {kind: set(keys) for kind, keys in state["done"].items()}
+    summary = {"mode": "upsert", "twins": 0, "relationships": 0, "failed": 0, "resumed": any(done.values())}
+    models, twins, relationships = source()
+    models = list(models)
+    if models:
+        try:
+            adt.create_models(models)
+        except Exception as e:
+            # Already uploaded models are expected on re-runs
+            logging.info(f"Models not created: {e}")
+    dispatcher = PatchDispatcher(adt, label=label)
+
+    def write(kind, records, key, submit):
+        pending = []
+        for record in records:
+            if key(record) in done[kind]:
+                continue
+            submit(record)
+            pending.append(key(record))
+            if len(pending) >= batch:
+                flush(kind, pending)
+                pending = []
+        if pending:
+            flush(kind, pending)
+
+    def flush(kind, keys):
+        result = dispatcher.flush()
+        summary[kind] += result["updated"]
+        summary["failed"] += result["failed"] + result["not_found"]
+        done[kind].update(keys)
+        state["done"][kind].extend(keys)
+        checkpoint.commit(state)
+
+    write("twins", twins, lambda t: t["$dtId"], lambda t: dispatcher.submit_upsert(t["$dtId"], t))
+    write("relationships", relationships, lambda r: f"{r['$dtId']}/{r['$relationshipId']}",
+          lambda r: dispatcher.submit_relationship(r["$dtId"], r["$relationshipId"], relationship_body(r)))
+    checkpoint.clear()
+    return summary
+
+def bulk_import(adt, blob_service, name: str, source, mode: str = None, jobs: ImportJobClient = None,
+                timeout: float = None, version: str = None) -> dict:
+    """Load source() -> (models, twins, relationships) into ADT.
+
+    source is called once per attempt, so a job that cannot be started falls
+    back to concurrent upserts with fresh iterables. version identifies the
+    source content (e.g. its ETag); a checkpoint from another version is not resumed.
+    """
+    from shared import ensure_container
+    mode = mode or os.environ.get("ADT_IMPORT_MODE", "upsert")
+    ensure_container(blob_service, os.environ.get("ADT_IMPORT_CONTAINER", "imports"))
+    checkpoint = ImportCheckpoint(blob_service, name, version=version)
+    if mode == "job":
+        try:
+            if jobs is None:
+                from shared import get_credential
+                jobs = ImportJobClient(os.environ["ADT_ENDPOINT"], get_credential())
+            return run_import_job(jobs, blob_service, name, source, checkpoint, timeout=timeout)
+        except Exception as e:
+            logging.warning(f"Import job unavailable ({e}); falling back to concurrent upserts")
+            checkpoint.clear()
+    return run_upserts(adt, source, checkpoint, label=name)
@@ -1,30 +1,89 @@
-import azure.functions as func, os, json
-from azure.identity import DefaultAzureCredential
-from azure.digitaltwins.core import DigitalTwinsClient
+import azure.functions as func, logging
+from shared import (get_adt_client, get_segment_model, cached_response_headers, encode_rows,
+                    SEGMENT_FIELDS, SEGMENT_MODEL_ID, traced, dependency)
 
+# Query parameters:
+# limit - page size; enables paging straight from ADT (max 1000)
+# continuationToken - token from the previous page's X-Continuation-Token header
+# fields - comma-separated projection, e.g. fields=avgSpeed,volume
+# format - "ndjson" for newline-delimited JSON (default: JSON array)
+# gzip is applied when the client sends Accept-Encoding: gzip
+
+MAX_PAGE_SIZE = 1000
+PAGE_SIZE_HEADER = "max-items-per-page"
+PROJECTABLE = set(SEGMENT_FIELDS) | {"segmentId", "name", "lanes", "speedLimit"}
+
+def shape(seg: dict) -> dict:
+    return {
+        'segmentId': seg.get('segmentId') or seg.get('$dtId'),
+        'avgSpeed': seg.get('avgSpeed'),
+        'volume': seg.get('volume'),
+        'PCI': seg.get('PCI'),
+        'IRI': seg.get('IRI'),
+        'prediction': {
+            'predictedAvgSpeed': seg.get('predictedAvgSpeed'),
+            'predictedCongestionIndex': seg.get('predictedCongestionIndex')
+        }
+    }
+
+def parse_fields(raw: str) -> list:
+    fields = [f.strip() for f in (raw or "").split(",") if f.strip()]
+    unknown = [f for f in fields if f not in PROJECTABLE]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    return fields
+
+def build_query(fields: list) -> str:
+    if fields:
+        select = ", ".join(["seg.$dtId"] + [f"seg.{f}" for f in fields if f != "segmentId"])
+    else:
+        select = "seg"
+    return f"SELECT {select} FROM DIGITALTWINS seg WHERE IS_OF_MODEL(seg, '{SEGMENT_MODEL_ID}')"
+
+def query_page(adt, fields: list, limit: int, token: str = None):
+    """Fetch one ADT query page; returns (items, next continuation token)."""
+    # query_twins has no page-size keyword; the service reads it from this header, which the
+    # per-call `headers` option of azure-core adds to every page request
+    headers = {PAGE_SIZE_HEADER: str(limit)}
+    with dependency("adt.query"):
+        pages = adt.query_twins(build_query(fields), headers=headers).by_page(continuation_token=token)
+        page = list(next(pages, []))
+    if fields:
+        items = [{"segmentId": r.get("$dtId"), **{f: r.get(f) for f in fields if f != "segmentId"}} for r in page]
+    else:
+        items = [shape(r.get('seg') or r) for r in page]
+    return items, pages.continuation_token
+
+@traced("list_segments")
 def main(req: func.HttpRequest) -> func.HttpResponse:
     try:
-        cred = DefaultAzureCredential()
-        adt = DigitalTwinsClient(os.environ["ADT_ENDPOINT"], cred)
-        # Basic query for all road segments
-        query = """
-        SELECT seg FROM DIGITALTWINS seg WHERE IS_OF_MODEL(seg, 'dtmi:fgcu:traffic:RoadSegment;1')
-        """
-        results = adt.query_twins(query)
-        out = []
-        for r in results:
-            seg = r.get('seg') or r
-            out.append({
-                'segmentId': seg.get('$dtId'),
-                'avgSpeed': seg.get('avgSpeed'),
-                'volume': seg.get('volume'),
-                'PCI': seg.get('PCI'),
-                'IRI': seg.get('IRI'),
-                'prediction': {
-                    'predictedAvgSpeed': seg.get('predictedAvgSpeed'),
-                    'predictedCongestionIndex': seg.get('predictedCongestionIndex')
-                }
-            })
-        return func.HttpResponse(json.dumps(out), status_code=200, mimetype="application/json")
+        fields = parse_fields(req.params.get("fields"))
+        limit = req.params.get("limit")
+        limit = min(MAX_PAGE_SIZE, max(1, int(limit))) if limit else None
+    except ValueError as e:
+        return func.HttpResponse(f"Bad request: {e}", status_code=400)
+    ndjson = (req.params.get("format") or "").lower() == "ndjson"
+    gzip = "gzip" in (req.headers.get("Accept-Encoding") or "").lower()
+    headers = {"Vary": "Accept-Encoding"}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    mimetype = "application/x-ndjson" if ndjson else "application/json"
+    try:
+        adt = get_adt_client()
+        if limit or fields:
+            items, next_token = query_page(adt, fields, limit or MAX_PAGE_SIZE, req.params.get("continuationToken"))
+            if next_token:
+                headers["X-Continuation-Token"] = next_token
+            body = encode_rows(items, ndjson=ndjson, gzip=gzip)
+            return func.HttpResponse(body, status_code=200, mimetype=mimetype, headers=headers)
+
+        model = get_segment_model()
+        model.ensure_fresh(adt)
+        headers.update(cached_response_headers(model))
+        if req.headers.get("If-None-Match") == headers["ETag"]:
+            return func.HttpResponse(status_code=304, headers=headers)
+        body = encode_rows((shape(seg) for seg in model.rows()), ndjson=ndjson, gzip=gzip)
+        logging.info(f"list_segments cache: {model.report()}")
+        return func.HttpResponse(body, status_code=200, mimetype=mimetype, headers=headers)
     except Exception as e:
         return func.HttpResponse(f"Error: {e}", status_code=500)
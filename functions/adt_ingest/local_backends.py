@@ -0,0 +1,590 @@
+import os, re, json, time, uuid, random, threading
+from datetime import datetime, timezone
+from pathlib import Path
+from azure.core import MatchConditions
+from azure.core.paging import ItemPaged
+from azure.core.exceptions import (HttpResponseError, ResourceNotFoundError, ResourceExistsError,
+                                   ResourceModifiedError, ResourceNotModifiedError)
+
+# In-process stand-ins for DigitalTwinsClient and BlobServiceClient, selected by
+# shared.get_clients for local runs, tests and benchmarks. They implement the
+# subset of the SDK surface this app uses and raise the same azure.core
+# exceptions, so retry, ETag and not-found paths behave as they do in Azure.
+#
+# Environment variables:
+# ADT_BACKEND - "local" to use LocalDigitalTwinsClient (default: azure)
+# LOCAL_ADT_LATENCY_MS - simulated latency per ADT call (default: 0)
+# LOCAL_ADT_JITTER_MS - uniform extra latency on top (default: 0)
+# LOCAL_ADT_THROTTLE_RATE - fraction of writes answered with 429 (default: 0)
+# LOCAL_ADT_RETRY_AFTER - Retry-After seconds sent with simulated 429s (default: 0)
+# BLOB_BACKEND - "local" to use LocalBlobServiceClient (default: azure)
+# LOCAL_BLOB_ROOT - directory with one subdirectory per container (default: .local_blobs)
+# QUEUE_BACKEND - "local" to use LocalQueueClient (default: azure)
+# LOCAL_QUEUE_ROOT - directory with one subdirectory per queue (default: .local_queues)
+
+DEFAULT_PAGE_SIZE = 100
+
+class _Response:
+    """Just enough of an HTTP response for HttpResponseError and the 429 retry logic."""
+
+    def __init__(self, status_code: int, reason: str, headers: dict = None):
+        self.status_code, self.reason, self.headers = status_code, reason, headers or {}
+
+    def text(self):
+        return ""
+
+def _now():
+    return datetime.now(timezone.utc)
+
+# ---------------------------------------------------------------- Digital Twins
+
+_QUERY_RE = re.compile(
+    r"^\s*SELECT\s+(?P<select>.+?)\s+FROM\s+(?P<source>DIGITALTWINS|RELATIONSHIPS)"
+    r"(?:\s+(?!WHERE\b)(?P<alias>\w+))?(?:\s+WHERE\s+(?P<where>.+?))?\s*$", re.I | re.S)
+_MODEL_RE = re.compile(r"^IS_OF_MODEL\(\s*(?:(?P<alias>\w+)\s*,\s*)?'(?P<model>[^']+)'\s*(?:,\s*exact\s*)?\)$", re.I)
+_EQ_RE = re.compile(r"^(?:(?P<alias>\w+)\.)?(?P<field>\$?\w+)\s*=\s*(?:'(?P<str>[^']*)'|(?P<num>-?[\d.]+)|(?P<bool>true|false))$", re.I)
+
+def _compile_query(query: str):
+    """(source, predicate, project) for the query subset the app uses:
+    SELECT * | alias | alias.f, ... FROM DIGITALTWINS|RELATIONSHIPS [alias]
+    [WHERE term AND term ...] with IS_OF_MODEL(...) and field = literal terms."""
+    m = _QUERY_RE.match(query)
+    if not m:
+        raise HttpResponseError(message=f"Query not supported by the local ADT backend: {query}",
+                                response=_Response(400, "Bad Request"))
+    source, alias = m.group("source").upper(), m.group("alias")
+    tests = []
+    for term in re.split(r"\s+AND\s+", m.group("where") or "", flags=re.I):
+        term = term.strip()
+        if not term:
+            continue
+        mm, me = _MODEL_RE.match(term), _EQ_RE.match(term)
+        if mm:
+            model = mm.group("model")
+            tests.append(lambda rec, model=model: rec.get("$metadata", {}).get("$model") == model)
+        elif me:
+            if me.group("str") is not None:
+                value = me.group("str")
+            elif me.group("bool") is not None:
+                value = me.group("bool").lower() == "true"
+            else:
+                value = float(me.group("num"))
+            tests.append(lambda rec, f=me.group("field"), v=value: rec.get(f) == v)
+        else:
+            raise HttpResponseError(message=f"WHERE clause not supported by the local ADT backend: {term}",
+                                    response=_Response(400, "Bad Request"))
+    select = [s.strip() for s in m.group("select").split(",")]
+    if select == ["*"]:
+        project = lambda rec: dict(rec)
+    elif alias and select == [alias]:
+        project = lambda rec: {alias: dict(rec)}
+    else:
+        fields = [s.split(".", 1)[1] if "." in s else s for s in select]
+        project = lambda rec: {f: rec.get(f) for f in fields if f in rec}
+    return source, (lambda rec: all(t(rec) for t in tests)), project
+
+def _apply_json_patch(doc: dict, ops: list):
+    for op in ops:
+        parts = [p.replace("~1", "/").replace("~0", "~") for p in op["path"].lstrip("/").split("/")]
+        target = doc
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        key, kind = parts[-1], op.get("op")
+        if kind in ("remove", "replace") and key not in target:
+            raise HttpResponseError(message=f"Property {op['path']} does not exist",
+                                    response=_Response(400, "Bad Request"))
+        if kind == "remove":
+            del target[key]
+        else:
+            target[key] = op.get("value")
+
+class LocalDigitalTwinsClient:
+    """Dict-backed DigitalTwinsClient with optional injected latency and 429 throttling.
+
+    patch_latencies holds one entry per successful write, measured from the
+    first attempt for that twin, so throttling retries count towards it.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, jitter_ms: float = 0.0, throttle_rate: float = 0.0,
+                 retry_after: str = "0", seed: int = None):
+        self.latency_ms, self.jitter_ms = latency_ms, jitter_ms
+        self.throttle_rate, self.retry_after = throttle_rate, retry_after
+        self._rng = random.Random(seed)
+        self._twins = {}
+        self._relationships = {}  # source id -> {relationship id: relationship}
+        self._models = {}
+        self._lock = threading.Lock()
+        self._first_attempt = {}
+        self.patch_latencies = []
+        self.stats = {"reads": 0, "writes": 0, "throttled": 0, "queries": 0}
+
+    @classmethod
+    def from_env(cls):
+        return cls(latency_ms=float(os.environ.get("LOCAL_ADT_LATENCY_MS", 0)),
+                   jitter_ms=float(os.environ.get("LOCAL_ADT_JITTER_MS", 0)),
+                   throttle_rate=float(os.environ.get("LOCAL_ADT_THROTTLE_RATE", 0)),
+                   retry_after=os.environ.get("LOCAL_ADT_RETRY_AFTER", "0"))
+
+    def _delay(self):
+        delay = self.latency_ms + (self._rng.uniform(0, self.jitter_ms) if self.jitter_ms else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+
+    def _read(self):
+        self._delay()
+        with self._lock:
+            self.stats["reads"] += 1
+
+    def _write(self, key):
+        start = time.perf_counter()
+        with self._lock:
+            start = self._first_attempt.setdefault(key, start)
+            throttle = self.throttle_rate > 0 and self._rng.random() < self.throttle_rate
+            if throttle:
+                self.stats["throttled"] += 1
+        self._delay()
+        if throttle:
+            raise HttpResponseError(message="Too many requests (simulated)",
+                                    response=_Response(429, "Too Many Requests", {"Retry-After": self.retry_after}))
+        return start
+
+    def _written(self, key, start):
+        with self._lock:
+            self._first_attempt.pop(key, None)
+            self.stats["writes"] += 1
+            self.patch_latencies.append(time.perf_counter() - start)
+
+    def seed(self, twins=(), relationships=()):
+        """Load twins and relationships directly, without latency or throttling."""
+        with self._lock:
+            for twin in twins:
+                self._twins[twin["$dtId"]] = self._stamp(json.loads(json.dumps(twin)))
+            for rel in relationships:
+                source = rel.get("$sourceId") or rel["$dtId"]
+                stored = {k: v for k, v in rel.items() if k != "$dtId"}
+                stored["$sourceId"] = source
+                self._relationships.setdefault(source, {})[rel["$relationshipId"]] = stored
+
+    def reset_stats(self):
+        with self._lock:
+            self.patch_latencies = []
+            self._first_attempt.clear()
+            for k in self.stats:
+                self.stats[k] = 0
+
+    @staticmethod
+    def _stamp(twin: dict) -> dict:
+        twin.setdefault("$metadata", {})
+        twin["$etag"] = f'W/"{uuid.uuid4()}"'
+        return twin
+
+    # Twins
+    def get_digital_twin(self, digital_twin_id: str, **kwargs) -> dict:
+        self._read()
+        with self._lock:
+            twin = self._twins.get(digital_twin_id)
+            if twin is None:
+                raise ResourceNotFoundError(f"Twin {digital_twin_id} not found")
+            return json.loads(json.dumps(twin))
+
+    def upsert_digital_twin(self, digital_twin_id: str, digital_twin: dict, **kwargs) -> dict:
+        start = self._write(("twin", digital_twin_id))
+        twin = self._stamp(dict(json.loads(json.dumps(digital_twin)), **{"$dtId": digital_twin_id}))
+        with self._lock:
+            if kwargs.get("match_condition") == MatchConditions.IfMissing and digital_twin_id in self._twins:
+                raise ResourceExistsError(f"Twin {digital_twin_id} already exists")
+            self._twins[digital_twin_id] = twin
+        self._written(("twin", digital_twin_id), start)
+        return dict(twin)
+
+    def update_digital_twin(self, digital_twin_id: str, json_patch: list, **kwargs):
+        start = self._write(("twin", digital_twin_id))
+        with self._lock:
+            twin = self._twins.get(digital_twin_id)
+            if twin is None:
+                self._first_attempt.pop(("twin", digital_twin_id), None)
+                raise ResourceNotFoundError(f"Twin {digital_twin_id} not found")
+            _apply_json_patch(twin, json_patch)
+            self._stamp(twin)
+        self._written(("twin", digital_twin_id), start)
+
+    def delete_digital_twin(self, digital_twin_id: str, **kwargs):
+        start = self._write(("twin", digital_twin_id))
+        with self._lock:
+            if self._twins.pop(digital_twin_id, None) is None:
+                raise ResourceNotFoundError(f"Twin {digital_twin_id} not found")
+            self._relationships.pop(digital_twin_id, None)
+        self._written(("twin", digital_twin_id), start)
+
+    # Relationships
+    def upsert_relationship(self, digital_twin_id: str, relationship_id: str, relationship: dict = None, **kwargs):
+        key = ("relationship", digital_twin_id, relationship_id)
+        start = self._write(key)
+        # Stored as sent, so a body the service would reject (e.g. one carrying $dtId) shows up in reads
+        rel = dict(relationship or {}, **{"$sourceId": digital_twin_id, "$relationshipId": relationship_id})
+        with self._lock:
+            if digital_twin_id not in self._twins or rel.get("$targetId") not in self._twins:
+                self._first_attempt.pop(key, None)
+                raise ResourceNotFoundError(f"Source or target of {relationship_id} not found")
+            self._relationships.setdefault(digital_twin_id, {})[relationship_id] = rel
+        self._written(key, start)
+        return dict(rel)
+
+    def get_relationship(self, digital_twin_id: str, relationship_id: str, **kwargs) -> dict:
+        self._read()
+        with self._lock:
+            rel = self._relationships.get(digital_twin_id, {}).get(relationship_id)
+            if rel is None:
+                raise ResourceNotFoundError(f"Relationship {relationship_id} not found")
+            return dict(rel)
+
+    def list_relationships(self, digital_twin_id: str, relationship_id: str = None, **kwargs):
+        self._read()
+        with self._lock:
+            rels = [dict(r) for r in self._relationships.get(digital_twin_id, {}).values()
+                    if relationship_id is None or r.get("$relationshipName") == relationship_id]
+        return iter(rels)
+
+    def delete_relationship(self, digital_twin_id: str, relationship_id: str, **kwargs):
+        key = ("relationship", digital_twin_id, relationship_id)
+        start = self._write(key)
+        with self._lock:
+            if self._relationships.get(digital_twin_id, {}).pop(relationship_id, None) is None:
+                self._first_attempt.pop(key, None)
+                raise ResourceNotFoundError(f"Relationship {relationship_id} not found")
+        self._written(key, start)
+
+    # Models
+    def create_models(self, dtdl_models: list, **kwargs) -> list:
+        self._read()
+        with self._lock:
+            for model in dtdl_models:
+                if model["@id"] in self._models:
+                    raise ResourceExistsError(f"Model {model['@id']} already exists")
+            for model in dtdl_models:
+                self._models[model["@id"]] = model
+        return list(dtdl_models)
+
+    def get_model(self, model_id: str, **kwargs):
+        with self._lock:
+            if model_id not in self._models:
+                raise ResourceNotFoundError(f"Model {model_id} not found")
+            return {"id": model_id, "model": self._models[model_id]}
+
+    def list_models(self, dependencies_for=None, **kwargs):
+        with self._lock:
+            return iter([{"id": k, "model": v} for k, v in self._models.items()])
+
+    # Queries
+    def query_twins(self, query_expression: str, **kwargs):
+        source, predicate, project = _compile_query(query_expression)
+        # Page size as the service takes it: the max-items-per-page request header
+        page_size = int((kwargs.get("headers") or {}).get("max-items-per-page") or DEFAULT_PAGE_SIZE)
+        with self._lock:
+            self.stats["queries"] += 1
+            if source == "DIGITALTWINS":
+                records = list(self._twins.values())
+            else:
+                records = [r for rels in self._relationships.values() for r in rels.values()]
+            results = [project(r) for r in records if predicate(r)]
+
+        def get_next(token):
+            self._read()
+            offset = int(token or 0)
+            return offset, results[offset:offset + page_size]
+
+        def extract_data(response):
+            offset, page = response
+            nxt = offset + page_size
+            return (str(nxt) if nxt < len(results) else None), iter(page)
+
+        return ItemPaged(get_next, extract_data)
+
+# ---------------------------------------------------------------- Blob storage
+
+class _Properties:
+    def __init__(self, name, container, size, etag, last_modified, metadata, content_type, content_range=None):
+        self.name, self.container, self.size, self.etag = name, container, size, etag
+        self.last_modified, self.metadata, self.content_range = last_modified, metadata, content_range
+        self.content_settings = type("ContentSettings", (), {"content_type": content_type})()
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+class _Downloader:
+    def __init__(self, data: bytes, properties: _Properties, chunk_size: int = 4 * 1024 * 1024):
+        self._data, self.properties, self._chunk_size = data, properties, chunk_size
+        self.size = len(data)
+
+    def readall(self) -> bytes:
+        return self._data
+
+    def content_as_bytes(self) -> bytes:
+        return self._data
+
+    def content_as_text(self, encoding: str = "UTF-8") -> str:
+        return self._data.decode(encoding)
+
+    def readinto(self, stream) -> int:
+        stream.write(self._data)
+        return len(self._data)
+
+    def chunks(self):
+        for i in range(0, len(self._data), self._chunk_size):
+            yield self._data[i:i + self._chunk_size]
+
+def _as_bytes(data) -> bytes:
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, str):
+        return data.encode("utf-8")
+    if hasattr(data, "read"):
+        return _as_bytes(data.read())
+    return b"".join(_as_bytes(piece) for piece in data)
+
+class LocalBlobClient:
+    """One blob stored as a file; ETag, metadata and content type live in a JSON sidecar
+    under <root>/.meta so listings only see blobs."""
+
+    _locks = {}
+    _locks_guard = threading.Lock()
+
+    def __init__(self, root: Path, container: str, blob: str):
+        self.root, self.container_name, self.blob_name = root, container, blob
+        self.path = root / container / Path(*blob.split("/"))
+        self.meta_path = root / ".meta" / container / Path(*(blob + ".json").split("/"))
+        self.url = self.path.resolve().as_uri()
+        with self._locks_guard:
+            self._lock = self._locks.setdefault(str(self.path), threading.Lock())
+
+    def _meta(self) -> dict:
+        try:
+            return json.loads(self.meta_path.read_text())
+        except (OSError, ValueError):
+            return {}
+
+    def _check_container(self):
+        if not (self.root / self.container_name).is_dir():
+            raise ResourceNotFoundError(f"Container {self.container_name} not found")
+
+    def _properties(self, meta: dict = None) -> _Properties:
+        meta = meta if meta is not None else self._meta()
+        stat = self.path.stat()
+        etag = meta.get("etag") or f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+        modified = datetime.fromtimestamp(stat.st_mtime, timezone.utc)
+        return _Properties(self.blob_name, self.container_name, stat.st_size, etag, modified,
+                           meta.get("metadata") or {}, meta.get("content_type"))
+
+    def exists(self, **kwargs) -> bool:
+        return self.path.is_file()
+
+    def get_blob_properties(self, **kwargs) -> _Properties:
+        if not self.path.is_file():
+            raise ResourceNotFoundError(f"Blob {self.blob_name} not found")
+        return self._properties()
+
+    def upload_blob(self, data, overwrite: bool = False, metadata: dict = None, content_settings=None,
+                    etag: str = None, match_condition=None, **kwargs) -> dict:
+        self._check_container()
+        body = _as_bytes(data)
+        with self._lock:
+            exists = self.path.is_file()
+            if exists and not overwrite:
+                raise ResourceExistsError(f"Blob {self.blob_name} already exists")
+            if match_condition == MatchConditions.IfNotModified:
+                if not exists:
+                    raise ResourceNotFoundError(f"Blob {self.blob_name} not found")
+                if self._properties().etag != etag:
+                    raise ResourceModifiedError(f"Blob {self.blob_name} was modified")
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.meta_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(f".{self.path.name}.{uuid.uuid4().hex}.tmp")
+            tmp.write_bytes(body)
+            os.replace(tmp, self.path)
+            meta = {"etag": f'"0x{uuid.uuid4().hex[:16].upper()}"', "metadata": dict(metadata or {}),
+                    "content_type": getattr(content_settings, "content_type", None)}
+            self.meta_path.write_text(json.dumps(meta))
+        return {"etag": meta["etag"], "last_modified": _now()}
+
+    def download_blob(self, offset: int = None, length: int = None, etag: str = None, match_condition=None,
+                      **kwargs) -> _Downloader:
+        self._check_container()
+        with self._lock:
+            if not self.path.is_file():
+                raise ResourceNotFoundError(f"Blob {self.blob_name} not found")
+            props = self._properties()
+            if match_condition == MatchConditions.IfModified and etag == props.etag:
+                raise ResourceNotModifiedError(f"Blob {self.blob_name} not modified")
+            if match_condition == MatchConditions.IfNotModified and etag != props.etag:
+                raise ResourceModifiedError(f"Blob {self.blob_name} was modified")
+            with open(self.path, "rb") as f:
+                if offset:
+                    f.seek(offset)
+                data = f.read(length) if length is not None else f.read()
+        if offset is not None or length is not None:
+            # Like the SDK: a ranged download reports the range's size, and the blob's in content_range
+            start = offset or 0
+            props = _Properties(props.name, props.container, len(data), props.etag, props.last_modified,
+                                props.metadata, props.content_settings.content_type,
+                                f"bytes {start}-{start + len(data) - 1}/{props.size}")
+        return _Downloader(data, props)
+
+    def delete_blob(self, **kwargs):
+        with self._lock:
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                raise ResourceNotFoundError(f"Blob {self.blob_name} not found")
+            try:
+                self.meta_path.unlink()
+            except FileNotFoundError:
+                pass
+
+class LocalContainerClient:
+    def __init__(self, root: Path, container: str):
+        self.root, self.container_name = root, container
+
+    def get_blob_client(self, blob: str) -> LocalBlobClient:
+        return LocalBlobClient(self.root, self.container_name, blob)
+
+    def exists(self, **kwargs) -> bool:
+        return (self.root / self.container_name).is_dir()
+
+    def create_container(self, **kwargs):
+        path = self.root / self.container_name
+        if path.is_dir():
+            raise ResourceExistsError(f"Container {self.container_name} already exists")
+        path.mkdir(parents=True)
+
+    def upload_blob(self, name: str, data, **kwargs) -> LocalBlobClient:
+        bc = self.get_blob_client(name)
+        bc.upload_blob(data, **kwargs)
+        return bc
+
+    def download_blob(self, blob: str, **kwargs) -> _Downloader:
+        return self.get_blob_client(blob).download_blob(**kwargs)
+
+    def delete_blob(self, blob: str, **kwargs):
+        self.get_blob_client(blob).delete_blob()
+
+    def list_blobs(self, name_starts_with: str = None, include=None, **kwargs):
+        base = self.root / self.container_name
+        if not base.is_dir():
+            raise ResourceNotFoundError(f"Container {self.container_name} not found")
+        names = []
+        # Only walk the deepest directory the prefix pins down
+        start = base.joinpath(*(name_starts_with or "").split("/")[:-1])
+        for dirpath, _, files in os.walk(start):
+            for fname in files:
+                if fname.startswith(".") and fname.endswith(".tmp"):
+                    continue
+                name = Path(dirpath, fname).relative_to(base).as_posix()
+                if not name_starts_with or name.startswith(name_starts_with):
+                    names.append(name)
+        for name in sorted(names):
+            yield self.get_blob_client(name)._properties()
+
+class LocalBlobServiceClient:
+    """Filesystem-backed BlobServiceClient: <root>/<container>/<blob path>."""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.url = self.root.resolve().as_uri()
+
+    @classmethod
+    def from_env(cls):
+        return cls(os.environ.get("LOCAL_BLOB_ROOT", ".local_blobs"))
+
+    def get_container_client(self, container: str) -> LocalContainerClient:
+        return LocalContainerClient(self.root, container)
+
+    def get_blob_client(self, container: str, blob: str, **kwargs) -> LocalBlobClient:
+        return LocalBlobClient(self.root, container, blob)
+
+    def create_container(self, name: str, **kwargs) -> LocalContainerClient:
+        cc = self.get_container_client(name)
+        cc.create_container()
+        return cc
+
+    def list_containers(self, **kwargs):
+        return iter([{"name": p.name} for p in sorted(self.root.iterdir()) if p.is_dir() and p.name != ".meta"])
+
+class _QueueMessage:
+    def __init__(self, msg_id: str, content: bytes, pop_receipt: str = None, dequeue_count: int = 0):
+        self.id, self.content, self.pop_receipt, self.dequeue_count = msg_id, content, pop_receipt, dequeue_count
+
+class LocalQueueClient:
+    """Filesystem-backed QueueClient (bytes messages, as with the Base64 binary policies).
+
+    Each message is one file named <visible-at ns>-<id>-<dequeue count>.msg.
+    Receiving claims a message by renaming it with a later visibility time, so
+    several processes can consume the same queue; the new name is the pop
+    receipt, and a message that is not deleted reappears once it expires.
+    """
+
+    def __init__(self, root: str, queue_name: str):
+        self.queue_name = queue_name
+        self.path = Path(root) / queue_name
+        self.url = self.path.resolve().as_uri()
+
+    @classmethod
+    def from_env(cls, queue_name: str):
+        return cls(os.environ.get("LOCAL_QUEUE_ROOT", ".local_queues"), queue_name)
+
+    def create_queue(self, **kwargs):
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _check_queue(self):
+        if not self.path.is_dir():
+            raise ResourceNotFoundError(f"Queue {self.queue_name} not found")
+
+    def send_message(self, content, visibility_timeout: int = None, **kwargs) -> _QueueMessage:
+        self._check_queue()
+        msg_id = uuid.uuid4().hex
+        visible = time.time_ns() + int((visibility_timeout or 0) * 1e9)
+        tmp = self.path / f".{msg_id}.tmp"
+        tmp.write_bytes(_as_bytes(content))
+        os.replace(tmp, self.path / f"{visible:020d}-{msg_id}-0.msg")
+        return _QueueMessage(msg_id, content)
+
+    def receive_messages(self, max_messages: int = 32, visibility_timeout: int = 30, **kwargs):
+        self._check_queue()
+        now = time.time_ns()
+        out = []
+        for name in sorted(os.listdir(self.path)):
+            if len(out) >= max_messages:
+                break
+            if not name.endswith(".msg"):
+                continue
+            visible, msg_id, dequeued = name[:-4].split("-")
+            if int(visible) > now:
+                break
+            receipt = f"{now + int(visibility_timeout * 1e9):020d}-{msg_id}-{int(dequeued) + 1}.msg"
+            try:
+                os.rename(self.path / name, self.path / receipt)
+            except FileNotFoundError:
+                continue  # claimed by another consumer
+            out.append(_QueueMessage(msg_id, (self.path / receipt).read_bytes(), receipt, int(dequeued) + 1))
+        return iter(out)
+
+    def delete_message(self, message, pop_receipt: str = None, **kwargs):
+        receipt = pop_receipt or message.pop_receipt
+        try:
+            os.remove(self.path / receipt)
+        except FileNotFoundError:
+            raise ResourceNotFoundError(f"Message {getattr(message, 'id', message)} not found or pop receipt expired")
+
+    def get_queue_properties(self, **kwargs):
+        self._check_queue()
+        count = sum(1 for name in os.listdir(self.path) if name.endswith(".msg"))
+        return type("QueueProperties", (), {"name": self.queue_name, "approximate_message_count": count})()
+
+    def clear_messages(self, **kwargs):
+        self._check_queue()
+        for name in os.listdir(self.path):
+            if name.endswith(".msg"):
+                try:
+                    os.remove(self.path / name)
+                except FileNotFoundError:
+                    pass
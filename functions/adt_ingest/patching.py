@@ -0,0 +1,214 @@
+import os, time, random, logging, threading, contextvars
+from concurrent.futures import ThreadPoolExecutor
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+from shared import latency_summary, observe, count
+
+# Concurrent ADT write dispatcher shared by the ingest functions.
+#
+# Environment variables:
+# ADT_PATCH_CONCURRENCY - max in-flight ADT writes per run (default: 8)
+# ADT_PATCH_MAX_RETRIES - retries per twin after a 429/503 (default: 5)
+
+DEFAULT_CONCURRENCY = 8
+DEFAULT_MAX_RETRIES = 5
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 30
+RETRYABLE_STATUS = (429, 503)
+
+def coalesce_ops(ops: list) -> list:
+    """Collapse JSON patch ops so each path is written once (last value wins)."""
+    return list(merge_ops({}, ops).values())
+
+def merge_ops(by_path: dict, ops: list) -> dict:
+    """Fold ops into a {path: op} map in place, so a twin's pending patch never outgrows its paths."""
+    for op in ops:
+        by_path.pop(op["path"], None)
+        by_path[op["path"]] = op
+    return by_path
+
+def chain(*callbacks):
+    """Combine several on_written callbacks into one."""
+    def run(twin_id, ops):
+        for cb in callbacks:
+            cb(twin_id, ops)
+    return run
+
+def _notify(callback, twin_id, ops):
+    """Run an on_written/on_not_found callback; its errors never change the write's outcome."""
+    try:
+        callback(twin_id, ops)
+    except Exception as e:
+        logging.warning(f"Callback for twin {twin_id} failed: {e}")
+        count("adt.callback_failed")
+
+def _retry_after_seconds(err, attempt: int) -> float:
+    headers = getattr(getattr(err, "response", None), "headers", None) or {}
+    hinted = headers.get("Retry-After") or headers.get("retry-after")
+    if hinted:
+        try:
+            return min(BACKOFF_MAX_SECONDS, float(hinted))
+        except ValueError:
+            pass
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+class _AdaptiveLimiter:
+    """Concurrency gate that halves on throttling and creeps back up on success."""
+
+    def __init__(self, limit: int):
+        self.max_limit = max(1, limit)
+        self.limit = self.max_limit
+        self.in_flight = 0
+        self._successes = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self.in_flight >= self.limit:
+                self._cond.wait()
+            self.in_flight += 1
+
+    def release(self, throttled: bool = False):
+        with self._cond:
+            self.in_flight -= 1
+            if throttled:
+                self.limit = max(1, self.limit // 2)
+                self._successes = 0
+            else:
+                self._successes += 1
+                if self.limit < self.max_limit and self._successes >= self.limit:
+                    self.limit += 1
+                    self._successes = 0
+            self._cond.notify_all()
+
+class PatchDispatcher:
+    """Collects twin writes and applies them to ADT with bounded concurrency.
+
+    Patches submitted for the same twin are merged into one request as they are
+    submitted, so pending state is one op per twin and path. Upserts run
+    before relationships, and both before patches, so newly seeded twins exist by
+    the time they are linked or patched.
+    on_written(twin_id, ops) is called from worker threads after each accepted patch,
+    and on_not_found(twin_id, ops) after each patch rejected because the twin does not exist.
+    """
+
+    def __init__(self, adt, concurrency: int = None, max_retries: int = None, label: str = "adt",
+                 on_written=None, on_not_found=None):
+        self.adt = adt
+        self.label = label
+        self.on_written = on_written
+        self.on_not_found = on_not_found
+        self.concurrency = concurrency or int(os.environ.get("ADT_PATCH_CONCURRENCY", DEFAULT_CONCURRENCY))
+        self.max_retries = max_retries if max_retries is not None else int(
+            os.environ.get("ADT_PATCH_MAX_RETRIES", DEFAULT_MAX_RETRIES))
+        self._patches = {}
+        self._upserts = {}
+        self._relationships = {}
+        self.submitted = 0
+
+    def submit(self, twin_id: str, ops: list):
+        if not twin_id or not ops:
+            return
+        self.submitted += 1
+        merge_ops(self._patches.setdefault(twin_id, {}), ops)
+
+    def submit_upsert(self, twin_id: str, twin: dict):
+        if not twin_id:
+            return
+        self.submitted += 1
+        self._upserts[twin_id] = twin
+
+    def submit_relationship(self, source_id: str, relationship_id: str, relationship: dict):
+        if not source_id or not relationship_id:
+            return
+        self.submitted += 1
+        self._relationships[(source_id, relationship_id)] = relationship
+
+    def pending(self) -> int:
+        return len(self._patches) + len(self._upserts) + len(self._relationships)
+
+    def flush(self) -> dict:
+        """Apply all pending writes and return a run summary."""
+        upserts, self._upserts = self._upserts, {}
+        relationships, self._relationships = self._relationships, {}
+        patches, self._patches = self._patches, {}
+        stats = {
+            "submitted": self.submitted, "requests": len(upserts) + len(relationships) + len(patches),
+            "updated": 0, "failed": 0, "not_found": 0, "throttled": 0, "retries": 0,
+        }
+        self.submitted = 0
+        latencies = []
+        lock = threading.Lock()
+        limiter = _AdaptiveLimiter(self.concurrency)
+
+        def run(kind, twin_id, body):
+            start = time.perf_counter()
+            outcome = "failed"
+            attempt = 0
+            while True:
+                limiter.acquire()
+                retry_err = None
+                call_start = time.perf_counter()
+                try:
+                    if kind == "upsert":
+                        self.adt.upsert_digital_twin(twin_id, body)
+                    elif kind == "relationship":
+                        self.adt.upsert_relationship(twin_id[0], twin_id[1], body)
+                    else:
+                        self.adt.update_digital_twin(twin_id, body)
+                    outcome = "updated"
+                except ResourceNotFoundError:
+                    logging.warning(f"Twin {twin_id} not found; {kind} skipped")
+                    outcome = "not_found"
+                except HttpResponseError as e:
+                    if e.status_code in RETRYABLE_STATUS and attempt < self.max_retries:
+                        retry_err = e
+                    else:
+                        logging.error(f"Failed {kind} twin {twin_id}: {e}")
+                except Exception as e:
+                    logging.error(f"Failed {kind} twin {twin_id}: {e}")
+                finally:
+                    limiter.release(throttled=retry_err is not None)
+                    observe(f"adt.{kind}", time.perf_counter() - call_start)
+                if retry_err is None:
+                    break
+                count("adt.throttled", kind=kind)
+                with lock:
+                    stats["throttled"] += 1
+                    stats["retries"] += 1
+                time.sleep(_retry_after_seconds(retry_err, attempt))
+                attempt += 1
+            # Outside the write's try: ADT has already answered, whatever the callback does
+            if kind == "patch" and outcome == "updated" and self.on_written:
+                _notify(self.on_written, twin_id, body)
+            elif kind == "patch" and outcome == "not_found" and self.on_not_found:
+                _notify(self.on_not_found, twin_id, body)
+            elapsed = time.perf_counter() - start
+            with lock:
+                stats[outcome] += 1
+                latencies.append(elapsed)
+
+        run_start = time.perf_counter()
+        for kind, batch in (("upsert", upserts), ("relationship", relationships), ("patch", patches)):
+            if not batch:
+                continue
+            with ThreadPoolExecutor(max_workers=min(self.concurrency, len(batch))) as pool:
+                for twin_id, body in batch.items():
+                    if kind == "patch":
+                        body = list(body.values())
+                    # Each task gets a copy of the caller's context so telemetry lands in this run
+                    pool.submit(contextvars.copy_context().run, run, kind, twin_id, body)
+        wall = time.perf_counter() - run_start
+
+        stats["elapsed_s"] = round(wall, 3)
+        stats["per_sec"] = round(stats["requests"] / wall, 1) if wall > 0 else 0.0
+        stats.update(latency_summary(latencies))
+        for key in ("updated", "failed", "not_found"):
+            if stats[key]:
+                count(f"adt.{key}", stats[key])
+        logging.info(
+            f"{self.label} writes: requests={stats['requests']} updated={stats['updated']} "
+            f"failed={stats['failed']} throttled={stats['throttled']} "
+            f"rate={stats['per_sec']}/s p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms"
+        )
+        return stats
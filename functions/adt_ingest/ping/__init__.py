@@ -1,4 +1,6 @@
 import azure.functions as func
+from shared import traced
 
+@traced("ping")
 def main(req: func.HttpRequest) -> func.HttpResponse:
     return func.HttpResponse("pong", status_code=200)
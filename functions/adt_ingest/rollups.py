@@ -0,0 +1,547 @@
+import os, io, json, zlib, struct, logging, threading
+from datetime import datetime, timedelta, timezone
+import numpy as np
+from shared import dependency, count
+
+# Time-bucketed traffic rollups.
+#
+# The traffic timer appends each tick's (segment, speed, volume) observations to
+# an open-hour buffer blob. When a tick lands in a later hour the buffer is sealed
+# into 5-minute and hourly blocks, and day/month boundaries compact those into
+# coarser blocks and derive the daily tier:
+#
+#   rollups/<dataset>/<tier>/shard-NN/YYYY/MM/DD/HH.bin   (sealed hour; 5m and 1h)
+#   rollups/<dataset>/<tier>/shard-NN/YYYY/MM/DD.bin      (compacted day)
+#   rollups/<dataset>/<tier>/shard-NN/YYYY/MM.bin         (compacted month; 1h and 1d)
+#
+# Segments are spread over ROLLUP_SHARDS shards by crc32 of the twin id, so a
+# query lists and reads only its segment's shard. A block starts with a JSON index of twinId -> [first row, rows], so readers
+# fetch the index and then range-read one segment's rows. Rows (ROLLUP_DTYPE)
+# carry count/min/max/sum for speed and volume plus a fixed-bin speed histogram,
+# which merges exactly across tiers and gives approximate percentiles.
+#
+# The buffer blob uses the same layout (an hour field, then an index of twinId ->
+# [first row, rows] over observations grouped by segment), so get_segment_history
+# range-reads one segment's open-hour rows, and skips the buffer entirely when the
+# query ends before the open hour, instead of downloading every segment's tick.
+#
+# Environment variables:
+# ROLLUPS - maintain rollups from the traffic timer (default: true)
+# ROLLUP_SHARDS - blocks per window; keep it fixed once data exists (default: 16)
+# ROLLUP_BUFFER_BLOB - open-hour buffer in TRAFFIC_HISTORY_CONTAINER (default: state/rollup_buffer.npz)
+
+PREFIX = "rollups"
+TIERS = {"5m": 300, "1h": 3600, "1d": 86400}
+# Windows a tier has no block for yet are rebuilt from the finer tier; 5m and 1h
+# fall back to the open-hour buffer instead.
+FINER = {"1d": "1h"}
+SPEED_EDGES = np.arange(0.0, 85.0, 5.0, dtype=np.float32)  # 5 mph bins; >= 80 mph lands in the last one
+SKETCH_BINS = len(SPEED_EDGES) - 1
+MAGIC = b"RLUP0001"
+BUFFER_MAGIC = b"RLBF0001"
+INDEX_PROBE = 65536  # first read of a block; covers the index of ~1500 segments
+MAX_POINTS = 10000
+
+ROLLUP_DTYPE = np.dtype([
+    ("bucket", "i8"),
+    ("count", "u4"),
+    ("speedCount", "u4"),
+    ("speedMin", "f4"),
+    ("speedMax", "f4"),
+    ("speedSum", "f4"),
+    ("volumeCount", "u4"),
+    ("volumeMin", "f4"),
+    ("volumeMax", "f4"),
+    ("volumeSum", "f4"),
+    ("speedHist", "u2", (SKETCH_BINS,)),
+])
+OBSERVATION_DTYPE = np.dtype([("ts", "<i8"), ("speed", "<f4"), ("volume", "<f4")])
+
+def observe(ts, speeds, volumes) -> np.ndarray:
+    """One rollup row per observation (NaN = not reported); reduce() folds them into buckets."""
+    speeds = np.asarray(speeds, dtype=np.float32)
+    volumes = np.asarray(volumes, dtype=np.float32)
+    rows = np.zeros(len(speeds), dtype=ROLLUP_DTYPE)
+    rows["bucket"] = ts
+    rows["count"] = 1
+    for field, values in (("speed", speeds), ("volume", volumes)):
+        ok = ~np.isnan(values)
+        rows[f"{field}Count"] = ok
+        rows[f"{field}Min"] = values
+        rows[f"{field}Max"] = values
+        rows[f"{field}Sum"] = np.where(ok, values, 0.0)
+    ok = ~np.isnan(speeds)
+    bins = np.clip(np.searchsorted(SPEED_EDGES, speeds[ok], side="right") - 1, 0, SKETCH_BINS - 1)
+    rows["speedHist"][np.flatnonzero(ok), bins] = 1
+    return rows
+
+def reduce(keys, rows: np.ndarray, seconds: int):
+    """Merge rows sharing (key, bucket floored to `seconds`); returns (keys, rows) sorted by key then bucket."""
+    keys = np.asarray(keys)
+    if not len(rows):
+        return keys[:0], np.zeros(0, dtype=ROLLUP_DTYPE)
+    buckets = rows["bucket"] // seconds * seconds
+    order = np.lexsort((buckets, keys))
+    keys, buckets, rows = keys[order], buckets[order], rows[order]
+    starts = np.flatnonzero(np.r_[True, (keys[1:] != keys[:-1]) | (buckets[1:] != buckets[:-1])])
+    out = np.zeros(len(starts), dtype=ROLLUP_DTYPE)
+    out["bucket"] = buckets[starts]
+    for field in ("count", "speedCount", "speedSum", "volumeCount", "volumeSum"):
+        out[field] = np.add.reduceat(rows[field], starts)
+    for field in ("speedMin", "volumeMin"):
+        out[field] = np.fmin.reduceat(rows[field], starts)
+    for field in ("speedMax", "volumeMax"):
+        out[field] = np.fmax.reduceat(rows[field], starts)
+    hist = np.add.reduceat(rows["speedHist"].astype(np.uint32), starts, axis=0)
+    out["speedHist"] = np.minimum(hist, np.iinfo(np.uint16).max)
+    return keys[starts], out
+
+def sketch_quantile(hist, q: float, lo, hi):
+    """Quantile from speed histograms (one per row of a 2-D array), interpolated
+    within the bin and clamped to each bucket's [min, max]. NaN where empty."""
+    hist = np.atleast_2d(hist).astype(np.int64)
+    cum = np.cumsum(hist, axis=1)
+    target = q * cum[:, -1]
+    i = np.minimum((cum < target[:, None]).sum(axis=1), SKETCH_BINS - 1)
+    rows = np.arange(len(hist))
+    below = np.where(i > 0, cum[rows, i - 1], 0)
+    width = hist[rows, i]
+    frac = np.divide(target - below, width, out=np.zeros(len(hist)), where=width > 0)
+    value = SPEED_EDGES[i] + frac * (SPEED_EDGES[i + 1] - SPEED_EDGES[i])
+    return np.where(cum[:, -1] > 0, np.clip(value, lo, hi), np.nan)
+
+def to_points(rows: np.ndarray, seconds: int) -> list:
+    """JSON-ready points at `seconds` resolution."""
+    _, rows = reduce(np.zeros(len(rows), dtype=np.uint8), rows, seconds)
+    starts = [datetime.fromtimestamp(int(b), timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ") for b in rows["bucket"]]
+    columns = {"count": rows["count"].tolist()}
+    for field in ("speed", "volume"):
+        n = rows[f"{field}Count"]
+        columns[field] = [n.tolist()] + [np.round(v, 2).tolist() for v in (
+            rows[f"{field}Min"], rows[f"{field}Max"], rows[f"{field}Sum"] / np.maximum(n, 1))]
+    speed_lo, speed_hi = rows["speedMin"], rows["speedMax"]
+    for q in (0.5, 0.85):
+        columns["speed"].append(np.round(sketch_quantile(rows["speedHist"], q, speed_lo, speed_hi), 2).tolist())
+    points = []
+    for i, start in enumerate(starts):
+        point = {"start": start, "count": columns["count"][i]}
+        for field, keys in (("speed", ("count", "min", "max", "mean", "p50", "p85")),
+                            ("volume", ("count", "min", "max", "mean"))):
+            values = columns[field]
+            point[field] = {k: v[i] for k, v in zip(keys, values)} if values[0][i] else None
+        points.append(point)
+    return points
+
+def parse_resolution(text) -> int:
+    """'5m', '15m', '1h', '1d', '1w' or seconds; must be a multiple of 5 minutes."""
+    text = str(text).strip().lower()
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+    seconds = int(text[:-1]) * units[text[-1]] if text[-1:] in units else int(text)
+    if seconds <= 0 or seconds % TIERS["5m"]:
+        raise ValueError(f"resolution must be a positive multiple of 5 minutes, got {text!r}")
+    return seconds
+
+def choose_tier(seconds: int) -> str:
+    """Coarsest tier whose buckets tile `seconds` exactly."""
+    return max((t for t, s in TIERS.items() if seconds % s == 0), key=TIERS.get)
+
+def encode_block(keys, rows: np.ndarray) -> bytes:
+    """Rows must be grouped by key (as reduce() returns them)."""
+    keys = np.asarray(keys)
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.zeros(0, dtype=np.int64)
+    ends = np.r_[starts[1:], len(keys)]
+    index = {str(keys[s]): [int(s), int(e - s)] for s, e in zip(starts, ends)}
+    header = json.dumps({"itemsize": ROLLUP_DTYPE.itemsize, "segments": index}, separators=(",", ":")).encode()
+    return MAGIC + struct.pack("<Q", len(header)) + header + rows.tobytes()
+
+def decode_block(data: bytes):
+    size = struct.unpack("<Q", data[8:16])[0]
+    header = json.loads(data[16:16 + size])
+    rows = np.frombuffer(data[16 + size:], dtype=ROLLUP_DTYPE)
+    keys = np.empty(len(rows), dtype=object)
+    for twin_id, (start, n) in header["segments"].items():
+        keys[start:start + n] = twin_id
+    return keys.astype(str), rows
+
+def _window(ts: int, level: str) -> str:
+    fmt = {"hour": "%Y/%m/%d/%H", "day": "%Y/%m/%d", "month": "%Y/%m", "year": "%Y"}[level]
+    return datetime.fromtimestamp(int(ts), timezone.utc).strftime(fmt)
+
+def _span(window: str):
+    """[start, end) epoch seconds of a month, day or hour window."""
+    parts = [int(p) for p in window.split("/")]
+    if len(parts) == 2:
+        year, month = parts
+        start = datetime(year, month, 1, tzinfo=timezone.utc)
+        end = datetime(year + month // 12, month % 12 + 1, 1, tzinfo=timezone.utc)
+    else:
+        start = datetime(*parts, tzinfo=timezone.utc)
+        end = start + (timedelta(hours=1) if len(parts) == 4 else timedelta(days=1))
+    return int(start.timestamp()), int(end.timestamp())
+
+def _periods(lo: int, hi: int, level: str):
+    """Window strings at `level` (day/month/year) overlapping [lo, hi)."""
+    seen, ts = [], lo
+    while ts < hi:
+        window = _window(ts, level)
+        if window not in seen:
+            seen.append(window)
+        ts = (ts // 86400 + 1) * 86400
+    return seen
+
+def _gaps(lo: int, hi: int, covered):
+    gaps, pos = [], lo
+    for start, end in sorted(covered):
+        if start > pos:
+            gaps.append((pos, min(start, hi)))
+        pos = max(pos, end)
+        if pos >= hi:
+            break
+    if pos < hi:
+        gaps.append((pos, hi))
+    return [(a, b) for a, b in gaps if a < b]
+
+class RollupBuffer:
+    """Observations of the open hour, appended tick by tick and sealed when the hour closes."""
+
+    def __init__(self, hour: int = None, names=(), idx=None, ts=None, speeds=None, volumes=None, etag=None):
+        self.hour, self.etag = hour, etag
+        self.names = list(names)
+        self.index = {name: i for i, name in enumerate(self.names)}
+        self.idx = idx if idx is not None else np.zeros(0, dtype=np.uint32)
+        self.ts = ts if ts is not None else np.zeros(0, dtype=np.int64)
+        self.speeds = speeds if speeds is not None else np.zeros(0, dtype=np.float32)
+        self.volumes = volumes if volumes is not None else np.zeros(0, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.idx)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, etag=None):
+        if data[:8] != BUFFER_MAGIC:
+            # npz written before the buffer was indexed by segment
+            with np.load(io.BytesIO(data), allow_pickle=False) as z:
+                return cls(int(z["hour"]), z["names"].tolist(), z["idx"], z["ts"], z["speeds"], z["volumes"], etag)
+        hour, size = struct.unpack("<qQ", data[8:24])
+        segments = json.loads(data[24:24 + size])["segments"]
+        rows = np.frombuffer(data[24 + size:], dtype=OBSERVATION_DTYPE)
+        idx = np.repeat(np.arange(len(segments), dtype=np.uint32), [n for _, n in segments.values()])
+        return cls(hour, list(segments), idx, rows["ts"].copy(), rows["speed"].copy(), rows["volume"].copy(), etag)
+
+    def to_bytes(self) -> bytes:
+        """Observations grouped by segment behind a [first row, rows] index (see BufferReader)."""
+        order = np.argsort(self.idx, kind="stable")
+        counts = np.bincount(self.idx, minlength=len(self.names))
+        starts = np.cumsum(counts) - counts
+        index = {name: [int(starts[j]), int(counts[j])] for j, name in enumerate(self.names) if counts[j]}
+        rows = np.zeros(len(order), dtype=OBSERVATION_DTYPE)
+        rows["ts"], rows["speed"], rows["volume"] = self.ts[order], self.speeds[order], self.volumes[order]
+        header = json.dumps({"segments": index}, separators=(",", ":")).encode()
+        return BUFFER_MAGIC + struct.pack("<qQ", self.hour, len(header)) + header + rows.tobytes()
+
+    def extend(self, twin_ids, speeds, volumes, ts: int):
+        idx = np.empty(len(twin_ids), dtype=np.uint32)
+        for i, twin_id in enumerate(twin_ids):
+            j = self.index.get(twin_id)
+            if j is None:
+                j = self.index[twin_id] = len(self.names)
+                self.names.append(twin_id)
+            idx[i] = j
+        self.idx = np.concatenate([self.idx, idx])
+        self.ts = np.concatenate([self.ts, np.full(len(idx), ts, dtype=np.int64)])
+        self.speeds = np.concatenate([self.speeds, np.asarray(speeds, dtype=np.float32)])
+        self.volumes = np.concatenate([self.volumes, np.asarray(volumes, dtype=np.float32)])
+
+    def observations(self):
+        """(twin id per row, observation rows)."""
+        keys = np.array(self.names, dtype=str)[self.idx] if self.names else np.zeros(0, dtype=str)
+        return keys, observe(self.ts, self.speeds, self.volumes)
+
+    def segment(self, twin_id: str) -> np.ndarray:
+        j = self.index.get(twin_id)
+        if j is None:
+            return np.zeros(0, dtype=ROLLUP_DTYPE)
+        mask = self.idx == j
+        return observe(self.ts[mask], self.speeds[mask], self.volumes[mask])
+
+    def rows(self, twin_id: str, lo: int, hi: int) -> np.ndarray:
+        """Observation rows of one segment in [lo, hi)."""
+        if not len(self) or hi <= self.hour:
+            return np.zeros(0, dtype=ROLLUP_DTYPE)
+        rows = self.segment(twin_id)
+        return rows[(rows["bucket"] >= lo) & (rows["bucket"] < hi)]
+
+class BufferReader:
+    """One segment's open-hour rows read from the buffer blob with ranged reads.
+
+    The buffer is rewritten every tick, so caching it per worker saves nothing for
+    readers; this fetches the header and the segment's rows instead of every segment's
+    observations, and nothing past the header when the range ends before the open hour.
+    """
+
+    def __init__(self, blob_service, attempts: int = 3):
+        self.blob_service, self.attempts = blob_service, attempts
+        self.bc = _buffer_blob(blob_service)
+
+    def rows(self, twin_id: str, lo: int, hi: int) -> np.ndarray:
+        from azure.core.exceptions import ResourceModifiedError, ResourceNotFoundError
+        for attempt in range(self.attempts):
+            try:
+                return self._read(twin_id, lo, hi)
+            except ResourceNotFoundError:
+                return np.zeros(0, dtype=ROLLUP_DTYPE)
+            except ResourceModifiedError:
+                # A tick replaced the buffer between the header and the rows
+                count("rollups.buffer_retry")
+        return load_buffer(self.blob_service, force=True).rows(twin_id, lo, hi)
+
+    def _read(self, twin_id: str, lo: int, hi: int) -> np.ndarray:
+        from azure.core import MatchConditions
+        empty = np.zeros(0, dtype=ROLLUP_DTYPE)
+        with dependency("blob.rollups"):
+            downloader = self.bc.download_blob(offset=0, length=INDEX_PROBE)
+            head, etag = downloader.readall(), downloader.properties.etag
+            if head[:8] != BUFFER_MAGIC:
+                return load_buffer(self.blob_service).rows(twin_id, lo, hi)
+            hour, size = struct.unpack("<qQ", head[8:24])
+            if hi <= hour:
+                return empty
+            unchanged = {"etag": etag, "match_condition": MatchConditions.IfNotModified}
+            if len(head) < 24 + size:
+                head += self.bc.download_blob(offset=len(head), length=24 + size - len(head), **unchanged).readall()
+            entry = json.loads(head[24:24 + size])["segments"].get(twin_id)
+            if not entry:
+                return empty
+            start, n = entry
+            offset = 24 + size + start * OBSERVATION_DTYPE.itemsize
+            length = n * OBSERVATION_DTYPE.itemsize
+            if offset + length <= len(head):
+                data = head[offset:offset + length]
+            else:
+                data = self.bc.download_blob(offset=offset, length=length, **unchanged).readall()
+        obs = np.frombuffer(data, dtype=OBSERVATION_DTYPE)
+        rows = observe(obs["ts"], obs["speed"], obs["volume"])
+        return rows[(rows["bucket"] >= lo) & (rows["bucket"] < hi)]
+
+class RollupStore:
+    def __init__(self, blob_service, dataset: str = "traffic", container: str = None, shards: int = None):
+        container = container or os.environ.get("TRAFFIC_HISTORY_CONTAINER", "raw")
+        self.container = blob_service.get_container_client(container)
+        self.dataset = dataset
+        self.shards = shards or int(os.environ.get("ROLLUP_SHARDS", "16"))
+
+    def shard_of(self, twin_id: str) -> int:
+        return zlib.crc32(twin_id.encode("utf-8")) % self.shards
+
+    def _base(self, tier: str, shard: int) -> str:
+        return f"{PREFIX}/{self.dataset}/{tier}/shard-{shard:02d}/"
+
+    def _name(self, tier: str, window: str, shard: int) -> str:
+        return f"{self._base(tier, shard)}{window}.bin"
+
+    def write(self, tier: str, window: str, keys, rows: np.ndarray):
+        """Write one block per shard for `window`; rows grouped by key."""
+        keys = np.asarray(keys)
+        shard = np.array([self.shard_of(k) for k in keys], dtype=np.int64)
+        for s in np.unique(shard):
+            mask = shard == s
+            with dependency("blob.rollups"):
+                self.container.upload_blob(self._name(tier, window, int(s)), encode_block(keys[mask], rows[mask]),
+                                           overwrite=True)
+
+    def _blocks(self, tier: str, lo: int, hi: int, shard: int):
+        """Blocks of `shard` overlapping [lo, hi) as (selected, shadowed).
+
+        A block is shadowed by a compacted block covering its window (compaction
+        writes the coarse block before deleting the fine ones).
+        """
+        base = self._base(tier, shard)
+        level = {"5m": "day", "1h": "month", "1d": "year"}[tier]
+        found = {}
+        for period in _periods(lo, hi, level):
+            with dependency("blob.rollups"):
+                for b in self.container.list_blobs(name_starts_with=f"{base}{period}"):
+                    if b.name.endswith(".bin"):
+                        window = b.name[len(base):-len(".bin")]
+                        start, end = _span(window)
+                        if start < hi and end > lo:
+                            found[window] = (b.name, start, end)
+        selected, shadowed = [], []
+        for window, block in sorted(found.items()):
+            parts = window.split("/")
+            covered = any("/".join(parts[:n]) in found for n in range(2, len(parts)))
+            (shadowed if covered else selected).append(block)
+        return selected, shadowed
+
+    def _read_segment(self, name: str, twin_id: str) -> np.ndarray:
+        bc = self.container.get_blob_client(name)
+        with dependency("blob.rollups"):
+            head = bc.download_blob(offset=0, length=INDEX_PROBE).readall()
+            size = struct.unpack("<Q", head[8:16])[0]
+            if len(head) < 16 + size:
+                head += bc.download_blob(offset=len(head), length=16 + size - len(head)).readall()
+            header = json.loads(head[16:16 + size])
+            if header.get("itemsize") != ROLLUP_DTYPE.itemsize:
+                logging.warning(f"Rollup block {name} has a different row layout; skipping")
+                return np.zeros(0, dtype=ROLLUP_DTYPE)
+            entry = header["segments"].get(twin_id)
+            if not entry:
+                return np.zeros(0, dtype=ROLLUP_DTYPE)
+            start, n = entry
+            offset = 16 + size + start * ROLLUP_DTYPE.itemsize
+            length = n * ROLLUP_DTYPE.itemsize
+            if offset + length <= len(head):
+                data = head[offset:offset + length]
+            else:
+                data = bc.download_blob(offset=offset, length=length).readall()
+        return np.frombuffer(data, dtype=ROLLUP_DTYPE)
+
+    def _read_block(self, name: str):
+        with dependency("blob.rollups"):
+            return decode_block(self.container.download_blob(name).readall())
+
+    def segment_rows(self, twin_id: str, tier: str, lo: int, hi: int, buffer=None) -> np.ndarray:
+        """`tier` buckets for one segment in [lo, hi); unsealed windows come from finer data.
+
+        buffer (a RollupBuffer or a BufferReader) supplies the open hour.
+        """
+        parts, covered = [], []
+        for name, start, end in self._blocks(tier, lo, hi, self.shard_of(twin_id))[0]:
+            parts.append(self._read_segment(name, twin_id))
+            covered.append((start, end))
+        for gap_lo, gap_hi in _gaps(lo, hi, covered):
+            if tier in FINER:
+                parts.append(self.segment_rows(twin_id, FINER[tier], gap_lo, gap_hi, buffer))
+            elif buffer is not None:
+                parts.append(buffer.rows(twin_id, gap_lo, gap_hi))
+        rows = np.concatenate(parts) if parts else np.zeros(0, dtype=ROLLUP_DTYPE)
+        rows = rows[(rows["bucket"] >= lo) & (rows["bucket"] < hi)]
+        return reduce(np.zeros(len(rows), dtype=np.uint8), rows, TIERS[tier])[1]
+
+    def history(self, twin_id: str, start: int, end: int, seconds: int, buffer=None) -> dict:
+        """Points at `seconds` resolution for [start, end), answered from the coarsest tier that tiles it."""
+        tier = choose_tier(seconds)
+        lo, hi = start // seconds * seconds, -(-end // seconds) * seconds
+        rows = self.segment_rows(twin_id, tier, lo, hi, buffer)
+        return {"tier": tier, "points": to_points(rows, seconds)}
+
+    def seal_hour(self, buffer: RollupBuffer):
+        keys, rows = buffer.observations()
+        window = _window(buffer.hour, "hour")
+        for tier in ("5m", "1h"):
+            self.write(tier, window, *reduce(keys, rows, TIERS[tier]))
+
+    def compact(self, tier: str, window: str, source: str = None):
+        """Merge the `source` blocks under `window` into one `tier` block per shard.
+
+        With source == tier (the default) the merged blocks are deleted afterwards;
+        otherwise the result is derived (1d from 1h) and the sources are kept.
+        """
+        source = source or tier
+        lo, hi = _span(window)
+        for shard in range(self.shards):
+            target = self._name(tier, window, shard)
+            selected, shadowed = self._blocks(source, lo, hi, shard)
+            if source == tier and any(name == target for name, _, _ in selected):
+                stale = [b for b in selected if b[0] != target] + shadowed  # left by an interrupted compaction
+            else:
+                if not selected:
+                    continue
+                blocks = [self._read_block(name) for name, _, _ in selected]
+                keys = np.concatenate([k for k, _ in blocks])
+                rows = np.concatenate([r for _, r in blocks])
+                self.write(tier, window, *reduce(keys, rows, TIERS[tier]))
+                stale = selected + shadowed if source == tier else []
+            for name, _, _ in stale:
+                with dependency("blob.rollups"):
+                    self.container.delete_blob(name)
+
+    def close_hour(self, buffer: RollupBuffer, next_hour: int):
+        """Seal the buffer's hour and compact any day/month the next tick has moved past.
+
+        The compaction runs on the boundary alone: an hour with no observations
+        still closes its day, whose earlier hours were sealed.
+        """
+        if len(buffer):
+            self.seal_hour(buffer)
+        if _window(next_hour, "day") != _window(buffer.hour, "day"):
+            day = _window(buffer.hour, "day")
+            self.compact("5m", day)
+            self.compact("1h", day)
+            self.compact("1d", day, source="1h")
+        if _window(next_hour, "month") != _window(buffer.hour, "month"):
+            month = _window(buffer.hour, "month")
+            self.compact("1h", month)
+            self.compact("1d", month)
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+def _buffer_blob(blob_service):
+    container = os.environ.get("TRAFFIC_HISTORY_CONTAINER", "raw")
+    name = os.environ.get("ROLLUP_BUFFER_BLOB", "state/rollup_buffer.npz")
+    return blob_service.get_blob_client(container=container, blob=name)
+
+def load_buffer(blob_service, force: bool = False) -> RollupBuffer:
+    """Per-worker copy of the open-hour buffer, revalidated against the blob ETag."""
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceNotModifiedError, ResourceNotFoundError
+    global _buffer
+    with _buffer_lock:
+        bc = _buffer_blob(blob_service)
+        try:
+            with dependency("blob.rollups"):
+                if _buffer is not None and _buffer.etag and not force:
+                    downloader = bc.download_blob(etag=_buffer.etag, match_condition=MatchConditions.IfModified)
+                else:
+                    downloader = bc.download_blob()
+                data = downloader.readall()
+            _buffer = RollupBuffer.from_bytes(data, etag=downloader.properties.etag)
+        except ResourceNotModifiedError:
+            pass
+        except ResourceNotFoundError:
+            _buffer = RollupBuffer()
+        return _buffer
+
+def commit_rollups(blob_service, twin_ids, speeds, volumes, ts: int, store: RollupStore = None) -> RollupBuffer:
+    """Fold one tick into the buffer, sealing/compacting first if the tick starts a new hour."""
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+    global _buffer
+    store = store or RollupStore(blob_service)
+    buffer = load_buffer(blob_service)
+    hour = ts // 3600 * 3600
+    if buffer.hour is not None and hour < buffer.hour:
+        logging.warning(f"Dropping {len(twin_ids)} rollup observations older than the open hour")
+        count("rollups.late", len(twin_ids))
+        return buffer
+    if buffer.hour is not None and hour > buffer.hour:
+        # Block names are deterministic, so if saving the buffer fails below the
+        # next tick simply seals the same hour again.
+        store.close_hour(buffer, hour)
+    if buffer.hour != hour:
+        buffer = RollupBuffer(hour, etag=buffer.etag)
+    buffer.extend(twin_ids, speeds, volumes, ts)
+    bc = _buffer_blob(blob_service)
+    try:
+        with dependency("blob.rollups"):
+            if buffer.etag:
+                result = bc.upload_blob(buffer.to_bytes(), overwrite=True, etag=buffer.etag,
+                                        match_condition=MatchConditions.IfNotModified)
+            else:
+                result = bc.upload_blob(buffer.to_bytes(), overwrite=False)
+        buffer.etag = result.get("etag")
+        with _buffer_lock:
+            _buffer = buffer
+    except (ResourceModifiedError, ResourceExistsError):
+        logging.warning("Rollup buffer changed concurrently; dropping this tick")
+        reset_rollups()
+    except Exception as e:
+        logging.warning(f"Failed to save rollup buffer: {e}")
+        reset_rollups()
+    return buffer
+
+def reset_rollups():
+    global _buffer
+    with _buffer_lock:
+        _buffer = None
@@ -0,0 +1,394 @@
+import os, json, gzip, time, uuid, zlib, logging, contextvars
+from concurrent.futures import ThreadPoolExecutor
+from shared import get_segment_model, dependency, span, count
+from patching import PatchDispatcher, chain, merge_ops
+from delta import get_delta_cache
+
+# Sharded fan-out of ADT writes through a Storage Queue.
+#
+# With INGEST_SHARDS set, the ingest timers swap their PatchDispatcher for a
+# ShardedDispatcher: patches are still coalesced per twin, then grouped by a
+# stable hash of the twin id into shards and enqueued as gzip'd JSON messages.
+# The apply_shard queue trigger applies each message with its own
+# PatchDispatcher (delta filtering and the read model happen there), so the
+# writes spread over every instance the host scales out to. Everything that
+# needs the whole tick (history archive, feature store, anomaly scoring,
+# incident state) stays in the timer.
+#
+# Delivery is at least once. Each message carries an idempotency key
+# (source:run:shard:seq); workers record the keys they finish in a per-shard
+# progress blob and skip redeliveries. For sources whose runs are full
+# snapshots (traffic), a message from a run older than the one its shard has
+# already applied is dropped as stale, so a late redelivery cannot roll a twin
+# back. Incident messages are not dropped by run, since a later run does not
+# repeat an earlier clear of another twin. For every source the shard also
+# keeps each twin's last-applied run timestamp, and a patch from an older run
+# is dropped for that twin, so a redelivered "active" can't reopen an incident
+# a newer run already cleared.
+#
+# A message whose writes fail (errors, or throttling past the retries) raises
+# after the successful twins are written, so the queue redelivers it and its
+# key is only recorded once every write has landed; twins that do not exist are
+# final and only counted. For incident sources the failed twins are also kept in
+# unwritten.json until a later write succeeds, so the timer, which only sees
+# its messages enqueued, re-sends their incidents (see unwritten_twins()).
+#
+# Per-shard progress is kept in TRAFFIC_HISTORY_CONTAINER under
+# state/shards/<source>/ (run.json: messages sent per shard for the latest
+# run; shard-<n>.json: keys applied and write totals; twins-<n>.json: run ts
+# last applied per twin; unwritten.json: run ts of each twin whose write
+# failed) and summarised by shard_progress() and the
+# get_ingest_progress endpoint.
+#
+# Environment variables:
+# INGEST_SHARDS - number of shards; 0 keeps all writes inside the timer (default: 0)
+# SHARD_MESSAGE_MAX_BYTES - compressed size limit per message (default: 48000, under the 64 KiB
+#                           queue limit once Base64 encoded)
+# SHARD_SEND_CONCURRENCY - concurrent queue sends per flush (default: 8)
+
+SHARD_QUEUE = "ingest-shards"  # must match apply_shard/function.json
+DEFAULT_MAX_MESSAGE_BYTES = 48000
+RAW_CHUNK_BYTES = 512 * 1024
+SAVE_RETRIES = 5
+
+def ingest_shards() -> int:
+    return int(os.environ.get("INGEST_SHARDS", 0))
+
+def shard_of(twin_id: str, shards: int) -> int:
+    """Stable across processes (unlike hash())."""
+    return zlib.crc32(twin_id.encode()) % shards
+
+def encode_message(message: dict) -> bytes:
+    return gzip.compress(json.dumps(message, separators=(",", ":")).encode(), compresslevel=6)
+
+def decode_message(body) -> dict:
+    if isinstance(body, str):
+        body = body.encode()
+    if body[:2] == b"\x1f\x8b":
+        body = gzip.decompress(body)
+    return json.loads(body)
+
+def message_key(message: dict) -> str:
+    return f"{message['source']}:{message['run']}:{message['shard']}:{message['seq']}"
+
+def _state_blob(blob_service, source: str, name: str):
+    container = os.environ.get("TRAFFIC_HISTORY_CONTAINER", "raw")
+    return blob_service.get_blob_client(container=container, blob=f"state/shards/{source}/{name}")
+
+def _read_json(bc):
+    """(document, etag); ({}, None) when the blob does not exist yet."""
+    from azure.core.exceptions import ResourceNotFoundError
+    try:
+        downloader = bc.download_blob()
+        return json.loads(downloader.readall()), downloader.properties.etag
+    except ResourceNotFoundError:
+        return {}, None
+
+def _update_json(bc, apply, label: str) -> dict:
+    """Read-modify-write with ETag conditions, re-running apply(doc) when another worker got there first."""
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+    for attempt in range(SAVE_RETRIES):
+        doc, etag = _read_json(bc)
+        if apply(doc) is False:
+            return doc
+        body = json.dumps(doc, separators=(",", ":"))
+        try:
+            with dependency("blob.shard_state"):
+                if etag:
+                    bc.upload_blob(body, overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified)
+                else:
+                    bc.upload_blob(body, overwrite=False)
+            return doc
+        except (ResourceModifiedError, ResourceExistsError):
+            continue
+    logging.warning(f"Gave up updating {label} after {SAVE_RETRIES} concurrent updates")
+    return doc
+
+class ShardedDispatcher:
+    """PatchDispatcher stand-in that enqueues coalesced patches by twin shard instead of writing them.
+
+    flush() returns the same summary keys as PatchDispatcher.flush() ("updated"
+    stays 0, the writes happen in apply_shard) plus queued/messages/shards.
+    on_written(twin_id, ops) is called once a twin's patch is safely on the queue.
+    """
+
+    def __init__(self, queue, blob_service, source: str, shards: int, supersedes: bool = True,
+                 max_message_bytes: int = None, concurrency: int = None, ts: int = None, on_written=None):
+        self.queue, self.blob_service, self.source = queue, blob_service, source
+        self.on_written = on_written
+        self.shards = max(1, shards)
+        self.supersedes = supersedes
+        self.max_message_bytes = max_message_bytes or int(
+            os.environ.get("SHARD_MESSAGE_MAX_BYTES", DEFAULT_MAX_MESSAGE_BYTES))
+        self.concurrency = concurrency or int(os.environ.get("SHARD_SEND_CONCURRENCY", 8))
+        self.ts = ts if ts is not None else int(time.time())
+        self.run_id = f"{self.ts}-{uuid.uuid4().hex[:8]}"
+        self.submitted = 0
+        self._patches = {}
+        self._seq = [0] * self.shards
+        self._sent = [0] * self.shards
+
+    def submit(self, twin_id: str, ops: list):
+        if not twin_id or not ops:
+            return
+        self.submitted += 1
+        merge_ops(self._patches.setdefault(twin_id, {}), ops)
+
+    def pending(self) -> int:
+        return len(self._patches)
+
+    def _messages(self, shard: int, items: list):
+        """Yield (body, items) per message, splitting chunks whose compressed body is over the size limit."""
+        def message(chunk):
+            self._seq[shard] += 1
+            msg = {"v": 1, "source": self.source, "run": self.run_id, "ts": self.ts, "shard": shard,
+                   "seq": self._seq[shard], "supersedes": self.supersedes, "patches": chunk}
+            msg["key"] = message_key(msg)
+            return msg
+
+        def pack(chunk):
+            body = encode_message(message(chunk))
+            if len(body) <= self.max_message_bytes:
+                yield body, chunk
+            elif len(chunk) > 1:
+                self._seq[shard] -= 1
+                yield from pack(chunk[:len(chunk) // 2])
+                yield from pack(chunk[len(chunk) // 2:])
+            else:
+                self._seq[shard] -= 1
+                logging.error(f"Patch for {chunk[0][0]} exceeds the queue message limit; dropped")
+
+        chunk, size = [], 0
+        for item in items:
+            chunk.append(item)
+            size += len(item[0]) + sum(len(str(op)) for op in item[1])
+            if size >= RAW_CHUNK_BYTES:
+                yield from pack(chunk)
+                chunk, size = [], 0
+        if chunk:
+            yield from pack(chunk)
+
+    def flush(self) -> dict:
+        patches, self._patches = self._patches, {}
+        stats = {"submitted": self.submitted, "requests": 0, "updated": 0, "failed": 0, "not_found": 0,
+                 "throttled": 0, "retries": 0, "queued": 0, "messages": 0, "shards": self.shards}
+        self.submitted = 0
+        start = time.perf_counter()
+        by_shard = {}
+        for twin_id, ops in patches.items():
+            by_shard.setdefault(shard_of(twin_id, self.shards), []).append([twin_id, list(ops.values())])
+
+        def send(shard, body, chunk):
+            try:
+                with dependency("queue.send"):
+                    self.queue.send_message(body)
+                return shard, chunk, True
+            except Exception as e:
+                logging.error(f"Failed to enqueue {self.source} shard {shard}: {e}")
+                return shard, chunk, False
+
+        with span("enqueue"), ThreadPoolExecutor(max_workers=self.concurrency) as pool:
+            futures = []
+            for shard, items in sorted(by_shard.items()):
+                for body, chunk in self._messages(shard, items):
+                    futures.append(pool.submit(contextvars.copy_context().run, send, shard, body, chunk))
+            for future in futures:
+                shard, chunk, ok = future.result()
+                if ok:
+                    self._sent[shard] += 1
+                    stats["messages"] += 1
+                    stats["queued"] += len(chunk)
+                    if self.on_written:
+                        for twin_id, ops in chunk:
+                            self.on_written(twin_id, ops)
+                else:
+                    stats["failed"] += len(chunk)
+        stats["requests"] = stats["messages"]
+        if patches:
+            self._write_manifest()
+        wall = time.perf_counter() - start
+        stats["elapsed_s"] = round(wall, 3)
+        stats["per_sec"] = round(stats["queued"] / wall, 1) if wall > 0 else 0.0
+        count("shard.messages", stats["messages"])
+        count("shard.queued", stats["queued"])
+        logging.info(f"{self.source} fan-out: run={self.run_id} shards={self.shards} messages={stats['messages']} "
+                     f"patches={stats['queued']} failed={stats['failed']} in {stats['elapsed_s']}s")
+        return stats
+
+    def _write_manifest(self):
+        manifest = {"run": self.run_id, "ts": self.ts, "shards": self.shards, "messages": list(self._sent)}
+        try:
+            with dependency("blob.shard_state"):
+                _state_blob(self.blob_service, self.source, "run.json").upload_blob(
+                    json.dumps(manifest, separators=(",", ":")), overwrite=True)
+        except Exception as e:
+            logging.warning(f"Failed to write {self.source} shard manifest: {e}")
+
+def _claim_twins(blob_service, message: dict) -> list:
+    """Record the message's run as last applied for its twins; returns the patches not superseded by a newer run."""
+    fresh = []
+
+    def claim(doc):
+        fresh.clear()
+        changed = False
+        for twin_id, ops in message["patches"]:
+            applied = doc.get(twin_id, 0)
+            if applied > message["ts"]:
+                continue
+            fresh.append((twin_id, ops))
+            if applied != message["ts"]:
+                doc[twin_id] = message["ts"]
+                changed = True
+        return changed
+    _update_json(_state_blob(blob_service, message["source"], f"twins-{message['shard']}.json"), claim,
+                 f"{message['source']} shard {message['shard']} twins")
+    return fresh
+
+class ShardWriteError(RuntimeError):
+    """Raised when some of a shard message's writes failed, so the queue redelivers it."""
+
+def unwritten_twins(blob_service, source: str) -> dict:
+    """{twin_id: run ts} of twins whose shard write failed and has not succeeded since."""
+    doc, _ = _read_json(_state_blob(blob_service, source, "unwritten.json"))
+    return doc
+
+def _note_unwritten(blob_service, message: dict, written, failed):
+    def update(doc):
+        changed = False
+        for twin_id in written:
+            if twin_id in doc and doc[twin_id] <= message["ts"]:
+                del doc[twin_id]
+                changed = True
+        for twin_id in failed:
+            if doc.get(twin_id, 0) < message["ts"]:
+                doc[twin_id] = message["ts"]
+                changed = True
+        return changed
+    bc = _state_blob(blob_service, message["source"], "unwritten.json")
+    if failed or any(t in unwritten_twins(blob_service, message["source"]) for t in written):
+        _update_json(bc, update, f"{message['source']} unwritten twins")
+
+def apply_shard_message(adt, blob_service, body) -> dict:
+    """Apply one shard message; returns {"status": "applied" | "duplicate" | "stale", ...}.
+
+    Raises ShardWriteError when writes failed, after recording them (see above).
+    """
+    message = decode_message(body)
+    key, source, shard, seq = message["key"], message["source"], message["shard"], message["seq"]
+    bc = _state_blob(blob_service, source, f"shard-{shard}.json")
+    progress, _ = _read_json(bc)
+    if progress.get("run") == message["run"] and seq in progress.get("done", []):
+        logging.info(f"Shard message {key} already applied; skipping redelivery")
+        count("shard.duplicate")
+        return {"status": "duplicate", "key": key}
+
+    def note_stale(doc):
+        doc["stale"] = doc.get("stale", 0) + 1
+    if message.get("supersedes") and progress.get("ts", 0) > message["ts"]:
+        logging.info(f"Shard message {key} is older than run {progress.get('run')}; skipping")
+        count("shard.stale")
+        _update_json(bc, note_stale, f"{source} shard {shard}")
+        return {"status": "stale", "key": key}
+    patches = _claim_twins(blob_service, message)
+    if len(patches) < len(message["patches"]):
+        logging.info(f"Shard message {key}: {len(message['patches']) - len(patches)} twins already written "
+                     f"by a newer run; skipped")
+        count("shard.stale_twins", len(message["patches"]) - len(patches))
+    if not patches:
+        _update_json(bc, note_stale, f"{source} shard {shard}")
+        return {"status": "stale", "key": key}
+
+    delta = get_delta_cache(blob_service)
+    submitted, written, missing = set(), set(), set()
+    dispatcher = PatchDispatcher(adt, label=f"{source} shard {shard}",
+                                 on_written=chain(delta.commit, get_segment_model().apply_patch,
+                                                  lambda twin_id, ops: written.add(twin_id)),
+                                 on_not_found=lambda twin_id, ops: missing.add(twin_id))
+    for twin_id, ops in patches:
+        ops = delta.filter(twin_id, ops)
+        if ops:
+            submitted.add(twin_id)
+        dispatcher.submit(twin_id, ops)
+    summary = dispatcher.flush()
+    failed = submitted - written - missing
+    if not message.get("supersedes"):
+        # Snapshot sources resend every twin next tick; the others need the failures remembered
+        _note_unwritten(blob_service, message, written | missing, failed)
+    if failed:
+        count("shard.write_failed", len(failed))
+        raise ShardWriteError(f"Shard message {key}: {len(failed)} of {len(submitted)} writes failed; "
+                              f"returning it to the queue")
+
+    def record(doc):
+        if doc.get("run") != message["run"]:
+            if doc.get("ts", 0) > message["ts"]:
+                # A newer run started on this shard while this message was applied
+                doc["late"] = doc.get("late", 0) + 1
+                return
+            doc.clear()
+            doc.update({"run": message["run"], "ts": message["ts"], "done": [],
+                        "patches": 0, "updated": 0, "failed": 0, "throttled": 0})
+        if seq in doc["done"]:
+            return False
+        doc["done"].append(seq)
+        doc["patches"] += len(message["patches"])
+        doc["updated"] += summary["updated"]
+        doc["failed"] += summary["failed"] + summary["not_found"]
+        doc["throttled"] += summary["throttled"]
+        doc["updatedAt"] = int(time.time())
+    _update_json(bc, record, f"{source} shard {shard}")
+    return {"status": "applied", "key": key, **summary}
+
+def shard_progress(blob_service, source: str) -> dict:
+    """Latest run's per-shard progress: messages sent vs applied, and write totals."""
+    manifest, _ = _read_json(_state_blob(blob_service, source, "run.json"))
+    if not manifest:
+        return {"source": source, "run": None, "shards": [], "complete": 0, "total": 0}
+    shards = []
+    for shard, expected in enumerate(manifest["messages"]):
+        doc, _ = _read_json(_state_blob(blob_service, source, f"shard-{shard}.json")) if expected else ({}, None)
+        current = doc.get("run") == manifest["run"]
+        done = len(doc.get("done", [])) if current else 0
+        shards.append({
+            "shard": shard, "expected": expected, "applied": done, "complete": done >= expected,
+            "updated": doc.get("updated", 0) if current else 0, "failed": doc.get("failed", 0) if current else 0,
+            "throttled": doc.get("throttled", 0) if current else 0,
+            "lagSeconds": (doc["updatedAt"] - manifest["ts"]) if current and "updatedAt" in doc else None,
+        })
+    complete = sum(1 for s in shards if s["complete"])
+    return {"source": source, "run": manifest["run"], "ts": manifest["ts"], "shards": shards,
+            "complete": complete, "total": len(shards)}
+
+def report_previous_run(blob_service, source: str):
+    """Log how far the previous fan-out got before starting the next one."""
+    try:
+        progress = shard_progress(blob_service, source)
+    except Exception as e:
+        logging.warning(f"Shard progress unavailable: {e}")
+        return None
+    if progress["run"]:
+        incomplete = progress["total"] - progress["complete"]
+        count("shard.incomplete", incomplete)
+        level = logging.warning if incomplete else logging.info
+        level(f"Previous {source} run {progress['run']}: {progress['complete']}/{progress['total']} shards applied")
+    return progress
+
+def drain(queue, adt, blob_service, max_messages: int = None, batch: int = 16, visibility_timeout: int = 60) -> dict:
+    """Run the apply_shard worker loop in-process until the queue is empty (local runs and tests)."""
+    totals = {"applied": 0, "duplicate": 0, "stale": 0, "failed": 0}
+    handled = 0
+    while max_messages is None or handled < max_messages:
+        messages = list(queue.receive_messages(max_messages=batch, visibility_timeout=visibility_timeout))
+        if not messages:
+            break
+        for msg in messages:
+            try:
+                result = apply_shard_message(adt, blob_service, msg.content)
+                totals[result["status"]] += 1
+                queue.delete_message(msg)
+            except Exception as e:
+                logging.error(f"Shard message {msg.id} failed: {e}")
+                totals["failed"] += 1
+            handled += 1
+    return totals
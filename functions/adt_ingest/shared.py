@@ -1,60 +1,772 @@
-import os, io, csv, logging
-from azure.identity import DefaultAzureCredential
-from azure.digitaltwins.core import DigitalTwinsClient
-from azure.storage.blob import BlobServiceClient
-import pandas as pd
+import os, io, csv, json, time, zlib, bisect, logging, importlib, threading, functools, contextlib, contextvars
+from collections import deque
+
+# The Azure SDKs and pandas are imported on first use, not at module load, so
+# HTTP functions that never reach them (ping, get_segment, ...) cold-start
+# without paying for them. The SDK classes stay reachable as module attributes
+# (shared.BlobServiceClient) through __getattr__; benchmarks/bench_import_time.py
+# measures the import cost per function.
+_LAZY = {
+    "DefaultAzureCredential": ("azure.identity", "DefaultAzureCredential"),
+    "DigitalTwinsClient": ("azure.digitaltwins.core", "DigitalTwinsClient"),
+    "BlobServiceClient": ("azure.storage.blob", "BlobServiceClient"),
+}
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    module_name, attr = _LAZY[name]
+    value = getattr(importlib.import_module(module_name), attr)
+    globals()[name] = value
+    return value
+
+def _lazy(name):
+    """Module attribute from _LAZY (or whatever replaced it, e.g. in tests)."""
+    return globals()[name] if name in globals() else __getattr__(name)
+
+# Process-wide client registry. Azure Functions reuses the Python worker across
+# invocations, so credentials (and their token caches) and SDK clients (and their
+# HTTP connection pools) are built once per worker and shared by every handler.
+_registry = {}
+_registry_lock = threading.RLock()
+_ensured_containers = set()
+_client_stats = {"cold": 0, "warm": 0, "containers_ensured": 0}
+
+DEFAULT_CONTAINERS = [
+    ("SEGMENT_MAP_CONTAINER", "raw"),
+    ("TRAFFIC_HISTORY_CONTAINER", "raw"),
+    ("PREDICTION_CONTAINER", "predictions"),
+]
+
+def _get_or_create(key, factory):
+    client = _registry.get(key)
+    if client is not None:
+        with _registry_lock:
+            _client_stats["warm"] += 1
+        return client
+    with _registry_lock:
+        client = _registry.get(key)
+        if client is not None:
+            _client_stats["warm"] += 1
+            return client
+        client = factory()
+        _registry[key] = client
+        _client_stats["cold"] += 1
+        return client
+
+# Environment variables:
+# ADT_BACKEND / BLOB_BACKEND / QUEUE_BACKEND - "local" swaps in the stand-ins from
+#                                             local_backends.py (default: azure)
+
+def get_credential():
+    return _get_or_create(("credential",), _lazy("DefaultAzureCredential"))
+
+def get_adt_client():
+    if os.environ.get("ADT_BACKEND", "azure").lower() == "local":
+        from local_backends import LocalDigitalTwinsClient
+        return _get_or_create(("adt", "local"), LocalDigitalTwinsClient.from_env)
+    endpoint = os.environ["ADT_ENDPOINT"]
+    return _get_or_create(("adt", endpoint), lambda: _lazy("DigitalTwinsClient")(endpoint, get_credential()))
+
+def get_blob_service():
+    # Prefer explicit storage connection string if provided (easier local dev)
+    conn = os.environ.get("STORAGE_CONNECTION_STRING")
+    if os.environ.get("BLOB_BACKEND", "azure").lower() == "local":
+        from local_backends import LocalBlobServiceClient
+        root = os.environ.get("LOCAL_BLOB_ROOT", ".local_blobs")
+        blob = _get_or_create(("blob", "local", root), LocalBlobServiceClient.from_env)
+    elif conn:
+        blob = _get_or_create(("blob", conn), lambda: _lazy("BlobServiceClient").from_connection_string(conn))
+    else:
+        sa = os.environ["STORAGE_ACCOUNT_NAME"]
+        blob = _get_or_create(
+            ("blob", sa),
+            lambda: _lazy("BlobServiceClient")(f"https://{sa}.blob.core.windows.net", credential=get_credential()),
+        )
+    # Proactively ensure common containers exist (once per process)
+    for env_var, default in DEFAULT_CONTAINERS:
+        ensure_container(blob, os.environ.get(env_var, default))
+    return blob
+
+def get_queue_client(name: str):
+    """Storage Queue client sending and receiving raw bytes (Base64 on the wire, as queue triggers expect).
+
+    Uses the AzureWebJobsStorage account, the one queue triggers listen on. The
+    queue is created once per process.
+    """
+    if os.environ.get("QUEUE_BACKEND", "azure").lower() == "local":
+        from local_backends import LocalQueueClient
+        root = os.environ.get("LOCAL_QUEUE_ROOT", ".local_queues")
+        factory, key = (lambda: LocalQueueClient.from_env(name)), ("queue", "local", root, name)
+    else:
+        from azure.storage.queue import QueueClient, BinaryBase64EncodePolicy, BinaryBase64DecodePolicy
+        policies = {"message_encode_policy": BinaryBase64EncodePolicy(),
+                    "message_decode_policy": BinaryBase64DecodePolicy()}
+        conn = os.environ.get("AzureWebJobsStorage") or os.environ.get("STORAGE_CONNECTION_STRING")
+        if conn:
+            factory, key = (lambda: QueueClient.from_connection_string(conn, name, **policies)), ("queue", conn, name)
+        else:
+            sa = os.environ["STORAGE_ACCOUNT_NAME"]
+            factory = lambda: QueueClient(f"https://{sa}.queue.core.windows.net", name,
+                                          credential=get_credential(), **policies)
+            key = ("queue", sa, name)
+    queue = _get_or_create(key, factory)
+    ensure_queue(queue)
+    return queue
+
+def ensure_queue(queue):
+    key = (id(queue), "queue")
+    if key in _ensured_containers:
+        return
+    try:
+        queue.create_queue()
+    except Exception:
+        # Exists or cannot create with current permissions; ignore
+        pass
+    with _registry_lock:
+        _ensured_containers.add(key)
 
 def ensure_container(blob_service, name: str):
+    key = (id(blob_service), name)
+    if key in _ensured_containers:
+        return
     try:
         blob_service.create_container(name)
     except Exception:
         # Exists or cannot create with current permissions; ignore
         pass
+    with _registry_lock:
+        _ensured_containers.add(key)
+        _client_stats["containers_ensured"] += 1
 
 def get_clients():
-    cred = DefaultAzureCredential()
-    adt = DigitalTwinsClient(os.environ["ADT_ENDPOINT"], cred)
-    # Prefer explicit storage connection string if provided (easier local dev)
-    conn = os.environ.get("STORAGE_CONNECTION_STRING")
-    if conn:
-        blob = BlobServiceClient.from_connection_string(conn)
+    return get_adt_client(), get_blob_service()
+
+def client_stats() -> dict:
+    """Snapshot of registry counters: cold (constructed) vs warm (reused) acquisitions."""
+    with _registry_lock:
+        return dict(_client_stats, cached=len(_registry))
+
+def reset_clients():
+    """Drop all cached clients, e.g. after credential rotation or between tests."""
+    global _segment_model, _segment_map
+    with _registry_lock:
+        _segment_model = None
+        _segment_map = None
+        _registry.clear()
+        _ensured_containers.clear()
+        for k in _client_stats:
+            _client_stats[k] = 0
+        for k in _segment_map_stats:
+            _segment_map_stats[k] = 0
+
+# Instrumentation: spans, counters and dependency latency histograms per invocation.
+#
+# Functions are wrapped with @traced(name); inside a run, span(stage) times a
+# stage, dependency(name) times an ADT/blob/HTTP call and also feeds that
+# dependency's latency histogram, and count(name) bumps a counter. Each run is
+# aggregated into a summary (span totals, counters, p50/p99 per dependency) that
+# the active exporter receives when the function returns. Worker threads see the
+# run when submitted with contextvars.copy_context() (PatchDispatcher does).
+#
+# Environment variables:
+# TELEMETRY_EXPORTER - "otel" (OpenTelemetry -> Azure Monitor via APPLICATIONINSIGHTS_CONNECTION_STRING,
+#                      needs azure-monitor-opentelemetry), "json" (one summary line per run) or "none"
+#                      (default: otel when the connection string is set, otherwise json)
+# TELEMETRY_JSON_PATH - append JSON summaries to this file instead of logging them
+
+_current_run = contextvars.ContextVar("telemetry_run", default=None)
+_exporter = None
+_exporter_lock = threading.Lock()
+
+def latency_summary(latencies) -> dict:
+    if not latencies:
+        return {"p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+    ordered = sorted(latencies)
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))] * 1000, 1)
+    return {"p50_ms": pct(0.50), "p99_ms": pct(0.99), "max_ms": round(ordered[-1] * 1000, 1)}
+
+class RunMetrics:
+    """Aggregates one function invocation; safe to update from worker threads."""
+
+    def __init__(self, function: str):
+        self.function = function
+        self.started = time.time()
+        self.spans = {}      # name -> [count, total seconds, max seconds]
+        self.counters = {}
+        self.latencies = {}  # dependency -> [seconds]
+        self._lock = threading.Lock()
+
+    def add_span(self, name: str, seconds: float):
+        with self._lock:
+            agg = self.spans.setdefault(name, [0, 0.0, 0.0])
+            agg[0] += 1
+            agg[1] += seconds
+            agg[2] = max(agg[2], seconds)
+
+    def add(self, name: str, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, seconds: float):
+        with self._lock:
+            self.latencies.setdefault(name, []).append(seconds)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "function": self.function,
+                "ts": int(self.started),
+                "duration_ms": round((time.time() - self.started) * 1000, 1),
+                "spans": {k: {"count": c, "total_ms": round(t * 1000, 1), "max_ms": round(m * 1000, 1)}
+                          for k, (c, t, m) in self.spans.items()},
+                "counters": dict(self.counters),
+                "dependencies": {k: dict(latency_summary(v), count=len(v)) for k, v in self.latencies.items()},
+            }
+
+class NoopExporter:
+    def span(self, name: str, attrs: dict):
+        return contextlib.nullcontext()
+
+    def count(self, name: str, value, attrs: dict):
+        pass
+
+    def observe(self, name: str, seconds: float, attrs: dict):
+        pass
+
+    def export(self, summary: dict):
+        pass
+
+class JsonExporter(NoopExporter):
+    """Writes each run summary as one JSON line (to path, else the log) and keeps the latest in memory."""
+
+    def __init__(self, path: str = None, keep: int = 20):
+        self.path = path
+        self.runs = deque(maxlen=keep)
+        self._lock = threading.Lock()
+
+    def export(self, summary: dict):
+        line = json.dumps(summary, separators=(",", ":"))
+        with self._lock:
+            self.runs.append(summary)
+            if self.path:
+                with open(self.path, "a") as f:
+                    f.write(line + "\n")
+                return
+        logging.info(f"telemetry {line}")
+
+class OpenTelemetryExporter(NoopExporter):
+    """Live spans, counters and millisecond histograms through the Azure Monitor OpenTelemetry distro."""
+
+    def __init__(self, connection_string: str):
+        from azure.monitor.opentelemetry import configure_azure_monitor
+        from opentelemetry import trace, metrics
+        configure_azure_monitor(connection_string=connection_string)
+        self.tracer = trace.get_tracer("adt_ingest")
+        self.meter = metrics.get_meter("adt_ingest")
+        self._instruments = {}
+        self._lock = threading.Lock()
+
+    def _instrument(self, kind: str, name: str):
+        key = (kind, name)
+        inst = self._instruments.get(key)
+        if inst is None:
+            with self._lock:
+                inst = self._instruments.get(key)
+                if inst is None:
+                    if kind == "counter":
+                        inst = self.meter.create_counter(name)
+                    else:
+                        inst = self.meter.create_histogram(name, unit="ms")
+                    self._instruments[key] = inst
+        return inst
+
+    def span(self, name: str, attrs: dict):
+        return self.tracer.start_as_current_span(name, attributes=attrs or None)
+
+    def count(self, name: str, value, attrs: dict):
+        self._instrument("counter", name).add(value, attrs or None)
+
+    def observe(self, name: str, seconds: float, attrs: dict):
+        self._instrument("histogram", name).record(seconds * 1000, attrs or None)
+
+def get_exporter():
+    global _exporter
+    if _exporter is not None:
+        return _exporter
+    with _exporter_lock:
+        if _exporter is None:
+            conn = os.environ.get("APPLICATIONINSIGHTS_CONNECTION_STRING")
+            kind = os.environ.get("TELEMETRY_EXPORTER") or ("otel" if conn else "json")
+            exporter = None
+            if kind == "otel" and conn:
+                try:
+                    exporter = OpenTelemetryExporter(conn)
+                except Exception as e:
+                    logging.warning(f"OpenTelemetry exporter unavailable ({e}); using JSON summaries")
+                    kind = "json"
+            if exporter is None:
+                exporter = JsonExporter(os.environ.get("TELEMETRY_JSON_PATH")) if kind in ("json", "otel") else NoopExporter()
+            _exporter = exporter
+        return _exporter
+
+def set_exporter(exporter):
+    """Install an exporter (None re-reads the environment on next use)."""
+    global _exporter
+    with _exporter_lock:
+        _exporter = exporter
+
+def current_run():
+    return _current_run.get()
+
+@contextlib.contextmanager
+def span(name: str, **attrs):
+    run = _current_run.get()
+    start = time.perf_counter()
+    try:
+        with get_exporter().span(name, attrs):
+            yield
+    finally:
+        if run is not None:
+            run.add_span(name, time.perf_counter() - start)
+
+@contextlib.contextmanager
+def dependency(name: str, **attrs):
+    """Time one outbound call (e.g. "adt.patch", "blob.download") into its latency histogram."""
+    start = time.perf_counter()
+    try:
+        with get_exporter().span(name, attrs):
+            yield
+    finally:
+        observe(name, time.perf_counter() - start, **attrs)
+
+def observe(name: str, seconds: float, **attrs):
+    run = _current_run.get()
+    if run is not None:
+        run.observe(name, seconds)
+    get_exporter().observe(name, seconds, attrs)
+
+def count(name: str, value=1, **attrs):
+    run = _current_run.get()
+    if run is not None:
+        run.add(name, value)
+    get_exporter().count(name, value, attrs)
+
+def timed_iter(name: str, iterable):
+    """Pass items through, recording the time spent waiting on the source as one span."""
+    run = _current_run.get()
+    total = 0.0
+    it = iter(iterable)
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                total += time.perf_counter() - start
+            yield item
+    finally:
+        if run is not None:
+            run.add_span(name, total)
+
+def traced(function: str):
+    """Decorator for a function entry point: collects one RunMetrics and exports it on return."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def inner(*args, **kwargs):
+            run = RunMetrics(function)
+            token = _current_run.set(run)
+            try:
+                with span(function):
+                    return fn(*args, **kwargs)
+            except Exception:
+                run.add("errors")
+                raise
+            finally:
+                _current_run.reset(token)
+                try:
+                    get_exporter().export(run.summary())
+                except Exception as e:
+                    logging.warning(f"Telemetry export failed: {e}")
+        return inner
+    return wrap
+
+# Materialized read model of RoadSegment twins for the HTTP read endpoints.
+#
+# Environment variables:
+# SEGMENT_CACHE_TTL_SECONDS - full ADT refresh interval (default: 60; 0 disables caching)
+
+SEGMENT_MODEL_ID = "dtmi:fgcu:traffic:RoadSegment;1"
+SEGMENT_FIELDS = (
+    "avgSpeed", "volume", "PCI", "IRI", "asOf", "status", "congestionIndex",
+    "predictedAvgSpeed", "predictedCongestionIndex", "predictionHorizon", "predictionTimestamp",
+)
+
+class SegmentReadModel:
+    """In-memory table of segment state, refreshed from ADT on a TTL and kept
+    current in between by patches pushed from the ingest functions.
+
+    The ADT query of a refresh runs outside the lock: readers keep getting the
+    previous table (only a cold start waits), and patches pushed meanwhile are
+    replayed onto the new one before it is swapped in.
+    """
+
+    def __init__(self, ttl: float = None):
+        self.ttl = ttl if ttl is not None else float(os.environ.get("SEGMENT_CACHE_TTL_SECONDS", 60))
+        self._rows = {}
+        self._refreshed_at = 0.0
+        self._version = 0
+        self._sorted = []  # [(-predictedCongestionIndex, twin_id)] ascending, i.e. most congested first
+        self._refreshing = None  # patches pushed while a refresh query is running, else None
+        self._lock = threading.RLock()
+        self._refreshed = threading.Condition(self._lock)
+        self.stats = {"hits": 0, "misses": 0, "refreshes": 0, "pushed": 0}
+
+    def _stale(self, now) -> bool:
+        return self.ttl <= 0 or not self._refreshed_at or now - self._refreshed_at >= self.ttl
+
+    @staticmethod
+    def _score(row):
+        value = row.get("predictedCongestionIndex")
+        return value if isinstance(value, (int, float)) else None
+
+    def refresh(self, adt):
+        with self._lock:
+            if self._refreshing is None:
+                self._refreshing = []
+        try:
+            query = f"SELECT seg FROM DIGITALTWINS seg WHERE IS_OF_MODEL(seg, '{SEGMENT_MODEL_ID}')"
+            rows = {}
+            with dependency("adt.query"):
+                for r in adt.query_twins(query):
+                    seg = r.get('seg') or r
+                    rows[seg['$dtId']] = {f: seg.get(f) for f in SEGMENT_FIELDS}
+        except BaseException:
+            with self._lock:
+                self._refreshing = None
+                self._refreshed.notify_all()
+            raise
+        ranked = sorted((-self._score(row), twin_id) for twin_id, row in rows.items()
+                        if self._score(row) is not None)
+        with self._lock:
+            pushed, self._refreshing = self._refreshing, None
+            self._rows, self._sorted = rows, ranked
+            for twin_id, ops in pushed or ():
+                self._apply(twin_id, ops)
+            self._refreshed_at = time.time()
+            self._version += 1
+            self.stats["refreshes"] += 1
+            self._refreshed.notify_all()
+
+    def ensure_fresh(self, adt):
+        with self._lock:
+            if not self._stale(time.time()):
+                self.stats["hits"] += 1
+                return
+            self.stats["misses"] += 1
+            if self._refreshing is not None:
+                # Another caller is already querying; serve the current table unless there is none yet
+                while self._refreshing is not None and not self._refreshed_at:
+                    self._refreshed.wait()
+                if self._refreshed_at:
+                    return
+            self._refreshing = []
+        self.refresh(adt)
+
+    def _apply(self, twin_id: str, ops: list) -> bool:
+        row = self._rows.get(twin_id)
+        if row is None:
+            return False
+        before = self._score(row)
+        for op in ops:
+            field = op["path"].lstrip("/")
+            if field in row:
+                row[field] = None if op.get("op") == "remove" else op.get("value")
+        after = self._score(row)
+        if after != before:
+            if before is not None:
+                i = bisect.bisect_left(self._sorted, (-before, twin_id))
+                if i < len(self._sorted) and self._sorted[i] == (-before, twin_id):
+                    del self._sorted[i]
+            if after is not None:
+                bisect.insort(self._sorted, (-after, twin_id))
+        return True
+
+    def apply_patch(self, twin_id: str, ops: list):
+        """Fold an accepted JSON patch into the table (unknown twins are ignored)."""
+        with self._lock:
+            if self._refreshing is not None:
+                self._refreshing.append((twin_id, ops))
+            if not self._apply(twin_id, ops):
+                return
+            self._version += 1
+            self.stats["pushed"] += 1
+
+    @property
+    def etag(self) -> str:
+        return f'W/"{int(self._refreshed_at)}-{self._version}"'
+
+    def rows(self) -> list:
+        with self._lock:
+            return [dict(row, segmentId=twin_id) for twin_id, row in self._rows.items()]
+
+    def top_congested(self, k: int = 10, threshold: float = 0.0) -> list:
+        """Top-k rows by predictedCongestionIndex above threshold, from a sorted
+        index built on refresh and kept in order by apply_patch."""
+        with self._lock:
+            out = []
+            for neg_score, twin_id in self._sorted:
+                if -neg_score <= threshold or len(out) >= k:
+                    break
+                out.append(dict(self._rows[twin_id], segmentId=twin_id))
+            return out
+
+    def report(self) -> dict:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(
+                self.stats,
+                segments=len(self._rows),
+                hit_ratio=round(self.stats["hits"] / lookups, 3) if lookups else 0.0,
+                age_s=round(time.time() - self._refreshed_at, 1) if self._refreshed_at else None,
+            )
+
+_segment_model = None
+
+def get_segment_model() -> SegmentReadModel:
+    global _segment_model
+    with _registry_lock:
+        if _segment_model is None:
+            _segment_model = SegmentReadModel()
+        return _segment_model
+
+def cached_response_headers(model: SegmentReadModel) -> dict:
+    report = model.report()
+    return {
+        "ETag": model.etag,
+        "X-Cache-Age": str(report["age_s"]),
+        "X-Cache-Hit-Ratio": str(report["hit_ratio"]),
+    }
+
+def encode_rows(rows, ndjson: bool = False, gzip: bool = False) -> bytes:
+    """Serialize an iterable of rows as a JSON array or NDJSON, optionally gzip'd.
+
+    Rows are encoded one at a time so callers can pass a generator straight from
+    an ADT page without materializing an intermediate list of dicts.
+    """
+    gz = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    chunks = []
+
+    def emit(text):
+        data = text.encode()
+        chunks.append(gz.compress(data) if gz else data)
+
+    if ndjson:
+        for row in rows:
+            emit(json.dumps(row, separators=(",", ":")) + "\n")
     else:
-        sa = os.environ["STORAGE_ACCOUNT_NAME"]
-        blob = BlobServiceClient(f"https://{sa}.blob.core.windows.net", credential=cred)
-    # Proactively ensure common containers exist
-    for env_var, default in [
-        ("SEGMENT_MAP_CONTAINER", "raw"),
-        ("TRAFFIC_HISTORY_CONTAINER", "raw"),
-        ("PREDICTION_CONTAINER", "predictions"),
-    ]:
-        ensure_container(blob, os.environ.get(env_var, default))
-    return adt, blob
+        emit("[")
+        for i, row in enumerate(rows):
+            emit(("," if i else "") + json.dumps(row, separators=(",", ":")))
+        emit("]")
+    if gz:
+        chunks.append(gz.flush())
+    return b"".join(chunks)
+
+# Streaming CSV reads.
+#
+# Environment variables:
+# CSV_CHUNK_ROWS - rows per DataFrame chunk yielded by iter_csv_chunks (default: 50000)
+
+DEFAULT_CSV_CHUNK_ROWS = 50000
+CSV_HEADER_PROBE_BYTES = 64 * 1024
+
+class CsvCheckpoint:
+    """Resume point for iter_csv_chunks, stored as checkpoints/<blob>.json next to the CSV."""
+
+    def __init__(self, blob_service, container, name):
+        self.bc = blob_service.get_blob_client(container=container, blob=f"checkpoints/{name}.json")
+
+    def load(self):
+        try:
+            return json.loads(self.bc.download_blob().readall())
+        except Exception:
+            return None
+
+    def commit(self, etag, offset: int, rows: int):
+        self.bc.upload_blob(json.dumps({"etag": etag, "offset": offset, "rows": rows}), overwrite=True)
+
+    def clear(self):
+        try:
+            self.bc.delete_blob()
+        except Exception:
+            pass
+
+def iter_csv_chunks(blob_service, container, name, chunksize: int = None, checkpoint: CsvCheckpoint = None,
+                    dtype=None):
+    """Yield DataFrames of at most chunksize rows while downloading the blob in ranged chunks.
+
+    With a checkpoint, each chunk is committed once the caller asks for the next
+    one, so a run cut short by a timeout resumes after the last fully processed
+    chunk (as long as the blob's ETag is unchanged). A line break inside a quoted
+    field continues the row. dtype is passed to pd.read_csv; without it every
+    chunk infers its own column types, so callers that need them to agree across
+    chunks (ids with leading zeros, sparse numeric columns) should pass it.
+    """
+    import pandas as pd
+    from azure.core import MatchConditions
+    chunksize = chunksize or int(os.environ.get("CSV_CHUNK_ROWS", DEFAULT_CSV_CHUNK_ROWS))
+    bc = blob_service.get_blob_client(container=container, blob=name)
+    probe = bc.download_blob(offset=0, length=CSV_HEADER_PROBE_BYTES)
+    etag = probe.properties.etag
+    head = probe.readall()
+    if not head.strip():
+        return
+    header = head.split(b"\n", 1)[0].rstrip(b"\r")
+    offset, rows = len(header) + 1, 0
+    state = checkpoint.load() if checkpoint else None
+    if state and state.get("etag") == etag:
+        offset, rows = state["offset"], state["rows"]
+        logging.info(f"Resuming {name} at row {rows} (byte {offset})")
+
+    def frame(lines):
+        return pd.read_csv(io.BytesIO(header + b"\n" + b"\n".join(lines)), dtype=dtype)
+
+    content_range = getattr(probe.properties, "content_range", None)
+    if content_range:
+        size = int(content_range.rsplit("/", 1)[1])
+    elif len(head) < CSV_HEADER_PROBE_BYTES:
+        size = len(head)
+    else:
+        size = bc.get_blob_properties().size
+    if offset >= size:
+        if checkpoint:
+            checkpoint.clear()
+        return
+    downloader = bc.download_blob(offset=offset, etag=etag, match_condition=MatchConditions.IfNotModified)
+    lines, buf = [], b""
+    record, quoted = None, False  # a row continued across lines by a quoted line break
+    for piece in downloader.chunks():
+        buf += piece
+        *complete, buf = buf.split(b"\n")
+        for line in complete:
+            offset += len(line) + 1
+            record = line if record is None else record + b"\n" + line
+            quoted ^= line.count(b'"') % 2 == 1
+            if quoted:
+                continue
+            if record.strip():
+                lines.append(record)
+            record = None
+            if len(lines) >= chunksize:
+                yield frame(lines)
+                rows += len(lines)
+                lines = []
+                if checkpoint:
+                    checkpoint.commit(etag, offset, rows)
+    if buf.strip() or record is not None:
+        lines.append(buf if record is None else record + b"\n" + buf)
+    if lines:
+        yield frame(lines)
+    if checkpoint:
+        checkpoint.clear()
 
 def read_csv(blob_client, container, name):
-    b = blob_client.get_blob_client(container=container, blob=name).download_blob().readall()
-    return pd.read_csv(io.BytesIO(b))
+    import pandas as pd
+    chunks = list(iter_csv_chunks(blob_client, container, name))
+    return pd.concat(chunks, ignore_index=True) if chunks else pd.DataFrame()
+
+class SegmentMap:
+    """Frozen external-id -> twin-id lookup.
 
-def load_segment_map(blob_service):
+    Several external ids may point at one twin, and one external id may fan out
+    to several twins (repeated rows, or twin ids separated by ';').
+    get() returns the first twin so the map still reads like the old dict.
+    """
+    __slots__ = ("_twins", "etag")
+
+    def __init__(self, pairs=(), etag=None):
+        grouped = {}
+        for ext_id, twin_id in pairs:
+            twins = grouped.setdefault(ext_id, [])
+            if twin_id not in twins:
+                twins.append(twin_id)
+        self._twins = {k: tuple(v) for k, v in grouped.items()}
+        self.etag = etag
+
+    def twins(self, ext_id) -> tuple:
+        return self._twins.get(ext_id, ())
+
+    def get(self, ext_id, default=None):
+        twins = self._twins.get(ext_id)
+        return twins[0] if twins else default
+
+    def __contains__(self, ext_id):
+        return ext_id in self._twins
+
+    def __len__(self):
+        return len(self._twins)
+
+def parse_segment_map(data: bytes):
+    pairs = []
+    for row in csv.reader(io.StringIO(data.decode())):
+        if not row or row[0].startswith('#') or len(row) < 2:
+            continue
+        ext_id = row[0].strip()
+        if ext_id == "external_segment_id":
+            continue  # header row
+        for twin_id in row[1].split(";"):
+            twin_id = twin_id.strip()
+            if ext_id and twin_id:
+                pairs.append((ext_id, twin_id))
+    return pairs
+
+_segment_map = None
+_segment_map_lock = threading.Lock()
+_segment_map_stats = {"reloads": 0, "not_modified": 0, "errors": 0, "last_parse_ms": 0.0}
+
+def load_segment_map(blob_service) -> SegmentMap:
     """Load external->twin segment mapping from blob CSV.
 
+    The parsed map is cached per process and revalidated on every call with a
+    conditional GET on the blob ETag, so an unchanged map costs a 304.
+
     Environment variables:
     SEGMENT_MAP_CONTAINER (default: raw)
     SEGMENT_MAP_BLOB (default: segment_map.csv)
     """
+    from azure.core import MatchConditions
+    from azure.core.exceptions import ResourceNotModifiedError
+    global _segment_map
     container = os.environ.get("SEGMENT_MAP_CONTAINER", "raw")
     name = os.environ.get("SEGMENT_MAP_BLOB", "segment_map.csv")
     ensure_container(blob_service, container)
-    mapping = {}
-    try:
-        data = blob_service.get_blob_client(container=container, blob=name).download_blob().readall()
-        f = io.StringIO(data.decode())
-        reader = csv.reader(f)
-        for row in reader:
-            if not row or row[0].startswith('#') or len(row) < 2:
-                continue
-            ext_id, twin_id = row[0].strip(), row[1].strip()
-            if ext_id and twin_id:
-                mapping[ext_id] = twin_id
-    except Exception as e:
-        logging.warning(f"Segment map not loaded: {e}")
-    return mapping
+    with _segment_map_lock:
+        cached = _segment_map
+        try:
+            bc = blob_service.get_blob_client(container=container, blob=name)
+            with dependency("blob.segment_map"):
+                if cached is not None and cached.etag:
+                    downloader = bc.download_blob(etag=cached.etag, match_condition=MatchConditions.IfModified)
+                else:
+                    downloader = bc.download_blob()
+                data = downloader.readall()
+            start = time.perf_counter()
+            _segment_map = SegmentMap(parse_segment_map(data), etag=downloader.properties.etag)
+            _segment_map_stats["last_parse_ms"] = round((time.perf_counter() - start) * 1000, 2)
+            _segment_map_stats["reloads"] += 1
+            logging.info(f"Segment map loaded: {len(_segment_map)} external ids "
+                         f"in {_segment_map_stats['last_parse_ms']}ms")
+        except ResourceNotModifiedError:
+            _segment_map_stats["not_modified"] += 1
+        except Exception as e:
+            _segment_map_stats["errors"] += 1
+            logging.warning(f"Segment map not loaded: {e}")
+        return _segment_map if _segment_map is not None else SegmentMap()
+
+def segment_map_stats() -> dict:
+    with _segment_map_lock:
+        return dict(_segment_map_stats)
@@ -0,0 +1,86 @@
+import os, hashlib, logging
+from datetime import datetime, timedelta, timezone
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+
+# "Latest snapshot" publishing for HTTP readers.
+#
+# Each snapshot is archived under <dataset>/date=YYYY-MM-DD/<dataset>_<ts>.json and
+# also copied to <dataset>/latest.json, whose metadata records the archived name,
+# its epoch ts and the body's sha256. A body identical to the published one is
+# neither archived nor rewritten, so the archive only grows when the content
+# changes. latest.json is only replaced through an ETag-conditional write and
+# never with an older ts, so concurrent or late runs cannot regress it.
+#
+# Environment variables:
+# LATEST_FALLBACK_DAYS - days of date partitions to list when latest.json is
+#                        missing (default: 7)
+
+POINTER_NAME = "latest.json"
+POINTER_RETRIES = 3
+DEFAULT_FALLBACK_DAYS = 7
+
+def _pointer_blob(blob_service, container, dataset):
+    return blob_service.get_blob_client(container=container, blob=f"{dataset}/{POINTER_NAME}")
+
+def publish_snapshot(blob_service, container: str, dataset: str, body: bytes, when: datetime = None) -> str:
+    """Archive a snapshot and advance <dataset>/latest.json to it. Returns the archived name.
+
+    When latest.json already holds the same content nothing is written and its
+    archived name is returned.
+    """
+    when = when or datetime.now(timezone.utc)
+    digest = hashlib.sha256(body).hexdigest()
+    try:
+        current = _pointer_blob(blob_service, container, dataset).get_blob_properties().metadata or {}
+        if current.get("sha256") == digest:
+            return current.get("snapshot")
+    except ResourceNotFoundError:
+        pass
+    name = f"{dataset}/date={when:%Y-%m-%d}/{dataset}_{when:%Y%m%d%H%M%S}.json"
+    from azure.storage.blob import ContentSettings  # writers only; keeps it out of get_latest_incidents' import
+    settings = ContentSettings(content_type="application/json")
+    blob_service.get_blob_client(container=container, blob=name).upload_blob(
+        body, overwrite=True, content_settings=settings)
+    update_pointer(blob_service, container, dataset, name, body, int(when.timestamp()), digest)
+    return name
+
+def update_pointer(blob_service, container, dataset, name, body, ts: int, digest: str = None) -> bool:
+    bc = _pointer_blob(blob_service, container, dataset)
+    from azure.storage.blob import ContentSettings
+    meta = {"snapshot": name, "ts": str(ts), "sha256": digest or hashlib.sha256(body).hexdigest()}
+    settings = ContentSettings(content_type="application/json")
+    for _ in range(POINTER_RETRIES):
+        try:
+            props = bc.get_blob_properties()
+            if int((props.metadata or {}).get("ts", 0)) > ts:
+                return False  # a newer snapshot is already published
+            bc.upload_blob(body, overwrite=True, metadata=meta, content_settings=settings,
+                           etag=props.etag, match_condition=MatchConditions.IfNotModified)
+            return True
+        except ResourceNotFoundError:
+            try:
+                bc.upload_blob(body, overwrite=False, metadata=meta, content_settings=settings)
+                return True
+            except ResourceExistsError:
+                continue
+        except ResourceModifiedError:
+            continue
+    logging.warning(f"Gave up advancing {dataset}/{POINTER_NAME} to {name} after concurrent updates")
+    return False
+
+def read_latest(blob_service, container: str, dataset: str, now: datetime = None):
+    """Return the latest snapshot bytes for dataset, or None if nothing is published."""
+    try:
+        return _pointer_blob(blob_service, container, dataset).download_blob().readall()
+    except ResourceNotFoundError:
+        logging.warning(f"{dataset}/{POINTER_NAME} missing; scanning recent date partitions")
+    cc = blob_service.get_container_client(container)
+    now = now or datetime.now(timezone.utc)
+    days = int(os.environ.get("LATEST_FALLBACK_DAYS", DEFAULT_FALLBACK_DAYS))
+    for back in range(days):
+        day = now - timedelta(days=back)
+        names = [b.name for b in cc.list_blobs(name_starts_with=f"{dataset}/date={day:%Y-%m-%d}/")]
+        if names:
+            return cc.download_blob(max(names)).readall()
+    return None
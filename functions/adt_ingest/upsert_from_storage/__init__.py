@@ -1,51 +1,84 @@
-import logging
+import os, json, logging
 import azure.functions as func
-from shared import get_clients, read_csv
+from shared import get_clients, iter_csv_chunks, CsvCheckpoint, get_segment_model, traced, span, count
+from patching import PatchDispatcher
+from bulk import TRAFFIC_SPEC, PAVEMENT_SPEC, csv_dtypes, frame_patches, merge_patches
+from importer import bulk_import, relationships_from_csv
 
-def upsert_twin(adt, twin):
-    adt.upsert_digital_twin(twin["$dtId"], twin)
+# Seeding goes through importer.bulk_import (see ADT_IMPORT_MODE). In job mode the
+# function waits at most ADT_IMPORT_WAIT_SECONDS (default: 0) for the import job;
+# a later call re-attaches to it through the import checkpoint.
 
-def upsert_patch(adt, twin_id, patch_ops):
-    adt.update_digital_twin(twin_id, patch_ops)
+def load_seed(blob):
+    """(models, twins, relationships) from raw/seed/seed_segments.json and optional raw/seed/relationships.csv."""
+    twins = json.loads(blob.get_blob_client("raw", "seed/seed_segments.json").download_blob().readall())
+    try:
+        text = blob.get_blob_client("raw", "seed/relationships.csv").download_blob().readall().decode("utf-8-sig")
+        relationships = list(relationships_from_csv(text.splitlines()))
+    except Exception:
+        relationships = []
+    return [], twins, relationships
+
+def seed_version(blob) -> str:
+    """ETags of the seed blobs, so an import checkpoint is only resumed against the same files."""
+    etags = []
+    for name in ("seed/seed_segments.json", "seed/relationships.csv"):
+        try:
+            etags.append(blob.get_blob_client("raw", name).get_blob_properties().etag)
+        except Exception:
+            etags.append(None)
+    return json.dumps(etags)
 
+@traced("upsert_from_storage")
 def main(req: func.HttpRequest) -> func.HttpResponse:
     logging.info("Ingest start")
     adt, blob = get_clients()
+    dispatcher = PatchDispatcher(adt, label="upsert_from_storage", on_written=get_segment_model().apply_patch)
+    updated, failed = 0, 0
 
-    # 1) Seed segments
+    def flush():
+        nonlocal updated, failed
+        with span("adt_flush"):
+            summary = dispatcher.flush()
+        updated += summary['updated']
+        failed += summary['failed'] + summary['not_found']
+
+    # 1) Seed segments and their relationships
     try:
-        seed_bytes = blob.get_blob_client("raw", "seed/seed_segments.json").download_blob().readall()
-        import json
-        seed = json.loads(seed_bytes)
-        for twin in seed:
-            upsert_twin(adt, twin)
+        with span("seed"):
+            seeded = bulk_import(adt, blob, "seed", lambda: load_seed(blob), version=seed_version(blob),
+                                 timeout=float(os.environ.get("ADT_IMPORT_WAIT_SECONDS", 0)))
+        logging.info(f"Seed import: {seeded}")
     except Exception as e:
         logging.warning(f"No seed or failed to seed: {e}")
 
-    # 2) Traffic metrics
+    # 2) Pavement metrics: one row per segment, held so they merge into the traffic patches
+    pavement = {}
     try:
-        tdf = read_csv(blob, "raw", "traffic.csv")
-        for _, r in tdf.iterrows():
-            patch = [
-                {"op":"add","path":"/avgSpeed","value":float(r["avgSpeed"])},
-                {"op":"add","path":"/volume","value":float(r["volume"])},
-                {"op":"add","path":"/asOf","value":str(r["asOf"])}
-            ]
-            upsert_patch(adt, r["segmentId"], patch)
+        with span("pavement"):
+            for chunk in iter_csv_chunks(blob, "raw", "pavement.csv", dtype=csv_dtypes(PAVEMENT_SPEC)):
+                pavement = merge_patches(pavement, frame_patches("pavement.csv", chunk, PAVEMENT_SPEC, order_by="asOf"))
     except Exception as e:
-        logging.warning(f"Traffic load skipped: {e}")
+        logging.warning(f"Pavement load skipped: {e}")
 
-    # 3) Pavement metrics
+    # 3) Traffic metrics, streamed; each chunk is written before it is checkpointed
     try:
-        pdf = read_csv(blob, "raw", "pavement.csv")
-        for _, r in pdf.iterrows():
-            patch = [
-                {"op":"add","path":"/PCI","value":float(r["PCI"])},
-                {"op":"add","path":"/IRI","value":float(r["IRI"])},
-                {"op":"add","path":"/asOf","value":str(r["asOf"])}
-            ]
-            upsert_patch(adt, r["segmentId"], patch)
+        checkpoint = CsvCheckpoint(blob, "raw", "traffic.csv")
+        for chunk in iter_csv_chunks(blob, "raw", "traffic.csv", checkpoint=checkpoint,
+                                     dtype=csv_dtypes(TRAFFIC_SPEC)):
+            with span("traffic"):
+                traffic = frame_patches("traffic.csv", chunk, TRAFFIC_SPEC, order_by="asOf")
+            merged = merge_patches(traffic, {t: pavement.pop(t) for t in list(traffic) if t in pavement})
+            for twin_id, ops in merged.items():
+                dispatcher.submit(twin_id, ops)
+            flush()
     except Exception as e:
-        logging.warning(f"Pavement load skipped: {e}")
+        logging.warning(f"Traffic load skipped: {e}")
 
-    return func.HttpResponse("Ingest done", status_code=200)
+    # Pavement rows for segments without traffic
+    for twin_id, ops in pavement.items():
+        dispatcher.submit(twin_id, ops)
+    flush()
+    count("records.updated", updated)
+    count("records.failed", failed)
+    return func.HttpResponse(f"Ingest done. Updated={updated} Failed={failed}", status_code=200)
@@ -1,11 +1,19 @@
-import logging
+import logging, os
 import azure.functions as func
 import pandas as pd
-from shared import get_clients
-import io, json
+import shared
+from shared import get_segment_model, traced, span
+from patching import PatchDispatcher
+from bulk import PREDICTION_SPEC, PREDICTION_ALIASES, csv_dtypes, frame_patches
+import json
 
+def prediction_patches(df: pd.DataFrame, label: str) -> dict:
+    return frame_patches(label, df, PREDICTION_SPEC, aliases=PREDICTION_ALIASES)
+
+@traced("write_predictions")
 def main(req: func.HttpRequest) -> func.HttpResponse:
-    adt, blob = get_clients()
+    adt, blob = shared.get_clients()
+    dispatcher = PatchDispatcher(adt, label="predictions", on_written=get_segment_model().apply_patch)
     try:
         # Prefer JSON body if provided
         body = req.get_body()
@@ -15,52 +23,22 @@ def main(req: func.HttpRequest) -> func.HttpResponse:
                 # Expect payload to be a list of prediction entries
                 if isinstance(payload, dict):
                     payload = [payload]
-                for r in payload:
-                    segment_id = r.get("segmentId") or r.get("twinId")
-                    if not segment_id:
-                        continue
-                    patch = []
-                    if "predictedAvgSpeed" in r:
-                        try:
-                            patch.append({"op":"add","path":"/predictedAvgSpeed","value":float(r["predictedAvgSpeed"])})
-                        except: pass
-                    if "predictedCongestionIndex" in r:
-                        try:
-                            patch.append({"op":"add","path":"/predictedCongestionIndex","value":float(r["predictedCongestionIndex"])})
-                        except: pass
-                    if "predictionTimestamp" in r:
-                        patch.append({"op":"add","path":"/predictionTimestamp","value":str(r["predictionTimestamp"])})
-                    if "predictionHorizon" in r:
-                        patch.append({"op":"add","path":"/predictionHorizon","value":str(r["predictionHorizon"])})
-                    if patch:
-                        adt.update_digital_twin(segment_id, patch)
+                for twin_id, ops in prediction_patches(pd.DataFrame.from_records(payload), "JSON body").items():
+                    dispatcher.submit(twin_id, ops)
+                with span("adt_flush"):
+                    dispatcher.flush()
                 return func.HttpResponse("Predictions written (JSON)", status_code=200)
             except Exception:
                 pass
         # Fallback to CSV in blob storage
         container = os.environ.get("PREDICTION_CONTAINER", "raw")
         name = os.environ.get("PREDICTION_BLOB", "predictions.csv")
-        b = blob.get_blob_client(container, name).download_blob().readall()
-        df = pd.read_csv(io.BytesIO(b))
-        for _, r in df.iterrows():
-            segment_id = r.get("segmentId") or r.get("twinId")
-            if not segment_id:
-                continue
-            patch = []
-            if "predictedAvgSpeed" in r:
-                try:
-                    patch.append({"op":"add","path":"/predictedAvgSpeed","value":float(r["predictedAvgSpeed"])})
-                except: pass
-            if "predictedCongestionIndex" in r:
-                try:
-                    patch.append({"op":"add","path":"/predictedCongestionIndex","value":float(r["predictedCongestionIndex"])})
-                except: pass
-            if "predictionTimestamp" in r:
-                patch.append({"op":"add","path":"/predictionTimestamp","value":str(r["predictionTimestamp"])})
-            if "predictionHorizon" in r:
-                patch.append({"op":"add","path":"/predictionHorizon","value":str(r["predictionHorizon"])})
-            if patch:
-                adt.update_digital_twin(segment_id, patch)
+        for chunk in shared.iter_csv_chunks(blob, container, name,
+                                            dtype=csv_dtypes(PREDICTION_SPEC, PREDICTION_ALIASES)):
+            for twin_id, ops in prediction_patches(chunk, name).items():
+                dispatcher.submit(twin_id, ops)
+        with span("adt_flush"):
+            dispatcher.flush()
         return func.HttpResponse("Predictions written (CSV)", status_code=200)
     except Exception as e:
         logging.error(f"Prediction write failed: {e}")
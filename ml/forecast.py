@@ -0,0 +1,336 @@
+"""Congestion forecasting from the archived traffic history.
+
+Speeds are binned onto a dense [segment, 15-minute bin] grid. Each segment gets
+a seasonal profile (mean speed per weekday/weekend time-of-day slot), and for
+every horizon h one pooled linear model predicts how the current anomaly from
+that profile carries forward:
+
+    speed[s, t+h] = profile[s, slot(t+h)]
+                    + a_h * r[s, t] + b_h * r[s, t-1] + c_h * v[s, t] + d_h * incident[s, t] + e_h
+
+where r is the speed anomaly, v the relative volume anomaly and incident a 0/1
+flag from the incident history. Fitting is one least-squares solve per horizon
+and scoring is a handful of array operations over all segments, CPU only.
+
+Output rows use the fields write_predictions accepts (adtSegmentId,
+predictedAvgSpeed, predictedCongestionIndex, predictionTimestamp,
+predictionHorizon). Twins hold one prediction each, so a payload is built per
+horizon.
+
+Usage:
+    python ml/forecast.py --history-dir <HISTORY_LOCAL_DIR> [--days 14] [--horizon 30] > predictions.json
+    python ml/forecast.py --synthetic 10000 [--days 14]    # timing + accuracy on synthetic data
+"""
+import argparse
+import json
+import sys
+import time
+import warnings
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+APP_ROOT = Path(__file__).resolve().parent.parent / "functions" / "adt_ingest"
+
+HORIZONS_MINUTES = (15, 30, 60)
+BIN_MINUTES = 15
+STALE_BINS = 4  # use an observation up to this many bins old as "current"
+MAX_TRAIN_ROWS = 2_000_000
+
+
+def build_grid(codes: np.ndarray, ts: np.ndarray, values: np.ndarray, n_segments: int,
+               start_ts: int, n_bins: int, bin_minutes: int = BIN_MINUTES) -> np.ndarray:
+    """Mean of values per (segment code, time bin); NaN where there is no data."""
+    bins = (ts - start_ts) // (bin_minutes * 60)
+    keep = (bins >= 0) & (bins < n_bins) & np.isfinite(values)
+    flat = codes[keep] * n_bins + bins[keep]
+    size = n_segments * n_bins
+    sums = np.bincount(flat, weights=values[keep], minlength=size)
+    counts = np.bincount(flat, minlength=size)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums / counts).astype(np.float32).reshape(n_segments, n_bins)
+
+
+def incident_grid(codes: np.ndarray, ts: np.ndarray, active: np.ndarray, n_segments: int,
+                  start_ts: int, n_bins: int, bin_minutes: int = BIN_MINUTES) -> np.ndarray:
+    """0/1 flag per (segment, bin): set from an active event until the next inactive one."""
+    flags = np.zeros((n_segments, n_bins), dtype=np.float32)
+    bins = np.clip((ts - start_ts) // (bin_minutes * 60), 0, n_bins)
+    order = np.lexsort((bins, codes))
+    open_at = {}
+    for code, b, is_active in zip(codes[order], bins[order], active[order]):
+        if is_active:
+            open_at.setdefault(code, b)
+        elif code in open_at:
+            flags[code, open_at.pop(code):b + 1] = 1.0
+    for code, b in open_at.items():
+        flags[code, b:] = 1.0
+    return flags
+
+
+def time_slots(start_ts: int, n_bins: int, bin_minutes: int = BIN_MINUTES, utc_offset_hours: float = 0.0) -> np.ndarray:
+    """Weekday/weekend x time-of-day slot for each bin (local time)."""
+    t = start_ts + np.arange(n_bins, dtype=np.int64) * bin_minutes * 60 + int(utc_offset_hours * 3600)
+    day = t // 86400
+    weekend = ((day + 3) % 7) >= 5  # 1970-01-01 was a Thursday
+    per_day = 24 * 60 // bin_minutes
+    return (weekend * per_day + (t % 86400) // (bin_minutes * 60)).astype(np.int64)
+
+
+def seasonal_profile(grid: np.ndarray, slots: np.ndarray, n_slots: int) -> np.ndarray:
+    """[segment, slot] mean, falling back to the segment mean and then the global mean."""
+    profile = np.full((grid.shape[0], n_slots), np.nan, dtype=np.float32)
+    with np.errstate(invalid="ignore"), _quiet():
+        for k in np.unique(slots):
+            profile[:, k] = np.nanmean(grid[:, slots == k], axis=1)
+        seg_mean = np.nanmean(grid, axis=1)
+    global_mean = np.nanmean(seg_mean) if np.isfinite(seg_mean).any() else 0.0
+    seg_mean = np.where(np.isfinite(seg_mean), seg_mean, global_mean)
+    return np.where(np.isfinite(profile), profile, seg_mean[:, None]).astype(np.float32)
+
+
+@contextmanager
+def _quiet():
+    """Silence numpy's 'Mean of empty slice' warnings for all-NaN rows."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        yield
+
+
+def _last_finite(grid: np.ndarray, col: int, max_age: int) -> np.ndarray:
+    """Most recent finite value at or before col (within max_age bins), else NaN."""
+    out = np.full(grid.shape[0], np.nan, dtype=np.float32)
+    for c in range(col, max(-1, col - max_age - 1), -1):
+        fill = np.isnan(out)
+        if not fill.any():
+            break
+        out[fill] = grid[fill, c]
+    return out
+
+
+def _features(r: np.ndarray, r_prev: np.ndarray, v: np.ndarray, inc: np.ndarray) -> np.ndarray:
+    cols = [np.nan_to_num(x, nan=0.0) for x in (r, r_prev, v, inc)]
+    return np.column_stack(cols + [np.ones_like(cols[0])]).astype(np.float64)
+
+
+class CongestionForecaster:
+    def __init__(self, horizons=HORIZONS_MINUTES, bin_minutes: int = BIN_MINUTES, utc_offset_hours: float = 0.0):
+        if any(h % bin_minutes for h in horizons):
+            raise ValueError(f"horizons must be multiples of {bin_minutes} minutes")
+        self.horizons = tuple(horizons)
+        self.bin_minutes = bin_minutes
+        self.utc_offset_hours = utc_offset_hours
+        self.n_slots = 2 * 24 * 60 // bin_minutes
+        self.coef: Dict[int, np.ndarray] = {}
+
+    def fit(self, twin_ids: List[str], speed: np.ndarray, volume: np.ndarray, incidents: np.ndarray, start_ts: int):
+        """Fit profiles and one pooled anomaly model per horizon from [segment, bin] grids."""
+        self.twin_ids = list(twin_ids)
+        self.start_ts = start_ts
+        n_bins = speed.shape[1]
+        slots = time_slots(start_ts, n_bins, self.bin_minutes, self.utc_offset_hours)
+        self.profile = seasonal_profile(speed, slots, self.n_slots)
+        self.volume_profile = seasonal_profile(volume, slots, self.n_slots)
+        with _quiet():
+            self.free_flow = np.nanmax(self.profile, axis=1)
+        self.speed, self.volume, self.incidents = speed, volume, incidents
+        r = speed - self.profile[:, slots]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            v = volume / self.volume_profile[:, slots] - 1.0
+        rng = np.random.default_rng(0)
+        n_segments = speed.shape[0]
+        for h in self.horizons:
+            steps = h // self.bin_minutes
+            n_t = n_bins - 1 - steps
+            if n_t <= 0:
+                self.coef[h] = np.zeros(5)
+                continue
+            if n_segments * n_t > MAX_TRAIN_ROWS:
+                rows = rng.integers(0, n_segments, MAX_TRAIN_ROWS)
+                tt = rng.integers(1, n_bins - steps, MAX_TRAIN_ROWS)
+            else:
+                rows, tt = (a.ravel() for a in np.meshgrid(np.arange(n_segments), np.arange(1, n_bins - steps), indexing="ij"))
+            y, r_t = r[rows, tt + steps], r[rows, tt]
+            ok = np.isfinite(y) & np.isfinite(r_t)
+            rows, tt, y = rows[ok], tt[ok], y[ok].astype(np.float64)
+            X = _features(r_t[ok], r[rows, tt - 1], v[rows, tt], incidents[rows, tt])
+            if len(X) < X.shape[1]:
+                self.coef[h] = np.zeros(X.shape[1])
+                continue
+            # Normal equations: 5 unknowns, so this is far cheaper than lstsq on millions of rows
+            self.coef[h] = np.linalg.solve(X.T @ X + 1e-6 * np.eye(X.shape[1]), X.T @ y)
+        return self
+
+    def predict(self, now_bin: int = None) -> Dict[int, Dict[str, np.ndarray]]:
+        """{horizon: {"speed", "congestion"}} for every segment, from the state at now_bin
+        (default: the last bin of the fitted grid)."""
+        n_bins = self.speed.shape[1]
+        now_bin = n_bins - 1 if now_bin is None else now_bin
+        slots = time_slots(self.start_ts, now_bin + 1 + max(self.horizons) // self.bin_minutes,
+                           self.bin_minutes, self.utc_offset_hours)
+        cur = _last_finite(self.speed, now_bin, STALE_BINS)
+        prev = _last_finite(self.speed, now_bin - 1, STALE_BINS) if now_bin > 0 else cur
+        r = cur - self.profile[:, slots[now_bin]]
+        r_prev = prev - self.profile[:, slots[max(now_bin - 1, 0)]]
+        vol = _last_finite(self.volume, now_bin, STALE_BINS)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            v = vol / self.volume_profile[:, slots[now_bin]] - 1.0
+        X = _features(r, r_prev, v, self.incidents[:, now_bin])
+        out = {}
+        for h in self.horizons:
+            target = slots[now_bin + h // self.bin_minutes]
+            pred = np.maximum(self.profile[:, target] + X @ self.coef[h], 0.0)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                congestion = np.clip(1.0 - pred / self.free_flow, 0.0, 1.0)
+            out[h] = {"speed": pred, "congestion": congestion}
+        return out
+
+    def issued_at(self, now_bin: int = None) -> datetime:
+        n_bins = self.speed.shape[1]
+        now_bin = n_bins - 1 if now_bin is None else now_bin
+        return datetime.fromtimestamp(self.start_ts + (now_bin + 1) * self.bin_minutes * 60, timezone.utc)
+
+
+def to_payload(twin_ids: List[str], forecast: Dict[int, Dict[str, np.ndarray]], horizon: int, issued: datetime) -> List[Dict]:
+    """write_predictions payload for one horizon (segments without a prediction are skipped)."""
+    speed, congestion = forecast[horizon]["speed"], forecast[horizon]["congestion"]
+    when = (issued + timedelta(minutes=horizon)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    return [
+        {
+            "adtSegmentId": twin_id,
+            "predictedAvgSpeed": round(float(s), 2),
+            "predictedCongestionIndex": round(float(c), 3),
+            "predictionTimestamp": when,
+            "predictionHorizon": f"PT{horizon}M",
+        }
+        for twin_id, s, c in zip(twin_ids, speed, congestion)
+        if np.isfinite(s) and np.isfinite(c)
+    ]
+
+
+def load_history(store, end: datetime, days: int, bin_minutes: int = BIN_MINUTES):
+    """Traffic and incident grids from a history_store.HistoryStore."""
+    start = end - timedelta(days=days)
+    start_ts = int(start.timestamp()) // (bin_minutes * 60) * (bin_minutes * 60)
+    n_bins = (int(end.timestamp()) - start_ts) // (bin_minutes * 60)
+    traffic = [r for r in store.scan("traffic", start, end, columns=["ts", "twinId", "avgSpeed", "volume"]) if r["twinId"]]
+    twin_ids = sorted({r["twinId"] for r in traffic})
+    index = {t: i for i, t in enumerate(twin_ids)}
+    codes = np.fromiter((index[r["twinId"]] for r in traffic), dtype=np.int64, count=len(traffic))
+    ts = np.fromiter((r["ts"] for r in traffic), dtype=np.int64, count=len(traffic))
+    as_float = lambda key: np.array([np.nan if r[key] is None else float(r[key]) for r in traffic], dtype=np.float64)
+    speed = build_grid(codes, ts, as_float("avgSpeed"), len(twin_ids), start_ts, n_bins, bin_minutes)
+    volume = build_grid(codes, ts, as_float("volume"), len(twin_ids), start_ts, n_bins, bin_minutes)
+    events = [(index[t], r["ts"], r["status"] == "active" and r["transition"] != "expired")
+              for r in store.scan("incidents", start, end, columns=["ts", "twinId", "status", "transition"])
+              for t in (r.get("twinId") or "").split(";") if t in index]
+    if events:
+        c, e_ts, act = (np.array(x) for x in zip(*events))
+        incidents = incident_grid(c, e_ts, act, len(twin_ids), start_ts, n_bins, bin_minutes)
+    else:
+        incidents = np.zeros_like(speed)
+    return twin_ids, speed, volume, incidents, start_ts
+
+
+def synthetic_history(segments: int, days: int, bin_minutes: int = BIN_MINUTES, seed: int = 42):
+    """Speed/volume grids with weekday rush hours, AR(1) noise and random incidents."""
+    rng = np.random.default_rng(seed)
+    n_bins = days * 24 * 60 // bin_minutes
+    start_ts = 1_759_276_800  # 2025-10-01T00:00:00Z
+    slots = time_slots(start_ts, n_bins, bin_minutes)
+    per_day = 24 * 60 // bin_minutes
+    hour = (slots % per_day) * bin_minutes / 60.0
+    weekday = slots < per_day
+    rush = weekday * (np.exp(-((hour - 8) ** 2) / 1.5) + np.exp(-((hour - 17.5) ** 2) / 2.0))
+    free_flow = rng.uniform(40, 70, segments).astype(np.float32)
+    depth = rng.uniform(0.1, 0.5, segments).astype(np.float32)
+    noise = np.zeros((segments, n_bins), dtype=np.float32)
+    shocks = rng.normal(0, 2.0, (segments, n_bins)).astype(np.float32)
+    for t in range(1, n_bins):
+        noise[:, t] = 0.8 * noise[:, t - 1] + shocks[:, t]
+    incidents = np.zeros((segments, n_bins), dtype=np.float32)
+    for s, t0 in zip(rng.integers(0, segments, segments // 5), rng.integers(0, n_bins, segments // 5)):
+        incidents[s, t0:t0 + rng.integers(2, 8)] = 1.0
+    speed = free_flow[:, None] * (1 - depth[:, None] * rush[None, :]) + noise - 15.0 * incidents
+    speed = np.maximum(speed, 2.0)
+    volume = (800 * (1 + rush[None, :]) * rng.uniform(0.5, 1.5, (segments, 1))).astype(np.float32)
+    speed[rng.random(speed.shape) < 0.02] = np.nan  # missed polls
+    twin_ids = [f"Segment_{i:05d}" for i in range(segments)]
+    return twin_ids, speed.astype(np.float32), volume, incidents, start_ts
+
+
+def run_synthetic(segments: int, days: int, horizons):
+    twin_ids, speed, volume, incidents, start_ts = synthetic_history(segments, days)
+    per_day = 24 * 60 // BIN_MINUTES
+    train_bins = speed.shape[1] - per_day  # hold out the last day
+    t0 = time.perf_counter()
+    model = CongestionForecaster(horizons).fit(twin_ids, speed[:, :train_bins], volume[:, :train_bins],
+                                               incidents[:, :train_bins], start_ts)
+    train_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    forecast = model.predict()
+    score_s = time.perf_counter() - t0
+    per_10k = 10000 / segments
+    print(f"{segments} segments x {train_bins} bins: train {train_s:.2f}s ({train_s * per_10k:.2f}s/10k), "
+          f"score {score_s * 1000:.1f}ms ({score_s * per_10k * 1000:.1f}ms/10k) for {len(horizons)} horizons")
+    # Rolling evaluation over the held-out day against persistence and the seasonal profile
+    model.speed, model.volume, model.incidents = speed, volume, incidents
+    slots = time_slots(start_ts, speed.shape[1] + max(horizons) // BIN_MINUTES)
+    for h in horizons:
+        steps = h // BIN_MINUTES
+        errs = {"model": [], "persistence": [], "seasonal": []}
+        for now in range(train_bins, speed.shape[1] - steps, 4):
+            actual = speed[:, now + steps]
+            ok = np.isfinite(actual) & np.isfinite(speed[:, now])
+            pred = model.predict(now)[h]["speed"]
+            errs["model"].append(np.abs(pred - actual)[ok])
+            errs["persistence"].append(np.abs(speed[:, now] - actual)[ok])
+            errs["seasonal"].append(np.abs(model.profile[:, slots[now + steps]] - actual)[ok])
+        mae = {k: float(np.mean(np.concatenate(v))) for k, v in errs.items()}
+        print(f"  T+{h:<3d} MAE mph: model {mae['model']:.2f}  persistence {mae['persistence']:.2f}  "
+              f"seasonal {mae['seasonal']:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--history-dir", help="local history archive (HISTORY_LOCAL_DIR); default: blob storage")
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--horizons", default=",".join(str(h) for h in HORIZONS_MINUTES))
+    parser.add_argument("--horizon", type=int, default=HORIZONS_MINUTES[0], help="horizon written to the payload")
+    parser.add_argument("--utc-offset", type=float, default=-5.0, help="local time offset for seasonality")
+    parser.add_argument("--synthetic", type=int, help="time and evaluate on N synthetic segments instead")
+    args = parser.parse_args()
+    horizons = tuple(int(h) for h in args.horizons.split(","))
+
+    if args.synthetic:
+        run_synthetic(args.synthetic, args.days, horizons)
+        return
+
+    sys.path.insert(0, str(APP_ROOT))
+    from history_store import HistoryStore, LocalBackend, get_history_store
+    if args.history_dir:
+        store = HistoryStore(LocalBackend(args.history_dir), compact=False)
+    else:
+        from shared import get_blob_service
+        store = get_history_store(get_blob_service())
+    now = datetime.now(timezone.utc)
+    t0 = time.perf_counter()
+    twin_ids, speed, volume, incidents, start_ts = load_history(store, now, args.days)
+    load_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    model = CongestionForecaster(horizons, utc_offset_hours=args.utc_offset).fit(twin_ids, speed, volume, incidents, start_ts)
+    train_s = time.perf_counter() - t0
+    t0 = time.perf_counter()
+    forecast = model.predict()
+    score_s = time.perf_counter() - t0
+    per_10k = 10000 / max(len(twin_ids), 1)
+    print(f"{len(twin_ids)} segments: load {load_s:.2f}s, train {train_s:.2f}s ({train_s * per_10k:.2f}s/10k), "
+          f"score {score_s * 1000:.1f}ms ({score_s * per_10k * 1000:.1f}ms/10k)", file=sys.stderr)
+    print(json.dumps(to_payload(twin_ids, forecast, args.horizon, model.issued_at())))
+
+
+if __name__ == "__main__":
+    main()
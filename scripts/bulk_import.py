@@ -0,0 +1,78 @@
+"""Bulk-load models, twins and relationships from local files into ADT.
+
+Builds the load from any mix of DTDL model files, a seed JSON list of twins
+(ingestion/seed_segments.json), a twins CSV ($dtId or twinId column plus
+property columns) and a relationships CSV (source,target[,name][,relationshipId]).
+With --ndjson-out the ADT Import Jobs file is only written locally; otherwise it is
+loaded with importer.bulk_import (--mode job runs an ADT import job, --mode upsert
+writes with concurrent upserts; both resume from a checkpoint when re-run, unless
+the input files changed in between). ADT import jobs only create entities: use
+--mode upsert to update twins that already exist.
+
+Usage:
+    python scripts/bulk_import.py --models dtdl/RoadSegment.v2.json --seed ingestion/seed_segments.json \
+        --relationships-csv ingestion/relationships.csv [--mode job|upsert] [--ndjson-out import.ndjson]
+"""
+import argparse, hashlib, json, os, sys, logging
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "functions" / "adt_ingest"))
+
+from importer import ndjson_lines, twins_from_csv, relationships_from_csv, bulk_import
+
+
+def build_source(args):
+    def source():
+        models = [json.loads(Path(p).read_text()) for p in args.models]
+        twins, relationships = [], []
+        if args.seed:
+            twins.extend(json.loads(Path(args.seed).read_text()))
+        if args.twins_csv:
+            with open(args.twins_csv, newline="", encoding="utf-8-sig") as f:
+                twins.extend(twins_from_csv(f, args.model_id))
+        if args.relationships_csv:
+            with open(args.relationships_csv, newline="", encoding="utf-8-sig") as f:
+                relationships.extend(relationships_from_csv(f))
+        return models, twins, relationships
+    return source
+
+
+def source_version(args) -> str:
+    """sha256 over the input files, so a checkpoint is only resumed against the same inputs."""
+    digest = hashlib.sha256()
+    for path in [*args.models, args.seed, args.twins_csv, args.relationships_csv]:
+        if path:
+            digest.update(path.encode() + b"\0" + Path(path).read_bytes())
+    digest.update(args.model_id.encode())
+    return digest.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="*", default=[])
+    parser.add_argument("--seed")
+    parser.add_argument("--twins-csv")
+    parser.add_argument("--model-id", default="dtmi:fgcu:traffic:RoadSegment;2")
+    parser.add_argument("--relationships-csv")
+    parser.add_argument("--mode", choices=("job", "upsert"), default="job")
+    parser.add_argument("--name", default="bulk")
+    parser.add_argument("--ndjson-out")
+    args = parser.parse_args()
+    source = build_source(args)
+
+    if args.ndjson_out:
+        with open(args.ndjson_out, "wb") as f:
+            f.writelines(ndjson_lines(*source()))
+        print(f"wrote {args.ndjson_out}")
+        return
+
+    if not os.environ.get("ADT_ENDPOINT"):
+        raise SystemExit("ADT_ENDPOINT not set")
+    from shared import get_clients
+    adt, blob_service = get_clients()
+    print(bulk_import(adt, blob_service, args.name, source, mode=args.mode, version=source_version(args)))
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
+    main()
@@ -2,55 +2,73 @@
 
 Creates v2 twins for existing RoadSegment;1 twins by copying properties.
 Existing twin IDs are preserved with a suffix (e.g., Segment_001 -> Segment_001_v2) to avoid collision.
-Relationships are not automatically migrated; export and recreate as needed.
+Relationships are migrated too: outgoing ones are recreated from the v2 twin (re-pointed at
+v2 targets where those were migrated), incoming ones get a parallel relationship to the v2 twin.
+
+Twins are streamed from ADT rather than listed into memory and written with importer.bulk_import:
+ROADSEGMENT_V2_MODE=upsert (default) writes with concurrent upserts; =job generates an ADT Import
+Jobs NDJSON file, uploads it to ADT_IMPORT_CONTAINER and runs the import job. Import jobs only
+create twins, so job mode is only used for a first migration: if any v2 twins already exist the
+script says so and upserts instead. Both resume from a checkpoint blob if interrupted, so
+re-running after a timeout continues the migration.
 
 Usage (PowerShell):
     $env:ADT_ENDPOINT="https://<name>.api.<region>.digitaltwins.azure.net"
+    $env:STORAGE_ACCOUNT_NAME="<account>"   # or STORAGE_CONNECTION_STRING
     python scripts/migrate_to_v2.py
 
 Requires DefaultAzureCredential chain (Azure CLI login, Managed Identity, etc.)
 """
-import os, logging
-from azure.identity import DefaultAzureCredential
-from azure.digitaltwins.core import DigitalTwinsClient
+import os, sys, logging
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "functions" / "adt_ingest"))
+
+from shared import get_clients
+from importer import migrate_model, migration_query, bulk_import
 
 OLD_MODEL = "dtmi:fgcu:traffic:RoadSegment;1"
 NEW_MODEL = os.environ.get("ROADSEGMENT_V2_ID", "dtmi:fgcu:traffic:RoadSegment;2")
 SUFFIX = os.environ.get("ROADSEGMENT_V2_SUFFIX", "_v2")
 DRY_RUN = os.environ.get("ROADSEGMENT_V2_DRY_RUN", "true").lower() == "true"
+MODE = os.environ.get("ROADSEGMENT_V2_MODE", "upsert")
+
+def existing_twins(client, model: str) -> int:
+    rows = list(client.query_twins(f"SELECT COUNT() FROM digitaltwins WHERE IS_OF_MODEL('{model}')"))
+    return int(rows[0].get("COUNT", 0)) if rows else 0
 
 def main():
-    endpoint = os.environ.get("ADT_ENDPOINT")
-    if not endpoint:
+    if not os.environ.get("ADT_ENDPOINT"):
         raise SystemExit("ADT_ENDPOINT not set")
-    cred = DefaultAzureCredential()
-    client = DigitalTwinsClient(endpoint, cred)
-
-    query = f"SELECT * FROM digitaltwins WHERE IS_OF_MODEL('{OLD_MODEL}')"
-    twins_to_migrate = list(client.query_twins(query))
-    logging.info(f"Found {len(twins_to_migrate)} twins of model {OLD_MODEL}")
-
-    migrated = 0
-    for twin in twins_to_migrate:
-        orig_id = twin.get("$dtId")
-        new_id = f"{orig_id}{SUFFIX}"
-        contents = {k: v for k, v in twin.items() if not k.startswith("$")}
-        new_twin = {
-            "$dtId": new_id,
-            "$metadata": {"$model": NEW_MODEL},
-            **contents
-        }
-        if DRY_RUN:
-            logging.info(f"[DRY RUN] Would create new twin {new_id} from {orig_id}")
-            continue
-        try:
-            client.upsert_digital_twin(new_id, new_twin)
-            migrated += 1
-        except Exception as e:
-            logging.error(f"Failed to create twin {new_id}: {e}")
-
-    logging.info(f"Migration complete. Migrated={migrated} DryRun={DRY_RUN}")
+    client, blob_service = get_clients()
+
+    if DRY_RUN:
+        twins, relationships = migrate_model(client, OLD_MODEL, NEW_MODEL, SUFFIX)
+        count = 0
+        for twin in twins:
+            count += 1
+            logging.info(f"[DRY RUN] Would create new twin {twin['$dtId']}")
+        rels = sum(1 for _ in relationships)
+        logging.info(f"[DRY RUN] Would migrate {count} twins of model {OLD_MODEL} and {rels} relationships")
+        return
+
+    def source():
+        twins, relationships = migrate_model(client, OLD_MODEL, NEW_MODEL, SUFFIX)
+        return [], twins, relationships
+
+    mode = MODE
+    if mode == "job":
+        existing = existing_twins(client, NEW_MODEL)
+        if existing:
+            logging.warning(f"{existing} twins of {NEW_MODEL} already exist and ADT import jobs cannot update them; "
+                            f"using upsert mode instead")
+            mode = "upsert"
+    # ADT is the source here: the checkpoint is keyed on the query and on what it produces, and
+    # records twin ids (query results come in no fixed order)
+    summary = bulk_import(client, blob_service, "migrate_v2", source, mode=mode,
+                          version=f"{migration_query(OLD_MODEL)} -> {NEW_MODEL} {SUFFIX}")
+    logging.info(f"Migration complete. {summary} DryRun={DRY_RUN}")
 
 if __name__ == "__main__":
     logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO"))
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,7 @@
+import sys
+from pathlib import Path
+
+# The Functions host puts the app root on sys.path so handlers can `import shared`;
+# mirror that for tests.
+APP_ROOT = Path(__file__).resolve().parent.parent / "functions" / "adt_ingest"
+sys.path.insert(0, str(APP_ROOT))
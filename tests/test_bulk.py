@@ -0,0 +1,45 @@
+import pandas as pd
+
+from bulk import PAVEMENT_SPEC, PREDICTION_ALIASES, PREDICTION_SPEC, TRAFFIC_SPEC, coerce_frame, frame_patches, merge_patches
+
+
+def test_coerce_reports_bad_rows_in_bulk():
+    df = pd.DataFrame({
+        "segmentId": ["SEG-001", "SEG-002", None],
+        "asOf": ["2025-10-28T12:00:00Z"] * 3,
+        "avgSpeed": ["37.5", "fast", "20"],
+        "volume": [820, 1100, 500],
+    })
+    clean, bad = coerce_frame(df, TRAFFIC_SPEC)
+    assert list(clean["twinId"]) == ["SEG-001"]
+    assert bad == [{"row": 1, "reason": "non-numeric avgSpeed"}, {"row": 2, "reason": "missing segment id"}]
+    assert clean["avgSpeed"].tolist() == [37.5]
+
+
+def test_traffic_and_pavement_merge_into_one_patch_per_twin():
+    traffic = frame_patches("traffic", pd.DataFrame({
+        "segmentId": ["SEG-001", "SEG-001"],
+        "asOf": ["2025-10-28T13:00:00Z", "2025-10-28T12:00:00Z"],
+        "avgSpeed": [40.0, 30.0],
+        "volume": [900, 800],
+    }), TRAFFIC_SPEC, order_by="asOf")
+    pavement = frame_patches("pavement", pd.DataFrame({
+        "segmentId": ["SEG-001"], "asOf": ["2025-07-01T00:00:00Z"], "PCI": [72], "IRI": [2.1],
+    }), PAVEMENT_SPEC)
+
+    merged = merge_patches(traffic, pavement)
+    values = {op["path"]: op["value"] for op in merged["SEG-001"]}
+    assert values == {"/avgSpeed": 40.0, "/volume": 900.0, "/asOf": "2025-10-28T13:00:00Z", "/PCI": 72.0, "/IRI": 2.1}
+
+
+def test_prediction_aliases_and_missing_cells():
+    df = pd.DataFrame.from_records([
+        {"adtSegmentId": "segment-001", "congestionIndex": 0.5, "timestamp": 1733090000},
+        {"segmentId": "SEG-002", "predictedAvgSpeed": None, "predictedCongestionIndex": 0.8, "predictionHorizon": "T+30"},
+    ])
+    patches = frame_patches("predictions", df, PREDICTION_SPEC, aliases=PREDICTION_ALIASES)
+    assert patches["segment-001"] == [
+        {"op": "add", "path": "/predictedCongestionIndex", "value": 0.5},
+        {"op": "add", "path": "/predictionTimestamp", "value": "2024-12-01T21:53:20Z"},
+    ]
+    assert [op["path"] for op in patches["SEG-002"]] == ["/predictedCongestionIndex", "/predictionHorizon"]
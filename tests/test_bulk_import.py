@@ -0,0 +1,220 @@
+import json
+
+import pytest
+import requests
+
+import importer
+
+
+class FakeBlob:
+    def __init__(self, store, name):
+        self.store, self.name = store, name
+        self.url = f"https://acct.blob.core.windows.net/{name}"
+
+    def upload_blob(self, data, overwrite=False):
+        self.store[self.name] = data if isinstance(data, (bytes, str)) else b"".join(data)
+
+    def download_blob(self):
+        if self.name not in self.store:
+            raise KeyError(self.name)
+        data = self.store[self.name]
+        return type("D", (), {"readall": lambda _self: data})()
+
+    def delete_blob(self):
+        self.store.pop(self.name, None)
+
+
+class FakeBlobService:
+    def __init__(self):
+        self.store = {}
+
+    def get_blob_client(self, container, blob):
+        return FakeBlob(self.store, f"{container}/{blob}")
+
+
+class FakeADT:
+    def __init__(self, twins=(), relationships=()):
+        self.twins = {t["$dtId"]: t for t in twins}
+        self.relationships = {(r["$sourceId"], r["$relationshipId"]): r for r in relationships}
+        self.calls = 0
+
+    def query_twins(self, query):
+        if "RELATIONSHIPS" in query:
+            return iter(list(self.relationships.values()))
+        return iter([t for t in self.twins.values() if t["$metadata"]["$model"] in query])
+
+    def upsert_digital_twin(self, twin_id, twin):
+        self.calls += 1
+        self.twins[twin_id] = twin
+
+    def upsert_relationship(self, source_id, relationship_id, rel):
+        self.calls += 1
+        self.relationships[(source_id, relationship_id)] = dict(
+            rel, **{"$sourceId": source_id, "$relationshipId": relationship_id})
+
+    def create_models(self, models):
+        self.models = models
+
+
+def twin(twin_id, model="dtmi:fgcu:traffic:RoadSegment;1", **props):
+    return {"$dtId": twin_id, "$metadata": {"$model": model}, **props}
+
+
+def test_ndjson_sections_and_csv_sources():
+    twins = list(importer.twins_from_csv(["$dtId,name,lanes,speedLimit", "SEG-1,Main St,2,", "SEG-2,2nd,4,45.5"],
+                                         "dtmi:x;2"))
+    assert twins[0] == {"$dtId": "SEG-1", "$metadata": {"$model": "dtmi:x;2"}, "name": "Main St", "lanes": 2}
+    assert twins[1]["speedLimit"] == 45.5
+    rels = list(importer.relationships_from_csv(["source,target", "SEG-1,SEG-2"]))
+    lines = [json.loads(line) for line in importer.ndjson_lines([{"@id": "dtmi:x;2"}], twins, rels)]
+    sections = [line["Section"] for line in lines if "Section" in line]
+    assert sections == ["Header", "Models", "Twins", "Relationships"]
+    assert lines[-1] == {"$dtId": "SEG-1", "$relationshipId": "SEG-1-connectedTo-SEG-2",
+                         "$targetId": "SEG-2", "$relationshipName": "connectedTo"}
+
+
+def test_migration_copies_twins_and_repoints_relationships():
+    adt = FakeADT(
+        [twin("A", avgSpeed=40), twin("B"), twin("S1", model="dtmi:fgcu:traffic:Sensor;1")],
+        [
+            {"$sourceId": "A", "$relationshipId": "r1", "$targetId": "B", "$relationshipName": "connectedTo"},
+            {"$sourceId": "A", "$relationshipId": "r2", "$targetId": "S1", "$relationshipName": "hasSensor"},
+            {"$sourceId": "S1", "$relationshipId": "r3", "$targetId": "A", "$relationshipName": "monitors"},
+        ])
+    twins, rels = importer.migrate_model(adt, "dtmi:fgcu:traffic:RoadSegment;1", "dtmi:fgcu:traffic:RoadSegment;2", "_v2")
+    twins = list(twins)
+    assert [t["$dtId"] for t in twins] == ["A_v2", "B_v2"] and twins[0]["avgSpeed"] == 40
+    got = {(r["$dtId"], r["$relationshipId"], r["$targetId"]) for r in rels}
+    assert got == {("A_v2", "r1", "B_v2"), ("A_v2", "r2", "S1"), ("S1", "r3_v2", "A_v2")}
+
+
+def test_upserts_resume_from_checkpoint_after_interruption(monkeypatch):
+    monkeypatch.setenv("ADT_IMPORT_BATCH", "10")
+    blob, adt = FakeBlobService(), FakeADT()
+    twins = [twin(f"SEG-{i}") for i in range(35)]
+    rels = [importer.relationship_record(f"SEG-{i}", f"SEG-{i + 1}", "connectedTo") for i in range(34)]
+
+    def interrupted():
+        def gen():
+            for i, t in enumerate(twins):
+                if i == 25:
+                    raise TimeoutError("function timeout")
+                yield t
+        return [], gen(), iter(rels)
+
+    with pytest.raises(TimeoutError):
+        importer.bulk_import(adt, blob, "seed", interrupted, mode="upsert")
+    assert adt.calls == 20
+    summary = importer.bulk_import(adt, blob, "seed", lambda: ([], iter(twins), iter(rels)), mode="upsert")
+    assert summary["resumed"] and summary["twins"] == 15 and summary["relationships"] == 34
+    assert adt.calls == 20 + 15 + 34 and len(adt.twins) == 35
+    assert "imports/checkpoints/import_seed.json" not in blob.store
+
+
+def test_upserts_resume_by_id_when_the_source_order_changes(monkeypatch):
+    monkeypatch.setenv("ADT_IMPORT_BATCH", "10")
+    blob, adt = FakeBlobService(), FakeADT()
+    twins = [twin(f"SEG-{i}") for i in range(30)]
+
+    def interrupted():
+        def gen():
+            yield from twins[:20]
+            raise TimeoutError("function timeout")
+        return [], gen(), iter([])
+
+    with pytest.raises(TimeoutError):
+        importer.bulk_import(adt, blob, "migrate", interrupted, mode="upsert")
+    # A query returns the same twins in another order on the re-run
+    summary = importer.bulk_import(adt, blob, "migrate", lambda: ([], iter(twins[::-1]), iter([])), mode="upsert")
+    assert summary["resumed"] and summary["twins"] == 10 and adt.calls == 30 and len(adt.twins) == 30
+
+
+def test_checkpoint_for_another_source_version_is_discarded(monkeypatch):
+    monkeypatch.setenv("ADT_IMPORT_BATCH", "10")
+    blob, adt = FakeBlobService(), FakeADT()
+    twins = [twin(f"SEG-{i}") for i in range(25)]
+
+    def interrupted():
+        def gen():
+            yield from twins[:15]
+            raise TimeoutError("function timeout")
+        return [], gen(), iter([])
+
+    with pytest.raises(TimeoutError):
+        importer.bulk_import(adt, blob, "seed", interrupted, mode="upsert", version='"etag-1"')
+    assert json.loads(blob.store["imports/checkpoints/import_seed.json"])["source"] == '"etag-1"'
+    summary = importer.bulk_import(adt, blob, "seed", lambda: ([], iter(twins), iter([])), mode="upsert",
+                                   version='"etag-2"')
+    assert not summary["resumed"] and summary["twins"] == 25 and adt.calls == 10 + 25
+
+
+def test_upserted_relationships_carry_no_dtid():
+    from local_backends import LocalDigitalTwinsClient
+    adt = LocalDigitalTwinsClient()
+    rels = [importer.relationship_record("SEG-1", "SEG-2", "connectedTo")]
+    importer.bulk_import(adt, FakeBlobService(), "seed", lambda: ([], iter([twin("SEG-1"), twin("SEG-2")]), iter(rels)),
+                         mode="upsert")
+    stored = adt.get_relationship("SEG-1", "SEG-1-connectedTo-SEG-2")
+    assert "$dtId" not in stored and stored["$sourceId"] == "SEG-1" and stored["$targetId"] == "SEG-2"
+
+
+class FakeResponse:
+    def __init__(self, status, body=None):
+        self.status_code, self.body, self.headers = status, body, {}
+
+    def json(self):
+        return self.body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code}")
+
+
+class FakeJobsSession:
+    def __init__(self, put_status=201, polls_until_done=2):
+        self.jobs, self.put_status, self.polls_until_done, self.requests = {}, put_status, polls_until_done, []
+
+    def request(self, method, url, headers=None, json=None, **kwargs):
+        self.requests.append(method)
+        job_id = url.split("/jobs/imports/")[1].split("?")[0]
+        assert "api-version=2023-10-31" in url and headers["Authorization"] == "Bearer tok"
+        if method == "PUT":
+            if self.put_status >= 400:
+                return FakeResponse(self.put_status)
+            self.jobs[job_id] = dict(json, id=job_id, status="notstarted", polls=0)
+            return FakeResponse(self.put_status, self.jobs[job_id])
+        job = self.jobs.get(job_id)
+        if job is None:
+            return FakeResponse(404)
+        job["polls"] += 1
+        job["status"] = "succeeded" if job["polls"] >= self.polls_until_done else "running"
+        return FakeResponse(200, job)
+
+
+class FakeCredential:
+    def get_token(self, scope):
+        assert scope == importer.ADT_SCOPE
+        return type("T", (), {"token": "tok"})()
+
+
+def test_import_job_uploads_ndjson_and_reattaches_after_timeout(monkeypatch):
+    monkeypatch.setenv("ADT_IMPORT_POLL_SECONDS", "0")
+    blob, adt = FakeBlobService(), FakeADT()
+    session = FakeJobsSession(polls_until_done=3)
+    jobs = importer.ImportJobClient("adt.example.net", FakeCredential(), session=session)
+    source = lambda: ([], iter([twin("SEG-1")]), iter([]))
+    first = importer.bulk_import(adt, blob, "seed", source, mode="job", jobs=jobs, timeout=0)
+    assert first["status"] == "running"
+    uploaded = [k for k in blob.store if k.endswith(".ndjson")]
+    assert len(uploaded) == 1 and b'"$dtId":"SEG-1"' in blob.store[uploaded[0]]
+    second = importer.bulk_import(adt, blob, "seed", source, mode="job", jobs=jobs)
+    assert second["jobId"] == first["jobId"] and second["status"] == "succeeded"
+    assert session.requests.count("PUT") == 1 and len(blob.store) == 1  # checkpoint cleared
+    assert adt.calls == 0
+
+
+def test_falls_back_to_upserts_when_the_job_cannot_start():
+    blob, adt = FakeBlobService(), FakeADT()
+    jobs = importer.ImportJobClient("https://adt.example.net", FakeCredential(), session=FakeJobsSession(put_status=403))
+    summary = importer.bulk_import(adt, blob, "seed", lambda: ([], iter([twin("SEG-1")]), iter([])), mode="job", jobs=jobs)
+    assert summary["mode"] == "upsert" and summary["twins"] == 1 and "SEG-1" in adt.twins
@@ -0,0 +1,36 @@
+import shared
+
+
+class FakeBlobService:
+    def __init__(self):
+        self.created = []
+
+    def create_container(self, name):
+        self.created.append(name)
+
+
+def test_clients_are_built_once_and_reused(monkeypatch):
+    shared.reset_clients()
+    built = []
+    fake_blob = FakeBlobService()
+    monkeypatch.setenv("ADT_ENDPOINT", "https://example.digitaltwins.azure.net")
+    monkeypatch.setenv("STORAGE_CONNECTION_STRING", "UseDevelopmentStorage=true")
+    monkeypatch.setattr(shared, "DefaultAzureCredential", lambda: built.append("cred") or object())
+    monkeypatch.setattr(shared, "DigitalTwinsClient", lambda endpoint, cred: built.append("adt") or object())
+    monkeypatch.setattr(
+        shared.BlobServiceClient, "from_connection_string",
+        staticmethod(lambda conn: built.append("blob") or fake_blob),
+    )
+
+    first = shared.get_clients()
+    second = shared.get_clients()
+    third = shared.get_clients()
+
+    assert first == second == third
+    assert sorted(built) == ["adt", "blob", "cred"]
+    # raw + predictions bootstrapped once, not once per call
+    assert sorted(fake_blob.created) == ["predictions", "raw"]
+    stats = shared.client_stats()
+    assert stats["cold"] == 3
+    assert stats["warm"] == 4
+    shared.reset_clients()
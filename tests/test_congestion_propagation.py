@@ -0,0 +1,71 @@
+import random
+
+import graph
+
+
+def reference(edges, seeds, decay, max_hops, min_impact):
+    values = dict(seeds)
+    for _ in range(max_hops):
+        nxt = dict(values)
+        for src, dst in edges:
+            if dst in values:
+                nxt[src] = max(nxt.get(src, 0.0), values[dst] * decay)
+        values = nxt
+    return {t: v for t, v in values.items() if v >= min_impact}
+
+
+def test_chain_decays_upstream_and_stops_after_max_hops():
+    g = graph.SegmentGraph([("A", "B"), ("B", "C"), ("C", "D"), ("Z", "A")])
+    out = g.propagate({"D": 1.0}, decay=0.5, max_hops=2, min_impact=0.0)
+    assert out == {"D": 1.0, "C": 0.5, "B": 0.25}
+    # Downstream segments are not affected, and tiny impacts are dropped
+    assert g.propagate({"B": 0.8}, decay=0.5, max_hops=5, min_impact=0.15) == {"B": 0.8, "A": 0.4, "Z": 0.2}
+    assert g.downstream("B") == ["C"]
+
+
+def test_matches_reference_on_random_graph():
+    rnd = random.Random(5)
+    nodes = [f"S{i}" for i in range(300)]
+    edges = {(rnd.choice(nodes), rnd.choice(nodes)) for _ in range(700)}
+    edges = [(s, t) for s, t in edges if s != t]
+    seeds = {rnd.choice(nodes): round(rnd.random(), 3) for _ in range(20)}
+    seeds["OUTSIDE"] = 0.9
+    g = graph.SegmentGraph(edges)
+    got = g.propagate(seeds, decay=0.6, max_hops=4, min_impact=0.05)
+    want = reference(edges, seeds, 0.6, 4, 0.05)
+    assert got.keys() == want.keys()
+    assert all(abs(got[t] - want[t]) < 1e-12 for t in want)
+
+
+def test_patches_reset_twins_that_no_longer_carry_propagated_congestion():
+    patches, current = graph.propagation_patches({"A": 0.5, "B": 1.0, "C": 0.25}, {"B": 1.0}, {"X": 0.3, "C": 0.5})
+    assert current == {"A": 0.5, "C": 0.25}
+    values = {t: ops[0]["value"] for t, ops in patches}
+    assert values == {"A": 0.5, "C": 0.25, "X": 0.0}
+    # A seed twin that was raised by a neighbour falls back to its own ratio
+    patches, _ = graph.propagation_patches({"B": 0.4}, {"B": 0.4}, {"B": 0.7})
+    assert patches == [("B", [{"op": "add", "path": "/congestionIndex", "value": 0.4}])]
+
+
+class FakeADT:
+    def __init__(self, edges):
+        self.edges, self.queries = edges, 0
+
+    def query_twins(self, query):
+        self.queries += 1
+        assert "RELATIONSHIPS" in query and "connectedTo" in query
+        return [{"$sourceId": s, "$targetId": t} for s, t in self.edges]
+
+
+def test_graph_is_cached_and_only_rebuilt_when_edges_change(monkeypatch):
+    monkeypatch.setenv("GRAPH_REFRESH_SECONDS", "60")
+    graph.reset_segment_graph()
+    adt = FakeADT([("A", "B")])
+    first = graph.get_segment_graph(adt, now=1000)
+    assert graph.get_segment_graph(adt, now=1030) is first
+    assert adt.queries == 1
+    assert graph.get_segment_graph(adt, now=1061) is first  # re-read, unchanged
+    adt.edges = [("A", "B"), ("B", "C")]
+    second = graph.get_segment_graph(adt, now=1200)
+    assert second is not first and second.downstream("B") == ["C"]
+    graph.reset_segment_graph()
@@ -0,0 +1,100 @@
+import types
+
+from azure.core.exceptions import ResourceNotFoundError
+
+from shared import CsvCheckpoint, iter_csv_chunks
+
+
+class FakeDownloader:
+    def __init__(self, data, offset, length, etag, piece=7):
+        end = len(data) if length is None else min(len(data), offset + length)
+        self.body = data[offset:end]
+        self.piece = piece
+        self.properties = types.SimpleNamespace(etag=etag, content_range=f"bytes {offset}-{end - 1}/{len(data)}")
+
+    def readall(self):
+        return self.body
+
+    def chunks(self):
+        for i in range(0, len(self.body), self.piece):
+            yield self.body[i:i + self.piece]
+
+
+class FakeBlob:
+    def __init__(self, store, name):
+        self.store, self.name = store, name
+
+    def download_blob(self, offset=0, length=None, etag=None, match_condition=None):
+        if self.name not in self.store:
+            raise ResourceNotFoundError(message="missing")
+        return FakeDownloader(self.store[self.name], offset, length, etag=f"etag-{len(self.store[self.name])}")
+
+    def upload_blob(self, data, overwrite=False, **_):
+        self.store[self.name] = data.encode() if isinstance(data, str) else data
+
+    def delete_blob(self):
+        self.store.pop(self.name, None)
+
+
+class FakeBlobService:
+    def __init__(self, store):
+        self.store = store
+
+    def get_blob_client(self, container, blob):
+        return FakeBlob(self.store, blob)
+
+
+def traffic_csv(n):
+    rows = [f"SEG-{i:03d},2025-10-28T12:00:00Z,{30 + i}.5,{100 + i}" for i in range(n)]
+    return ("segmentId,asOf,avgSpeed,volume\n" + "\n".join(rows)).encode()
+
+
+def test_chunks_are_bounded_and_cover_every_row():
+    svc = FakeBlobService({"traffic.csv": traffic_csv(10)})
+    chunks = list(iter_csv_chunks(svc, "raw", "traffic.csv", chunksize=4))
+    assert [len(c) for c in chunks] == [4, 4, 2]
+    assert list(chunks[-1]["segmentId"]) == ["SEG-008", "SEG-009"]
+    assert chunks[0]["avgSpeed"].tolist()[0] == 30.5
+
+
+def test_resume_after_interrupted_run_skips_committed_chunks():
+    store = {"traffic.csv": traffic_csv(10)}
+    svc = FakeBlobService(store)
+    checkpoint = CsvCheckpoint(svc, "raw", "traffic.csv")
+
+    gen = iter_csv_chunks(svc, "raw", "traffic.csv", chunksize=4, checkpoint=checkpoint)
+    next(gen)
+    next(gen)  # first chunk is committed once the second is requested
+    gen.close()  # simulated timeout while processing the second chunk
+    assert checkpoint.load()["rows"] == 4
+
+    resumed = list(iter_csv_chunks(svc, "raw", "traffic.csv", chunksize=4, checkpoint=checkpoint))
+    assert [c["segmentId"].iloc[0] for c in resumed] == ["SEG-004", "SEG-008"]
+    assert checkpoint.load() is None
+
+
+def test_resume_past_the_header_probe_on_local_blobs(tmp_path):
+    from local_backends import LocalBlobServiceClient
+    svc = LocalBlobServiceClient(str(tmp_path))
+    svc.create_container("raw")
+    svc.get_container_client("raw").upload_blob("traffic.csv", traffic_csv(4000))  # ~160 KB
+    checkpoint = CsvCheckpoint(svc, "raw", "traffic.csv")
+    gen = iter_csv_chunks(svc, "raw", "traffic.csv", chunksize=2500, checkpoint=checkpoint)
+    next(gen)
+    next(gen)
+    gen.close()
+    assert checkpoint.load()["offset"] > 64 * 1024
+    resumed = list(iter_csv_chunks(svc, "raw", "traffic.csv", chunksize=2500, checkpoint=checkpoint))
+    assert [len(c) for c in resumed] == [1500] and resumed[0]["segmentId"].iloc[0] == "SEG-2500"
+
+
+def test_quoted_line_breaks_and_explicit_dtypes():
+    from bulk import TRAFFIC_SPEC, csv_dtypes
+    data = (b'segmentId,asOf,avgSpeed,note\n007,2025-10-28T12:00:00Z,30.5,"lane 1\nclosed"\n'
+            b'008,2025-10-28T12:00:00Z,,plain\n009,2025-10-28T12:00:00Z,41,"a ""quoted""\nline\n3"\n')
+    svc = FakeBlobService({"traffic.csv": data})
+    chunks = list(iter_csv_chunks(svc, "raw", "traffic.csv", chunksize=2, dtype=csv_dtypes(TRAFFIC_SPEC)))
+    assert [len(c) for c in chunks] == [2, 1]
+    assert chunks[0]["note"].tolist()[0] == "lane 1\nclosed" and chunks[1]["note"].iloc[0] == 'a "quoted"\nline\n3'
+    # Ids keep their leading zeros and the metric column reads the same way in every chunk
+    assert chunks[0]["segmentId"].tolist() == ["007", "008"] and chunks[1]["avgSpeed"].tolist() == ["41"]
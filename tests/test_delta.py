@@ -0,0 +1,48 @@
+from delta import DeltaCache, parse_deadbands
+
+
+def ops(speed, volume, as_of="t"):
+    return [
+        {"op": "add", "path": "/avgSpeed", "value": speed},
+        {"op": "add", "path": "/volume", "value": volume},
+        {"op": "add", "path": "/asOf", "value": as_of},
+    ]
+
+
+def test_parse_deadbands():
+    assert parse_deadbands("avgSpeed=1, /volume=5,bogus") == {"/avgSpeed": 1.0, "/volume": 5.0}
+
+
+def test_unchanged_and_deadbanded_ops_are_dropped():
+    cache = DeltaCache(max_twins=10, refresh_seconds=3600, deadbands={"/avgSpeed": 1.0})
+    first = cache.filter("SEG-1", ops(40.0, 800.0, "t0"), now=0)
+    assert len(first) == 3
+    cache.commit("SEG-1", first, now=0)
+
+    # Speed moved < 1 mph, volume identical: only timestamps differ -> nothing sent
+    assert cache.filter("SEG-1", ops(40.6, 800.0, "t1"), now=60) == []
+    # Volume changed: volume + asOf go, speed stays suppressed
+    sent = cache.filter("SEG-1", ops(40.6, 900.0, "t2"), now=120)
+    assert [op["path"] for op in sent] == ["/volume", "/asOf"]
+    cache.commit("SEG-1", sent, now=120)
+    # Deadband is measured against the last written value, so drift accumulates
+    assert [op["path"] for op in cache.filter("SEG-1", ops(41.2, 900.0), now=180)] == ["/avgSpeed", "/asOf"]
+
+
+def test_forced_refresh_and_snapshot_roundtrip():
+    cache = DeltaCache(max_twins=10, refresh_seconds=300, deadbands={})
+    cache.commit("SEG-1", ops(40.0, 800.0), now=0)
+    assert cache.filter("SEG-1", ops(40.0, 800.0), now=100) == []
+    assert len(cache.filter("SEG-1", ops(40.0, 800.0), now=400)) == 3
+
+    restored = DeltaCache(max_twins=10, refresh_seconds=300, deadbands={})
+    restored.load_bytes(cache.to_bytes())
+    assert restored.filter("SEG-1", ops(40.0, 800.0), now=100) == []
+
+
+def test_lru_evicts_oldest_twin():
+    cache = DeltaCache(max_twins=2, refresh_seconds=3600, deadbands={})
+    for i in range(3):
+        cache.commit(f"SEG-{i}", ops(40.0, 800.0), now=0)
+    assert len(cache) == 2
+    assert len(cache.filter("SEG-0", ops(40.0, 800.0), now=1)) == 3
@@ -0,0 +1,132 @@
+import math
+
+import numpy as np
+
+import features
+
+T0 = 1_761_652_800  # 2025-10-28 12:00 UTC, a Tuesday
+
+
+def test_ewma_rolling_volume_and_incident_decay(monkeypatch):
+    monkeypatch.setenv("FEATURE_EWMA_MINUTES", "30")
+    monkeypatch.setenv("FEATURE_INCIDENT_HALF_LIFE_HOURS", "24")
+    store = features.FeatureStore()
+    store.update_traffic(["A", "B"], [60.0, float("nan")], [100.0, 40.0], T0)
+    store.update_traffic(["A"], [30.0], [50.0], T0 + 1800)
+    snap = store.snapshot(T0 + 1800)
+    a = snap["twinId"].index("A")
+    assert math.isclose(snap["ewmaSpeed"][a], 60 + (1 - math.exp(-1)) * (30 - 60), rel_tol=1e-6)
+    assert snap["rollingVolume"][a] == 150.0
+    # Buckets older than an hour drop out of the rolling volume
+    assert store.snapshot(T0 + 3 * 3600)["rollingVolume"][a] == 0.0
+    store.record_incidents(["A", "A", "B"], T0)
+    later = store.snapshot(T0 + 24 * 3600)
+    assert math.isclose(later["incidentScore"][a], 1.0, rel_tol=1e-6)
+    assert later["incidentTotal"].tolist() == [2, 1]
+
+
+def test_speed_percentile_against_time_of_day_baseline():
+    store = features.FeatureStore()
+    week = 7 * 86400
+    for w, speed in enumerate([60.0, 62.0, 58.0, 61.0]):
+        store.update_traffic(["A"], [speed], [0.0], T0 + w * week)
+        if w < features.BASELINE_MIN_N:
+            assert np.isnan(store.snapshot()["speedPercentile"][0])
+    assert 0.3 < store.snapshot()["speedPercentile"][0] < 0.8
+    store.update_traffic(["A"], [20.0], [0.0], T0 + 4 * week)
+    assert store.snapshot()["speedPercentile"][0] < 0.01
+    # Saturday at the same hour has its own, still empty, baseline
+    saturday = T0 + 4 * week + 4 * 86400
+    assert features.time_slot(saturday) != features.time_slot(T0)
+    store.update_traffic(["A"], [20.0], [0.0], saturday)
+    assert np.isnan(store.snapshot()["speedPercentile"][0])
+
+
+def test_saved_store_memory_maps_and_keeps_growing(tmp_path):
+    path = str(tmp_path / "features.npy")
+    store = features.FeatureStore()
+    store.update_traffic([f"S{i}" for i in range(40)], np.arange(40.0), np.ones(40), T0)
+    store.save(path)
+    mapped = features.FeatureStore.open(path)
+    assert isinstance(mapped.table, np.memmap) and len(mapped) == 40
+    assert mapped.snapshot(T0)["ewmaSpeed"][7] == 7.0
+    # A read-only mapping is copied on first write rather than failing
+    mapped.record_incidents(["S1"], T0)
+    mapped.update_traffic(["S1", "NEW"], [5.0, 9.0], [1.0, 1.0], T0 + 300)
+    assert len(mapped) == 41 and mapped.snapshot()["twinId"][-1] == "NEW"
+
+
+class FakeDownloader:
+    def __init__(self, data, etag):
+        self.data, self.properties = data, type("P", (), {"etag": etag})()
+
+    def readall(self):
+        return self.data
+
+
+class FakeBlob:
+    def __init__(self, shared):
+        self.shared = shared
+
+    def download_blob(self, etag=None, match_condition=None):
+        from azure.core.exceptions import ResourceNotFoundError, ResourceNotModifiedError
+        if self.shared.get("data") is None:
+            raise ResourceNotFoundError("missing")
+        if etag is not None and etag == self.shared["etag"]:
+            raise ResourceNotModifiedError("same")
+        return FakeDownloader(self.shared["data"], self.shared["etag"])
+
+    def upload_blob(self, data, overwrite=False, etag=None, match_condition=None):
+        from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+        if not overwrite and self.shared.get("data") is not None:
+            raise ResourceExistsError("exists")
+        if etag is not None and etag != self.shared["etag"]:
+            raise ResourceModifiedError("changed")
+        self.shared["version"] = self.shared.get("version", 0) + 1
+        self.shared.update(data=data, etag=f"v{self.shared['version']}")
+        return {"etag": self.shared["etag"]}
+
+
+class FakeBlobService:
+    def __init__(self):
+        self.shared = {}
+
+    def get_blob_client(self, container, blob):
+        assert blob == "state/features.npy"
+        return FakeBlob(self.shared)
+
+
+def test_commit_reapplies_after_a_concurrent_write(monkeypatch):
+    monkeypatch.delenv("FEATURE_STORE_LOCAL_PATH", raising=False)
+    features.reset_feature_store()
+    svc = FakeBlobService()
+    features.commit_feature_store(svc, lambda s: s.update_traffic(["A"], [50.0], [10.0], T0))
+    # Another worker saves in between; this worker's cached copy is stale
+    other = features.FeatureStore.from_bytes(svc.shared["data"])
+    other.record_incidents(["A"], T0)
+    FakeBlob(svc.shared).upload_blob(other.to_bytes(), overwrite=True)
+    store = features.commit_feature_store(svc, lambda s: s.update_traffic(["B"], [40.0], [5.0], T0 + 300))
+    saved = features.FeatureStore.from_bytes(svc.shared["data"]).snapshot(T0 + 300)
+    assert saved["twinId"] == ["A", "B"] and saved["incidentTotal"].tolist() == [1, 0]
+    assert store.etag == svc.shared["etag"]
+    features.reset_feature_store()
+
+
+def test_long_twin_ids_are_kept_whole_or_rejected(tmp_path):
+    store = features.FeatureStore()
+    base = "dtmi-segment-" + "x" * 100
+    store.update_traffic([base + "-east", base + "-west"], [40.0, 50.0], [1.0, 1.0], T0)
+    assert len(store) == 2 and store.snapshot()["twinId"] == [base + "-east", base + "-west"]
+    too_long = "y" * (features.TWIN_ID_BYTES + 1)
+    store.update_traffic([too_long, base + "-east"], [10.0, 45.0], [1.0, 1.0], T0 + 300)
+    store.record_incidents([too_long], T0)
+    assert len(store) == 2 and store.snapshot()["lastSpeed"][0] == 45.0
+    # A store saved with the old 64-byte field is widened, not discarded
+    old = np.zeros(1, dtype=[(n, "S64" if n == "twinId" else store.table.dtype[n]) for n in store.table.dtype.names])
+    old["twinId"] = b"S1"
+    old["ewmaSpeed"] = 33.0
+    path = str(tmp_path / "old.npy")
+    np.save(path, old)
+    widened = features.FeatureStore.open(path)
+    assert widened.table.dtype == features.FEATURE_DTYPE and widened.rows(["S1"])[0] == 0
+    assert widened.snapshot()["ewmaSpeed"][0] == 33.0
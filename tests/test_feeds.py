@@ -0,0 +1,164 @@
+import json
+import types
+
+import pytest
+
+import feeds
+
+
+class FakeResponse:
+    def __init__(self, status, headers=None, text=""):
+        self.status_code, self.headers, self.text = status, headers or {}, text
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses, self.calls = list(responses), []
+
+    def request(self, method, url, **kwargs):
+        self.calls.append(kwargs.get("headers") or {})
+        return self.responses.pop(0)
+
+
+class FakeStateBlob:
+    def __init__(self, store):
+        self.store = store
+
+    def download_blob(self):
+        if "data" not in self.store:
+            raise FileNotFoundError("missing")
+        return types.SimpleNamespace(readall=lambda: self.store["data"])
+
+    def upload_blob(self, data, overwrite=False):
+        self.store["data"] = data.encode()
+
+
+class FakeBlobService:
+    def __init__(self):
+        self.store = {}
+
+    def get_blob_client(self, container, blob):
+        return FakeStateBlob(self.store)
+
+
+def test_unchanged_feed_short_circuits_only_after_commit(monkeypatch):
+    feeds.reset_feed_state()
+    session = FakeSession([
+        FakeResponse(200, {"ETag": '"a"'}, "feed"),
+        FakeResponse(200, {"ETag": '"a"'}, "feed"),
+        FakeResponse(304),
+    ])
+    assert feeds.conditional_get(session, "u").text == "feed"
+    # Not committed yet: the next request is unconditional
+    assert feeds.conditional_get(session, "u").text == "feed"
+    assert "If-None-Match" not in session.calls[1]
+    feeds.commit_validators("u")
+    assert feeds.conditional_get(session, "u") is None
+    assert session.calls[2]["If-None-Match"] == '"a"'
+
+
+def test_retries_with_backoff_and_honours_retry_after(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(feeds.time, "sleep", sleeps.append)
+    session = FakeSession([FakeResponse(429, {"Retry-After": "3"}), FakeResponse(503), FakeResponse(200)])
+    resp = feeds.request_with_backoff(session, "GET", "u", max_retries=4)
+    assert resp.status_code == 200
+    assert sleeps[0] == 3.0
+    assert 0 <= sleeps[1] <= 2.0
+
+    session = FakeSession([FakeResponse(503), FakeResponse(503)])
+    assert feeds.request_with_backoff(session, "GET", "u", max_retries=1).status_code == 503
+
+
+def test_unread_responses_are_closed(monkeypatch):
+    feeds.reset_feed_state()
+    monkeypatch.setattr(feeds.time, "sleep", lambda s: None)
+    throttled, ok = FakeResponse(429), FakeResponse(200, {"ETag": '"a"'})
+    assert feeds.request_with_backoff(FakeSession([throttled, ok]), "GET", "u", stream=True) is ok
+    assert throttled.closed and not ok.closed
+    not_modified = FakeResponse(304)
+    assert feeds.conditional_get(FakeSession([not_modified]), "u", stream=True) is None
+    assert not_modified.closed
+
+
+def test_validators_and_cookies_survive_cold_start():
+    feeds.reset_feed_state()
+    svc = FakeBlobService()
+    session = feeds.get_session("ritis")
+    session.cookies.set("auth", "tok", domain="example.org", path="/")
+    feeds.conditional_get(FakeSession([FakeResponse(200, {"Last-Modified": "Mon"})]), "u")
+    feeds.commit_validators("u")
+    feeds.save_feed_state(svc)
+    assert json.loads(svc.store["data"])["validators"]["u"]["last_modified"] == "Mon"
+
+    feeds.reset_feed_state()
+    feeds.load_feed_state(svc)
+    assert feeds.get_session("ritis").cookies.get("auth") == "tok"
+    probe = FakeSession([FakeResponse(304)])
+    assert feeds.conditional_get(probe, "u") is None
+    assert probe.calls[0]["If-Modified-Since"] == "Mon"
+    feeds.reset_feed_state()
+
+
+def _chunks(data: bytes, size: int):
+    return (data[i:i + size] for i in range(0, len(data), size))
+
+
+def test_streams_records_across_any_chunk_boundary():
+    body = json.dumps({
+        "meta": {"count": 3, "tags": ["x"]},
+        "records": [{"id": "SEG1", "speed": 123.5, "name": "café"}, {"id": "SEG2"}, 4567],
+        "items": [{"id": "ignored"}],
+    }, ensure_ascii=False).encode()
+    expected = [{"id": "SEG1", "speed": 123.5, "name": "café"}, {"id": "SEG2"}, 4567]
+    for size in (1, 2, 3, 7, 64, len(body)):
+        assert list(feeds.iter_json_records(_chunks(body, size))) == expected
+
+
+def test_bare_array_and_flatten_fallback():
+    assert list(feeds.iter_json_records(_chunks(b' [1, {"a": [2]}] ', 2))) == [1, {"a": [2]}]
+    body = b'{"north": [{"id": 1}], "n": 2, "south": [{"id": 2}]}'
+    assert list(feeds.iter_json_records(_chunks(body, 5))) == [{"id": 1}, {"id": 2}]
+    with pytest.raises(ValueError):
+        list(feeds.iter_json_records(_chunks(b'"text"', 2)))
+
+
+def test_truncated_body_raises_while_iterating():
+    records = feeds.iter_json_records(_chunks(b'{"data": [{"id": 1}, {"id": ', 4))
+    assert next(records) == {"id": 1}
+    try:
+        next(records)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("truncated body should fail")
+
+
+class JsonResponse(FakeResponse):
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return json.loads(self.text)
+
+
+def test_unreadable_fdot_body_fails_the_run_and_keeps_validators(monkeypatch):
+    import importlib.util
+    from pathlib import Path
+    path = Path("functions/adt_ingest/fetch_dot_traffic/__init__.py").resolve()
+    spec = importlib.util.spec_from_file_location("fetch_dot_traffic", str(path))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    monkeypatch.setenv("FDOT_TRAFFIC_API_URL", "u")
+    monkeypatch.setenv("FDOT_STREAM", "false")
+    for body in ("{not json", '"a string"'):
+        feeds.reset_feed_state()
+        monkeypatch.setattr(mod, "get_session", lambda name: FakeSession([JsonResponse(200, {"ETag": '"v1"'}, body)]))
+        counts = {"raw": 0, "error": None}
+        assert list(mod.iter_normalized(mod.fetch_fdot_json(), counts)) == []
+        assert counts["error"] is not None
+    feeds.reset_feed_state()
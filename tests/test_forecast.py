@@ -0,0 +1,65 @@
+import importlib.util
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from bulk import PREDICTION_ALIASES, PREDICTION_SPEC, coerce_frame
+from history_store import HistoryStore, LocalBackend
+
+
+def load_forecast():
+    path = Path(__file__).resolve().parent.parent / "ml" / "forecast.py"
+    spec = importlib.util.spec_from_file_location("forecast", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_beats_persistence_and_seasonal_baselines_on_synthetic_history():
+    fc = load_forecast()
+    twin_ids, speed, volume, incidents, start_ts = fc.synthetic_history(300, 7)
+    train = speed.shape[1] - 96
+    model = fc.CongestionForecaster().fit(twin_ids, speed[:, :train], volume[:, :train], incidents[:, :train], start_ts)
+    model.speed, model.volume, model.incidents = speed, volume, incidents
+    slots = fc.time_slots(start_ts, speed.shape[1] + 4)
+    model_err, persist_err, seasonal_err = [], [], []
+    for now in range(train, speed.shape[1] - 4, 8):
+        actual = speed[:, now + 4]
+        ok = np.isfinite(actual) & np.isfinite(speed[:, now])
+        model_err.append(np.abs(model.predict(now)[60]["speed"] - actual)[ok])
+        persist_err.append(np.abs(speed[:, now] - actual)[ok])
+        seasonal_err.append(np.abs(model.profile[:, slots[now + 4]] - actual)[ok])
+    mae = [float(np.mean(np.concatenate(e))) for e in (model_err, persist_err, seasonal_err)]
+    assert mae[0] < mae[1] and mae[0] < mae[2]
+
+
+def test_payload_is_accepted_by_write_predictions_coercion():
+    fc = load_forecast()
+    twin_ids, speed, volume, incidents, start_ts = fc.synthetic_history(20, 3)
+    model = fc.CongestionForecaster((15, 30)).fit(twin_ids, speed, volume, incidents, start_ts)
+    payload = fc.to_payload(twin_ids, model.predict(), 30, model.issued_at())
+    assert len(payload) == 20
+    assert payload[0]["predictionHorizon"] == "PT30M"
+    assert all(0.0 <= p["predictedCongestionIndex"] <= 1.0 for p in payload)
+    clean, bad = coerce_frame(pd.DataFrame.from_records(payload), PREDICTION_SPEC, PREDICTION_ALIASES)
+    assert not bad and len(clean) == 20
+
+
+def test_grids_are_built_from_the_history_store(tmp_path):
+    fc = load_forecast()
+    store = HistoryStore(LocalBackend(str(tmp_path)), compact=False)
+    end = datetime(2025, 10, 28, 12, 0, tzinfo=timezone.utc)
+    for i in range(8):
+        when = end - timedelta(minutes=15 * (8 - i))
+        store.append("traffic", [
+            {"twinId": "A", "avgSpeed": 50 + i, "volume": 100},
+            {"twinId": "B", "avgSpeed": None, "volume": 80},
+        ], when)
+    store.append("incidents", [{"twinId": "A", "status": "active", "transition": "new"}], end - timedelta(minutes=40))
+    twin_ids, speed, volume, incidents, start_ts = fc.load_history(store, end, days=1)
+    assert twin_ids == ["A", "B"]
+    assert speed.shape[1] == 96 and speed[0, -1] == 57 and np.isnan(speed[1]).all()
+    assert volume[1, -1] == 80
+    assert incidents[0, -3:].tolist() == [1.0, 1.0, 1.0] and incidents[0, :-3].sum() == 0
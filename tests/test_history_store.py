@@ -0,0 +1,98 @@
+from datetime import datetime, timedelta, timezone
+
+from history_store import HistoryStore, LocalBackend
+
+
+def tick(store, when, speeds):
+    store.append("traffic", [
+        {"twinId": seg, "externalId": seg.lower(), "avgSpeed": speed, "volume": 100.0, "asOf": when.isoformat()}
+        for seg, speed in speeds.items()
+    ], when=when)
+
+
+def test_scan_prunes_by_time_and_segment(tmp_path):
+    store = HistoryStore(LocalBackend(str(tmp_path)), compact=False)
+    t0 = datetime(2025, 10, 28, 11, 55, tzinfo=timezone.utc)
+    for i in range(4):
+        tick(store, t0 + timedelta(minutes=5 * i), {"SEG-1": 40.0 + i, "SEG-2": 20.0 + i})
+
+    rows = list(store.scan(
+        "traffic", t0 + timedelta(minutes=5), t0 + timedelta(minutes=15),
+        segments=["SEG-1"], columns=["ts", "avgSpeed"],
+    ))
+    assert rows == [
+        {"ts": int((t0 + timedelta(minutes=5)).timestamp()), "avgSpeed": 41.0},
+        {"ts": int((t0 + timedelta(minutes=10)).timestamp()), "avgSpeed": 42.0},
+    ]
+    # Files land in date/hour partitions
+    names = sorted(name for name, _ in store.backend.list("history/traffic/"))
+    assert any("/date=2025-10-28/hour=11/" in n for n in names)
+    assert any("/date=2025-10-28/hour=12/" in n for n in names)
+
+
+def test_compaction_merges_day_into_single_file(tmp_path):
+    store = HistoryStore(LocalBackend(str(tmp_path)), compact=True)
+    day = datetime(2025, 10, 28, 0, 0, tzinfo=timezone.utc)
+    for h in range(0, 24, 6):
+        tick(store, day + timedelta(hours=h), {"SEG-1": float(h)})
+
+    # First write on the next day compacts the previous one
+    tick(store, day + timedelta(days=1, minutes=5), {"SEG-1": 99.0})
+    names = [name for name, _ in store.backend.list("history/traffic/date=2025-10-28/")]
+    assert names == ["history/traffic/date=2025-10-28/daily.ndjson.gz"]
+
+    speeds = [r["avgSpeed"] for r in store.scan("traffic", day, day + timedelta(days=2))]
+    assert speeds == [0.0, 6.0, 12.0, 18.0, 99.0]
+
+
+def test_compaction_is_claimed_and_merges_late_files_in_order(tmp_path):
+    from history_store import BlobBackend
+    from local_backends import LocalBlobServiceClient
+    blob = LocalBlobServiceClient(str(tmp_path))
+    blob.create_container("raw")
+    store = HistoryStore(BlobBackend(blob, "raw"), compact=False)
+    day = datetime(2025, 10, 28, 0, 0, tzinfo=timezone.utc)
+    for h in (3, 9, 15):
+        tick(store, day + timedelta(hours=h), {"SEG-1": float(h)})
+
+    # Another worker holds the day's claim: nothing is touched
+    assert store.backend.claim("history/_compaction/traffic/2025-10-28.lock", 60)
+    assert store.compact("traffic", day.date()) is None
+    store.backend.release("history/_compaction/traffic/2025-10-28.lock")
+
+    assert store.compact_recent(days=1, now=day + timedelta(days=1, hours=1)) == 3
+    # A late file for an earlier hour is merged with the existing daily file in ts order
+    tick(store, day + timedelta(hours=6), {"SEG-1": 6.0})
+    assert store.compact("traffic", day.date()) == 1
+    names = [name for name, _ in store.backend.list("history/traffic/date=2025-10-28/")]
+    assert names == ["history/traffic/date=2025-10-28/daily.ndjson.gz"]
+    meta = dict(store.backend.list("history/traffic/date=2025-10-28/"))[names[0]]
+    assert meta["rows"] == "4" and int(meta["min_ts"]) == int((day + timedelta(hours=3)).timestamp())
+    assert [r["avgSpeed"] for r in store.scan("traffic", day, day + timedelta(days=1))] == [3.0, 6.0, 9.0, 15.0]
+    assert not list(store.backend.list("history/_compaction/"))
+
+
+def test_files_left_by_an_interrupted_compaction_are_not_merged_twice(tmp_path, monkeypatch):
+    import history_store
+    monkeypatch.setattr(history_store, "_compacted", set())
+    store = HistoryStore(LocalBackend(str(tmp_path)), compact=True)
+    day = datetime(2025, 10, 28, 0, 0, tzinfo=timezone.utc)
+    for h in (3, 9):
+        tick(store, day + timedelta(hours=h), {"SEG-1": float(h)})
+    delete = store.backend.delete
+
+    def crash(name):
+        raise OSError("worker recycled")
+
+    # The daily file is written, then the worker dies before deleting the hourly files
+    monkeypatch.setattr(store.backend, "delete", crash)
+    tick(store, day + timedelta(days=1), {"SEG-1": 99.0})
+    assert len(list(store.backend.list("history/traffic/date=2025-10-28/"))) == 3
+    assert ("traffic", day.date()) not in history_store._compacted  # so the next append tries again
+
+    monkeypatch.setattr(store.backend, "delete", delete)
+    tick(store, day + timedelta(days=1, minutes=5), {"SEG-1": 98.0})
+    names = [name for name, _ in store.backend.list("history/traffic/date=2025-10-28/")]
+    assert names == ["history/traffic/date=2025-10-28/daily.ndjson.gz"]
+    assert [r["avgSpeed"] for r in store.scan("traffic", day, day + timedelta(days=1))] == [3.0, 9.0]
+    assert ("traffic", day.date()) in history_store._compacted
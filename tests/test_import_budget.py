@@ -0,0 +1,29 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+import shared
+
+path = Path("benchmarks/bench_import_time.py").resolve()
+spec = importlib.util.spec_from_file_location("bench_import_time", str(path))
+bench = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(bench)
+
+BUDGET = bench.load_budget()
+
+
+def test_every_http_function_has_a_budget():
+    assert sorted(bench.functions(http_only=True)) == sorted(BUDGET["functions"])
+
+
+@pytest.mark.parametrize("name", sorted(BUDGET["functions"]))
+def test_http_function_import_stays_within_budget(name):
+    result = bench.measure(name, runs=2)
+    assert bench.violations([result], BUDGET) == [], result["top_packages"][:5]
+
+
+def test_lazy_sdk_classes_stay_reachable_on_shared():
+    assert shared.BlobServiceClient.__module__.startswith("azure.storage.blob")
+    with pytest.raises(AttributeError):
+        shared.NotAClient
@@ -0,0 +1,97 @@
+import importlib.util
+from pathlib import Path
+
+import shared
+
+
+def load_module():
+    path = Path("functions/adt_ingest/fetch_ritis_incidents/__init__.py").resolve()
+    spec = importlib.util.spec_from_file_location("fetch_ritis_incidents", str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def entry(guid, desc, title="Crash on I-75"):
+    return {"id": guid, "title": title, "description": desc, "published": "Tue, 28 Oct 2025 12:00:00 GMT"}
+
+
+LANES = "Segment {seg} Lane Status: 1 out of 2 lanes affected Right lane blocked (NB) Last Update Time: 2025-10-28 12:{m:02d}:00-04:00"
+
+
+def test_unchanged_entries_are_skipped_and_vanished_ones_expire(monkeypatch):
+    mod = load_module()
+    seg_map = shared.SegmentMap([("A1", "SEG-001"), ("B2", "SEG-002")])
+    now = "2025-10-28T16:00:00+00:00"
+
+    feed1 = [entry("g1", LANES.format(seg="A1", m=0)), entry("g2", LANES.format(seg="B2", m=0))]
+    state, changed, patches = mod.reconcile(feed1, {}, seg_map, now)
+    assert [c["transition"] for c in changed] == ["new", "new"]
+    assert sorted(t for t, _ in patches) == ["SEG-001", "SEG-002"]
+
+    # Same content again: nothing is parsed or patched
+    calls = []
+    monkeypatch.setattr(mod, "parse_entry", lambda *a: calls.append(a))
+    state, changed, patches = mod.reconcile(feed1, state, seg_map, now)
+    assert (changed, patches, calls) == ([], [], [])
+    monkeypatch.undo()
+
+    # g1 gets a new Last Update Time, g2 disappears from the feed
+    feed2 = [entry("g1", LANES.format(seg="A1", m=10))]
+    state, changed, patches = mod.reconcile(feed2, state, seg_map, now)
+    assert {c["transition"] for c in changed} == {"updated", "expired"}
+    cleared = [ops for twin, ops in patches if twin == "SEG-002"]
+    assert cleared and {"op": "add", "path": "/status", "value": "cleared"} in cleared[0]
+    assert set(state) == {"g1"}
+
+
+def test_reparse_patches_everything_but_reports_only_changes():
+    mod = load_module()
+    seg_map = shared.SegmentMap([("A1", "SEG-001"), ("B2", "SEG-002")])
+    feed = [entry("g1", LANES.format(seg="A1", m=0)), entry("g2", LANES.format(seg="B2", m=0))]
+    state, _, _ = mod.reconcile(feed, {}, seg_map, "now")
+    feed[1] = entry("g2", LANES.format(seg="B2", m=5))
+    state, changed, patches = mod.reconcile(feed, state, seg_map, "later", reparse=True)
+    assert [(c["externalSegmentId"], c["transition"]) for c in changed] == [("B2", "updated")]
+    assert sorted(t for t, _ in patches) == ["SEG-001", "SEG-002"]
+    assert state["g1"]["incident"]["transition"] == "new" and state["g1"]["incident"]["ingested"] == "later"
+
+
+def test_empty_feed_keeps_state():
+    mod = load_module()
+    seg_map = shared.SegmentMap([("A1", "SEG-001")])
+    state, _, _ = mod.reconcile([entry("g1", LANES.format(seg="A1", m=0))], {}, seg_map, "now")
+    kept, changed, patches = mod.reconcile([], state, seg_map, "later")
+    assert kept == state and changed == [] and patches == []
+
+
+def test_fingerprints_of_unwritten_twins_are_held_back_for_a_retry():
+    mod = load_module()
+    seg_map = shared.SegmentMap([("A1", "SEG-001"), ("B2", "SEG-002"), ("C3", "SEG-003")])
+    feed1 = [entry("g1", LANES.format(seg="A1", m=0)), entry("g2", LANES.format(seg="B2", m=0))]
+    previous, _, _ = mod.reconcile(feed1, {}, seg_map, "now")
+
+    # g1 updated, g2 expired, g3 new; the writes for SEG-001 and SEG-002 fail, SEG-003 succeeds
+    feed2 = [entry("g1", LANES.format(seg="A1", m=10)), entry("g3", LANES.format(seg="C3", m=0))]
+    state, _, _ = mod.reconcile(feed2, previous, seg_map, "later")
+    state = mod.hold_back_unwritten(state, previous, {"SEG-001", "SEG-002"})
+    assert state["g1"]["fp"] == previous["g1"]["fp"] and state["g2"] == previous["g2"]
+    assert state["g3"]["incident"]["twinId"] == "SEG-003"
+
+    # The next run re-sends both failed writes
+    _, changed, patches = mod.reconcile(feed2, state, seg_map, "retry")
+    assert {c["transition"] for c in changed} == {"updated", "expired"}
+    assert sorted(t for t, _ in patches) == ["SEG-001", "SEG-002"]
+    # A failed write for a brand-new incident leaves it unseen, so it is "new" again next run
+    state, _, _ = mod.reconcile(feed2, previous, seg_map, "later")
+    assert "g3" not in mod.hold_back_unwritten(state, previous, {"SEG-003"})
+
+
+def test_unwritten_shard_twins_are_resent():
+    mod = load_module()
+    previous = {
+        "g1": {"fp": "a", "misses": 0, "incident": {"twinId": "SEG-001;SEG-009", "status": "active"}},
+        "g2": {"fp": "b", "misses": 0, "incident": {"twinId": "SEG-002", "status": "active"}},
+    }
+    previous = mod.resend_unwritten(previous, {"SEG-009": 100})
+    assert previous["g1"]["fp"] is None and previous["g2"]["fp"] == "b"
@@ -0,0 +1,93 @@
+import gzip
+import importlib.util
+import json
+from pathlib import Path
+
+import azure.functions as func
+from azure.core.paging import ItemPaged
+
+import shared
+
+
+def load_module():
+    path = Path("functions/adt_ingest/list_segments/__init__.py").resolve()
+    spec = importlib.util.spec_from_file_location("list_segments", str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class FakeADTClient:
+    """Serves query_twins in pages of the max-items-per-page header using integer offsets as tokens."""
+
+    def __init__(self, n):
+        self.twins = [{"$dtId": f"SEG-{i:03d}", "avgSpeed": float(i), "volume": 10.0 * i} for i in range(n)]
+        self.queries = []
+
+    def query_twins(self, query, headers=None):
+        self.queries.append(query)
+        size = int((headers or {}).get("max-items-per-page", 100))
+        projected = not query.startswith("SELECT seg FROM")
+
+        def get_next(token=None):
+            start = int(token or 0)
+            end = start + size
+            return start, end
+
+        def extract(bounds):
+            start, end = bounds
+            rows = self.twins[start:end]
+            if not projected:
+                rows = [{"seg": r} for r in rows]
+            return (str(end) if end < len(self.twins) else None), iter(rows)
+
+        return ItemPaged(get_next, extract)
+
+
+def request(params=None, headers=None):
+    return func.HttpRequest(method="GET", url="/api/segments", params=params or {}, headers=headers or {}, body=b"")
+
+
+def test_limit_pages_through_adt_continuation_tokens(monkeypatch):
+    mod = load_module()
+    adt = FakeADTClient(5)
+    monkeypatch.setattr(mod, "get_adt_client", lambda: adt)
+
+    seen, token = [], None
+    while True:
+        params = {"limit": "2", "fields": "avgSpeed"}
+        if token:
+            params["continuationToken"] = token
+        resp = mod.main(request(params))
+        assert resp.status_code == 200
+        seen.extend(json.loads(resp.get_body()))
+        token = resp.headers.get("X-Continuation-Token")
+        if not token:
+            break
+
+    assert [r["segmentId"] for r in seen] == [f"SEG-{i:03d}" for i in range(5)]
+    assert seen[1] == {"segmentId": "SEG-001", "avgSpeed": 1.0}
+    assert adt.queries[0].startswith("SELECT seg.$dtId, seg.avgSpeed FROM")
+
+
+def test_unknown_field_is_rejected(monkeypatch):
+    mod = load_module()
+    monkeypatch.setattr(mod, "get_adt_client", lambda: FakeADTClient(1))
+    resp = mod.main(request({"fields": "avgSpeed,1=1 OR seg.x"}))
+    assert resp.status_code == 400
+
+
+def test_cached_path_supports_ndjson_gzip_and_etag(monkeypatch):
+    mod = load_module()
+    adt = FakeADTClient(3)
+    monkeypatch.setattr(mod, "get_adt_client", lambda: adt)
+    monkeypatch.setattr(shared, "_segment_model", shared.SegmentReadModel(ttl=300))
+
+    resp = mod.main(request({"format": "ndjson"}, {"Accept-Encoding": "gzip"}))
+    assert resp.headers["Content-Encoding"] == "gzip"
+    lines = gzip.decompress(resp.get_body()).decode().splitlines()
+    assert [json.loads(line)["segmentId"] for line in lines] == ["SEG-000", "SEG-001", "SEG-002"]
+
+    again = mod.main(request(headers={"If-None-Match": resp.headers["ETag"]}))
+    assert again.status_code == 304
+    assert len(adt.queries) == 1
@@ -0,0 +1,109 @@
+import importlib.util
+import json
+from pathlib import Path
+
+import pytest
+from azure.core import MatchConditions
+from azure.core.exceptions import (ResourceExistsError, ResourceModifiedError, ResourceNotFoundError,
+                                   ResourceNotModifiedError)
+
+import shared
+from local_backends import LocalBlobServiceClient, LocalDigitalTwinsClient
+from patching import PatchDispatcher
+
+MODEL = "dtmi:fgcu:traffic:RoadSegment;1"
+
+
+def test_get_clients_selects_local_backends(monkeypatch, tmp_path):
+    monkeypatch.setenv("ADT_BACKEND", "local")
+    monkeypatch.setenv("BLOB_BACKEND", "local")
+    monkeypatch.setenv("LOCAL_BLOB_ROOT", str(tmp_path))
+    shared.reset_clients()
+    adt, blob = shared.get_clients()
+    assert isinstance(adt, LocalDigitalTwinsClient) and isinstance(blob, LocalBlobServiceClient)
+    assert shared.get_clients() == (adt, blob)
+    assert (tmp_path / "raw").is_dir() and (tmp_path / "predictions").is_dir()
+    shared.reset_clients()
+
+
+def test_blob_etags_conditions_and_listing(tmp_path):
+    svc = LocalBlobServiceClient(str(tmp_path))
+    with pytest.raises(ResourceNotFoundError):
+        svc.get_blob_client("raw", "a.json").upload_blob(b"x")
+    svc.create_container("raw")
+    bc = svc.get_blob_client("raw", "state/a.json")
+    first = bc.upload_blob(b'{"v": 1}', metadata={"ts": "1"})
+    with pytest.raises(ResourceExistsError):
+        bc.upload_blob(b"again")
+    with pytest.raises(ResourceNotModifiedError):
+        bc.download_blob(etag=first["etag"], match_condition=MatchConditions.IfModified)
+    second = bc.upload_blob(b'{"v": 2}', overwrite=True, etag=first["etag"],
+                            match_condition=MatchConditions.IfNotModified)
+    with pytest.raises(ResourceModifiedError):
+        bc.upload_blob(b"stale", overwrite=True, etag=first["etag"], match_condition=MatchConditions.IfNotModified)
+    down = bc.download_blob(offset=2, length=3)
+    assert down.readall() == b'v":' and down.properties.etag == second["etag"]
+    assert bc.get_blob_properties().metadata == {}
+    svc.get_container_client("raw").upload_blob("state/b.json", b"{}", metadata={"k": "v"})
+    listed = [(b.name, b.metadata) for b in svc.get_container_client("raw").list_blobs(name_starts_with="state/")]
+    assert listed == [("state/a.json", {}), ("state/b.json", {"k": "v"})]
+    bc.delete_blob()
+    assert not bc.exists()
+
+
+def test_adt_queries_paging_and_patches():
+    adt = LocalDigitalTwinsClient()
+    adt.seed([{"$dtId": f"S{i}", "$metadata": {"$model": MODEL}, "avgSpeed": i} for i in range(5)] +
+             [{"$dtId": "X", "$metadata": {"$model": "dtmi:other;1"}}],
+             [{"$sourceId": "S0", "$relationshipId": "r0", "$targetId": "S1", "$relationshipName": "connectedTo"}])
+    rows = list(adt.query_twins(f"SELECT seg FROM DIGITALTWINS seg WHERE IS_OF_MODEL(seg, '{MODEL}')"))
+    assert [r["seg"]["$dtId"] for r in rows] == ["S0", "S1", "S2", "S3", "S4"]
+    edges = list(adt.query_twins("SELECT r.$sourceId, r.$targetId FROM RELATIONSHIPS r "
+                                 "WHERE r.$relationshipName = 'connectedTo'"))
+    assert edges == [{"$sourceId": "S0", "$targetId": "S1"}]
+    pages = adt.query_twins(f"SELECT seg.$dtId, seg.avgSpeed FROM DIGITALTWINS seg WHERE IS_OF_MODEL(seg, '{MODEL}')",
+                            headers={"max-items-per-page": "2"}).by_page()
+    assert list(next(pages)) == [{"$dtId": "S0", "avgSpeed": 0}, {"$dtId": "S1", "avgSpeed": 1}]
+    assert pages.continuation_token == "2"
+    adt.update_digital_twin("S1", [{"op": "add", "path": "/volume", "value": 9},
+                                   {"op": "replace", "path": "/avgSpeed", "value": 50}])
+    assert adt.get_digital_twin("S1")["volume"] == 9 and adt.get_digital_twin("S1")["avgSpeed"] == 50
+    with pytest.raises(ResourceNotFoundError):
+        adt.update_digital_twin("missing", [{"op": "add", "path": "/a", "value": 1}])
+
+
+def test_injected_throttling_is_retried_by_the_dispatcher():
+    adt = LocalDigitalTwinsClient(throttle_rate=0.3, seed=7)
+    adt.seed([{"$dtId": f"S{i}", "$metadata": {"$model": MODEL}} for i in range(200)])
+    dispatcher = PatchDispatcher(adt, concurrency=8, max_retries=20)
+    for i in range(200):
+        dispatcher.submit(f"S{i}", [{"op": "add", "path": "/avgSpeed", "value": float(i)}])
+    summary = dispatcher.flush()
+    assert summary["updated"] == 200 and summary["throttled"] == adt.stats["throttled"] > 0
+    assert len(adt.patch_latencies) == 200
+    assert adt.get_digital_twin("S42")["avgSpeed"] == 42.0
+
+
+def test_fetch_dot_traffic_runs_end_to_end_on_local_backends(monkeypatch, tmp_path):
+    monkeypatch.setenv("ADT_BACKEND", "local")
+    monkeypatch.setenv("BLOB_BACKEND", "local")
+    monkeypatch.setenv("LOCAL_BLOB_ROOT", str(tmp_path / "blobs"))
+    monkeypatch.setenv("FEATURE_STORE_LOCAL_PATH", str(tmp_path / "features.npy"))
+    monkeypatch.setenv("FDOT_TRAFFIC_API_URL", "http://fdot.invalid/feed")
+    monkeypatch.delenv("HISTORY_LOCAL_DIR", raising=False)
+    shared.reset_clients()
+    path = Path("functions/adt_ingest/fetch_dot_traffic/__init__.py").resolve()
+    spec = importlib.util.spec_from_file_location("fetch_dot_traffic", str(path))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    feed = [{"segment_id": f"E{i}", "speed": 30.0 + i, "volume": 100} for i in range(3)]
+    monkeypatch.setattr(mod, "fetch_fdot_json", lambda: feed)
+
+    adt, blob = shared.get_clients()
+    adt.seed([{"$dtId": f"S{i}", "$metadata": {"$model": MODEL}} for i in range(3)])
+    blob.get_container_client("raw").upload_blob("segment_map.csv", b"E0,S0\nE1,S1\nE2,S2\n")
+    mod.main(None)
+    assert adt.get_digital_twin("S2")["avgSpeed"] == 32.0
+    names = [b.name for b in blob.get_container_client("raw").list_blobs(name_starts_with="history/")]
+    assert names, "traffic history was archived to the local blob store"
+    shared.reset_clients()
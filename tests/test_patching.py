@@ -0,0 +1,105 @@
+import threading
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+
+import patching
+from patching import PatchDispatcher, coalesce_ops
+
+
+class FakeADTClient:
+    def __init__(self, throttle_first=0):
+        self.patches = []
+        self.upserts = []
+        self.throttle_first = throttle_first
+        self._lock = threading.Lock()
+
+    def update_digital_twin(self, twin_id, ops):
+        with self._lock:
+            if self.throttle_first > 0:
+                self.throttle_first -= 1
+                err = HttpResponseError(message="Too Many Requests")
+                err.status_code = 429
+                raise err
+            if twin_id == "missing":
+                raise ResourceNotFoundError(message="not found")
+            self.patches.append((twin_id, ops))
+
+    def upsert_digital_twin(self, twin_id, twin):
+        with self._lock:
+            self.upserts.append(twin_id)
+
+
+def test_coalesce_keeps_last_value_per_path():
+    ops = [
+        {"op": "add", "path": "/avgSpeed", "value": 30.0},
+        {"op": "add", "path": "/asOf", "value": "a"},
+        {"op": "add", "path": "/avgSpeed", "value": 31.0},
+    ]
+    merged = coalesce_ops(ops)
+    assert merged == [
+        {"op": "add", "path": "/asOf", "value": "a"},
+        {"op": "add", "path": "/avgSpeed", "value": 31.0},
+    ]
+
+
+def test_pending_patches_hold_one_op_per_twin_and_path():
+    d = PatchDispatcher(FakeADTClient())
+    for i in range(1000):
+        d.submit("SEG-1", [{"op": "add", "path": "/avgSpeed", "value": float(i)},
+                           {"op": "add", "path": "/asOf", "value": str(i)}])
+    assert d.pending() == 1 and len(d._patches["SEG-1"]) == 2
+
+
+def test_dispatcher_merges_per_twin_and_reports_summary():
+    adt = FakeADTClient()
+    d = PatchDispatcher(adt, concurrency=4)
+    for i in range(50):
+        d.submit(f"SEG-{i % 10}", [{"op": "add", "path": "/volume", "value": float(i)}])
+    d.submit("missing", [{"op": "add", "path": "/volume", "value": 1.0}])
+    d.submit_upsert("SEG-NEW", {"$dtId": "SEG-NEW"})
+    summary = d.flush()
+
+    assert summary["submitted"] == 52
+    assert summary["requests"] == 12
+    assert summary["updated"] == 11
+    assert summary["not_found"] == 1
+    assert adt.upserts == ["SEG-NEW"]
+    assert len(adt.patches) == 10
+    # Last submitted value wins for each twin
+    by_twin = dict(adt.patches)
+    assert by_twin["SEG-3"] == [{"op": "add", "path": "/volume", "value": 43.0}]
+    assert d.pending() == 0
+
+
+def test_dispatcher_retries_throttled_requests(monkeypatch):
+    monkeypatch.setattr(patching, "BACKOFF_BASE_SECONDS", 0.001)
+    adt = FakeADTClient(throttle_first=3)
+    d = PatchDispatcher(adt, concurrency=2, max_retries=5)
+    for i in range(4):
+        d.submit(f"SEG-{i}", [{"op": "add", "path": "/avgSpeed", "value": 40.0}])
+    summary = d.flush()
+
+    assert summary["updated"] == 4
+    assert summary["throttled"] == 3
+    assert summary["failed"] == 0
+
+
+def test_missing_twins_are_reported_apart_from_writes():
+    written, missing = [], []
+    d = PatchDispatcher(FakeADTClient(), on_written=lambda t, ops: written.append(t),
+                        on_not_found=lambda t, ops: missing.append(t))
+    d.submit("SEG-1", [{"op": "add", "path": "/status", "value": "active"}])
+    d.submit("missing", [{"op": "add", "path": "/status", "value": "active"}])
+    summary = d.flush()
+    assert written == ["SEG-1"] and missing == ["missing"] and summary["not_found"] == 1
+
+
+def test_a_failing_callback_does_not_fail_an_accepted_write():
+    adt = FakeADTClient()
+
+    def broken(twin_id, ops):
+        raise RuntimeError("read model unavailable")
+
+    d = PatchDispatcher(adt, on_written=broken)
+    d.submit("SEG-1", [{"op": "add", "path": "/avgSpeed", "value": 40.0}])
+    summary = d.flush()
+    assert summary["updated"] == 1 and summary["failed"] == 0 and len(adt.patches) == 1
@@ -0,0 +1,169 @@
+import importlib.util
+import io
+import json
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import rollups
+from local_backends import LocalBlobServiceClient
+
+T0 = int(datetime(2025, 1, 31, 22, 0, tzinfo=timezone.utc).timestamp())
+
+
+@pytest.fixture
+def blob(tmp_path):
+    rollups.reset_rollups()
+    service = LocalBlobServiceClient(str(tmp_path))
+    service.create_container("raw")
+    yield service
+    rollups.reset_rollups()
+
+
+def feed(blob, store, start, ticks, segments=("S1", "S2", "S3")):
+    """Five-minute ticks; S1's speed is the tick number, S2 reports no speed."""
+    for i in range(ticks):
+        speeds = [float(i), float("nan"), 40.0][:len(segments)]
+        rollups.commit_rollups(blob, list(segments), speeds, [10.0] * len(segments), start + i * 300, store=store)
+
+
+def names(blob, prefix):
+    return [b.name for b in blob.get_container_client("raw").list_blobs(name_starts_with=prefix)]
+
+
+def test_reduce_merges_exactly_across_tiers():
+    rng = np.random.default_rng(1)
+    ts = np.sort(rng.integers(0, 86400, 2000))
+    speeds = rng.uniform(0, 90, 2000).astype(np.float32)
+    speeds[::7] = np.nan
+    keys = np.array(["A", "B"])[rng.integers(0, 2, 2000)]
+    rows = rollups.observe(ts, speeds, rng.uniform(0, 50, 2000))
+    direct = rollups.reduce(keys, rows, 3600)
+    staged = rollups.reduce(*rollups.reduce(keys, rows, 300), 3600)
+    assert (direct[0] == staged[0]).all()
+    for field in ("count", "speedCount", "speedMin", "speedMax", "speedHist", "volumeMax"):
+        assert np.array_equal(direct[1][field], staged[1][field])
+    assert np.allclose(direct[1]["speedSum"], staged[1]["speedSum"], rtol=1e-5)
+    assert direct[1]["count"].sum() == 2000 and direct[1]["speedCount"].sum() == 2000 - len(speeds[::7])
+
+
+def test_sketch_percentiles_are_within_a_bin():
+    speeds = np.random.default_rng(2).uniform(20, 70, 5000)
+    _, row = rollups.reduce(np.zeros(5000), rollups.observe(np.zeros(5000, dtype=np.int64), speeds, speeds), 300)
+    point = rollups.to_points(row, 300)[0]["speed"]
+    assert abs(point["p50"] - np.percentile(speeds, 50)) < 2.5
+    assert abs(point["p85"] - np.percentile(speeds, 85)) < 2.5
+
+
+def test_resolution_parsing_and_tier_choice():
+    assert rollups.parse_resolution("15m") == 900 and rollups.parse_resolution("3600") == 3600
+    with pytest.raises(ValueError):
+        rollups.parse_resolution("90s")
+    assert [rollups.choose_tier(s) for s in (300, 900, 3600, 7200, 86400, 604800)] == \
+        ["5m", "5m", "1h", "1h", "1d", "1d"]
+
+
+def test_hours_are_sealed_and_days_and_months_compacted(blob):
+    store = rollups.RollupStore(blob, shards=4)
+    feed(blob, store, T0, 12 * 4 + 1)  # 22:00 Jan 31 -> 02:00 Feb 1
+    shard = store.shard_of("S1")
+    jan31 = names(blob, f"rollups/traffic/5m/shard-{shard:02d}/2025/01/31")
+    assert jan31 == [f"rollups/traffic/5m/shard-{shard:02d}/2025/01/31.bin"]  # the day block replaced the hours
+    assert names(blob, f"rollups/traffic/5m/shard-{shard:02d}/2025/02/01/01.bin")  # the open day keeps its hours
+    for tier in ("1h", "1d"):
+        assert names(blob, f"rollups/traffic/{tier}/shard-{shard:02d}/2025/01") == \
+            [f"rollups/traffic/{tier}/shard-{shard:02d}/2025/01.bin"]  # only the month block is left
+    assert rollups.load_buffer(blob).hour == T0 + 4 * 3600
+
+    day = store.history("S1", T0, T0 + 2 * 3600, 86400)
+    assert day["tier"] == "1d" and day["points"][0]["count"] == 24
+    assert day["points"][0]["speed"]["max"] == 23.0 and day["points"][0]["volume"]["mean"] == 10.0
+    hours = store.history("S1", T0, T0 + 4 * 3600, 3600)
+    assert hours["tier"] == "1h" and [p["speed"]["min"] for p in hours["points"]] == [0.0, 12.0, 24.0, 36.0]
+    s2 = store.history("S2", T0, T0 + 3600, 3600)["points"][0]
+    assert s2["speed"] is None and s2["count"] == 12
+
+
+def test_day_is_compacted_when_its_last_hour_had_no_observations(blob):
+    store = rollups.RollupStore(blob, shards=1)
+    feed(blob, store, T0, 12)  # 22:00 -> 22:55
+    rollups.commit_rollups(blob, [], [], [], T0 + 3600, store=store)  # 23:00, nothing mapped
+    feed(blob, store, T0 + 2 * 3600, 1)  # the next day
+    assert names(blob, "rollups/traffic/5m/shard-00/2025/01/31") == ["rollups/traffic/5m/shard-00/2025/01/31.bin"]
+    assert names(blob, "rollups/traffic/1d/shard-00/2025/01") == ["rollups/traffic/1d/shard-00/2025/01.bin"]
+    assert store.history("S1", T0, T0 + 3600, 86400)["points"][0]["count"] == 12
+
+
+def test_queries_combine_sealed_blocks_with_the_open_hour(blob):
+    store = rollups.RollupStore(blob, shards=4)
+    feed(blob, store, T0, 18)  # 22:00 -> 23:25, 23:xx still in the buffer
+    buffer = rollups.load_buffer(blob)
+    points = store.history("S1", T0, T0 + 7200, 1800, buffer)["points"]
+    assert [p["count"] for p in points] == [6, 6, 6]
+    whole_day = store.history("S1", T0 - 22 * 3600, T0 + 7200, 86400, buffer)
+    assert whole_day["tier"] == "1d" and whole_day["points"][0]["count"] == 18
+    assert whole_day["points"][0]["speed"]["mean"] == pytest.approx(8.5)
+
+
+def test_buffer_reader_range_reads_one_segment(blob, monkeypatch):
+    store = rollups.RollupStore(blob, shards=4)
+    feed(blob, store, T0, 6)
+    reads = []
+    download = type(blob.get_blob_client("raw", "x")).download_blob
+
+    def spy(self, offset=None, length=None, **kwargs):
+        reads.append((self.blob_name, offset, length))
+        return download(self, offset=offset, length=length, **kwargs)
+
+    monkeypatch.setattr(type(blob.get_blob_client("raw", "x")), "download_blob", spy)
+    reader = rollups.BufferReader(blob)
+    rows = reader.rows("S1", T0, T0 + 3600)
+    assert rows["count"].sum() == 6 and rows["speedMax"].max() == 5.0
+    assert reads == [("state/rollup_buffer.npz", 0, rollups.INDEX_PROBE)]  # header and rows in one probe
+    assert len(reader.rows("S1", T0 - 3600, T0)) == 0 and len(reads) == 2  # before the open hour: header only
+    assert len(reader.rows("nope", T0, T0 + 3600)) == 0
+    assert rollups.load_buffer(blob, force=True).rows("S1", T0, T0 + 3600).tobytes() == rows.tobytes()
+
+
+def test_buffer_reader_reads_the_npz_buffer(blob):
+    legacy = rollups.RollupBuffer(T0)
+    legacy.extend(["S1", "S2"], [30.0, 40.0], [1.0, 2.0], T0 + 60)
+    buf = io.BytesIO()
+    np.savez(buf, hour=np.int64(legacy.hour), names=np.array(legacy.names, dtype=str), idx=legacy.idx,
+             ts=legacy.ts, speeds=legacy.speeds, volumes=legacy.volumes)
+    blob.get_blob_client("raw", "state/rollup_buffer.npz").upload_blob(buf.getvalue())
+    assert rollups.BufferReader(blob).rows("S2", T0, T0 + 3600)["speedMax"].tolist() == [40.0]
+
+
+def test_late_ticks_are_dropped(blob):
+    store = rollups.RollupStore(blob, shards=2)
+    feed(blob, store, T0 + 3600, 2)
+    rollups.commit_rollups(blob, ["S1"], [99.0], [1.0], T0, store=store)
+    assert len(rollups.load_buffer(blob, force=True)) == 6
+
+
+def test_get_segment_history_endpoint(monkeypatch, tmp_path, blob):
+    monkeypatch.setenv("BLOB_BACKEND", "local")
+    monkeypatch.setenv("LOCAL_BLOB_ROOT", str(tmp_path))
+    monkeypatch.setenv("ROLLUP_SHARDS", "4")
+    import shared
+    shared.reset_clients()
+    feed(blob, rollups.RollupStore(blob, shards=4), T0, 30)
+    path = Path("functions/adt_ingest/get_segment_history/__init__.py").resolve()
+    spec = importlib.util.spec_from_file_location("get_segment_history", str(path))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+
+    def call(**params):
+        return mod.main(type("Req", (), {"params": params})())
+
+    ok = call(id="S3", **{"from": "2025-01-31T22:00:00Z", "to": str(T0 + 3 * 3600)}, resolution="1h")
+    body = json.loads(ok.get_body())
+    assert ok.status_code == 200 and body["tier"] == "1h"
+    assert [p["count"] for p in body["points"]] == [12, 12, 6] and body["points"][0]["speed"]["p50"] == 40.0
+    assert call(id="S3", resolution="7m").status_code == 400
+    assert call(resolution="1h").status_code == 400
+    assert call(id="S3", **{"from": "0"}, resolution="5m").status_code == 400  # too many points
+    shared.reset_clients()
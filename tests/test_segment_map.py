@@ -0,0 +1,54 @@
+import types
+
+from azure.core.exceptions import ResourceNotModifiedError
+
+import shared
+
+
+class FakeBlob:
+    def __init__(self, svc):
+        self.svc = svc
+
+    def download_blob(self, etag=None, match_condition=None):
+        self.svc.gets += 1
+        if etag is not None and etag == self.svc.etag:
+            raise ResourceNotModifiedError(message="not modified")
+        data = self.svc.data
+        return types.SimpleNamespace(readall=lambda: data, properties=types.SimpleNamespace(etag=self.svc.etag))
+
+
+class FakeBlobService:
+    def __init__(self, data):
+        self.data, self.etag, self.gets = data, '"1"', 0
+
+    def create_container(self, name):
+        pass
+
+    def get_blob_client(self, container, blob):
+        return FakeBlob(self)
+
+
+def test_map_is_cached_and_revalidated_by_etag():
+    shared.reset_clients()
+    svc = FakeBlobService(b"external_segment_id,adt_segment_id\nSEG123,Segment_001\nSEG124,Segment_001\n")
+    first = shared.load_segment_map(svc)
+    second = shared.load_segment_map(svc)
+    assert first is second
+    assert first.get("SEG123") == first.get("SEG124") == "Segment_001"
+    assert "external_segment_id" not in first
+
+    svc.data, svc.etag = b"SEG123,Segment_009\n", '"2"'
+    third = shared.load_segment_map(svc)
+    assert third.get("SEG123") == "Segment_009"
+
+    stats = shared.segment_map_stats()
+    assert svc.gets == 3
+    assert stats["not_modified"] >= 1
+    shared.reset_clients()
+
+
+def test_one_external_id_can_fan_out_to_several_twins():
+    m = shared.SegmentMap(shared.parse_segment_map(b"X1,SEG-A;SEG-B\nX1,SEG-C\nX1,SEG-A\n# comment\n"))
+    assert m.twins("X1") == ("SEG-A", "SEG-B", "SEG-C")
+    assert m.get("X1") == "SEG-A"
+    assert m.twins("missing") == ()
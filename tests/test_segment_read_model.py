@@ -0,0 +1,76 @@
+from shared import SegmentReadModel
+
+
+class FakeADTClient:
+    def __init__(self, twins):
+        self.twins = twins
+        self.queries = 0
+
+    def query_twins(self, query):
+        self.queries += 1
+        return [{"seg": dict(t)} for t in self.twins]
+
+
+def make_twins(n):
+    return [
+        {"$dtId": f"SEG-{i:03d}", "avgSpeed": 30.0 + i, "predictedCongestionIndex": i / n}
+        for i in range(n)
+    ]
+
+
+def test_ttl_cache_serves_hits_and_reports_ratio():
+    adt = FakeADTClient(make_twins(20))
+    model = SegmentReadModel(ttl=300)
+    for _ in range(4):
+        model.ensure_fresh(adt)
+    assert adt.queries == 1
+    report = model.report()
+    assert report["hits"] == 3 and report["misses"] == 1
+    assert report["hit_ratio"] == 0.75
+    assert report["segments"] == 20
+
+
+def test_top_congested_uses_threshold_and_pushed_patches():
+    adt = FakeADTClient(make_twins(20))
+    model = SegmentReadModel(ttl=300)
+    model.ensure_fresh(adt)
+
+    top = model.top_congested(3, threshold=0.5)
+    assert [r["segmentId"] for r in top] == ["SEG-019", "SEG-018", "SEG-017"]
+    assert [r["segmentId"] for r in model.top_congested(10, threshold=0.85)] == ["SEG-019", "SEG-018"]
+
+    etag = model.etag
+    model.apply_patch("SEG-001", [{"op": "add", "path": "/predictedCongestionIndex", "value": 0.99}])
+    model.apply_patch("SEG-999", [{"op": "add", "path": "/predictedCongestionIndex", "value": 1.0}])
+    assert model.etag != etag
+    assert model.top_congested(1, threshold=0.5)[0]["segmentId"] == "SEG-001"
+    assert adt.queries == 1
+
+
+def test_refresh_queries_outside_the_lock_and_keeps_patches_pushed_meanwhile():
+    import threading
+    started, release = threading.Event(), threading.Event()
+
+    class SlowADT(FakeADTClient):
+        def query_twins(self, query):
+            rows = super().query_twins(query)
+            if self.queries > 1:
+                started.set()
+                release.wait(5)
+            return rows
+
+    adt = SlowADT(make_twins(20))
+    model = SegmentReadModel(ttl=0)
+    model.ensure_fresh(adt)
+    worker = threading.Thread(target=model.ensure_fresh, args=(adt,))
+    worker.start()
+    assert started.wait(5)
+    # Readers and pushes are not blocked by the running query, and the push survives the swap
+    assert model.top_congested(1)[0]["segmentId"] == "SEG-019"
+    model.apply_patch("SEG-002", [{"op": "add", "path": "/predictedCongestionIndex", "value": 2.0}])
+    release.set()
+    worker.join(5)
+    assert model.report()["refreshes"] == 2
+    assert [r["segmentId"] for r in model.top_congested(2)] == ["SEG-002", "SEG-019"]
+    model.apply_patch("SEG-002", [{"op": "remove", "path": "/predictedCongestionIndex"}])
+    assert model.top_congested(1)[0]["segmentId"] == "SEG-019"
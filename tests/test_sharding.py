@@ -0,0 +1,198 @@
+import importlib.util
+from pathlib import Path
+
+import pytest
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
+
+import shared
+import sharding
+from delta import reset_delta_cache
+from local_backends import LocalBlobServiceClient, LocalDigitalTwinsClient, LocalQueueClient
+
+MODEL = "dtmi:fgcu:traffic:RoadSegment;1"
+
+
+@pytest.fixture
+def backends(tmp_path):
+    reset_delta_cache()
+    shared.reset_clients()
+    blob = LocalBlobServiceClient(str(tmp_path / "blobs"))
+    blob.create_container("raw")
+    queue = LocalQueueClient(str(tmp_path / "queues"), sharding.SHARD_QUEUE)
+    queue.create_queue()
+    adt = LocalDigitalTwinsClient()
+    adt.seed([{"$dtId": f"S{i}", "$metadata": {"$model": MODEL}} for i in range(300)])
+    yield adt, blob, queue
+    reset_delta_cache()
+    shared.reset_clients()
+
+
+def speed_patch(value):
+    return [{"op": "add", "path": "/avgSpeed", "value": value}]
+
+
+def test_local_queue_visibility_and_pop_receipts(tmp_path):
+    queue = LocalQueueClient(str(tmp_path), "q")
+    with pytest.raises(ResourceNotFoundError):
+        queue.send_message(b"x")
+    queue.create_queue()
+    queue.send_message(b"a")
+    queue.send_message(b"b", visibility_timeout=60)
+    first = list(queue.receive_messages(visibility_timeout=0))
+    assert [m.content for m in first] == [b"a"] and first[0].dequeue_count == 1
+    again = list(queue.receive_messages(visibility_timeout=30))
+    assert again[0].id == first[0].id and again[0].dequeue_count == 2
+    assert list(queue.receive_messages()) == []
+    with pytest.raises(ResourceNotFoundError):
+        queue.delete_message(first[0])  # receipt superseded by the redelivery
+    queue.delete_message(again[0])
+    assert queue.get_queue_properties().approximate_message_count == 1
+
+
+def test_messages_are_sharded_stably_and_split_under_the_size_limit(backends):
+    adt, blob, queue = backends
+    dispatcher = sharding.ShardedDispatcher(queue, blob, "traffic", shards=4, max_message_bytes=600, ts=100)
+    for i in range(300):
+        dispatcher.submit(f"S{i}", speed_patch(float(i)))
+        dispatcher.submit(f"S{i}", [{"op": "add", "path": "/volume", "value": i * 7919 % 1000}])
+    summary = dispatcher.flush()
+    assert summary["queued"] == 300 and summary["messages"] > 4 and summary["failed"] == 0
+    bodies = [m.content for m in queue.receive_messages(max_messages=1000, visibility_timeout=0)]
+    assert len(bodies) == summary["messages"] and all(len(b) <= 600 for b in bodies)
+    messages = [sharding.decode_message(b) for b in bodies]
+    assert len({m["key"] for m in messages}) == len(messages)
+    for m in messages:
+        for twin_id, ops in m["patches"]:
+            assert sharding.shard_of(twin_id, 4) == m["shard"] and len(ops) == 2
+    assert sorted(t for m in messages for t, _ in m["patches"]) == sorted(f"S{i}" for i in range(300))
+
+
+class CaptureQueue:
+    def __init__(self):
+        self.bodies = []
+
+    def send_message(self, body):
+        self.bodies.append(body)
+
+
+def test_workers_apply_shards_and_skip_redeliveries_and_stale_runs(backends):
+    adt, blob, _ = backends
+    runs = []
+    for ts, speed in ((100, 10.0), (200, 50.0)):
+        queue = CaptureQueue()
+        dispatcher = sharding.ShardedDispatcher(queue, blob, "traffic", shards=3, ts=ts)
+        for i in range(300):
+            dispatcher.submit(f"S{i}", speed_patch(speed))
+        dispatcher.flush()
+        runs.append((dispatcher.run_id, queue.bodies))
+    (_, stale_bodies), (new_run, new_bodies) = runs
+
+    for body in new_bodies:
+        assert sharding.apply_shard_message(adt, blob, body)["status"] == "applied"
+    assert sharding.apply_shard_message(adt, blob, new_bodies[0])["status"] == "duplicate"
+    assert {sharding.apply_shard_message(adt, blob, b)["status"] for b in stale_bodies} == {"stale"}
+    assert all(adt.get_digital_twin(f"S{i}")["avgSpeed"] == 50.0 for i in range(300))
+
+    progress = sharding.shard_progress(blob, "traffic")
+    assert progress["run"] == new_run and progress["complete"] == progress["total"] == 3
+    assert sum(s["updated"] for s in progress["shards"]) == 300
+
+
+def test_incident_messages_are_applied_even_when_late(backends):
+    adt, blob, queue = backends
+    late = sharding.ShardedDispatcher(queue, blob, "incidents", shards=1, supersedes=False, ts=100)
+    late.submit("S1", [{"op": "add", "path": "/incidentStatus", "value": "cleared"}])
+    late.flush()
+    newer = sharding.ShardedDispatcher(queue, blob, "incidents", shards=1, supersedes=False, ts=200)
+    newer.submit("S2", [{"op": "add", "path": "/incidentStatus", "value": "active"}])
+    newer.flush()
+    bodies = [m.content for m in queue.receive_messages(visibility_timeout=0)]
+    for body in reversed(bodies):
+        assert sharding.apply_shard_message(adt, blob, body)["status"] == "applied"
+    assert adt.get_digital_twin("S1")["incidentStatus"] == "cleared"
+    assert sharding.shard_progress(blob, "incidents")["complete"] == 1
+
+
+def test_older_incident_run_cannot_reopen_a_newer_clear(backends):
+    adt, blob, queue = backends
+    older = sharding.ShardedDispatcher(queue, blob, "incidents", shards=1, supersedes=False, ts=100)
+    older.submit("S1", [{"op": "add", "path": "/incidentStatus", "value": "active"}])
+    older.submit("S2", [{"op": "add", "path": "/incidentStatus", "value": "active"}])
+    older.flush()
+    newer = sharding.ShardedDispatcher(queue, blob, "incidents", shards=1, supersedes=False, ts=200)
+    newer.submit("S1", [{"op": "add", "path": "/incidentStatus", "value": "cleared"}])
+    newer.flush()
+    received = list(queue.receive_messages(visibility_timeout=0))
+    old_body, new_body = [m.content for m in received]
+    for msg in received:
+        queue.delete_message(msg)
+    assert sharding.apply_shard_message(adt, blob, new_body)["status"] == "applied"
+    # The older run's message is redelivered after the clear: S1 stays cleared, S2 still gets its write
+    assert sharding.apply_shard_message(adt, blob, old_body)["status"] == "applied"
+    assert adt.get_digital_twin("S1")["incidentStatus"] == "cleared"
+    assert adt.get_digital_twin("S2")["incidentStatus"] == "active"
+    only_s1 = sharding.ShardedDispatcher(queue, blob, "incidents", shards=1, supersedes=False, ts=150)
+    only_s1.submit("S1", [{"op": "add", "path": "/incidentStatus", "value": "active"}])
+    only_s1.flush()
+    body = [m.content for m in queue.receive_messages(visibility_timeout=0)][0]
+    assert sharding.apply_shard_message(adt, blob, body)["status"] == "stale"
+    assert adt.get_digital_twin("S1")["incidentStatus"] == "cleared"
+
+
+def test_failed_writes_return_the_message_and_are_reported_to_the_timer(backends, monkeypatch):
+    adt, blob, queue = backends
+    dispatcher = sharding.ShardedDispatcher(queue, blob, "incidents", shards=1, supersedes=False, ts=100)
+    for twin_id in ("S1", "S2", "nope"):
+        dispatcher.submit(twin_id, [{"op": "add", "path": "/incidentStatus", "value": "active"}])
+    dispatcher.flush()
+    body = [m.content for m in queue.receive_messages(visibility_timeout=0)][0]
+    update = adt.update_digital_twin
+
+    def flaky(twin_id, ops):
+        if twin_id == "S2":
+            raise HttpResponseError(message="Internal Server Error")
+        return update(twin_id, ops)
+
+    monkeypatch.setattr(adt, "update_digital_twin", flaky)
+    with pytest.raises(sharding.ShardWriteError):
+        sharding.apply_shard_message(adt, blob, body)
+    assert adt.get_digital_twin("S1")["incidentStatus"] == "active"
+    assert sharding.shard_progress(blob, "incidents")["complete"] == 0  # not recorded as done
+    assert sharding.unwritten_twins(blob, "incidents") == {"S2": 100}  # the missing twin is not retried
+
+    monkeypatch.setattr(adt, "update_digital_twin", update)
+    assert sharding.apply_shard_message(adt, blob, body)["status"] == "applied"  # the redelivery
+    assert adt.get_digital_twin("S2")["incidentStatus"] == "active"
+    assert sharding.unwritten_twins(blob, "incidents") == {}
+    assert sharding.shard_progress(blob, "incidents")["complete"] == 1
+
+
+def test_fetch_dot_traffic_fans_out_to_queue_workers(monkeypatch, tmp_path):
+    for key, value in {"ADT_BACKEND": "local", "BLOB_BACKEND": "local", "QUEUE_BACKEND": "local",
+                       "LOCAL_BLOB_ROOT": str(tmp_path / "blobs"), "LOCAL_QUEUE_ROOT": str(tmp_path / "queues"),
+                       "FEATURE_STORE_LOCAL_PATH": str(tmp_path / "features.npy"),
+                       "FDOT_TRAFFIC_API_URL": "http://fdot.invalid/feed", "INGEST_SHARDS": "4"}.items():
+        monkeypatch.setenv(key, value)
+    monkeypatch.delenv("HISTORY_LOCAL_DIR", raising=False)
+    reset_delta_cache()
+    shared.reset_clients()
+    path = Path("functions/adt_ingest/fetch_dot_traffic/__init__.py").resolve()
+    spec = importlib.util.spec_from_file_location("fetch_dot_traffic", str(path))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    monkeypatch.setattr(mod, "fetch_fdot_json",
+                        lambda: [{"segment_id": f"E{i}", "speed": 20.0 + i, "volume": 5} for i in range(40)])
+    adt, blob = shared.get_clients()
+    adt.seed([{"$dtId": f"S{i}", "$metadata": {"$model": MODEL}} for i in range(40)])
+    blob.get_container_client("raw").upload_blob(
+        "segment_map.csv", "".join(f"E{i},S{i}\n" for i in range(40)).encode())
+
+    mod.main(None)
+    assert "avgSpeed" not in adt.get_digital_twin("S7")
+    queue = shared.get_queue_client(sharding.SHARD_QUEUE)
+    totals = sharding.drain(queue, adt, blob)
+    assert totals["applied"] == sharding.shard_progress(blob, "traffic")["total"] == 4
+    assert adt.get_digital_twin("S7")["avgSpeed"] == 27.0
+    assert queue.get_queue_properties().approximate_message_count == 0
+    reset_delta_cache()
+    shared.reset_clients()
@@ -0,0 +1,85 @@
+import types
+from datetime import datetime, timezone
+
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+
+from snapshots import publish_snapshot, read_latest
+
+
+class FakeBlob:
+    def __init__(self, store, name):
+        self.store, self.name = store, name
+
+    def get_blob_properties(self):
+        if self.name not in self.store:
+            raise ResourceNotFoundError(message="missing")
+        _, meta, etag = self.store[self.name]
+        return types.SimpleNamespace(metadata=meta, etag=etag)
+
+    def upload_blob(self, data, overwrite=False, metadata=None, etag=None, match_condition=None, **_):
+        if self.name in self.store:
+            if not overwrite:
+                raise ResourceExistsError(message="exists")
+            if etag is not None and self.store[self.name][2] != etag:
+                raise ResourceModifiedError(message="etag mismatch")
+        prev = self.store.get(self.name, (None, None, 0))[2]
+        self.store[self.name] = (data, metadata or {}, prev + 1)
+
+    def download_blob(self):
+        if self.name not in self.store:
+            raise ResourceNotFoundError(message="missing")
+        return types.SimpleNamespace(readall=lambda: self.store[self.name][0])
+
+
+class FakeBlobService:
+    def __init__(self):
+        self.store = {}
+
+    def get_blob_client(self, container, blob):
+        return FakeBlob(self.store, blob)
+
+    def get_container_client(self, container):
+        svc = self
+
+        class CC:
+            def list_blobs(self, name_starts_with=""):
+                return [types.SimpleNamespace(name=n) for n in svc.store if n.startswith(name_starts_with)]
+
+            def download_blob(self, name):
+                return FakeBlob(svc.store, name).download_blob()
+
+        return CC()
+
+
+def test_pointer_tracks_newest_snapshot_only():
+    svc = FakeBlobService()
+    t1 = datetime(2025, 10, 28, 12, 0, tzinfo=timezone.utc)
+    t2 = datetime(2025, 10, 28, 12, 10, tzinfo=timezone.utc)
+    publish_snapshot(svc, "raw", "incidents", b"[1]", when=t1)
+    publish_snapshot(svc, "raw", "incidents", b"[2]", when=t2)
+    # A late run with an older tick must not move the pointer back
+    publish_snapshot(svc, "raw", "incidents", b"[0]", when=datetime(2025, 10, 28, 11, 0, tzinfo=timezone.utc))
+
+    assert read_latest(svc, "raw", "incidents") == b"[2]"
+    assert svc.store["incidents/latest.json"][1]["snapshot"] == "incidents/date=2025-10-28/incidents_20251028121000.json"
+
+
+def test_missing_pointer_falls_back_to_date_partitions():
+    svc = FakeBlobService()
+    t1 = datetime(2025, 10, 27, 23, 50, tzinfo=timezone.utc)
+    publish_snapshot(svc, "raw", "incidents", b"[1]", when=t1)
+    del svc.store["incidents/latest.json"]
+
+    now = datetime(2025, 10, 28, 0, 5, tzinfo=timezone.utc)
+    assert read_latest(svc, "raw", "incidents", now=now) == b"[1]"
+    assert read_latest(FakeBlobService(), "raw", "incidents", now=now) is None
+
+
+def test_unchanged_content_is_not_archived_again():
+    svc = FakeBlobService()
+    first = publish_snapshot(svc, "raw", "incidents", b"[1]", when=datetime(2025, 10, 28, 12, 0, tzinfo=timezone.utc))
+    again = publish_snapshot(svc, "raw", "incidents", b"[1]", when=datetime(2025, 10, 28, 12, 10, tzinfo=timezone.utc))
+    assert again == first
+    assert sorted(svc.store) == [first, "incidents/latest.json"]
+    changed = publish_snapshot(svc, "raw", "incidents", b"[2]", when=datetime(2025, 10, 28, 12, 20, tzinfo=timezone.utc))
+    assert changed != first and read_latest(svc, "raw", "incidents") == b"[2]"
@@ -0,0 +1,81 @@
+import importlib.util
+import json
+import math
+import random
+from pathlib import Path
+
+import geo
+import shared
+
+
+def brute_force(polylines, lat, lon, radius_m):
+    best = None
+    kx = geo.METERS_PER_DEG * math.cos(math.radians(lat))
+    for twin_id, points in polylines:
+        pts = points if len(points) > 1 else points * 2
+        for (alat, alon), (blat, blon) in zip(pts, pts[1:]):
+            ax, ay = (alon - lon) * kx, (alat - lat) * geo.METERS_PER_DEG
+            bx, by = (blon - lon) * kx, (blat - lat) * geo.METERS_PER_DEG
+            dx, dy = bx - ax, by - ay
+            length2 = dx * dx + dy * dy
+            t = 0.0 if length2 == 0 else min(1.0, max(0.0, -(ax * dx + ay * dy) / length2))
+            d = math.hypot(ax + t * dx, ay + t * dy)
+            if d <= radius_m and (best is None or d < best[1]):
+                best = (twin_id, d)
+    return best
+
+
+def test_grid_lookup_matches_brute_force():
+    rnd = random.Random(3)
+    polylines = []
+    for i in range(400):
+        lat, lon = 26 + rnd.random() * 0.2, -82 + rnd.random() * 0.2
+        pts = [(lat, lon)]
+        for _ in range(rnd.randint(0, 4)):
+            lat, lon = lat + rnd.uniform(-0.004, 0.004), lon + rnd.uniform(-0.004, 0.004)
+            pts.append((lat, lon))
+        polylines.append((f"SEG-{i:03d}", pts))
+    index = geo.SegmentIndex(polylines, cell_deg=0.01)
+    for _ in range(300):
+        lat, lon = 26 + rnd.random() * 0.2, -82 + rnd.random() * 0.2
+        got, want = index.nearest(lat, lon, 250), brute_force(polylines, lat, lon, 250)
+        if want is None:
+            assert got is None
+        else:
+            assert got[0] == want[0] and abs(got[1] - want[1]) < 1e-6
+
+
+def test_radius_and_empty_index():
+    index = geo.SegmentIndex([("S1", [(26.0, -81.0), (26.0, -81.01)])], cell_deg=0.001)
+    # ~111 m north of the line's midpoint, across several grid cells
+    assert index.nearest(26.001, -81.005, 150)[0] == "S1"
+    assert index.nearest(26.001, -81.005, 100) is None
+    assert geo.SegmentIndex().nearest(26.0, -81.0) is None
+    assert index.resolve([{"lat": 26.0001, "lon": -81.002}, {"lat": 26.0, "lon": -81.009}]) == ("S1",)
+
+
+def test_parses_geojson_and_csv():
+    geojson = json.dumps({"type": "FeatureCollection", "features": [
+        {"type": "Feature", "properties": {"adt_segment_id": "S1"},
+         "geometry": {"type": "LineString", "coordinates": [[-81.0, 26.0], [-81.01, 26.0]]}},
+        {"type": "Feature", "id": "S2", "properties": {},
+         "geometry": {"type": "Point", "coordinates": [-81.5, 26.5]}},
+    ]}).encode()
+    assert geo.parse_segment_geometry(geojson) == [("S1", [(26.0, -81.0), (26.0, -81.01)]), ("S2", [(26.5, -81.5)])]
+    rows = b"adt_segment_id,lat,lon\nS1,26.0,-81.0\nS1,26.0,-81.01\nS2,26.5,-81.5\n"
+    assert geo.parse_segment_geometry(rows, "segment_geometry.csv") == [
+        ("S1", [(26.0, -81.0), (26.0, -81.01)]), ("S2", [(26.5, -81.5)])]
+
+
+def test_incident_without_segment_token_is_matched_by_coordinates():
+    path = Path("functions/adt_ingest/fetch_ritis_incidents/__init__.py").resolve()
+    spec = importlib.util.spec_from_file_location("fetch_ritis_incidents", str(path))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    index = geo.SegmentIndex([("SEG-007", [(26.0, -81.0), (26.0, -81.01)])])
+    entries = [{"id": "g1", "title": "Crash", "description": "Crash at 26.0003,-81.004 "
+                "Lane Status: 1 out of 2 lanes affected Right lane blocked (NB)"}]
+    state, changed, patches = mod.reconcile(entries, {}, shared.SegmentMap(), "2025-10-28T16:00:00+00:00",
+                                            geometry=index)
+    assert changed[0]["twinId"] == "SEG-007" and changed[0]["matchedBy"] == "coordinates"
+    assert [t for t, _ in patches] == ["SEG-007"]
@@ -0,0 +1,129 @@
+import importlib.util
+from pathlib import Path
+
+import numpy as np
+
+import anomaly
+import features
+
+T0 = 1_761_652_800  # 2025-10-28 12:00 UTC, a Tuesday
+WEEK = 7 * 86400
+
+
+def trained_store(n=1000, weeks=6, seed=3):
+    rnd = np.random.default_rng(seed)
+    twin_ids = [f"SEG-{i:04d}" for i in range(n)]
+    base = rnd.uniform(35, 70, n)
+    store = features.FeatureStore()
+    for w in range(weeks):
+        store.update_traffic(twin_ids, base + rnd.normal(0, 2, n), np.zeros(n), T0 + w * WEEK)
+    return store, twin_ids, base
+
+
+def load_traffic():
+    path = Path("functions/adt_ingest/fetch_dot_traffic/__init__.py").resolve()
+    spec = importlib.util.spec_from_file_location("fetch_dot_traffic", str(path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def test_collapsed_speeds_are_flagged_and_normal_ones_are_not():
+    store, twin_ids, base = trained_store()
+    now = T0 + 6 * WEEK
+    speeds = base.copy()
+    speeds[[10, 20]] = base[[10, 20]] * 0.3
+    speeds[30] = base[30] * 1.5  # faster than usual is not an anomaly
+    scores, flags = anomaly.score_speeds(store, twin_ids + ["UNKNOWN"], np.append(speeds, 10.0), now)
+    assert np.flatnonzero(flags).tolist() == [10, 20]
+    assert scores[10] > 0.99 and scores[30] == 0.0
+    assert np.nanmedian(scores[:1000]) < 0.5
+    # No baseline for an unknown twin or an hour that has never been observed
+    assert np.isnan(scores[1000])
+    assert np.isnan(anomaly.score_speeds(store, twin_ids[:1], [1.0], now + 3 * 3600)[0][0])
+
+
+def test_min_drop_keeps_tight_baselines_from_over_firing():
+    store = features.FeatureStore()
+    for w in range(5):
+        store.update_traffic(["A"], [60.0], [0.0], T0 + w * WEEK)
+    # 25% below a perfectly steady baseline: big z (std floored) but a small drop
+    scores, flags = anomaly.score_speeds(store, ["A"], [45.0], T0 + 5 * WEEK, z_threshold=3, min_drop=0.3)
+    assert scores[0] > 0.99 and not flags[0]
+
+
+class FakeDelta:
+    def filter(self, twin_id, ops):
+        return ops
+
+
+class FakeDispatcher:
+    def __init__(self):
+        self.patches = []
+
+    def submit(self, twin_id, ops):
+        self.patches.append((twin_id, ops))
+
+
+def test_pipeline_stage_scores_in_batches_and_passes_records_on(monkeypatch):
+    monkeypatch.setenv("ANOMALY_BATCH_ROWS", "300")
+    mod = load_traffic()
+    store, twin_ids, base = trained_store()
+    records = [{"twinIds": [t], "avgSpeed": s, "volume": None} for t, s in zip(twin_ids, base)]
+    records[5]["avgSpeed"] = 5.0
+    records.append({"external_id": "unmapped", "avgSpeed": 1.0, "volume": None})
+    dispatcher, counts = FakeDispatcher(), {"anomalies": 0}
+    out = list(mod.detect_anomalies(iter(records), store, T0 + 6 * WEEK, FakeDelta(), dispatcher, counts))
+    assert out == records
+    assert counts["anomalies"] == 1 and len(dispatcher.patches) == 1000
+    flagged = [t for t, ops in dispatcher.patches if ops[1]["value"]]
+    assert flagged == ["SEG-0005"]
+    assert dispatcher.patches[5][1][0] == {"op": "add", "path": "/speedAnomalyScore", "value": 1.0}
+
+
+def run_traffic_tick(monkeypatch, tmp_path, anomaly_env):
+    """One fetch_dot_traffic run on local backends with every speed scored as an anomaly; returns ADT requests."""
+    import shared
+    from delta import reset_delta_cache
+    monkeypatch.setenv("ADT_BACKEND", "local")
+    monkeypatch.setenv("BLOB_BACKEND", "local")
+    monkeypatch.setenv("LOCAL_BLOB_ROOT", str(tmp_path / "blobs"))
+    monkeypatch.setenv("FEATURE_STORE_LOCAL_PATH", str(tmp_path / "features.npy"))
+    monkeypatch.setenv("FDOT_TRAFFIC_API_URL", "http://fdot.invalid/feed")
+    monkeypatch.setenv("ROLLUPS", "false")
+    if anomaly_env is None:
+        monkeypatch.delenv("SPEED_ANOMALY", raising=False)
+    else:
+        monkeypatch.setenv("SPEED_ANOMALY", anomaly_env)
+    shared.reset_clients()
+    reset_delta_cache()
+    mod = load_traffic()
+    feed = [{"segment_id": f"E{i}", "speed": 30.0 + i, "volume": 100} for i in range(3)]
+    monkeypatch.setattr(mod, "fetch_fdot_json", lambda: feed)
+    monkeypatch.setattr(mod, "score_speeds", lambda store, twins, speeds, ts: (np.ones(len(twins)),
+                                                                              np.ones(len(twins), dtype=bool)))
+    adt, blob = shared.get_clients()
+    adt.seed([{"$dtId": f"S{i}", "$metadata": {"$model": "dtmi:fgcu:traffic:RoadSegment;1"}} for i in range(3)])
+    blob.get_container_client("raw").upload_blob("segment_map.csv", b"E0,S0\nE1,S1\nE2,S2\n")
+    requests = []
+    update = adt.update_digital_twin
+    monkeypatch.setattr(adt, "update_digital_twin",
+                        lambda twin_id, ops, **kw: (requests.append((twin_id, ops)), update(twin_id, ops, **kw))[1])
+    mod.main(None)
+    shared.reset_clients()
+    reset_delta_cache()
+    return requests
+
+
+def test_v1_twin_traffic_patches_carry_no_v2_properties_by_default(monkeypatch, tmp_path):
+    requests = run_traffic_tick(monkeypatch, tmp_path, None)
+    assert sorted(t for t, _ in requests) == ["S0", "S1", "S2"]
+    assert not [op for _, ops in requests for op in ops if op["path"].startswith("/speedAnomaly")]
+
+
+def test_anomaly_properties_are_written_as_their_own_patch(monkeypatch, tmp_path):
+    requests = run_traffic_tick(monkeypatch, tmp_path, "true")
+    traffic = [ops for _, ops in requests if any(op["path"] == "/avgSpeed" for op in ops)]
+    scored = [ops for _, ops in requests if any(op["path"].startswith("/speedAnomaly") for op in ops)]
+    assert len(traffic) == 3 and len(scored) == 3
+    assert not [op for ops in traffic for op in ops if op["path"].startswith("/speedAnomaly")]
@@ -0,0 +1,118 @@
+import importlib.util
+import json
+from pathlib import Path
+
+import pytest
+
+import shared
+from feeds import request_with_backoff
+from local_backends import LocalDigitalTwinsClient
+from patching import PatchDispatcher
+
+MODEL = "dtmi:fgcu:traffic:RoadSegment;1"
+
+
+@pytest.fixture
+def exporter():
+    exp = shared.JsonExporter()
+    shared.set_exporter(exp)
+    yield exp
+    shared.set_exporter(None)
+
+
+def test_traced_run_collects_spans_counters_and_worker_latencies(exporter):
+    adt = LocalDigitalTwinsClient(throttle_rate=0.3, seed=3)
+    adt.seed([{"$dtId": f"S{i}", "$metadata": {"$model": MODEL}} for i in range(50)])
+
+    @shared.traced("unit")
+    def run():
+        with shared.span("stage"):
+            shared.count("records", 50)
+        dispatcher = PatchDispatcher(adt, concurrency=4, max_retries=20)
+        for i in range(50):
+            dispatcher.submit(f"S{i}", [{"op": "add", "path": "/avgSpeed", "value": 1.0}])
+        return dispatcher.flush()
+
+    summary = run()
+    run_summary = exporter.runs[-1]
+    assert run_summary["function"] == "unit"
+    assert run_summary["spans"]["stage"]["count"] == 1 and "unit" in run_summary["spans"]
+    counters = run_summary["counters"]
+    assert counters["records"] == 50 and counters["adt.updated"] == 50
+    assert counters["adt.throttled"] == summary["throttled"] == adt.stats["throttled"] > 0
+    # one latency sample per ADT attempt, recorded from the dispatcher's worker threads
+    assert run_summary["dependencies"]["adt.patch"]["count"] == 50 + summary["throttled"]
+    assert shared.current_run() is None
+
+
+def test_errors_are_counted_and_the_run_still_exported(exporter):
+    @shared.traced("boom")
+    def run():
+        raise ValueError("x")
+
+    with pytest.raises(ValueError):
+        run()
+    assert exporter.runs[-1]["counters"] == {"errors": 1}
+
+
+def test_http_retries_and_host_latency_are_recorded(exporter, monkeypatch):
+    monkeypatch.setattr("feeds.backoff_delay", lambda attempt, retry_after=None: 0)
+    responses = [type("R", (), {"status_code": s, "headers": {}, "close": lambda self: None})() for s in (429, 503, 200)]
+    session = type("S", (), {"request": lambda self, method, url, **kw: responses.pop(0)})()
+
+    shared.traced("http")(lambda: request_with_backoff(session, "GET", "https://feed.example.com/x"))()
+    run_summary = exporter.runs[-1]
+    assert run_summary["counters"] == {"http.throttled": 2, "http.retries": 2}
+    assert run_summary["dependencies"]["http.feed.example.com"]["count"] == 3
+
+
+def test_exporter_from_env_writes_json_lines(monkeypatch, tmp_path):
+    out = tmp_path / "telemetry.jsonl"
+    monkeypatch.delenv("APPLICATIONINSIGHTS_CONNECTION_STRING", raising=False)
+    monkeypatch.setenv("TELEMETRY_JSON_PATH", str(out))
+    shared.set_exporter(None)
+    try:
+        shared.traced("a")(lambda: None)()
+        shared.traced("b")(lambda: None)()
+    finally:
+        shared.set_exporter(None)
+    assert [json.loads(line)["function"] for line in out.read_text().splitlines()] == ["a", "b"]
+
+    monkeypatch.setenv("TELEMETRY_EXPORTER", "none")
+    assert type(shared.get_exporter()) is shared.NoopExporter
+    shared.set_exporter(None)
+
+
+def test_otel_falls_back_to_json_without_the_distro(monkeypatch):
+    if importlib.util.find_spec("azure.monitor") is not None:
+        pytest.skip("azure-monitor-opentelemetry is installed")
+    monkeypatch.setenv("APPLICATIONINSIGHTS_CONNECTION_STRING", "InstrumentationKey=00000000-0000-0000-0000-000000000000")
+    monkeypatch.delenv("TELEMETRY_EXPORTER", raising=False)
+    shared.set_exporter(None)
+    assert isinstance(shared.get_exporter(), shared.JsonExporter)
+    shared.set_exporter(None)
+
+
+def test_fetch_dot_traffic_reports_every_stage(exporter, monkeypatch, tmp_path):
+    monkeypatch.setenv("ADT_BACKEND", "local")
+    monkeypatch.setenv("BLOB_BACKEND", "local")
+    monkeypatch.setenv("LOCAL_BLOB_ROOT", str(tmp_path / "blobs"))
+    monkeypatch.setenv("FEATURE_STORE_LOCAL_PATH", str(tmp_path / "features.npy"))
+    monkeypatch.setenv("FDOT_TRAFFIC_API_URL", "http://fdot.invalid/feed")
+    monkeypatch.delenv("HISTORY_LOCAL_DIR", raising=False)
+    shared.reset_clients()
+    path = Path("functions/adt_ingest/fetch_dot_traffic/__init__.py").resolve()
+    spec = importlib.util.spec_from_file_location("fetch_dot_traffic", str(path))
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    monkeypatch.setattr(mod, "fetch_fdot_json", lambda: [{"segment_id": "E0", "speed": 30.0, "volume": 10}])
+    adt, blob = shared.get_clients()
+    adt.seed([{"$dtId": "S0", "$metadata": {"$model": MODEL}}])
+    blob.get_container_client("raw").upload_blob("segment_map.csv", b"E0,S0\n")
+
+    mod.main(None)
+    run_summary = exporter.runs[-1]
+    assert {"load_state", "fetch", "parse", "pipeline", "adt_flush", "save_state"} <= set(run_summary["spans"])
+    assert {"adt.patch", "blob.segment_map", "blob.feed_state", "blob.history"} <= set(run_summary["dependencies"])
+    assert run_summary["counters"]["records.raw"] == 1 and run_summary["counters"]["adt.updated"] == 1
+    shared.reset_clients()